@@ -2,4 +2,9 @@
 """
 # flake8: noqa
 
-from ._version import __version__
+from importlib.metadata import PackageNotFoundError, version
+
+try:
+    __version__ = version("rgrspit_diffsky")
+except PackageNotFoundError:
+    __version__ = "unknown version"
@@ -0,0 +1,495 @@
+"""Benchmarks of the galaxy pipeline and of the fake_sats kernels
+
+Example usage
+-------------
+python -m rgrspit_diffsky.benchmarks --baseline scripts/benchmark_baseline.json
+python -m rgrspit_diffsky.benchmarks --save scripts/benchmark_baseline.json
+python -m rgrspit_diffsky.benchmarks --quick --filter qnfw rotation
+
+Each benchmark is run once untimed, so that compilation is excluded,
+and then timed n_repeat times. The runtime is the best of the repeats,
+and throughput is the number of items (galaxies, subhalos, satellites,
+vectors) processed per second. Peak memory is measured in one more untimed call,
+from the resident memory of the process and from tracemalloc,
+and is only available on Linux.
+
+Results are compared against a baseline file written with --save,
+and the command exits with status 1 if any benchmark is slower or uses more memory
+than its baseline beyond the tolerances. Baselines are specific to a machine,
+so a baseline should be saved on the machine used for the comparison.
+
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from collections import namedtuple
+from itertools import product
+
+import jax
+import numpy as np
+from dsps.cosmology.defaults import DEFAULT_COSMOLOGY
+from jax import random as jran
+
+from . import mc_galpop
+from .emission_lines.calibration import logsfr_poly2_mod
+from .emission_lines.halpha import sfr_to_Halpha_KTC94
+from .emission_lines.oii import sfr_to_OII3727_K98
+from .fake_sats import ellipsoidal_nfw_phase_space, nfw_config_space
+from .fake_sats import phase_space_kernels as psk
+from .fake_sats import rotations3d
+from .profiling import _reset_peak_rss, get_peak_rss, get_rss
+
+DEFAULT_N_REPEAT = 3
+DEFAULT_TIME_TOL = 0.25
+DEFAULT_MEM_TOL = 0.25
+MEM_SLACK = 32 * 1024**2
+MIN_REPEAT_TIME = 0.2
+
+HOST_LGM_MIN = 11.0
+Z_OBS = 0.5
+LBOX = 1_000.0
+POLY2_PARAMS = (0.0, 0.1, 1.0, 0.05)
+
+Benchmark = namedtuple(
+    "Benchmark", ("name", "setup", "func", "n_items", "params", "quick_params")
+)
+BenchmarkResult = namedtuple(
+    "BenchmarkResult",
+    ("key", "name", "params", "n_items", "time", "throughput", "peak_mem"),
+)
+Comparison = namedtuple(
+    "Comparison",
+    ("key", "time_ratio", "mem_ratio", "time_regression", "mem_regression"),
+)
+
+
+def _grid(**params):
+    """List of dicts with every combination of the values of params"""
+    return [dict(zip(params, values)) for values in product(*params.values())]
+
+
+def _get_halos(n_halos, seed=0):
+    """Host halos above HOST_LGM_MIN with an exponential mass function"""
+    rng = np.random.default_rng(seed)
+    logmhost = np.sort(HOST_LGM_MIN + rng.exponential(scale=0.6, size=n_halos))
+    logmhost = np.minimum(logmhost, 15.5)
+    halo_radius = 0.3 * 10 ** ((logmhost - 12.0) / 3.0)
+    halo_pos = rng.uniform(0, LBOX, size=(n_halos, 3))
+    halo_vel = rng.normal(scale=300.0, size=(n_halos, 3))
+    halo_ids = np.arange(n_halos)
+    return logmhost, halo_radius, halo_pos, halo_vel, halo_ids
+
+
+def _get_sats(n_sats, seed=0):
+    rng = np.random.default_rng(seed)
+    rhalo = rng.uniform(0.1, 1.0, n_sats)
+    conc = rng.uniform(2.0, 20.0, n_sats)
+    sigma = rng.uniform(100.0, 1000.0, n_sats)
+    major_axes = rng.normal(size=(n_sats, 3))
+    b_to_a = rng.uniform(0.5, 1.0, n_sats)
+    c_to_a = b_to_a * rng.uniform(0.5, 1.0, n_sats)
+    return jran.key(seed), rhalo, conc, sigma, major_axes, b_to_a, c_to_a
+
+
+def _setup_galpop(n_halos, lgmp_min):
+    return (jran.key(0), *_get_halos(n_halos), lgmp_min)
+
+
+def _run_galpop(ran_key, logmhost, halo_radius, halo_pos, halo_vel, halo_ids, lgmp_min):
+    args = (halo_radius, halo_pos, halo_vel, Z_OBS, lgmp_min, DEFAULT_COSMOLOGY, LBOX)
+    return mc_galpop.mc_galpop_synthetic_subs(
+        ran_key, logmhost, *args, halo_ids=halo_ids, padded=True
+    )
+
+
+def _setup_subhalos(n_halos, lgmp_min):
+    return jran.key(0), _get_halos(n_halos)[0], lgmp_min
+
+
+def _run_subhalos(ran_key, logmhost, lgmp_min):
+    """Number of subhalos of each host and their mass,
+    as drawn by the stages of mc_galpop_synthetic_subs"""
+    counts_key, galpop_keys = mc_galpop._get_galpop_keys(ran_key, False)
+    msk_hosts = np.ones(logmhost.size).astype(bool)
+    subs_counts = mc_galpop._mc_subhalo_counts_kern(
+        counts_key, logmhost, lgmp_min, msk_hosts
+    )
+    subs_host_halo_indx = np.repeat(np.arange(logmhost.size), np.asarray(subs_counts))
+    return mc_galpop._GALPOP_STAGE_KERNS["subhalos"](
+        galpop_keys.subs_lgmu, logmhost, subs_host_halo_indx, lgmp_min
+    )[1]
+
+
+def _setup_sats(n_sats):
+    return _get_sats(n_sats)
+
+
+def _setup_qnfw(n):
+    rng = np.random.default_rng(0)
+    return rng.uniform(size=n), rng.uniform(2.0, 20.0, n)
+
+
+def _setup_vectors(n):
+    rng = np.random.default_rng(0)
+    return rng.normal(size=(n, 3)), rng.normal(size=(n, 3))
+
+
+def _setup_sfr(n):
+    rng = np.random.default_rng(0)
+    return (10 ** rng.uniform(-3.0, 2.0, n),)
+
+
+def _setup_logsfr(n):
+    return np.log10(_setup_sfr(n)[0]), POLY2_PARAMS
+
+
+def _n_first(res):
+    return len(jax.tree.leaves(res)[0])
+
+
+BENCHMARKS = (
+    Benchmark(
+        "mc_galpop_synthetic_subs",
+        _setup_galpop,
+        _run_galpop,
+        lambda galcat: galcat["upid"].size,
+        _grid(n_halos=(1_000, 4_000), lgmp_min=(11.0, 11.5)),
+        _grid(n_halos=(100,), lgmp_min=(11.5,)),
+    ),
+    Benchmark(
+        "subhalo_stages",
+        _setup_subhalos,
+        _run_subhalos,
+        _n_first,
+        _grid(n_halos=(10_000, 100_000), lgmp_min=(11.0,)),
+        _grid(n_halos=(1_000,), lgmp_min=(11.0,)),
+    ),
+    Benchmark(
+        "mc_ellipsoidal_nfw",
+        _setup_sats,
+        ellipsoidal_nfw_phase_space.mc_ellipsoidal_nfw,
+        _n_first,
+        _grid(n_sats=(100_000, 1_000_000)),
+        _grid(n_sats=(1_000,)),
+    ),
+    Benchmark(
+        "phase_space_kernels.mc_ellipsoidal_nfw",
+        _setup_sats,
+        psk.mc_ellipsoidal_nfw,
+        _n_first,
+        _grid(n_sats=(100_000, 1_000_000)),
+        _grid(n_sats=(1_000,)),
+    ),
+    Benchmark(
+        "_qnfw",
+        _setup_qnfw,
+        nfw_config_space._qnfw,
+        _n_first,
+        _grid(n=(100_000, 1_000_000)),
+        _grid(n=(1_000,)),
+    ),
+    Benchmark(
+        "rotation_matrices_from_vectors",
+        _setup_vectors,
+        rotations3d.rotation_matrices_from_vectors,
+        _n_first,
+        _grid(n=(100_000, 1_000_000)),
+        _grid(n=(1_000,)),
+    ),
+    Benchmark(
+        "phase_space_kernels.rotation_matrices_from_vectors",
+        _setup_vectors,
+        psk.rotation_matrices_from_vectors,
+        _n_first,
+        _grid(n=(100_000, 1_000_000)),
+        _grid(n=(1_000,)),
+    ),
+    Benchmark(
+        "sfr_to_Halpha_KTC94",
+        _setup_sfr,
+        sfr_to_Halpha_KTC94,
+        _n_first,
+        _grid(n=(1_000_000, 10_000_000)),
+        _grid(n=(1_000,)),
+    ),
+    Benchmark(
+        "sfr_to_OII3727_K98",
+        _setup_sfr,
+        sfr_to_OII3727_K98,
+        _n_first,
+        _grid(n=(1_000_000, 10_000_000)),
+        _grid(n=(1_000,)),
+    ),
+    Benchmark(
+        "logsfr_poly2_mod",
+        _setup_logsfr,
+        logsfr_poly2_mod,
+        _n_first,
+        _grid(n=(1_000_000, 10_000_000)),
+        _grid(n=(1_000,)),
+    ),
+)
+
+
+def get_benchmark_key(name, params):
+    """Unique name of a benchmark evaluated for params, e.g., _qnfw[n=1000]"""
+    return "{0}[{1}]".format(
+        name, ",".join("{0}={1}".format(key, val) for key, val in params.items())
+    )
+
+
+def select_benchmarks(patterns=None, benchmarks=BENCHMARKS):
+    """Benchmarks whose name contains any of the patterns, or all if patterns is None"""
+    if not patterns:
+        return list(benchmarks)
+    return [b for b in benchmarks if any(p in b.name for p in patterns)]
+
+
+def run_benchmark(benchmark, params, n_repeat=DEFAULT_N_REPEAT):
+    """Time a benchmark and measure its peak memory
+
+    Parameters
+    ----------
+    benchmark : Benchmark
+
+    params : dict
+        Keyword arguments of benchmark.setup
+
+    n_repeat : int, optional
+        Number of timed repeats, after one untimed call.
+        Default is DEFAULT_N_REPEAT.
+
+    Returns
+    -------
+    result : BenchmarkResult
+        time is the best runtime per call in seconds, throughput is n_items/time,
+        and peak_mem is the memory in bytes allocated during a separate untimed call,
+        or None where the peak resident memory cannot be reset.
+
+    Notes
+    -----
+    As with timeit, each repeat calls benchmark.func enough times to last
+    at least MIN_REPEAT_TIME, so that fast functions are timed reliably.
+
+    """
+    args = benchmark.setup(**params)
+    n_items = benchmark.n_items(jax.block_until_ready(benchmark.func(*args)))
+    peak_mem = _measure_peak_mem(benchmark.func, *args)
+
+    n_calls, runtimes = 1, []
+    while len(runtimes) < n_repeat:
+        start = time.perf_counter()
+        for __ in range(n_calls):
+            jax.block_until_ready(benchmark.func(*args))
+        runtime = time.perf_counter() - start
+        if runtime < MIN_REPEAT_TIME and not runtimes:
+            # Increase the number of calls until a repeat is long enough
+            n_calls = max(2 * n_calls, int(n_calls * MIN_REPEAT_TIME / runtime) + 1)
+            continue
+        runtimes.append(runtime / n_calls)
+
+    runtime = min(runtimes)
+    key = get_benchmark_key(benchmark.name, params)
+    return BenchmarkResult(
+        key, benchmark.name, params, n_items, runtime, n_items / runtime, peak_mem
+    )
+
+
+def _measure_peak_mem(func, *args):
+    """Peak memory in bytes allocated by func(*args), or None if unavailable
+
+    The peak is the larger of the increase of the resident memory of the process,
+    which includes the buffers of XLA but misses memory reused by the allocator,
+    and the peak traced by tracemalloc, which includes every buffer of NumPy.
+
+    """
+    rss = get_rss()
+    if not _reset_peak_rss() or rss is None:
+        return None
+    tracemalloc.start()
+    try:
+        jax.block_until_ready(func(*args))
+        __, traced_peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return max(get_peak_rss() - rss, traced_peak, 0)
+
+
+def iter_benchmark_params(benchmarks=BENCHMARKS, quick=False):
+    """Yield each benchmark with each of its params, or its quick_params if quick"""
+    for benchmark in benchmarks:
+        for params in benchmark.quick_params if quick else benchmark.params:
+            yield benchmark, params
+
+
+def save_baseline(results, fname):
+    """Write results to a baseline file in JSON format, with the environment"""
+    baseline = dict(
+        environment=get_environment(),
+        results={x.key: x._asdict() for x in results},
+    )
+    with open(fname, "w") as f:
+        json.dump(baseline, f, indent=1)
+
+
+def load_baseline(fname):
+    """Load the results of a baseline file
+
+    Returns
+    -------
+    baseline : dict
+        Keys are benchmark keys and values are BenchmarkResult
+
+    """
+    with open(fname, "r") as f:
+        results = json.load(f)["results"]
+    return {key: BenchmarkResult(**val) for key, val in results.items()}
+
+
+def compare_to_baseline(
+    results,
+    baseline,
+    time_tol=DEFAULT_TIME_TOL,
+    mem_tol=DEFAULT_MEM_TOL,
+    mem_slack=MEM_SLACK,
+):
+    """Compare the time and peak memory of results to those of a baseline
+
+    Parameters
+    ----------
+    results : list of BenchmarkResult
+
+    baseline : dict
+        Output of load_baseline
+
+    time_tol : float, optional
+        A result is a time regression if time > (1 + time_tol) * baseline time
+
+    mem_tol : float, optional
+        A result is a memory regression if
+        peak_mem > (1 + mem_tol) * baseline peak_mem + mem_slack
+
+    mem_slack : int, optional
+        Bytes of tolerance for the noise of the resident memory of small benchmarks
+
+    Returns
+    -------
+    comparisons : list of Comparison
+        One per result whose key is in the baseline. mem_ratio is None
+        if peak memory is missing from either result or zero in the baseline.
+
+    """
+    comparisons = []
+    for result in results:
+        if result.key not in baseline:
+            continue
+        ref = baseline[result.key]
+        time_ratio = result.time / ref.time
+        time_regression = time_ratio > 1 + time_tol
+        if result.peak_mem is None or ref.peak_mem is None:
+            mem_ratio, mem_regression = None, False
+        else:
+            mem_ratio = result.peak_mem / ref.peak_mem if ref.peak_mem > 0 else None
+            mem_max = (1 + mem_tol) * ref.peak_mem + mem_slack
+            mem_regression = result.peak_mem > mem_max
+        comparisons.append(
+            Comparison(
+                result.key, time_ratio, mem_ratio, time_regression, mem_regression
+            )
+        )
+    return comparisons
+
+
+def get_environment():
+    """Versions and hardware that the results of the benchmarks depend on"""
+    import diffmah
+    import diffstar
+    import dsps
+
+    return dict(
+        python=platform.python_version(),
+        platform=platform.platform(),
+        machine=platform.machine(),
+        jax=jax.__version__,
+        numpy=np.__version__,
+        diffmah=diffmah.__version__,
+        diffstar=diffstar.__version__,
+        dsps=dsps.__version__,
+        backend=jax.default_backend(),
+        devices=[str(x) for x in jax.devices()],
+    )
+
+
+def _format_mem(n_bytes):
+    return "n/a" if n_bytes is None else "{0:.1f}".format(n_bytes / 1024**2)
+
+
+def _format_ratio(ratio, regression):
+    if ratio is None:
+        return "n/a"
+    return "{0:.2f}{1}".format(ratio, " !" if regression else "")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m rgrspit_diffsky.benchmarks",
+        description="Benchmark the galaxy pipeline and the fake_sats kernels",
+    )
+    parser.add_argument("--baseline", default=None, help="Baseline file to compare to")
+    parser.add_argument("--save", default=None, help="Write results as a baseline file")
+    parser.add_argument(
+        "--filter", nargs="+", default=None, help="Run benchmarks matching a substring"
+    )
+    parser.add_argument("--quick", action="store_true", help="Small sizes only")
+    parser.add_argument("--n_repeat", type=int, default=DEFAULT_N_REPEAT)
+    parser.add_argument("--time_tol", type=float, default=DEFAULT_TIME_TOL)
+    parser.add_argument("--mem_tol", type=float, default=DEFAULT_MEM_TOL)
+    args = parser.parse_args(argv)
+
+    baseline = dict() if args.baseline is None else load_baseline(args.baseline)
+    benchmarks = select_benchmarks(args.filter)
+
+    print("JAX backend: {0}".format(jax.default_backend()))
+    msg = "{0:<64}  {1:>10}  {2:>9}  {3:>10}  {4:>9}  {5:>9}"
+    print(
+        msg.format("benchmark", "n_items", "time [s]", "items/s", "mem [MB]", "vs base")
+    )
+    results, n_regressions = [], 0
+    for benchmark, params in iter_benchmark_params(benchmarks, quick=args.quick):
+        result = run_benchmark(benchmark, params, n_repeat=args.n_repeat)
+        results.append(result)
+        comparisons = compare_to_baseline(
+            [result], baseline, time_tol=args.time_tol, mem_tol=args.mem_tol
+        )
+        if comparisons:
+            c = comparisons[0]
+            n_regressions += c.time_regression or c.mem_regression
+            vs_base = "{0} / {1}".format(
+                _format_ratio(c.time_ratio, c.time_regression),
+                _format_ratio(c.mem_ratio, c.mem_regression),
+            )
+        else:
+            vs_base = "n/a"
+        row = (
+            result.key,
+            result.n_items,
+            "{0:.4f}".format(result.time),
+            "{0:.3g}".format(result.throughput),
+            _format_mem(result.peak_mem),
+            vs_base,
+        )
+        print(msg.format(*row), flush=True)
+
+    if args.save is not None:
+        save_baseline(results, args.save)
+    if n_regressions:
+        print("{0} regression(s) relative to {1}".format(n_regressions, args.baseline))
+    return 1 if n_regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
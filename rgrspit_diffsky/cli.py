@@ -0,0 +1,15 @@
+"""Entry points of the console scripts of rgrspit_diffsky
+
+Each entry point imports its command only when called. Worker processes spawned
+by a command import the main module of the calling process, which is the console
+script, and this keeps JAX out of that import, so that worker_setup.init_worker
+sets XLA_FLAGS before JAX creates its backend in the worker.
+
+"""
+
+
+def rgrspit_mock(argv=None):
+    """Entry point of the rgrspit-mock console script, see run_mock.main"""
+    from .run_mock import main
+
+    return main(argv)
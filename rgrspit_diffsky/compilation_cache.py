@@ -0,0 +1,206 @@
+"""Persistent compilation cache and warm-up of the jitted kernels of mc_galpop
+
+Fresh processes otherwise recompile the diffmah and diffstarpop kernels
+on their first call to mc_galpop_synthetic_subs. Calling enable_compilation_cache
+at the start of each job stores the compiled executables on disk, and calling
+warmup precompiles the kernels for the capacity buckets used with padded=True.
+
+"""
+
+import os
+
+import jax
+import numpy as np
+from diffmah.diffmahpop_kernels.bimod_censat_params import DEFAULT_DIFFMAHPOP_PARAMS
+from diffstarpop.defaults import DEFAULT_DIFFSTARPOP_PARAMS
+from jax import random as jran
+
+from . import halo_keys as hk
+from . import mc_galpop
+from .fake_sats import phase_space_kernels as psk
+from .precision import cast_floats, check_precision, get_precision_policy
+from .profiling import CompileStats, track_compilation
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "RGRSPIT_DIFFSKY_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "rgrspit_diffsky", "jax"),
+)
+
+
+def enable_compilation_cache(cache_dir=DEFAULT_CACHE_DIR, min_compile_time_secs=0.0):
+    """Store compiled XLA executables on disk so that they are reused across processes
+
+    Parameters
+    ----------
+    cache_dir : string, optional
+        Directory of the cache. Default is set by the environment variable
+        RGRSPIT_DIFFSKY_CACHE_DIR, or ~/.cache/rgrspit_diffsky/jax if unset.
+        The directory may be shared by all workers of an array job.
+
+    min_compile_time_secs : float, optional
+        Executables that compile faster than this are not cached. Default is 0,
+        so that the many small kernels of the pipeline are also cached.
+
+    Returns
+    -------
+    cache_dir : string
+
+    Notes
+    -----
+    JAX reads the cache configuration at the first compilation of the process,
+    so this function should be called before any jitted function is evaluated.
+
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    jax.config.update("jax_compilation_cache_dir", cache_dir)
+    jax.config.update(
+        "jax_persistent_cache_min_compile_time_secs", min_compile_time_secs
+    )
+    jax.config.update("jax_persistent_cache_min_entry_size_bytes", 0)
+    return cache_dir
+
+
+def warmup(
+    capacity_buckets,
+    cosmo_params,
+    z_obs=0.5,
+    lgmp_min=11.0,
+    diffmahpop_params=DEFAULT_DIFFMAHPOP_PARAMS,
+    diffstarpop_params=DEFAULT_DIFFSTARPOP_PARAMS,
+    halo_ids=False,
+    store_tables=True,
+    verbose=False,
+    precision=None,
+):
+    """Precompile the kernels of mc_galpop_synthetic_subs for padded=True
+
+    Parameters
+    ----------
+    capacity_buckets : sequence
+        Each entry is either an int, the capacity used for both hosts and subhalos,
+        or a tuple (n_hosts_capacity, n_subs_capacity).
+        Capacities must be values returned by mc_galpop.get_capacity_bucket.
+
+    cosmo_params : namedtuple
+        Field names: ('Om0', 'w0', 'wa', 'h')
+
+    z_obs : float, optional
+        Redshift. Compiled kernels do not depend on its value.
+
+    lgmp_min : float, optional
+        log10 of halo mass cutoff in Msun. Compiled kernels do not depend on its value.
+
+    diffmahpop_params, diffstarpop_params : namedtuple, optional
+
+    halo_ids : bool, optional
+        If True, compile the kernels used when halo_ids is passed to
+        mc_galpop_synthetic_subs. Default is False.
+
+    store_tables : bool, optional
+        Value of store_tables passed to mc_galpop_synthetic_subs. Default is True.
+
+    verbose : bool, optional
+        If True, print the compile statistics of each bucket
+
+    precision : string, optional
+        Value of precision passed to mc_galpop_synthetic_subs.
+        Default is None, in which case precision.get_precision() is used.
+
+    Returns
+    -------
+    report : dict
+        Keys are (n_hosts_capacity, n_subs_capacity), values are CompileStats.
+        A warm persistent cache shows up as n_cache_hits > 0 and n_cache_misses = 0.
+
+    """
+    dtype = get_precision_policy(check_precision(precision)).compute_dtype
+    report = dict()
+    for bucket in capacity_buckets:
+        n_cens, n_sats = _get_bucket_capacities(bucket)
+        with track_compilation() as stats:
+            _warmup_bucket(
+                n_cens,
+                n_sats,
+                cosmo_params,
+                mc_galpop._as_kern_scalar(z_obs, dtype),
+                mc_galpop._as_kern_scalar(lgmp_min, dtype),
+                diffmahpop_params,
+                diffstarpop_params,
+                halo_ids,
+                store_tables,
+                dtype,
+            )
+        report[(n_cens, n_sats)] = CompileStats(**stats)
+        if verbose:
+            print(_format_compile_stats((n_cens, n_sats), report[(n_cens, n_sats)]))
+    return report
+
+
+def _get_bucket_capacities(bucket):
+    n_cens, n_sats = (bucket, bucket) if np.ndim(bucket) == 0 else bucket
+    n_cens, n_sats = int(n_cens), int(n_sats)
+    for n in (n_cens, n_sats):
+        if n != mc_galpop.get_capacity_bucket(n):
+            msg = "Capacity {0} is not returned by mc_galpop.get_capacity_bucket"
+            raise ValueError(msg.format(n))
+    return n_cens, n_sats
+
+
+def _warmup_bucket(
+    n_cens,
+    n_sats,
+    cosmo_params,
+    z_obs,
+    lgmp_min,
+    diffmahpop_params,
+    diffstarpop_params,
+    halo_ids,
+    store_tables,
+    dtype=np.float64,
+):
+    """Compile the kernels called by mc_galpop_synthetic_subs for padded arrays
+    of n_cens hosts and n_sats subhalos of the floating-point dtype,
+    without evaluating the main kernel"""
+    ran_key = jran.key(0)
+    logmhost = np.zeros(n_cens, dtype=dtype) + float(lgmp_min)
+    msk_cens = np.ones(n_cens).astype(bool)
+    subs_host_halo_indx = np.zeros(n_sats).astype(int)
+
+    counts_key, galpop_keys = mc_galpop._get_galpop_keys(ran_key, halo_ids)
+    if halo_ids:
+        ids = np.arange(n_cens)
+        counts_key = hk.get_halo_keys(counts_key, ids)
+    mc_galpop._mc_subhalo_counts_kern(counts_key, logmhost, lgmp_min, msk_cens)
+
+    if halo_ids:
+        galpop_keys = mc_galpop._get_galpop_halo_keys(
+            galpop_keys, ids, subs_host_halo_indx
+        )
+
+    args = (
+        galpop_keys,
+        logmhost,
+        subs_host_halo_indx,
+        np.ones(n_cens),
+        np.zeros(n_cens) + mc_galpop.DEFAULT_CONC,
+        np.zeros((n_cens, 3)),
+        np.zeros((n_cens, 3)),
+        lgmp_min,
+        z_obs,
+        cosmo_params,
+        1.0,
+        diffmahpop_params,
+        psk.get_qnfw_table(),
+        diffstarpop_params,
+    )
+    args = cast_floats(args, dtype)
+    mc_galpop._mc_galpop_kern.lower(*args, store_tables=store_tables).compile()
+
+
+def _format_compile_stats(bucket, stats):
+    msg = (
+        "bucket {0}: {1:.2f} sec wall time, {2:.2f} sec compile time, "
+        "{3} compiles, {4} cache hits, {5} cache misses, "
+        "{6:.2f} sec compile time saved"
+    )
+    return msg.format(bucket, *stats)
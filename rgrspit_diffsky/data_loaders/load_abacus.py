@@ -1,13 +1,19 @@
 """This module loads catalogs of halos in the AbacusSummit dataset"""
 
 import os
+from glob import glob
+
+import numpy as np
+from dsps.cosmology.flat_wcdm import CosmoParams
 
 DRN_NERSC = "/global/cfs/cdirs/desi/public/cosmosim/AbacusSummit"
 
 halo_array_columns = ['id', 'npart', 'mass', 'pos', 'vel', 'radius', 'concentration']
-halo_header_columns = ['lbox']
+halo_header_columns = ['lbox', 'redshift', 'Om0', 'w0', 'wa', 'h']
 halo_columns = halo_array_columns + halo_header_columns
 
+COMPASO_FIELDS = ['id', 'N', 'x_com', 'v_com', 'r100_com', 'r10_com']
+
 try:
     assert os.path.isdir(DRN_NERSC)
     HAS_ABACUS_DATA = True
@@ -25,17 +31,102 @@ def load_abacus_halo_catalog(fname):
     if not HAS_ABACUS_DEPS:
         raise ImportError("abacusutils is required to read abacus data")
 
+    compaso_catalog = CompaSOHaloCatalog(fname,fields=COMPASO_FIELDS)
+    return get_halos_from_compaso(compaso_catalog.header, compaso_catalog.halos)
+
+
+def get_halos_from_compaso(header, compaso_halos):
+    """Convert the header and the halo fields of a CompaSO catalog to a halo catalog
+
+    Parameters
+    ----------
+    header : dict
+        Header of the catalog, with keys BoxSize, Redshift, Omega_M, w0, wa, H0,
+        and ParticleMassHMsun
+
+    compaso_halos : dict or table
+        Columns COMPASO_FIELDS of the halos
+
+    Returns
+    -------
+    halos : dict
+        Keys are halo_columns
+
+    """
     halos = {}
-    compaso_catalog = CompaSOHaloCatalog(fname,fields=['id','N','x_com','v_com','r100_com','r10_com'])
 
     # sim information
-    halos['lbox'] = compaso_catalog.header['BoxSize']
-    halos['id'] = compaso_catalog.halos['id']
-    halos['npart'] = compaso_catalog.halos['N']
-    halos['mass'] = compaso_catalog.halos['N'] * compaso_catalog.header['ParticleMassHMsun']
-    halos['pos'] = compaso_catalog.halos['x_com']
-    halos['vel'] = compaso_catalog.halos['v_com']
-    halos['radius'] = compaso_catalog.halos['r100_com']
-    halos['concentration'] = compaso_catalog.halos['r100_com'] / compaso_catalog.halos['r10_com']
+    halos['lbox'] = header['BoxSize']
+    halos['redshift'] = header['Redshift']
+    halos['Om0'] = header['Omega_M']
+    halos['w0'] = header['w0']
+    halos['wa'] = header['wa']
+    halos['h'] = header['H0'] / 100.0
+    halos['id'] = compaso_halos['id']
+    halos['npart'] = compaso_halos['N']
+    halos['mass'] = compaso_halos['N'] * header['ParticleMassHMsun']
+    halos['pos'] = compaso_halos['x_com']
+    halos['vel'] = compaso_halos['v_com']
+    halos['radius'] = compaso_halos['r100_com']
+    halos['concentration'] = compaso_halos['r100_com'] / compaso_halos['r10_com']
 
     return halos
+
+
+def get_slab_fnames(halocat_dir):
+    """List the CompaSO slab files of a halo catalog
+
+    Parameters
+    ----------
+    halocat_dir : string
+        Redshift directory of an AbacusSummit simulation, e.g., .../halos/z1.100,
+        or the halo_info directory inside it
+
+    Returns
+    -------
+    slab_fnames : list of strings
+        Sorted paths to the halo_info_XXX.asdf files
+
+    """
+    if os.path.basename(os.path.normpath(halocat_dir)) != 'halo_info':
+        halocat_dir = os.path.join(halocat_dir, 'halo_info')
+    slab_fnames = sorted(glob(os.path.join(halocat_dir, 'halo_info_*.asdf')))
+    if len(slab_fnames) == 0:
+        raise FileNotFoundError("No halo_info_*.asdf files in {0}".format(halocat_dir))
+    return slab_fnames
+
+
+def get_mc_galpop_inputs(halos):
+    """Convert a halo catalog to the inputs of mc_galpop.mc_galpop_synthetic_subs
+
+    Parameters
+    ----------
+    halos : dict
+        Halo catalog returned by load_abacus_halo_catalog, in which masses are
+        in Msun/h, lengths are in comoving Mpc/h, and positions are in [-lbox/2, lbox/2)
+
+    Returns
+    -------
+    inputs : dict
+        Keys are logmhost, halo_radius, halo_pos, halo_vel, halo_ids, concentration,
+        z_obs, cosmo_params, and Lbox, with masses in Msun,
+        lengths in comoving Mpc, and positions in [0, Lbox)
+
+    """
+    h = halos['h']
+    Lbox = halos['lbox'] / h
+
+    inputs = dict()
+    inputs['logmhost'] = np.log10(np.asarray(halos['mass']) / h)
+    inputs['halo_radius'] = np.asarray(halos['radius']) / h
+    halo_pos = (np.asarray(halos['pos']) + halos['lbox'] / 2.0) / h
+    inputs['halo_pos'] = np.mod(halo_pos, Lbox)
+    inputs['halo_vel'] = np.asarray(halos['vel'])
+    inputs['halo_ids'] = np.asarray(halos['id'])
+    inputs['concentration'] = np.asarray(halos['concentration'])
+    inputs['z_obs'] = float(halos['redshift'])
+    inputs['cosmo_params'] = CosmoParams(
+        float(halos['Om0']), float(halos['w0']), float(halos['wa']), float(h)
+    )
+    inputs['Lbox'] = float(Lbox)
+    return inputs
@@ -1,9 +1,68 @@
-"""This module loads Abacus-like synthetic halos for unit-testing purposes"""
+"""This module loads Abacus-like synthetic halos for unit-testing purposes
+
+Besides load_fake_abacus_halos, the module generates catalogs of host halos
+with the columns, units, and dtypes of load_abacus.load_abacus_halo_catalog,
+so that the loaders, prefetching, and runners of the pipeline can be tested and
+benchmarked without access to AbacusSummit data:
+
+- mc_fake_abacus_halos generates the halos of a single slab
+- iter_fake_abacus_halos streams a catalog of any size one slab at a time
+- write_fake_abacus_slabs writes the slabs as halo_info_XXX.asdf files
+  that are read by load_fake_abacus_slab, e.g., as the load_halos argument
+  of run_mock.run_mock or prefetch.iter_mc_galpop_inputs
+
+Example usage
+-------------
+>>> for halos in iter_fake_abacus_halos(10_000, chunk_size=2_000):  # doctest: +SKIP
+...     inputs = get_mc_galpop_inputs(halos)
+
+"""
+
+import os
+from functools import lru_cache
 
 import numpy as np
+from diffsky.mass_functions.hmf_model import DEFAULT_HMF_PARAMS, predict_cuml_hmf
 from diffsky.mass_functions.mc_diffmah_tpeak import mc_subhalos
+from diffsky.mass_functions.mc_hosts import _get_hmf_cdf_interp_tables
+from dsps.cosmology.defaults import DEFAULT_COSMOLOGY
 from jax import random as jran
 
+from ..fake_sats.nfw_config_space import _qnfw_kern
+from .load_abacus import COMPASO_FIELDS, get_halos_from_compaso
+
+try:
+    import asdf
+
+    HAS_ASDF = True
+except ImportError:
+    HAS_ASDF = False
+
+FAKE_LGMP_MIN = 11.0
+FAKE_REDSHIFT = 1.1
+DEFAULT_CHUNK_SIZE = 1_000_000
+
+# Particle mass of the AbacusSummit base simulations in Msun/h
+PARTICLE_MASS_HMSUN = 2.109e9
+
+# Abacus halo ids store the slab index times SLAB_ID_FACTOR plus the index in the slab
+SLAB_ID_FACTOR = 10**12
+
+# Halo radius encloses DELTA_MEAN times the mean matter density
+DELTA_MEAN = 200.0
+RHO_CRIT_HMSUN = 2.775e11  # (Msun/h) / (Mpc/h)**3
+
+# Concentration-mass relation of Duffy et al. (2008) for M200m, full sample
+CONC_A, CONC_B, CONC_C = 10.14, -0.081, -1.01
+CONC_PIVOT_HMSUN = 2e12
+CONC_SCATTER = 0.16  # dex
+CONC_MIN, CONC_MAX = 1.0, 1_000.0
+
+# Bulk velocity dispersion of host halos in km/s, per component
+SIGMA_VEL = 300.0
+
+_N_CONC_TABLE = 256
+
 
 def load_fake_abacus_halos(n_halos=200):
     """Load a catalog of synthetic halos with the same attributes as Abacus halos.
@@ -12,8 +71,8 @@ def load_fake_abacus_halos(n_halos=200):
     -----
     This function is currently just a placeholder wrapper around the Diffsky
     MC generator, which returns a catalog of both host halos and subhalos.
-    We will want to adapt this function so that the columns of the synthetic halos
-    have the same names as the actual halo catalogs in AbacusSummit.
+    See mc_fake_abacus_halos for host halos with the same columns
+    as the actual halo catalogs in AbacusSummit.
 
     """
 
@@ -25,3 +84,315 @@ def load_fake_abacus_halos(n_halos=200):
     subcat = mc_subhalos(ran_key, z_obs, lgmp_min, hosts_logmh_at_z=hosts_logmh_at_z)
 
     return subcat
+
+
+def get_fake_abacus_lbox(
+    n_halos,
+    lgmp_min=FAKE_LGMP_MIN,
+    redshift=FAKE_REDSHIFT,
+    cosmo_params=DEFAULT_COSMOLOGY,
+    hmf_params=DEFAULT_HMF_PARAMS,
+):
+    """Size of the box in which n_halos is the expected number of halos above lgmp_min
+
+    Parameters
+    ----------
+    n_halos : int
+
+    lgmp_min : float, optional
+        log10 of the minimum halo mass in Msun
+
+    redshift : float, optional
+
+    cosmo_params : namedtuple, optional
+        Field names: ('Om0', 'w0', 'wa', 'h')
+
+    hmf_params : namedtuple, optional
+        Parameters of the halo mass function of diffsky
+
+    Returns
+    -------
+    lbox : float
+        Comoving size of the box in Mpc/h
+
+    """
+    n_per_mpc3 = 10 ** float(predict_cuml_hmf(hmf_params, lgmp_min, redshift))
+    return (n_halos / n_per_mpc3) ** (1 / 3) * cosmo_params.h
+
+
+def mc_fake_abacus_halos(
+    n_halos,
+    seed=0,
+    islab=0,
+    n_slabs=1,
+    lgmp_min=FAKE_LGMP_MIN,
+    redshift=FAKE_REDSHIFT,
+    lbox=None,
+    cosmo_params=DEFAULT_COSMOLOGY,
+    hmf_params=DEFAULT_HMF_PARAMS,
+):
+    """Generate the host halos of one slab of a synthetic Abacus-like catalog
+
+    Parameters
+    ----------
+    n_halos : int
+        Number of halos in the slab
+
+    seed : int, optional
+        Seed of the catalog. The halos of each slab are drawn from a generator
+        seeded with (seed, islab), so that slabs can be generated
+        independently and in any order.
+
+    islab : int, optional
+        Index of the slab, which occupies the range
+        [islab/n_slabs - 1/2, (islab+1)/n_slabs - 1/2) * lbox in x, as CompaSO slabs
+
+    n_slabs : int, optional
+        Number of slabs of the catalog. Default is 1.
+
+    lgmp_min : float, optional
+        log10 of the minimum halo mass in Msun. Default is FAKE_LGMP_MIN.
+
+    redshift : float, optional
+        Default is FAKE_REDSHIFT
+
+    lbox : float, optional
+        Comoving size of the box in Mpc/h. Default is None, in which case
+        lbox = get_fake_abacus_lbox(n_halos * n_slabs, ...), so that the number
+        density of the halos matches the halo mass function.
+
+    cosmo_params : namedtuple, optional
+        Field names: ('Om0', 'w0', 'wa', 'h')
+
+    hmf_params : namedtuple, optional
+        Parameters of the halo mass function of diffsky
+
+    Returns
+    -------
+    halos : dict
+        Keys are load_abacus.halo_columns, with the units and dtypes of
+        load_abacus.load_abacus_halo_catalog: masses in Msun/h,
+        quantized to PARTICLE_MASS_HMSUN; comoving positions in Mpc/h in
+        [-lbox/2, lbox/2); velocities in km/s; radius in comoving Mpc/h;
+        and concentration defined as r100/r10, the ratio of the radii
+        enclosing 100% and 10% of the particles.
+
+    Notes
+    -----
+    Halo masses are drawn from the cumulative halo mass function of diffsky.
+    Radii enclose DELTA_MEAN times the mean matter density, NFW concentrations
+    follow the relation of Duffy et al. (2008) with CONC_SCATTER dex of scatter,
+    and positions and velocities are uncorrelated.
+
+    """
+    header, compaso_halos = _mc_fake_compaso_slab(
+        n_halos,
+        seed,
+        islab,
+        n_slabs,
+        lgmp_min,
+        redshift,
+        lbox,
+        cosmo_params,
+        hmf_params,
+    )
+    return get_halos_from_compaso(header, compaso_halos)
+
+
+def iter_fake_abacus_halos(
+    n_halos, chunk_size=DEFAULT_CHUNK_SIZE, seed=0, lbox=None, **kwargs
+):
+    """Stream a synthetic Abacus-like catalog of any size one slab at a time
+
+    Parameters
+    ----------
+    n_halos : int
+        Total number of halos, e.g., up to 1e9 or more
+
+    chunk_size : int, optional
+        Maximum number of halos per slab. The catalog is split into
+        ceil(n_halos/chunk_size) slabs of nearly equal size.
+
+    seed : int, optional
+
+    lbox : float, optional
+        Default is get_fake_abacus_lbox(n_halos, ...)
+
+    **kwargs : optional
+        lgmp_min, redshift, cosmo_params, and hmf_params of mc_fake_abacus_halos
+
+    Yields
+    ------
+    halos : dict
+        Output of mc_fake_abacus_halos for each slab, in order of x.
+        Only one slab is held in memory at a time.
+
+    """
+    for header, compaso_halos in _iter_fake_compaso_slabs(
+        n_halos, chunk_size, seed, lbox, **kwargs
+    ):
+        yield get_halos_from_compaso(header, compaso_halos)
+
+
+def write_fake_abacus_slabs(
+    halocat_dir, n_halos, chunk_size=DEFAULT_CHUNK_SIZE, seed=0, lbox=None, **kwargs
+):
+    """Write a synthetic Abacus-like catalog as CompaSO-like slab files
+
+    Parameters
+    ----------
+    halocat_dir : string
+        The slabs are written to halocat_dir/halo_info/halo_info_XXX.asdf,
+        so that halocat_dir can be passed to load_abacus.get_slab_fnames
+        and run_mock.run_mock
+
+    n_halos, chunk_size, seed, lbox, **kwargs
+        See iter_fake_abacus_halos
+
+    Returns
+    -------
+    slab_fnames : list of strings
+
+    Notes
+    -----
+    Each file stores the header and the COMPASO_FIELDS of an AbacusSummit slab
+    as plain arrays, and is read with load_fake_abacus_slab,
+    not with the CompaSOHaloCatalog of abacusutils.
+
+    """
+    if not HAS_ASDF:
+        raise ImportError("asdf is required to write fake abacus slabs")
+
+    halo_info_dir = os.path.join(halocat_dir, "halo_info")
+    os.makedirs(halo_info_dir, exist_ok=True)
+    slab_fnames = []
+    slab_iter = _iter_fake_compaso_slabs(n_halos, chunk_size, seed, lbox, **kwargs)
+    for islab, (header, compaso_halos) in enumerate(slab_iter):
+        slab_fname = os.path.join(halo_info_dir, "halo_info_{0:03d}.asdf".format(islab))
+        asdf.AsdfFile(dict(header=header, data=compaso_halos)).write_to(slab_fname)
+        slab_fnames.append(slab_fname)
+    return slab_fnames
+
+
+def load_fake_abacus_slab(fname):
+    """Load a slab written by write_fake_abacus_slabs
+
+    Returns
+    -------
+    halos : dict
+        Keys are load_abacus.halo_columns, as for load_abacus_halo_catalog
+
+    """
+    if not HAS_ASDF:
+        raise ImportError("asdf is required to read fake abacus slabs")
+
+    with asdf.open(fname, lazy_load=False, memmap=False) as af:
+        header = dict(af["header"])
+        data = {key: np.array(af["data"][key]) for key in COMPASO_FIELDS}
+    return get_halos_from_compaso(header, data)
+
+
+def _mc_fake_compaso_slab(
+    n_halos, seed, islab, n_slabs, lgmp_min, redshift, lbox, cosmo_params, hmf_params
+):
+    """Header and COMPASO_FIELDS of a slab, see mc_fake_abacus_halos"""
+    h = cosmo_params.h
+    if lbox is None:
+        lbox = get_fake_abacus_lbox(
+            n_halos * n_slabs, lgmp_min, redshift, cosmo_params, hmf_params
+        )
+    rng = np.random.default_rng((seed, islab))
+
+    lgmp_table, cdf_table = _get_hmf_cdf_table(hmf_params, lgmp_min, redshift)
+    logmp = np.interp(rng.uniform(size=n_halos), cdf_table, lgmp_table)
+    npart = np.maximum(np.round(10**logmp * h / PARTICLE_MASS_HMSUN), 1)
+    npart = npart.astype(np.uint32)
+    mass = npart * PARTICLE_MASS_HMSUN
+
+    rho_mean = cosmo_params.Om0 * RHO_CRIT_HMSUN
+    radius = (3 * mass / (4 * np.pi * DELTA_MEAN * rho_mean)) ** (1 / 3)
+
+    lgc = np.log10(CONC_A * (mass / CONC_PIVOT_HMSUN) ** CONC_B)
+    lgc = lgc + CONC_C * np.log10(1 + redshift)
+    lgc = lgc + rng.normal(scale=CONC_SCATTER, size=n_halos)
+    lgc = np.clip(lgc, np.log10(CONC_MIN), np.log10(CONC_MAX))
+    lgc_table, r10_table = _get_r10_table()
+    r10_com = radius * np.interp(lgc, lgc_table, r10_table)
+
+    xmin = lbox * (islab / n_slabs - 0.5)
+    pos = rng.uniform(size=(n_halos, 3)) * lbox - lbox / 2
+    pos[:, 0] = xmin + rng.uniform(size=n_halos) * lbox / n_slabs
+
+    header = _get_compaso_header(lbox, redshift, cosmo_params)
+    compaso_halos = dict(
+        id=(islab * SLAB_ID_FACTOR + np.arange(n_halos)).astype(np.uint64),
+        N=npart,
+        x_com=pos.astype(np.float32),
+        v_com=rng.normal(scale=SIGMA_VEL, size=(n_halos, 3)).astype(np.float32),
+        r100_com=radius.astype(np.float32),
+        r10_com=r10_com.astype(np.float32),
+    )
+    return header, compaso_halos
+
+
+def _iter_fake_compaso_slabs(
+    n_halos,
+    chunk_size,
+    seed,
+    lbox,
+    lgmp_min=FAKE_LGMP_MIN,
+    redshift=FAKE_REDSHIFT,
+    cosmo_params=DEFAULT_COSMOLOGY,
+    hmf_params=DEFAULT_HMF_PARAMS,
+):
+    if lbox is None:
+        lbox = get_fake_abacus_lbox(
+            n_halos, lgmp_min, redshift, cosmo_params, hmf_params
+        )
+    n_slabs = max(int(np.ceil(n_halos / chunk_size)), 1)
+    for islab, n_halos_slab in enumerate(_get_slab_sizes(n_halos, n_slabs)):
+        yield _mc_fake_compaso_slab(
+            n_halos_slab,
+            seed,
+            islab,
+            n_slabs,
+            lgmp_min,
+            redshift,
+            lbox,
+            cosmo_params,
+            hmf_params,
+        )
+
+
+def _get_compaso_header(lbox, redshift, cosmo_params):
+    Om0, w0, wa, h = cosmo_params
+    header = dict(
+        BoxSize=float(lbox),
+        Redshift=float(redshift),
+        Omega_M=float(Om0),
+        w0=float(w0),
+        wa=float(wa),
+        H0=100.0 * float(h),
+        ParticleMassHMsun=PARTICLE_MASS_HMSUN,
+    )
+    return header
+
+
+def _get_slab_sizes(n_halos, n_slabs):
+    return np.diff(np.linspace(0, n_halos, n_slabs + 1).astype(int))
+
+
+def _get_hmf_cdf_table(hmf_params, lgmp_min, redshift):
+    """Table of the CDF of log10 halo mass above lgmp_min, in Msun"""
+    lgmp_table, cdf_table = _get_hmf_cdf_interp_tables(hmf_params, lgmp_min, redshift)
+    return np.asarray(lgmp_table), np.asarray(cdf_table)
+
+
+@lru_cache()
+def _get_r10_table():
+    """Table of r10/r100 of the NFW profile vs log10 concentration"""
+    lgc_table = np.linspace(np.log10(CONC_MIN), np.log10(CONC_MAX), _N_CONC_TABLE)
+    r10_table = np.asarray(
+        _qnfw_kern(np.zeros(_N_CONC_TABLE) + 0.1, 10**lgc_table), dtype=float
+    )
+    return lgc_table, r10_table
@@ -0,0 +1,106 @@
+"""Load the next halo catalog on a background thread while the current one
+is being populated with galaxies"""
+
+import queue
+import threading
+
+from . import load_abacus
+
+_POLL_INTERVAL = 0.1  # seconds
+
+
+def prefetch(func, items, depth=1):
+    """Iterate over func(item) for each item, with func evaluated on a background
+    thread up to depth items ahead of the consumer
+
+    Parameters
+    ----------
+    func : callable
+
+    items : iterable
+
+    depth : int, optional
+        Maximum number of results waiting in the queue. Default is 1.
+        At most depth+2 results are alive at any time: those in the queue,
+        the one being computed by the thread, and the one held by the consumer.
+
+    Yields
+    ------
+    result : object
+        func(item), in the same order as items.
+        An exception raised by func is re-raised in the consumer.
+
+    """
+    if depth < 1:
+        raise ValueError("depth must be a positive integer")
+
+    results = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def _put(msg):
+        while not stop.is_set():
+            try:
+                results.put(msg, timeout=_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _producer():
+        try:
+            for item in items:
+                if not _put((True, func(item))):
+                    return
+        except BaseException as exc:
+            _put((False, exc))
+            return
+        _put((False, None))
+
+    thread = threading.Thread(target=_producer, daemon=True)
+    thread.start()
+    try:
+        while True:
+            is_result, val = results.get()
+            if is_result:
+                yield val
+            elif val is None:
+                return
+            else:
+                raise val
+    finally:
+        stop.set()
+        thread.join()
+
+
+def iter_mc_galpop_inputs(
+    slab_fnames, load_halos=load_abacus.load_abacus_halo_catalog, depth=1
+):
+    """Iterate over the slabs of a halo catalog, loading and preprocessing the next
+    slabs on a background thread
+
+    Parameters
+    ----------
+    slab_fnames : list of strings
+        Paths to CompaSO halo_info_XXX.asdf files
+
+    load_halos : callable, optional
+        Function that returns the halo catalog of a slab file with the columns
+        of load_abacus.load_abacus_halo_catalog
+
+    depth : int, optional
+        Number of slabs loaded ahead of the consumer, see prefetch
+
+    Yields
+    ------
+    slab_fname : string
+
+    inputs : dict
+        Output of load_abacus.get_mc_galpop_inputs for the slab
+
+    """
+
+    def _load(slab_fname):
+        halos = load_halos(slab_fname)
+        return slab_fname, load_abacus.get_mc_galpop_inputs(halos)
+
+    yield from prefetch(_load, slab_fnames, depth=depth)
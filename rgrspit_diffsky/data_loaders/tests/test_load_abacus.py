@@ -1,5 +1,7 @@
 """ """
 
+import os
+
 import numpy as np
 import pytest
 
@@ -19,3 +21,44 @@ def test_load_abacus_halo_catalog():
     for colname, val in catalog.items():
         assert colname in la.halo_columns
         assert np.all(np.isfinite(val))
+
+
+def test_get_slab_fnames(tmp_path):
+    halo_info_dir = tmp_path / "halo_info"
+    halo_info_dir.mkdir()
+    for i in (2, 0, 1):
+        (halo_info_dir / "halo_info_{0:03d}.asdf".format(i)).touch()
+
+    slab_fnames = la.get_slab_fnames(str(tmp_path))
+    assert [os.path.basename(x) for x in slab_fnames] == [
+        "halo_info_000.asdf",
+        "halo_info_001.asdf",
+        "halo_info_002.asdf",
+    ]
+    assert la.get_slab_fnames(str(halo_info_dir)) == slab_fnames
+
+    with pytest.raises(FileNotFoundError):
+        la.get_slab_fnames(str(halo_info_dir / "nonexistent"))
+
+
+def test_get_mc_galpop_inputs():
+    n_halos = 50
+    lbox, h = 500.0, 0.7
+    rng = np.random.default_rng(0)
+    halos = dict(lbox=lbox, redshift=1.1, Om0=0.3, w0=-1.0, wa=0.0, h=h)
+    halos['id'] = np.arange(n_halos).astype(np.uint64)
+    halos['npart'] = np.zeros(n_halos) + 100
+    halos['mass'] = halos['npart'] * 2e9
+    halos['pos'] = rng.uniform(-lbox / 2, lbox / 2, size=(n_halos, 3))
+    halos['vel'] = rng.normal(size=(n_halos, 3))
+    halos['radius'] = np.ones(n_halos)
+    halos['concentration'] = np.zeros(n_halos) + 5.0
+
+    inputs = la.get_mc_galpop_inputs(halos)
+    assert np.allclose(inputs['logmhost'], np.log10(2e11 / h))
+    assert np.allclose(inputs['halo_radius'], 1 / h)
+    assert np.allclose(inputs['Lbox'], lbox / h)
+    assert np.all(inputs['halo_pos'] >= 0)
+    assert np.all(inputs['halo_pos'] < inputs['Lbox'])
+    assert np.allclose(inputs['cosmo_params'].h, h)
+    assert inputs['z_obs'] == 1.1
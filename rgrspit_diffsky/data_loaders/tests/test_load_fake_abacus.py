@@ -1,11 +1,97 @@
 """ """
 
 import numpy as np
+import pytest
+from diffsky.mass_functions.hmf_model import DEFAULT_HMF_PARAMS, predict_cuml_hmf
 
+from .. import load_abacus as la
 from .. import load_fake_abacus as lfa
+from .. import prefetch
+
+NO_ASDF_MSG = "Must have asdf installed to run this test"
 
 
 def test_load_fake_abacus_halos():
     halos = lfa.load_fake_abacus_halos()
     for x in halos:
         assert np.all(np.isfinite(x))
+
+
+def test_mc_fake_abacus_halos_has_abacus_schema():
+    n_halos = 5_000
+    halos = lfa.mc_fake_abacus_halos(n_halos)
+    assert set(halos) == set(la.halo_columns)
+    assert halos["id"].dtype == np.uint64
+    assert halos["npart"].dtype == np.uint32
+    for key in ("pos", "vel"):
+        assert halos[key].shape == (n_halos, 3)
+        assert halos[key].dtype == np.float32
+    for key in la.halo_array_columns:
+        assert len(halos[key]) == n_halos
+        assert np.all(np.isfinite(halos[key]))
+
+    assert np.allclose(halos["mass"], halos["npart"] * lfa.PARTICLE_MASS_HMSUN)
+    assert np.all(halos["concentration"] > 1)
+    assert np.all(halos["radius"] > 0)
+    lbox = halos["lbox"]
+    assert np.all(halos["pos"] >= -lbox / 2)
+    assert np.all(halos["pos"] < lbox / 2)
+
+    inputs = la.get_mc_galpop_inputs(halos)
+    assert np.all(inputs["logmhost"] > lfa.FAKE_LGMP_MIN - 0.05)
+    assert inputs["z_obs"] == lfa.FAKE_REDSHIFT
+
+
+def test_mc_fake_abacus_halos_follows_the_halo_mass_function():
+    n_halos = 200_000
+    halos = lfa.mc_fake_abacus_halos(n_halos, lgmp_min=11.5)
+    inputs = la.get_mc_galpop_inputs(halos)
+    volume = inputs["Lbox"] ** 3
+    for lgm in (12.0, 13.0):
+        n_pred = volume * 10 ** predict_cuml_hmf(DEFAULT_HMF_PARAMS, lgm, 1.1)
+        n_halos_lgm = np.sum(inputs["logmhost"] > lgm)
+        assert np.abs(n_halos_lgm - n_pred) < 5 * np.sqrt(n_pred)
+
+
+def test_iter_fake_abacus_halos_streams_slabs():
+    n_halos, chunk_size = 10_001, 3_000
+    slabs = list(lfa.iter_fake_abacus_halos(n_halos, chunk_size=chunk_size, seed=1))
+    assert len(slabs) == 4
+    assert sum(x["id"].size for x in slabs) == n_halos
+    assert all(x["id"].size <= chunk_size for x in slabs)
+
+    lbox = slabs[0]["lbox"]
+    assert np.isclose(lbox, lfa.get_fake_abacus_lbox(n_halos))
+    ids = np.concatenate([x["id"] for x in slabs])
+    assert np.unique(ids).size == n_halos
+    for islab, halos in enumerate(slabs):
+        assert halos["lbox"] == lbox
+        assert np.all(halos["id"] // lfa.SLAB_ID_FACTOR == islab)
+        x = halos["pos"][:, 0]
+        assert np.all(x >= lbox * (islab / 4 - 0.5) - 1e-3)
+        assert np.all(x < lbox * ((islab + 1) / 4 - 0.5) + 1e-3)
+
+    # Each slab is independent of the others
+    halos = lfa.mc_fake_abacus_halos(
+        slabs[2]["id"].size, seed=1, islab=2, n_slabs=4, lbox=lbox
+    )
+    for key in la.halo_array_columns:
+        assert np.array_equal(halos[key], slabs[2][key])
+
+
+@pytest.mark.skipif(not lfa.HAS_ASDF, reason=NO_ASDF_MSG)
+def test_write_fake_abacus_slabs_roundtrip(tmp_path):
+    halocat_dir = str(tmp_path / "z1.100")
+    slab_fnames = lfa.write_fake_abacus_slabs(halocat_dir, 1_000, chunk_size=400)
+    assert la.get_slab_fnames(halocat_dir) == slab_fnames
+
+    slabs = lfa.iter_fake_abacus_halos(1_000, chunk_size=400)
+    input_iter = prefetch.iter_mc_galpop_inputs(
+        slab_fnames, load_halos=lfa.load_fake_abacus_slab
+    )
+    for halos, (slab_fname, inputs) in zip(slabs, input_iter):
+        halos2 = lfa.load_fake_abacus_slab(slab_fname)
+        assert set(halos2) == set(la.halo_columns)
+        for key in la.halo_columns:
+            assert np.allclose(halos2[key], halos[key])
+        assert np.allclose(inputs["logmhost"], np.log10(halos["mass"] / halos["h"]))
@@ -0,0 +1,86 @@
+""" """
+
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from .. import prefetch as pf
+
+
+def test_prefetch_preserves_order():
+    results = list(pf.prefetch(lambda x: x**2, range(10), depth=3))
+    assert results == [x**2 for x in range(10)]
+
+
+def test_prefetch_reraises_exceptions():
+    def _func(x):
+        if x == 3:
+            raise RuntimeError("bad item")
+        return x
+
+    results = []
+    with pytest.raises(RuntimeError):
+        for x in pf.prefetch(_func, range(10)):
+            results.append(x)
+    assert results == [0, 1, 2]
+
+
+def test_prefetch_bounds_the_number_of_items_ahead_of_the_consumer():
+    depth = 2
+    n_loaded = [0]
+    lock = threading.Lock()
+
+    def _func(x):
+        with lock:
+            n_loaded[0] += 1
+        return x
+
+    for n_consumed, x in enumerate(pf.prefetch(_func, range(20), depth=depth)):
+        time.sleep(0.02)
+        with lock:
+            n_ahead = n_loaded[0] - (n_consumed + 1)
+        assert n_ahead <= depth + 1
+
+
+def test_prefetch_overlaps_loading_and_consuming():
+    n_items, dt = 6, 0.1
+
+    def _load(x):
+        time.sleep(dt)
+        return x
+
+    start = time.time()
+    for x in pf.prefetch(_load, range(n_items)):
+        time.sleep(dt)
+    runtime = time.time() - start
+    assert runtime < 1.6 * n_items * dt
+
+
+def test_prefetch_stops_when_consumer_stops_early():
+    for x in pf.prefetch(lambda x: x, range(1_000)):
+        if x == 2:
+            break
+    assert threading.active_count() < 10
+
+
+def test_iter_mc_galpop_inputs():
+    n_halos = 10
+
+    def _load_halos(slab_fname):
+        halos = dict(lbox=100.0, redshift=1.0, Om0=0.3, w0=-1.0, wa=0.0, h=0.7)
+        halos["id"] = np.arange(n_halos)
+        halos["mass"] = np.zeros(n_halos) + 1e12
+        halos["pos"] = np.zeros((n_halos, 3))
+        halos["vel"] = np.zeros((n_halos, 3))
+        halos["radius"] = np.ones(n_halos)
+        halos["concentration"] = np.ones(n_halos)
+        return halos
+
+    slab_fnames = ["halo_info_{0:03d}.asdf".format(i) for i in range(4)]
+    slabs = list(pf.iter_mc_galpop_inputs(slab_fnames, load_halos=_load_halos))
+    assert [x[0] for x in slabs] == slab_fnames
+    for slab_fname, inputs in slabs:
+        assert inputs["logmhost"].shape == (n_halos,)
+        assert np.allclose(inputs["halo_pos"], 50.0 / 0.7)
@@ -1,12 +1,25 @@
 """ """
 
+import numpy as np
 from jax import random as jran
 
 from .ellipsoidal_velocities import mc_ellipsoidal_velocities
-from .nfw_config_space import mc_ellipsoidal_positions
+from .nfw_config_space import SPHERICAL_TOL, is_spherical, mc_ellipsoidal_positions
+from .rotations3d import rotate_from_x_axis
 
 
-def mc_ellipsoidal_nfw(ran_key, rhalo, conc, sigma, major_axes, b_to_a, c_to_a):
+def mc_ellipsoidal_nfw(
+    ran_key,
+    rhalo,
+    conc,
+    sigma,
+    major_axes,
+    b_to_a,
+    c_to_a,
+    pos_randoms=None,
+    vel_randoms=None,
+    spherical_tol=SPHERICAL_TOL,
+):
     """Generate points in the phase space of an ellipsoidal NFW halo
 
     Parameters
@@ -26,6 +39,17 @@ def mc_ellipsoidal_nfw(ran_key, rhalo, conc, sigma, major_axes, b_to_a, c_to_a):
 
     c_to_a : ndarray of shape (n, )
 
+    pos_randoms : ndarray of shape (n, 3), optional
+        Uniform randoms used in place of draws from ran_key for positions
+
+    vel_randoms : ndarray of shape (n, 3), optional
+        Normal randoms used in place of draws from ran_key for velocities
+
+    spherical_tol : float, optional
+        Halos with |1-b_to_a| and |1-c_to_a| below spherical_tol are spherical,
+        in which case positions and velocities are not rotated.
+        Default is set by nfw_config_space.SPHERICAL_TOL.
+
     Returns
     -------
     pos : ndarray of shape (npts, 3)
@@ -34,6 +58,31 @@ def mc_ellipsoidal_nfw(ran_key, rhalo, conc, sigma, major_axes, b_to_a, c_to_a):
 
     """
     pos_key, vel_key = jran.split(ran_key, 2)
-    pos = mc_ellipsoidal_positions(pos_key, rhalo, conc, major_axes, b_to_a, c_to_a)
-    vel = mc_ellipsoidal_velocities(vel_key, sigma, major_axes, b_to_a, c_to_a)
+
+    # Draw unrotated points, then apply one rotation per halo to both pos and vel
+    pos = mc_ellipsoidal_positions(
+        pos_key,
+        rhalo,
+        conc,
+        major_axes,
+        b_to_a,
+        c_to_a,
+        randoms=pos_randoms,
+        spherical_tol=np.inf,
+    )
+    vel = mc_ellipsoidal_velocities(
+        vel_key,
+        sigma,
+        major_axes,
+        b_to_a,
+        c_to_a,
+        randoms=vel_randoms,
+        spherical_tol=np.inf,
+    )
+
+    msk_rot = ~is_spherical(b_to_a, c_to_a, pos.shape[0], tol=spherical_tol)
+    if np.any(msk_rot):
+        pos[msk_rot], vel[msk_rot] = rotate_from_x_axis(
+            major_axes[msk_rot], pos[msk_rot], vel[msk_rot]
+        )
     return pos, vel
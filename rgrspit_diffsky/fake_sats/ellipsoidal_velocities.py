@@ -3,11 +3,15 @@
 import numpy as np
 from jax import random as jran
 
-from .rotations3d import rotation_matrices_from_vectors
-from .vector_utilities import rotate_vector_collection
+from . import vector_utilities as vectu
+from .nfw_config_space import SPHERICAL_TOL, is_spherical
+from .rotations3d import rotate_from_x_axis
 
 NEWTON_G = 4.3e-09  # (Mpc/Msun)*(km/s)^2
 
+# Python float, so that float32 inputs are not promoted to float64
+_SQRT3 = float(np.sqrt(3))
+
 
 def calculate_virial_velocity(halo_mass, halo_radius):
     """Calculate halo virial velocity to set normalization
@@ -31,7 +35,15 @@ def calculate_virial_velocity(halo_mass, halo_radius):
     return halo_vvir
 
 
-def mc_ellipsoidal_velocities(ran_key, sigma, major_axes, b_to_a, c_to_a):
+def mc_ellipsoidal_velocities(
+    ran_key,
+    sigma,
+    major_axes,
+    b_to_a,
+    c_to_a,
+    randoms=None,
+    spherical_tol=SPHERICAL_TOL,
+):
     """Generate a population with ellipsoidal velocities aligned with the major axes
 
     Parameters
@@ -48,20 +60,32 @@ def mc_ellipsoidal_velocities(ran_key, sigma, major_axes, b_to_a, c_to_a):
 
     c_to_a : ndarray of shape (n, )
 
+    randoms : ndarray of shape (n, 3), optional
+        Normal randoms used in place of draws from ran_key.
+        See mc_cartesian_ellipsoidal_velocities.
+
+    spherical_tol : float, optional
+        Velocities of halos with |1-b_to_a| and |1-c_to_a| below spherical_tol
+        are isotropic, and are not rotated into the frame of the major axis.
+        Default is set by nfw_config_space.SPHERICAL_TOL.
+
     Returns
     -------
     vel : ndarray of shape (n, 3)
 
     """
-    n = sigma.shape[0]
-    x_axes = np.tile([1, 0, 0], n).reshape((n, 3))
-    rotations = rotation_matrices_from_vectors(x_axes, major_axes)
-    vel_xyz = mc_cartesian_ellipsoidal_velocities(ran_key, sigma, b_to_a, c_to_a)
-    vel = rotate_vector_collection(rotations, vel_xyz)
+    vel = mc_cartesian_ellipsoidal_velocities(
+        ran_key, sigma, b_to_a, c_to_a, randoms=randoms
+    )
+    vel = np.array(vel)
+
+    msk_rot = ~is_spherical(b_to_a, c_to_a, sigma.shape[0], tol=spherical_tol)
+    if np.any(msk_rot):
+        vel[msk_rot] = rotate_from_x_axis(major_axes[msk_rot], vel[msk_rot])
     return vel
 
 
-def mc_cartesian_ellipsoidal_velocities(ran_key, sigma, b_to_a, c_to_a):
+def mc_cartesian_ellipsoidal_velocities(ran_key, sigma, b_to_a, c_to_a, randoms=None):
     """Generate a population with ellipsoidal velocities aligned with the Cartesian axes
 
     Parameters
@@ -74,26 +98,36 @@ def mc_cartesian_ellipsoidal_velocities(ran_key, sigma, b_to_a, c_to_a):
 
     c_to_a : ndarray of shape (n, )
 
+    randoms : ndarray of shape (n, 3), optional
+        Unit normal randoms used in place of draws from ran_key.
+        Default is None, in which case randoms are drawn from ran_key.
+
     Returns
     -------
     w : ndarray of shape (n, 3)
+        Same floating-point dtype as sigma when randoms is None
 
     """
     xkey, ykey, zkey, ran_key = jran.split(ran_key, 4)
 
     n = sigma.shape[0]
-    vx_u = jran.normal(xkey, (n,))
-    vy_u = jran.normal(ykey, (n,))
-    vz_u = jran.normal(zkey, (n,))
-
-    vx = vx_u * sigma / np.sqrt(3)
-    vy = vy_u * sigma * b_to_a / np.sqrt(3)
-    vz = vz_u * sigma * c_to_a / np.sqrt(3)
+    if randoms is None:
+        dtype = vectu._float_dtype(sigma)
+        vx_u = np.asarray(jran.normal(xkey, (n,)), dtype=dtype)
+        vy_u = np.asarray(jran.normal(ykey, (n,)), dtype=dtype)
+        vz_u = np.asarray(jran.normal(zkey, (n,)), dtype=dtype)
+    else:
+        assert np.shape(randoms) == (n, 3), "randoms must have shape (n, 3)"
+        vx_u, vy_u, vz_u = randoms[:, 0], randoms[:, 1], randoms[:, 2]
+
+    vx = vx_u * sigma / _SQRT3
+    vy = vy_u * sigma * b_to_a / _SQRT3
+    vz = vz_u * sigma * c_to_a / _SQRT3
     v = np.array((vx, vy, vz)).T
 
-    sigma2_x = sigma / np.sqrt(3)
-    sigma2_y = b_to_a * sigma / np.sqrt(3)
-    sigma2_z = c_to_a * sigma / np.sqrt(3)
+    sigma2_x = sigma / _SQRT3
+    sigma2_y = b_to_a * sigma / _SQRT3
+    sigma2_z = c_to_a * sigma / _SQRT3
     sigma_ellipse = np.sqrt(sigma2_x**2 + sigma2_y**2 + sigma2_z**2)
     volume_ratio = sigma / sigma_ellipse
     return v * volume_ratio.reshape((n, 1))
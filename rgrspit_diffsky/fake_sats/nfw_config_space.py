@@ -1,14 +1,35 @@
 """Module generates a random 3d positions according to a triaxial NFW profile."""
 
+import jax
 import numpy as np
+from jax import jit as jjit
+from jax import numpy as jnp
 from jax import random as jran
-from scipy import special
 
-from .rotations3d import rotation_matrices_from_vectors
-from .vector_utilities import rotate_vector_collection
+from . import vector_utilities as vectu
+from .rotations3d import rotate_from_x_axis
 
+N_HALLEY = 2
 
-def mc_ellipsoidal_positions(ran_key, rhalo, conc, major_axes, b_to_a, c_to_a):
+# Halos with |1 - b_to_a| and |1 - c_to_a| below this tolerance are spherical
+SPHERICAL_TOL = 1e-6
+
+# Coefficients of the series of 1 + W(z) in powers of sqrt(2(1 + e*z))
+# about the branch point z = -1/e of the principal branch of Lambert W
+_LAMBERTW_BRANCH_SERIES = (1.0, -1 / 3, 11 / 72, -43 / 540, 769 / 17280, -221 / 8505)
+_Q_SERIES_MAX = 1e-2
+
+
+def mc_ellipsoidal_positions(
+    ran_key,
+    rhalo,
+    conc,
+    major_axes,
+    b_to_a,
+    c_to_a,
+    randoms=None,
+    spherical_tol=SPHERICAL_TOL,
+):
     """Generate Monte Carlo realization of halo-centric xyz positions according to
     an ellipsoidal NFW distribution
 
@@ -26,24 +47,58 @@ def mc_ellipsoidal_positions(ran_key, rhalo, conc, major_axes, b_to_a, c_to_a):
 
     c_to_a : ndarray, shape (n, )
 
+    randoms : ndarray, shape (n, 3), optional
+        Uniform randoms in (0, 1) used in place of draws from ran_key.
+        See random_nfw_spherical_coords.
+
+    spherical_tol : float, optional
+        Halos with |1-b_to_a| and |1-c_to_a| below spherical_tol are spherical,
+        and their positions are not rotated into the frame of the major axis,
+        since the distribution of points is isotropic.
+        Default is set by SPHERICAL_TOL.
+
     Returns
     -------
     pos : ndarray, shape (n, 3)
 
     """
-    n = conc.shape[0]
-    x_axes = np.tile([1, 0, 0], n).reshape((n, 3))
-    rotations = rotation_matrices_from_vectors(x_axes, major_axes)
-
     a = rhalo / ((b_to_a * c_to_a) ** (1 / 3))
     b = a * b_to_a
     c = a * c_to_a
-    pos_xyz = np.vstack(random_nfw_ellipsoid(ran_key, conc, a, b, c)).T
-    pos = rotate_vector_collection(rotations, pos_xyz)
+    pos = np.vstack(random_nfw_ellipsoid(ran_key, conc, a, b, c, randoms)).T
+
+    msk_rot = ~is_spherical(b_to_a, c_to_a, conc.shape[0], tol=spherical_tol)
+    if np.any(msk_rot):
+        pos[msk_rot] = rotate_from_x_axis(major_axes[msk_rot], pos[msk_rot])
     return pos
 
 
-def random_nfw_ellipsoid(ran_key, conc, a=1, b=1, c=1):
+def is_spherical(b_to_a, c_to_a, n, tol=SPHERICAL_TOL):
+    """Identify the halos whose axis ratios are unity within a tolerance
+
+    Parameters
+    ----------
+    b_to_a : float or ndarray of shape (n, )
+
+    c_to_a : float or ndarray of shape (n, )
+
+    n : int
+        Number of halos
+
+    tol : float, optional
+        Default is set by SPHERICAL_TOL.
+
+    Returns
+    -------
+    msk : ndarray of shape (n, )
+        True for spherical halos
+
+    """
+    msk = (np.abs(1.0 - b_to_a) <= tol) & (np.abs(1.0 - c_to_a) <= tol)
+    return np.broadcast_to(msk, (n,))
+
+
+def random_nfw_ellipsoid(ran_key, conc, a=1, b=1, c=1, randoms=None):
     """Generate random points within an NFW ellipsoid with unit radius.
 
     Parameters
@@ -62,16 +117,20 @@ def random_nfw_ellipsoid(ran_key, conc, a=1, b=1, c=1):
     c : float or ndarray of shape (n, ), optional
         Length of the z-axis. Default is 1 for a unit sphere.
 
+    randoms : ndarray of shape (n, 3), optional
+        Uniform randoms in (0, 1) used in place of draws from ran_key.
+        See random_nfw_spherical_coords.
+
     Returns
     -------
     x, y, z : ndarrays of shape (n, )
 
     """
-    x, y, z = random_nfw_spherical_coords(ran_key, conc)
+    x, y, z = random_nfw_spherical_coords(ran_key, conc, randoms=randoms)
     return a * x, b * y, c * z
 
 
-def random_nfw_spherical_coords(ran_key, conc):
+def random_nfw_spherical_coords(ran_key, conc, randoms=None):
     """Generate random points within an NFW sphere with unit radius.
 
     Parameters
@@ -81,16 +140,28 @@ def random_nfw_spherical_coords(ran_key, conc):
     conc : ndarray
         Array of concentrations of shape (n, )
 
+    randoms : ndarray of shape (n, 3), optional
+        Uniform randoms in (0, 1) used in place of draws from ran_key.
+        Columns are used for the radial CDF, cos(θ), and φ, respectively.
+        Default is None, in which case randoms are drawn from ran_key.
+
     Returns
     -------
     x, y, z : ndarrays of shape (n, )
+        Same floating-point dtype as conc, e.g., float32 for float32 conc
 
     """
     conc = np.atleast_1d(conc)
     npts = conc.size
 
     ukey, rkey = jran.split(ran_key, 2)
-    randoms = np.array(jran.uniform(ukey, shape=(3 * npts,), minval=0, maxval=1))
+    if randoms is None:
+        randoms = jran.uniform(ukey, shape=(3 * npts,), minval=0, maxval=1)
+        randoms = np.array(randoms, dtype=vectu._float_dtype(conc))
+    else:
+        randoms = np.array(randoms)
+        assert randoms.shape == (npts, 3), "randoms must have shape (n, 3)"
+        randoms = randoms.T.flatten()
     r_randoms = randoms[:npts]
     xyz_randoms = randoms[npts:]
     r = random_nfw_radial_position(rkey, conc, randoms=r_randoms)
@@ -150,7 +221,8 @@ def random_nfw_radial_position(ran_key, conc, randoms=None):
     conc = np.atleast_1d(conc)
     n = conc.size
     if randoms is None:
-        u = np.array(jran.uniform(ran_key, shape=(n,), minval=0, maxval=1))
+        u = jran.uniform(ran_key, shape=(n,), minval=0, maxval=1)
+        u = np.array(u, dtype=vectu._float_dtype(conc))
     else:
         u = np.atleast_1d(randoms)
         assert u.size == n, "randoms must have the same size as conc"
@@ -166,9 +238,95 @@ def _pnfwunorm(q, conc):
     return np.log(1.0 + y) - y / (1.0 + y)
 
 
+def _pnfwunorm_kern(q, conc):
+    """Same as _pnfwunorm, for use within jitted kernels"""
+    y = q * conc
+    return jnp.log1p(y) - y / (1.0 + y)
+
+
 def _qnfw(p, conc):
-    """ """
+    """Inverse of the CDF of the NFW profile, computed in double precision and
+    returned in the floating-point dtype of p and conc"""
     assert np.all(p >= 0), "randoms must be non-negative"
     assert np.all(p <= 1), "randoms cannot exceed unity"
-    p *= _pnfwunorm(1, conc)
-    return (-(1.0 / np.real(special.lambertw(-np.exp(-p - 1)))) - 1) / conc
+    p, conc = np.broadcast_arrays(p, conc)
+    shape = p.shape
+    dtype = vectu._float_dtype(p, conc)
+    p, conc = p.flatten(), conc.flatten()
+
+    # Pad to a power of two so that _qnfw_kern compiles once per size bucket
+    n = p.size
+    n_pad = int(2 ** np.ceil(np.log2(max(n, 1))))
+    p = np.concatenate((p, np.zeros(n_pad - n)))
+    conc = np.concatenate((conc, np.ones(n_pad - n)))
+    with jax.enable_x64(True):
+        r = np.asarray(_qnfw_kern(p.astype(np.float64), conc.astype(np.float64)))
+    return r[:n].reshape(shape).astype(dtype)
+
+
+@jjit
+def _qnfw_kern(p, conc):
+    """Inverse of the CDF of the NFW profile truncated at r/Rhalo = 1
+
+    Parameters
+    ----------
+    p : ndarray, shape (n, )
+        CDF in [0, 1]
+
+    conc : ndarray, shape (n, )
+        Concentration
+
+    Returns
+    -------
+    r : ndarray, shape (n, )
+        r/Rhalo, so that 0 <= r <= 1
+
+    Notes
+    -----
+    The solution is r = (-1/W(-exp(-1-p')) - 1)/conc, where W is the principal
+    branch of the Lambert W function and p' = p * _pnfwunorm(1, conc).
+    Writing v = 1 + W, the function returns r = v / (1 - v) / conc,
+    with v evaluated by _lambertw_nfw_offset.
+
+    Compared to an extended-precision solution, the relative error of r
+    is below 1e-13 in double precision for every p in [0, 1] and conc <= 1000,
+    including the neighborhood of r=0 in which scipy.special.lambertw loses
+    precision. In single precision, the relative error is below 1e-4.
+
+    """
+    p = p * _pnfwunorm_kern(1.0, conc)
+    v = _lambertw_nfw_offset(p)
+    return v / (1.0 - v) / conc
+
+
+@jjit
+def _lambertw_nfw_offset(p):
+    """Evaluate v = 1 + W(-exp(-1-p)) for p >= 0 by Halley iteration
+
+    Close to the branch point, i.e., for small p, v is given by the series
+    about the branch point, which is exact to double precision for
+    q = sqrt(2(1 - exp(-p))) < _Q_SERIES_MAX.
+    Otherwise, the series (for small q) or the Taylor series of W about zero
+    (for large q) are refined by N_HALLEY Halley iterations of
+    v + log(1-v) + p = 0, each of which triples the number of correct digits.
+
+    """
+    q = jnp.sqrt(-2.0 * jnp.expm1(-p))
+    v_series = jnp.zeros_like(q)
+    for coeff in _LAMBERTW_BRANCH_SERIES[::-1]:
+        v_series = q * (coeff + v_series)
+
+    z = -jnp.exp(-1.0 - p)
+    v_taylor = 1.0 + z * (1.0 + z * (-1.0 + z * (1.5 + z * (-8.0 / 3.0))))
+    v = jnp.where(q < 1.0, v_series, v_taylor)
+
+    for __ in range(N_HALLEY):
+        g = v + jnp.log1p(-v) + p
+        dg = -v / (1.0 - v)
+        d2g = -1.0 / (1.0 - v) ** 2
+        denom = 2.0 * dg * dg - g * d2g
+        msk_step = denom != 0
+        denom = jnp.where(msk_step, denom, 1.0)
+        v = v - jnp.where(msk_step, 2.0 * g * dg / denom, 0.0)
+
+    return jnp.where(q < _Q_SERIES_MAX, v_series, v)
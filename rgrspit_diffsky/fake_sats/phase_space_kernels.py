@@ -0,0 +1,584 @@
+"""JAX implementation of the ellipsoidal NFW phase-space sampler
+
+Functions mirror those of nfw_config_space, ellipsoidal_velocities, rotations3d
+and vector_utilities. For the same ran_key or the same randoms, they return
+the same points as the NumPy implementation up to floating-point roundoff.
+Every function is written in jax.numpy, so that it can be compiled with jit,
+mapped with vmap, and called from within other jitted kernels.
+
+Outputs have the floating-point dtype of the inputs. Randoms drawn from ran_key
+are cast to that dtype, so that float32 inputs give the points of float64 inputs
+rounded to single precision.
+
+Radial positions are either computed exactly by nfw_config_space._qnfw_kern,
+or interpolated from the table of the inverse NFW CDF returned by get_qnfw_table,
+which is about three times faster and has the same cost for any concentration.
+
+"""
+
+from functools import lru_cache, partial
+
+import jax
+import numpy as np
+from jax import jit as jjit
+from jax import numpy as jnp
+from jax import random as jran
+
+from .ellipsoidal_velocities import NEWTON_G
+from .nfw_config_space import SPHERICAL_TOL, _qnfw_kern
+
+# Grid of the table of the inverse NFW CDF, see get_qnfw_table
+LGC_TABLE_MIN, LGC_TABLE_MAX = 0.0, 3.0
+N_LGC_TABLE = 128
+N_CDF_TABLE = 1024
+
+
+@partial(jjit, static_argnames=("spherical",))
+def mc_ellipsoidal_nfw(
+    ran_key,
+    rhalo,
+    conc,
+    sigma,
+    major_axes,
+    b_to_a,
+    c_to_a,
+    pos_randoms=None,
+    vel_randoms=None,
+    spherical=False,
+    qnfw_table=None,
+):
+    """Generate points in the phase space of an ellipsoidal NFW halo
+
+    Parameters
+    ----------
+    ran_key : jax.random.key
+
+    rhalo : ndarray of shape (n, )
+
+    conc : ndarray of shape (n, )
+
+    sigma : ndarray of shape (n, )
+
+    major_axes : ndarray of shape (n, 3)
+        xyz coordinates of the major axis of each ellipse
+
+    b_to_a : ndarray of shape (n, )
+
+    c_to_a : ndarray of shape (n, )
+
+    pos_randoms : ndarray of shape (n, 3), optional
+        Uniform randoms used in place of draws from ran_key for positions
+
+    vel_randoms : ndarray of shape (n, 3), optional
+        Normal randoms used in place of draws from ran_key for velocities
+
+    spherical : bool, optional
+        If True, every halo is treated as spherical, and no rotation is computed.
+        Default is False, in which case only halos with |1-b_to_a| and |1-c_to_a|
+        below nfw_config_space.SPHERICAL_TOL are left unrotated.
+
+    qnfw_table : ndarray of shape (N_LGC_TABLE, N_CDF_TABLE), optional
+        Table returned by get_qnfw_table. Default is None, in which case
+        radial positions are computed exactly rather than interpolated.
+
+    Returns
+    -------
+    pos : ndarray of shape (n, 3)
+
+    vel : ndarray of shape (n, 3)
+
+    """
+    pos_key, vel_key = jran.split(ran_key, 2)
+    pos = mc_ellipsoidal_positions(
+        pos_key,
+        rhalo,
+        conc,
+        major_axes,
+        b_to_a,
+        c_to_a,
+        randoms=pos_randoms,
+        spherical=True,
+        qnfw_table=qnfw_table,
+    )
+    vel = mc_ellipsoidal_velocities(
+        vel_key,
+        sigma,
+        major_axes,
+        b_to_a,
+        c_to_a,
+        randoms=vel_randoms,
+        spherical=True,
+    )
+    if spherical:
+        return pos, vel
+    # Positions and velocities share the rotation of each halo
+    return _rotate_from_x_axes(major_axes, b_to_a, c_to_a, pos, vel)
+
+
+@partial(jjit, static_argnames=("spherical",))
+def mc_ellipsoidal_positions(
+    ran_key,
+    rhalo,
+    conc,
+    major_axes,
+    b_to_a,
+    c_to_a,
+    randoms=None,
+    spherical=False,
+    qnfw_table=None,
+):
+    """Generate Monte Carlo realization of halo-centric xyz positions according to
+    an ellipsoidal NFW distribution
+
+    Parameters
+    ----------
+    ran_key : jax.random.key
+
+    rhalo : ndarray, shape (n, )
+
+    conc : ndarray, shape (n, )
+
+    major_axes : ndarray, shape (n, 3)
+
+    b_to_a : ndarray, shape (n, )
+
+    c_to_a : ndarray, shape (n, )
+
+    randoms : ndarray, shape (n, 3), optional
+        Uniform randoms in (0, 1) used in place of draws from ran_key.
+        See random_nfw_spherical_coords.
+
+    spherical : bool, optional
+        If True, positions are not rotated into the frame of the major axes.
+        See mc_ellipsoidal_nfw.
+
+    qnfw_table : ndarray of shape (N_LGC_TABLE, N_CDF_TABLE), optional
+        See mc_ellipsoidal_nfw.
+
+    Returns
+    -------
+    pos : ndarray, shape (n, 3)
+
+    """
+    a = rhalo / ((b_to_a * c_to_a) ** (1 / 3))
+    b = a * b_to_a
+    c = a * c_to_a
+    x, y, z = random_nfw_spherical_coords(
+        ran_key, conc, randoms=randoms, qnfw_table=qnfw_table
+    )
+    pos_xyz = jnp.stack((a * x, b * y, c * z), axis=1)
+    if spherical:
+        return pos_xyz
+    return _rotate_from_x_axes(major_axes, b_to_a, c_to_a, pos_xyz)
+
+
+@jjit
+def random_nfw_spherical_coords(ran_key, conc, randoms=None, qnfw_table=None):
+    """Generate random points within an NFW sphere with unit radius.
+
+    Parameters
+    ----------
+    ran_key : jax.random.key
+
+    conc : ndarray
+        Array of concentrations of shape (n, )
+
+    randoms : ndarray of shape (n, 3), optional
+        Uniform randoms in (0, 1) used in place of draws from ran_key.
+        Columns are used for the radial CDF, cos(θ), and φ, respectively.
+        Default is None, in which case randoms are drawn from ran_key.
+
+    qnfw_table : ndarray of shape (N_LGC_TABLE, N_CDF_TABLE), optional
+        See mc_ellipsoidal_nfw.
+
+    Returns
+    -------
+    x, y, z : ndarrays of shape (n, )
+
+    """
+    n = conc.shape[0]
+    if randoms is None:
+        ukey, __ = jran.split(ran_key, 2)
+        randoms = jran.uniform(ukey, shape=(3, n), minval=0, maxval=1).T
+        randoms = randoms.astype(jnp.result_type(float, conc))
+    if qnfw_table is None:
+        r = _qnfw_kern(randoms[:, 0], conc)
+    else:
+        r = qnfw_table_kern(randoms[:, 0], conc, qnfw_table)
+
+    cos_t = 2 * randoms[:, 1] - 1
+    phi = 2 * jnp.pi * randoms[:, 2]
+    sin_t = jnp.sqrt(1.0 - cos_t * cos_t)
+    return r * sin_t * jnp.cos(phi), r * sin_t * jnp.sin(phi), r * cos_t
+
+
+@lru_cache()
+def get_qnfw_table():
+    """Tabulate the inverse of the CDF of the NFW profile truncated at r/Rhalo = 1
+
+    Returns
+    -------
+    qnfw_table : ndarray of shape (N_LGC_TABLE, N_CDF_TABLE)
+        r/Rhalo on a grid of log10(conc) linearly spaced in
+        [LGC_TABLE_MIN, LGC_TABLE_MAX], and of sqrt(p) linearly spaced in [0, 1],
+        where p is the CDF. Values are computed in double precision by _qnfw_kern.
+
+    Notes
+    -----
+    Since r is proportional to sqrt(p) for p << 1, the grid in sqrt(p)
+    resolves the halo center. The table is computed once and then cached.
+
+    """
+    lgc = np.linspace(LGC_TABLE_MIN, LGC_TABLE_MAX, N_LGC_TABLE)
+    sqrt_p = np.linspace(0.0, 1.0, N_CDF_TABLE)
+    p, lgc = np.meshgrid(sqrt_p**2, lgc)
+    with jax.enable_x64(True):
+        r = np.asarray(_qnfw_kern(p.flatten(), 10 ** lgc.flatten()))
+    qnfw_table = r.reshape((N_LGC_TABLE, N_CDF_TABLE))
+    qnfw_table.flags.writeable = False
+    return qnfw_table
+
+
+@jjit
+def qnfw_table_kern(p, conc, qnfw_table):
+    """Inverse of the CDF of the NFW profile truncated at r/Rhalo = 1,
+    interpolated from the table returned by get_qnfw_table
+
+    Parameters
+    ----------
+    p : ndarray, shape (n, )
+        CDF in [0, 1]
+
+    conc : ndarray, shape (n, )
+        Concentration. Values outside of the range of the table
+        are clipped to 10**LGC_TABLE_MIN and 10**LGC_TABLE_MAX.
+
+    qnfw_table : ndarray of shape (N_LGC_TABLE, N_CDF_TABLE)
+
+    Returns
+    -------
+    r : ndarray, shape (n, )
+        r/Rhalo, so that 0 <= r <= 1
+
+    Notes
+    -----
+    Values are bilinear interpolations in log10(conc) and sqrt(p).
+    For the default grid, the absolute error of r is below 2e-5 and
+    the relative error is below 1e-3.
+
+    """
+    n_lgc, n_cdf = qnfw_table.shape
+    x = (jnp.log10(conc) - LGC_TABLE_MIN) / (LGC_TABLE_MAX - LGC_TABLE_MIN)
+    i, wx = _get_table_bin(x, n_lgc)
+    j, wy = _get_table_bin(jnp.sqrt(p), n_cdf)
+    r_lo = (1.0 - wy) * qnfw_table[i, j] + wy * qnfw_table[i, j + 1]
+    r_hi = (1.0 - wy) * qnfw_table[i + 1, j] + wy * qnfw_table[i + 1, j + 1]
+    r = (1.0 - wx) * r_lo + wx * r_hi
+    return r.astype(jnp.result_type(float, p, conc))
+
+
+def _get_table_bin(x, n):
+    """Lower index and interpolation weight of x in [0, 1] on a grid of n points"""
+    x = jnp.clip(x, 0.0, 1.0) * (n - 1)
+    indx = jnp.clip(jnp.floor(x).astype(int), 0, n - 2)
+    return indx, x - indx
+
+
+@partial(jjit, static_argnames=("spherical",))
+def mc_ellipsoidal_velocities(
+    ran_key, sigma, major_axes, b_to_a, c_to_a, randoms=None, spherical=False
+):
+    """Generate a population with ellipsoidal velocities aligned with the major axes
+
+    Parameters
+    ----------
+    ran_key : jax.random.key
+
+    sigma : ndarray of shape (n, )
+
+    major_axes : ndarray of shape (n, 3)
+        xyz coordinates of the major axis of each ellipse
+        Note that the normalization of the input major_axes will be ignored
+
+    b_to_a : ndarray of shape (n, )
+
+    c_to_a : ndarray of shape (n, )
+
+    randoms : ndarray of shape (n, 3), optional
+        Normal randoms used in place of draws from ran_key.
+        See mc_cartesian_ellipsoidal_velocities.
+
+    spherical : bool, optional
+        If True, velocities are not rotated into the frame of the major axes.
+        See mc_ellipsoidal_nfw.
+
+    Returns
+    -------
+    vel : ndarray of shape (n, 3)
+
+    """
+    vel_xyz = mc_cartesian_ellipsoidal_velocities(
+        ran_key, sigma, b_to_a, c_to_a, randoms=randoms
+    )
+    if spherical:
+        return vel_xyz
+    return _rotate_from_x_axes(major_axes, b_to_a, c_to_a, vel_xyz)
+
+
+@jjit
+def mc_cartesian_ellipsoidal_velocities(ran_key, sigma, b_to_a, c_to_a, randoms=None):
+    """Generate a population with ellipsoidal velocities aligned with the Cartesian axes
+
+    Parameters
+    ----------
+    ran_key : jax.random.key
+
+    sigma : ndarray of shape (n, )
+
+    b_to_a : ndarray of shape (n, )
+
+    c_to_a : ndarray of shape (n, )
+
+    randoms : ndarray of shape (n, 3), optional
+        Unit normal randoms used in place of draws from ran_key.
+        Default is None, in which case randoms are drawn from ran_key.
+
+    Returns
+    -------
+    w : ndarray of shape (n, 3)
+
+    """
+    n = sigma.shape[0]
+    if randoms is None:
+        xkey, ykey, zkey, __ = jran.split(ran_key, 4)
+        randoms = jnp.stack(
+            [jran.normal(key, (n,)) for key in (xkey, ykey, zkey)], axis=1
+        )
+        randoms = randoms.astype(jnp.result_type(float, sigma))
+
+    sigma_xyz = jnp.stack((sigma, sigma * b_to_a, sigma * c_to_a), axis=1) / jnp.sqrt(3)
+    sigma_ellipse = jnp.sqrt(jnp.sum(sigma_xyz**2, axis=1))
+    volume_ratio = sigma / sigma_ellipse
+    return randoms * sigma_xyz * volume_ratio.reshape((n, 1))
+
+
+@jjit
+def calculate_virial_velocity(halo_mass, halo_radius):
+    """Calculate halo virial velocity to set normalization
+    of NFW satellite velocity dispersion
+
+    Parameters
+    ----------
+    halo_mass : ndarray, shape (n, )
+        Units of Msun
+
+    halo_radius : ndarray, shape (n, )
+        Units of Mpc
+
+    Returns
+    -------
+    halo_vvir : ndarray, shape (n, )
+        Units of km/s
+
+    """
+    return jnp.sqrt(NEWTON_G * halo_mass / halo_radius)
+
+
+@jjit
+def rotation_matrices_from_vectors(v0, v1):
+    """
+    Calculate a collection of rotation matrices defined by two sets of vectors,
+    v0 into v1, such that the resulting matrices rotate v0 into v1 about
+    the mutually perpendicular axis.
+
+    Parameters
+    ----------
+    v0 : ndarray
+        Array of shape (npts, 3) storing a collection of initial vector orientations.
+        Note that the normalization of `v0` will be ignored.
+
+    v1 : ndarray
+        Array of shape (npts, 3) storing a collection of final vectors.
+        Note that the normalization of `v1` will be ignored.
+
+    Returns
+    -------
+    matrices : ndarray
+        Array of shape (npts, 3, 3) rotating each v0 into the corresponding v1
+
+    """
+    v0 = normalized_vectors(v0)
+    v1 = normalized_vectors(v1)
+    cross = jnp.cross(v0, v1)
+    cross_norm = jnp.sqrt(jnp.sum(cross**2, axis=1))
+    # arctan2 is accurate for nearly (anti)parallel vectors, unlike arccos
+    angles = jnp.arctan2(cross_norm, jnp.sum(v0 * v1, axis=1))
+
+    # Edge case: where v0 and v1 are aligned, replace directions with v0
+    msk = (cross_norm == 0) | (angles == 0)
+    cross_norm = jnp.where(msk, 1.0, cross_norm)
+    directions = jnp.where(msk[:, None], v0, cross / cross_norm[:, None])
+    return rotation_matrices_from_angles(angles, directions)
+
+
+@jjit
+def rotation_matrices_from_angles(angles, directions):
+    """
+    Calculate a collection of rotation matrices defined by
+    an input collection of rotation angles and rotation axes.
+
+    Parameters
+    ----------
+    angles : ndarray
+        Array of shape (npts, ) storing a collection of rotation angles
+
+    directions : ndarray
+        Array of shape (npts, 3) storing a collection of rotation axes in 3d
+
+    Returns
+    -------
+    matrices : ndarray
+        Array of shape (npts, 3, 3) storing a collection of rotation matrices
+
+    """
+    directions = normalized_vectors(directions)
+    sina = jnp.sin(angles).reshape((-1, 1, 1))
+    cosa = jnp.cos(angles).reshape((-1, 1, 1))
+
+    ux, uy, uz = directions[:, 0], directions[:, 1], directions[:, 2]
+    zeros = jnp.zeros_like(ux)
+    cross_matrices = jnp.stack(
+        (
+            jnp.stack((zeros, -uz, uy), axis=1),
+            jnp.stack((uz, zeros, -ux), axis=1),
+            jnp.stack((-uy, ux, zeros), axis=1),
+        ),
+        axis=1,
+    )
+    outer = directions[:, :, None] * directions[:, None, :]
+    return cosa * jnp.eye(3) + (1.0 - cosa) * outer + sina * cross_matrices
+
+
+@jjit
+def rotation_matrices_from_x_axis(major_axes):
+    """
+    Calculate the rotation matrices of the x-axis into a collection of vectors,
+    see rotations3d.rotation_matrices_from_x_axis
+
+    Parameters
+    ----------
+    major_axes : ndarray
+        Array of shape (npts, 3). Note that the normalization will be ignored.
+
+    Returns
+    -------
+    matrices : ndarray
+        Array of shape (npts, 3, 3) rotating the x-axis into each major axis
+
+    """
+    ux, uy, uz, f, msk_anti = _get_x_axis_rotation_terms(major_axes)
+    ryz = -f * uy * uz
+    return jnp.stack(
+        (
+            jnp.stack((ux, -uy, -uz), axis=1),
+            jnp.stack((uy, jnp.where(msk_anti, -1.0, 1.0 - f * uy * uy), ryz), axis=1),
+            jnp.stack((uz, ryz, 1.0 - f * uz * uz), axis=1),
+        ),
+        axis=1,
+    )
+
+
+@jjit
+def rotate_from_x_axis(major_axes, *vectors):
+    """
+    Apply the rotations of rotation_matrices_from_x_axis to collections of vectors,
+    without computing the rotation matrices
+
+    Parameters
+    ----------
+    major_axes : ndarray
+        Array of shape (npts, 3). Note that the normalization will be ignored.
+
+    *vectors : ndarrays
+        One or more arrays of shape (npts, 3), e.g., positions and velocities,
+        that are all rotated by the same collection of rotations.
+
+    Returns
+    -------
+    rotated_vectors : ndarray or tuple of ndarrays
+        Array of shape (npts, 3) for each input array of vectors
+
+    """
+    ux, uy, uz, f, msk_anti = _get_x_axis_rotation_terms(major_axes)
+
+    rotated = []
+    for v in vectors:
+        vx, vy, vz = v[:, 0], v[:, 1], v[:, 2]
+        s = uy * vy + uz * vz
+        v_rot_x = ux * vx - s
+        v_rot_y = jnp.where(msk_anti, -vy, uy * vx + vy - f * uy * s)
+        v_rot_z = uz * vx + vz - f * uz * s
+        rotated.append(jnp.stack((v_rot_x, v_rot_y, v_rot_z), axis=1))
+
+    return rotated[0] if len(rotated) == 1 else tuple(rotated)
+
+
+def _get_x_axis_rotation_terms(major_axes):
+    u = normalized_vectors(major_axes)
+    ux, uy, uz = u[:, 0], u[:, 1], u[:, 2]
+
+    # 1 + ux = (uy² + uz²)/(1 - ux) avoids cancellation when ux approaches -1
+    s2 = uy * uy + uz * uz
+    one_plus_ux = jnp.where(ux >= 0, 1.0 + ux, s2 / (1.0 - ux))
+    msk_anti = one_plus_ux == 0
+    f = 1.0 / jnp.where(msk_anti, 1.0, one_plus_ux)
+    return ux, uy, uz, f, msk_anti
+
+
+@jjit
+def rotate_vector_collection(rotation_matrices, vectors):
+    """
+    Given a collection of rotation matrices and a collection of 3d vectors,
+    apply an associated matrix to rotate corresponding vector(s).
+
+    Parameters
+    ----------
+    rotation_matrices : ndarray
+        Either an array of shape (npts, 3, 3) storing one rotation matrix per vector,
+        or an array of shape (3, 3) storing a single rotation matrix
+
+    vectors : ndarray
+        Array of shape (npts, 3)
+
+    Returns
+    -------
+    rotated_vectors : ndarray
+        Array of shape (npts, 3)
+
+    """
+    if rotation_matrices.ndim == 2:
+        return vectors @ rotation_matrices.T
+    return jnp.einsum("ijk,ik->ij", rotation_matrices, vectors)
+
+
+@jjit
+def normalized_vectors(vectors):
+    """Return a unit vector for each vector of an array of shape (npts, ndim)"""
+    norm = jnp.sqrt(jnp.sum(vectors**2, axis=1))
+    return vectors / norm.reshape((-1, 1))
+
+
+def _rotate_from_x_axes(major_axes, b_to_a, c_to_a, *vectors):
+    """Rotate vectors by the rotations of the x-axis into major_axes,
+    leaving the vectors of spherical halos unrotated as in the NumPy sampler"""
+    msk_sph = (jnp.abs(1.0 - b_to_a) <= SPHERICAL_TOL) & (
+        jnp.abs(1.0 - c_to_a) <= SPHERICAL_TOL
+    )
+    rotated = rotate_from_x_axis(major_axes, *vectors)
+    if len(vectors) == 1:
+        rotated = (rotated,)
+    rotated = tuple(
+        jnp.where(msk_sph.reshape((-1, 1)), v, v_rot)
+        for v, v_rot in zip(vectors, rotated)
+    )
+    return rotated[0] if len(rotated) == 1 else rotated
@@ -6,6 +6,8 @@ from . import vector_utilities as vectu
 
 __all__ = [
     "rotation_matrices_from_vectors",
+    "rotation_matrices_from_x_axis",
+    "rotate_from_x_axis",
 ]
 
 
@@ -35,7 +37,8 @@ def rotation_matrices_from_angles(angles, directions):
     sina = np.sin(angles)
     cosa = np.cos(angles)
 
-    R1 = np.zeros((npts, 3, 3))
+    dtype = vectu._float_dtype(directions, sina)
+    R1 = np.zeros((npts, 3, 3), dtype=dtype)
     R1[:, 0, 0] = cosa
     R1[:, 1, 1] = cosa
     R1[:, 2, 2] = cosa
@@ -44,7 +47,7 @@ def rotation_matrices_from_angles(angles, directions):
     R2 = R2 * np.repeat(1.0 - cosa, 9).reshape((npts, 3, 3))
 
     directions *= sina.reshape((npts, 1))
-    R3 = np.zeros((npts, 3, 3))
+    R3 = np.zeros((npts, 3, 3), dtype=dtype)
     R3[:, [1, 2, 0], [2, 0, 1]] -= directions
     R3[:, [2, 0, 1], [1, 2, 0]] += directions
 
@@ -92,3 +95,100 @@ def rotation_matrices_from_vectors(v0, v1):
     directions[mask] = v0[mask]
 
     return rotation_matrices_from_angles(angles, directions)
+
+
+def rotation_matrices_from_x_axis(major_axes):
+    """
+    Calculate the rotation matrices of the x-axis into a collection of vectors,
+    about the axis perpendicular to both, as rotation_matrices_from_vectors.
+
+    Parameters
+    ----------
+    major_axes : ndarray
+        Numpy array of shape (npts, 3) storing a collection of final vectors.
+
+        Note that the normalization of `major_axes` will be ignored.
+
+    Returns
+    -------
+    matrices : ndarray
+        Numpy array of shape (npts, 3, 3) rotating the x-axis into each major axis
+
+    Notes
+    -----
+    For a unit vector u, Rodrigues' formula reduces to the closed form
+
+        R = [[ux, -uy,          -uz],
+             [uy, 1 - f*uy*uy,  -f*uy*uz],
+             [uz, -f*uy*uz,     1 - f*uz*uz]],  with f = 1/(1 + ux).
+
+    Vectors antiparallel to the x-axis are rotated by π about the z-axis.
+
+    """
+    ux, uy, uz, f, msk_anti = _get_x_axis_rotation_terms(major_axes)
+    npts = ux.size
+
+    matrices = np.empty((npts, 3, 3), dtype=ux.dtype)
+    matrices[:, 0, 0] = ux
+    matrices[:, 0, 1] = -uy
+    matrices[:, 0, 2] = -uz
+    matrices[:, 1, 0] = uy
+    matrices[:, 1, 1] = np.where(msk_anti, -1.0, 1.0 - f * uy * uy)
+    matrices[:, 1, 2] = -f * uy * uz
+    matrices[:, 2, 0] = uz
+    matrices[:, 2, 1] = matrices[:, 1, 2]
+    matrices[:, 2, 2] = 1.0 - f * uz * uz
+    return matrices
+
+
+def rotate_from_x_axis(major_axes, *vectors):
+    """
+    Apply the rotations of rotation_matrices_from_x_axis to collections of vectors,
+    without computing the rotation matrices.
+
+    Parameters
+    ----------
+    major_axes : ndarray
+        Numpy array of shape (npts, 3).
+
+        Note that the normalization of `major_axes` will be ignored.
+
+    *vectors : ndarrays
+        One or more Numpy arrays of shape (npts, 3), e.g., positions and velocities,
+        that are all rotated by the same collection of rotations.
+
+    Returns
+    -------
+    rotated_vectors : ndarray or tuple of ndarrays
+        Numpy array of shape (npts, 3) for each input array of vectors
+
+    """
+    ux, uy, uz, f, msk_anti = _get_x_axis_rotation_terms(major_axes)
+
+    rotated = []
+    for v in vectors:
+        v = np.asarray(v)
+        vx, vy, vz = v[:, 0], v[:, 1], v[:, 2]
+        s = uy * vy + uz * vz
+        v_rot = np.empty(v.shape, dtype=np.result_type(v, ux))
+        v_rot[:, 0] = ux * vx - s
+        v_rot[:, 1] = np.where(msk_anti, -vy, uy * vx + vy - f * uy * s)
+        v_rot[:, 2] = uz * vx + vz - f * uz * s
+        rotated.append(v_rot)
+
+    return rotated[0] if len(rotated) == 1 else tuple(rotated)
+
+
+def _get_x_axis_rotation_terms(major_axes):
+    """Terms of the rotation of the x-axis into major_axes, see
+    rotation_matrices_from_x_axis"""
+    u = vectu.normalized_vectors(major_axes)
+    ux, uy, uz = u[:, 0], u[:, 1], u[:, 2]
+
+    # 1 + ux = (uy² + uz²)/(1 - ux) avoids cancellation when ux approaches -1
+    s2 = uy * uy + uz * uz
+    with np.errstate(divide="ignore", invalid="ignore"):
+        one_plus_ux = np.where(ux >= 0, 1.0 + ux, s2 / (1.0 - ux))
+    msk_anti = one_plus_ux == 0
+    f = 1.0 / np.where(msk_anti, 1.0, one_plus_ux)
+    return ux, uy, uz, f, msk_anti
@@ -4,6 +4,7 @@ import numpy as np
 from jax import random as jran
 
 from .. import ellipsoidal_nfw_phase_space as enfwps
+from .. import phase_space_kernels as psk
 
 
 def test_mc_ellipsoidal_nfw():
@@ -27,3 +28,98 @@ def test_mc_ellipsoidal_nfw():
 
     assert np.all(np.isfinite(pos))
     assert np.all(np.isfinite(vel))
+
+
+def test_mc_ellipsoidal_nfw_accepts_input_randoms():
+    ran_key = jran.key(0)
+    n_halos = 25
+
+    r_key, conc_key, axes_key, sigma_key, u_key, n_key = jran.split(ran_key, 6)
+
+    rhalo = jran.uniform(r_key, minval=0.5, maxval=2.0, shape=(n_halos,))
+    conc = jran.uniform(conc_key, minval=2.0, maxval=20.0, shape=(n_halos,))
+    sigma = jran.uniform(sigma_key, minval=10.0, maxval=200.0, shape=(n_halos,))
+    major_axes = jran.uniform(axes_key, minval=0.0, maxval=1.0, shape=(n_halos, 3))
+    b_to_a = np.ones(n_halos)
+    c_to_a = np.ones(n_halos)
+    pos_randoms = jran.uniform(u_key, shape=(n_halos, 3))
+    vel_randoms = jran.normal(n_key, shape=(n_halos, 3))
+
+    args = (rhalo, conc, sigma, major_axes, b_to_a, c_to_a)
+    kwargs = dict(pos_randoms=pos_randoms, vel_randoms=vel_randoms)
+    pos, vel = enfwps.mc_ellipsoidal_nfw(jran.key(1), *args, **kwargs)
+    pos2, vel2 = enfwps.mc_ellipsoidal_nfw(jran.key(2), *args, **kwargs)
+    assert np.allclose(pos, pos2)
+    assert np.allclose(vel, vel2)
+
+    # For spherical halos, the speed is set by the norm of the normal randoms
+    speed = np.sqrt(np.sum(vel**2, axis=1))
+    speed2 = sigma * np.sqrt(np.sum(vel_randoms**2, axis=1)) / np.sqrt(3)
+    assert np.allclose(speed, speed2, rtol=1e-4)
+
+
+def test_mc_ellipsoidal_nfw_skips_rotations_of_spherical_halos():
+    ran_key = jran.key(0)
+    n_halos = 50
+
+    r_key, axes_key, b_key, pos_key, vel_key, nfw_key = jran.split(ran_key, 6)
+    rhalo = np.array(jran.uniform(r_key, minval=0.5, maxval=2.0, shape=(n_halos,)))
+    conc = np.zeros(n_halos) + 5.0
+    sigma = np.zeros(n_halos) + 100.0
+    major_axes = np.array(jran.normal(axes_key, shape=(n_halos, 3)))
+    b_to_a = np.array(jran.uniform(b_key, minval=0.5, maxval=0.9, shape=(n_halos,)))
+    msk_sph = np.arange(n_halos) % 2 == 0
+    b_to_a[msk_sph] = 1.0
+    c_to_a = np.copy(b_to_a)
+    pos_randoms = np.array(jran.uniform(pos_key, shape=(n_halos, 3)))
+    vel_randoms = np.array(jran.normal(vel_key, shape=(n_halos, 3)))
+    args = (nfw_key, rhalo, conc, sigma, major_axes, b_to_a, c_to_a)
+    randoms = dict(pos_randoms=pos_randoms, vel_randoms=vel_randoms)
+
+    pos, vel = enfwps.mc_ellipsoidal_nfw(*args, **randoms)
+    pos_rot, vel_rot = enfwps.mc_ellipsoidal_nfw(*args, **randoms, spherical_tol=-1)
+
+    # Spherical halos are unrotated, so that vel is proportional to the randoms
+    vel_ratio = vel[msk_sph] / vel_randoms[msk_sph]
+    assert np.allclose(vel_ratio, vel_ratio[:, :1])
+    assert np.allclose(pos[~msk_sph], pos_rot[~msk_sph])
+    assert np.allclose(vel[~msk_sph], vel_rot[~msk_sph])
+
+    # Rotations do not change the distance to the center of spherical halos
+    r = np.sqrt(np.sum(pos**2, axis=1))
+    r_rot = np.sqrt(np.sum(pos_rot**2, axis=1))
+    assert np.allclose(r, r_rot)
+
+    pos2, vel2 = psk.mc_ellipsoidal_nfw(*args, **randoms)
+    assert np.allclose(pos, pos2, atol=1e-5)
+    assert np.allclose(vel, vel2, atol=1e-3)
+
+    args = [x[msk_sph] for x in args[1:]]
+    randoms = {key: val[msk_sph] for key, val in randoms.items()}
+    pos3, vel3 = psk.mc_ellipsoidal_nfw(nfw_key, *args, **randoms, spherical=True)
+    assert np.allclose(pos[msk_sph], pos3, atol=1e-5)
+    assert np.allclose(vel[msk_sph], vel3, atol=1e-3)
+
+
+def test_mc_ellipsoidal_nfw_preserves_float32_inputs():
+    ran_key = jran.key(0)
+    n_halos = 200
+
+    r_key, conc_key, axes_key, b_key, c_key, sigma_key, nfw_key = jran.split(ran_key, 7)
+    rhalo = np.array(jran.uniform(r_key, minval=0.5, maxval=2.0, shape=(n_halos,)))
+    conc = np.array(jran.uniform(conc_key, minval=2.0, maxval=20.0, shape=(n_halos,)))
+    sigma = np.array(jran.uniform(sigma_key, minval=10, maxval=200, shape=(n_halos,)))
+    major_axes = np.array(jran.normal(axes_key, shape=(n_halos, 3)))
+    b_to_a = np.array(jran.uniform(b_key, minval=0.5, maxval=1.0, shape=(n_halos,)))
+    c_to_a = np.array(jran.uniform(c_key, minval=0.5, maxval=1.0, shape=(n_halos,)))
+    args = (rhalo, conc, sigma, major_axes, b_to_a, c_to_a * b_to_a)
+
+    pos, vel = enfwps.mc_ellipsoidal_nfw(nfw_key, *args)
+    args32 = [x.astype(np.float32) for x in args]
+    pos32, vel32 = enfwps.mc_ellipsoidal_nfw(nfw_key, *args32)
+    assert pos32.dtype == np.float32
+    assert vel32.dtype == np.float32
+
+    # Same points as for float64 inputs, up to single-precision roundoff
+    assert np.allclose(pos32, pos, atol=1e-5)
+    assert np.allclose(vel32 / sigma[:, None], vel / sigma[:, None], atol=1e-5)
@@ -1,7 +1,13 @@
 """"""
 
+from decimal import Decimal, localcontext
+
+import jax
 import numpy as np
+from jax import jit as jjit
+from jax import numpy as jnp
 from jax import random as jran
+from scipy import special
 
 from .. import nfw_config_space as nfwcs
 
@@ -28,3 +34,110 @@ def test_mc_ellipsoidal_positions_are_inside_the_input_halos():
     assert np.all(pos >= -rhalo.reshape((-1, 1)))
     assert np.all(pos <= rhalo.reshape((-1, 1)))
     assert ~np.any(pos == 0.0)
+
+
+def test_mc_ellipsoidal_positions_accepts_input_randoms():
+    ran_key = jran.key(0)
+    n_halos = 25
+
+    r_key, conc_key, axes_key, u_key, pos_key = jran.split(ran_key, 5)
+
+    rhalo = jran.uniform(r_key, minval=0.5, maxval=2.0, shape=(n_halos,))
+    conc = jran.uniform(conc_key, minval=2.0, maxval=20.0, shape=(n_halos,))
+    major_axes = jran.uniform(axes_key, minval=0.0, maxval=1.0, shape=(n_halos, 3))
+    b_to_a = np.ones(n_halos)
+    c_to_a = np.ones(n_halos)
+    randoms = jran.uniform(u_key, shape=(n_halos, 3))
+
+    pos = nfwcs.mc_ellipsoidal_positions(
+        pos_key, rhalo, conc, major_axes, b_to_a, c_to_a, randoms=randoms
+    )
+    assert np.all(np.isfinite(pos))
+    assert np.all(np.sqrt(np.sum(pos**2, axis=1)) <= rhalo)
+
+    # Output is determined by the randoms, not by the key
+    pos2 = nfwcs.mc_ellipsoidal_positions(
+        jran.key(1), rhalo, conc, major_axes, b_to_a, c_to_a, randoms=randoms
+    )
+    assert np.allclose(pos, pos2)
+
+    r = np.sqrt(np.sum(pos**2, axis=1)) / rhalo
+    r2 = nfwcs.random_nfw_radial_position(pos_key, conc, randoms=randoms[:, 0])
+    assert np.allclose(r, r2, rtol=1e-4)
+
+
+def _qnfw_decimal(p, conc, n_digits=60):
+    """Solve the NFW CDF for r/Rhalo by Newton iteration in extended precision"""
+    with localcontext() as ctx:
+        ctx.prec = n_digits + max(0, -Decimal(p).adjusted())
+        conc = Decimal(conc)
+        p = Decimal(p) * ((1 + conc).ln() - conc / (1 + conc))
+        y = (2 * p).sqrt() if p < 1 else conc
+        for __ in range(500):
+            f = (1 + y).ln() - y / (1 + y) - p
+            y_new = y - f * (1 + y) ** 2 / y
+            y_new = y / 2 if y_new <= 0 else y_new
+            if abs(y_new - y) < Decimal(10) ** (-n_digits) * y:
+                break
+            y = y_new
+        return float(y_new / conc)
+
+
+def test_qnfw_agrees_with_extended_precision_solution():
+    p = np.concatenate(([1e-200, 1e-30, 1e-12], np.linspace(1e-6, 1, 30)))
+    for conc in (1.0, 5.0, 100.0, 1000.0):
+        r_exact = np.array([_qnfw_decimal(x, conc) for x in p])
+        with jax.enable_x64(True):
+            r = nfwcs._qnfw(p, np.zeros_like(p) + conc)
+        assert np.allclose(r, r_exact, rtol=1e-13, atol=0)
+
+        msk = p > 1e-30
+        with jax.enable_x64(False):
+            r = nfwcs._qnfw(p[msk], np.zeros_like(p[msk]) + conc)
+        assert np.allclose(r, r_exact[msk], rtol=1e-4, atol=0)
+
+
+def test_qnfw_agrees_with_scipy_lambertw():
+    ran_key = jran.key(0)
+    u_key, conc_key = jran.split(ran_key, 2)
+    n = 10_000
+    p = np.array(jran.uniform(u_key, shape=(n,)))
+    conc = np.array(jran.uniform(conc_key, minval=1.0, maxval=100.0, shape=(n,)))
+    with jax.enable_x64(True):
+        r = nfwcs._qnfw(p.astype(float), conc.astype(float))
+
+    p, conc = p.astype(float), conc.astype(float)
+    pnorm = p * (np.log1p(conc) - conc / (1 + conc))
+    w = np.real(special.lambertw(-np.exp(-pnorm - 1)))
+    r_scipy = (-(1.0 / w) - 1) / conc
+    assert np.allclose(r, r_scipy, rtol=1e-8)
+
+    assert np.allclose(nfwcs._qnfw(np.zeros(3), np.ones(3)), 0.0)
+    assert np.allclose(nfwcs._qnfw(np.ones(3), np.arange(1, 4)), 1.0)
+
+
+def test_qnfw_kern_is_jittable_and_vectorizes_over_concentration():
+    p = jnp.linspace(0, 1, 20)
+    conc = jnp.linspace(2, 20, 10)
+
+    @jjit
+    def _r_grid(p, conc):
+        return nfwcs._qnfw_kern(p.reshape((1, -1)), conc.reshape((-1, 1)))
+
+    r = _r_grid(p, conc)
+    assert r.shape == (10, 20)
+    assert np.all(np.diff(r, axis=1) > 0)
+    assert np.all(np.diff(r, axis=0) <= 1e-5)
+    assert np.allclose(r[:, 0], 0.0)
+    assert np.allclose(r[:, -1], 1.0, rtol=1e-5)
+
+
+def test_pnfwunorm_is_numpy_and_preserves_dtype():
+    conc = np.linspace(1.0, 100.0, 10)
+    for dtype in (np.float32, np.float64):
+        pnorm = nfwcs._pnfwunorm(1.0, conc.astype(dtype))
+        assert type(pnorm) is np.ndarray
+        assert pnorm.dtype == dtype
+    with jax.enable_x64(True):
+        pnorm_kern = nfwcs._pnfwunorm_kern(1.0, conc)
+    assert np.allclose(nfwcs._pnfwunorm(1.0, conc), pnorm_kern, rtol=1e-12)
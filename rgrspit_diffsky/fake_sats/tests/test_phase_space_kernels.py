@@ -0,0 +1,152 @@
+""" """
+
+import numpy as np
+from jax import jit as jjit
+from jax import random as jran
+from jax import vmap
+
+from .. import phase_space_kernels as psk
+from .. import rotations3d
+from ..ellipsoidal_nfw_phase_space import mc_ellipsoidal_nfw
+from ..nfw_config_space import _qnfw_kern
+
+
+def _mc_sats(ran_key, n):
+    r_key, conc_key, sigma_key, axes_key, b_key, c_key = jran.split(ran_key, 6)
+    rhalo = np.array(jran.uniform(r_key, minval=0.5, maxval=2.0, shape=(n,)))
+    conc = np.array(jran.uniform(conc_key, minval=2.0, maxval=20.0, shape=(n,)))
+    sigma = np.array(jran.uniform(sigma_key, minval=100.0, maxval=500.0, shape=(n,)))
+    major_axes = np.array(jran.normal(axes_key, shape=(n, 3)))
+    b_to_a = np.array(jran.uniform(b_key, minval=0.5, maxval=1.0, shape=(n,)))
+    c_to_a = np.array(jran.uniform(c_key, minval=0.5, maxval=1.0, shape=(n,)))
+    return rhalo, conc, sigma, major_axes, b_to_a, c_to_a * b_to_a
+
+
+def test_mc_ellipsoidal_nfw_agrees_with_numpy_implementation():
+    ran_key = jran.key(0)
+    sats_key, nfw_key, pos_key, vel_key = jran.split(ran_key, 4)
+    n = 500
+    sats = _mc_sats(sats_key, n)
+    sigma = sats[2].reshape((-1, 1))
+
+    pos, vel = mc_ellipsoidal_nfw(nfw_key, *sats)
+    pos2, vel2 = psk.mc_ellipsoidal_nfw(nfw_key, *sats)
+    assert np.allclose(pos, pos2, atol=1e-4)
+    assert np.allclose(vel / sigma, vel2 / sigma, atol=1e-4)
+
+    pos_randoms = jran.uniform(pos_key, shape=(n, 3))
+    vel_randoms = jran.normal(vel_key, shape=(n, 3))
+    pos, vel = mc_ellipsoidal_nfw(
+        nfw_key, *sats, pos_randoms=pos_randoms, vel_randoms=vel_randoms
+    )
+    pos2, vel2 = psk.mc_ellipsoidal_nfw(
+        jran.key(1), *sats, pos_randoms=pos_randoms, vel_randoms=vel_randoms
+    )
+    assert np.allclose(pos, pos2, atol=1e-4)
+    assert np.allclose(vel / sigma, vel2 / sigma, atol=1e-4)
+
+
+def test_mc_ellipsoidal_nfw_preserves_float32_inputs():
+    sats_key, nfw_key = jran.split(jran.key(0), 2)
+    sats = _mc_sats(sats_key, 500)
+    sigma = sats[2].reshape((-1, 1))
+    sats32 = [x.astype(np.float32) for x in sats]
+    for qnfw_table in (None, psk.get_qnfw_table()):
+        pos, vel = psk.mc_ellipsoidal_nfw(nfw_key, *sats, qnfw_table=qnfw_table)
+        pos32, vel32 = psk.mc_ellipsoidal_nfw(nfw_key, *sats32, qnfw_table=qnfw_table)
+        assert pos32.dtype == np.float32
+        assert vel32.dtype == np.float32
+        assert np.allclose(pos32, pos, atol=1e-5)
+        assert np.allclose(vel32 / sigma, vel / sigma, atol=1e-5)
+
+
+def test_rotation_matrices_from_vectors_agrees_with_numpy_implementation():
+    ran_key = jran.key(0)
+    v0_key, v1_key = jran.split(ran_key, 2)
+    n = 200
+    v0 = np.array(jran.normal(v0_key, shape=(n, 3)))
+    v1 = np.array(jran.normal(v1_key, shape=(n, 3)))
+    v1[0] = 2 * v0[0]
+
+    matrices = rotations3d.rotation_matrices_from_vectors(v0, v1)
+    matrices2 = psk.rotation_matrices_from_vectors(v0, v1)
+    assert np.allclose(matrices, matrices2, atol=1e-5)
+    assert np.allclose(np.linalg.det(matrices2), 1.0, atol=1e-5)
+
+    v0_rot = psk.rotate_vector_collection(matrices2, psk.normalized_vectors(v0))
+    assert np.allclose(v0_rot, psk.normalized_vectors(v1), atol=1e-5)
+    assert np.allclose(matrices2[0], np.eye(3), atol=1e-6)
+
+    v0_rot = psk.rotate_vector_collection(matrices2[0], v0)
+    assert np.allclose(v0_rot, v0, atol=1e-5)
+
+
+def test_mc_ellipsoidal_nfw_is_jittable_and_vmappable():
+    ran_key = jran.key(0)
+    n_batch, n = 4, 100
+    sats_key, nfw_key = jran.split(ran_key, 2)
+    sats = [np.array(x) for x in _mc_sats(sats_key, n_batch * n)]
+    sats = [x.reshape((n_batch, n, *x.shape[1:])) for x in sats]
+    nfw_keys = jran.split(nfw_key, n_batch)
+
+    pos, vel = jjit(vmap(psk.mc_ellipsoidal_nfw))(nfw_keys, *sats)
+    assert pos.shape == (n_batch, n, 3)
+    assert vel.shape == (n_batch, n, 3)
+    for i in range(n_batch):
+        pos_i, vel_i = psk.mc_ellipsoidal_nfw(nfw_keys[i], *[x[i] for x in sats])
+        assert np.allclose(pos[i], pos_i, atol=1e-5)
+        assert np.allclose(vel[i], vel_i, rtol=1e-4)
+
+    assert np.all(np.isfinite(pos))
+    assert np.all(np.isfinite(vel))
+
+
+def test_rotate_from_x_axis_agrees_with_numpy_implementation():
+    ran_key = jran.key(0)
+    axes_key, pos_key = jran.split(ran_key, 2)
+    n = 200
+    major_axes = np.array(jran.normal(axes_key, shape=(n, 3)))
+    major_axes[0] = (-3.0, 0.0, 0.0)
+    major_axes[1] = (3.0, 0.0, 0.0)
+    pos = np.array(jran.normal(pos_key, shape=(n, 3)))
+
+    matrices = rotations3d.rotation_matrices_from_x_axis(major_axes)
+    matrices2 = psk.rotation_matrices_from_x_axis(major_axes)
+    assert np.allclose(matrices, matrices2, atol=1e-6)
+
+    pos_rot = rotations3d.rotate_from_x_axis(major_axes, pos)
+    pos_rot2, pos_rot3 = psk.rotate_from_x_axis(major_axes, pos, 2 * pos)
+    assert np.allclose(pos_rot, pos_rot2, atol=1e-5)
+    assert np.allclose(2 * pos_rot, pos_rot3, atol=1e-5)
+
+
+def test_qnfw_table_kern_agrees_with_exact_inverse_cdf():
+    qnfw_table = psk.get_qnfw_table()
+    assert qnfw_table.shape == (psk.N_LGC_TABLE, psk.N_CDF_TABLE)
+    assert np.all(np.diff(qnfw_table, axis=1) >= 0)
+
+    ran_key = jran.key(0)
+    p_key, conc_key = jran.split(ran_key, 2)
+    n = 10_000
+    p = jran.uniform(p_key, shape=(n,))
+    conc = 10 ** jran.uniform(conc_key, minval=0.0, maxval=3.0, shape=(n,))
+    r = psk.qnfw_table_kern(p, conc, qnfw_table)
+    r_exact = _qnfw_kern(p, conc)
+    assert np.allclose(r, r_exact, atol=5e-5)
+    assert np.all((r >= 0) & (r <= 1))
+
+    p = np.array((0.0, 1.0, 0.5, 0.5))
+    conc = np.array((5.0, 5.0, 0.1, 1e4))
+    r = psk.qnfw_table_kern(p, conc, qnfw_table)
+    assert np.allclose(r[:2], (0.0, 1.0))
+    assert np.allclose(r[2:], _qnfw_kern(p[2:], np.array((1.0, 1e3))), atol=5e-5)
+
+
+def test_mc_ellipsoidal_nfw_with_qnfw_table_agrees_with_exact_radii():
+    ran_key = jran.key(0)
+    sats_key, nfw_key = jran.split(ran_key, 2)
+    sats = _mc_sats(sats_key, 500)
+    pos, vel = psk.mc_ellipsoidal_nfw(nfw_key, *sats)
+    pos2, vel2 = psk.mc_ellipsoidal_nfw(nfw_key, *sats, qnfw_table=psk.get_qnfw_table())
+    assert np.allclose(pos, pos2, atol=1e-4)
+    assert np.allclose(vel, vel2)
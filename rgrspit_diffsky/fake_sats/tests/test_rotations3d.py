@@ -26,3 +26,52 @@ def test_rotation_matrices_from_vectors():
 
     v_collection = vectu.rotate_vector_collection(rot_matrices, v0_collection)
     assert np.allclose(v_collection, v1_collection, rtol=1e-3)
+
+
+def test_rotation_matrices_from_x_axis_agrees_with_rotation_matrices_from_vectors():
+    ran_key = jran.key(0)
+    n_vectors = 200
+    major_axes = np.array(jran.normal(ran_key, shape=(n_vectors, 3)))
+    x_axes = np.tile([1.0, 0.0, 0.0], (n_vectors, 1))
+
+    matrices = rotations3d.rotation_matrices_from_x_axis(major_axes)
+    matrices2 = rotations3d.rotation_matrices_from_vectors(x_axes, major_axes)
+    assert np.allclose(matrices, matrices2, atol=1e-6)
+
+    x_rot = vectu.rotate_vector_collection(matrices, x_axes)
+    assert np.allclose(x_rot, vectu.normalized_vectors(major_axes))
+
+
+def test_rotation_matrices_from_x_axis_handles_aligned_and_antiparallel_axes():
+    major_axes = np.array(
+        [[2.0, 0, 0], [-2.0, 0, 0], [-1.0, 1e-9, 0], [-1.0, 1e-12, -1e-12]]
+    )
+    matrices = rotations3d.rotation_matrices_from_x_axis(major_axes)
+    assert np.allclose(matrices[0], np.eye(3))
+    assert np.allclose(np.linalg.det(matrices), 1.0)
+    identity = np.einsum("nij,nkj->nik", matrices, matrices)
+    assert np.allclose(identity, np.eye(3))
+
+    x_axes = np.tile([1.0, 0.0, 0.0], (4, 1))
+    x_rot = vectu.rotate_vector_collection(matrices, x_axes)
+    assert np.allclose(x_rot, vectu.normalized_vectors(major_axes))
+
+
+def test_rotate_from_x_axis_agrees_with_rotation_matrices():
+    ran_key = jran.key(0)
+    axes_key, pos_key, vel_key = jran.split(ran_key, 3)
+    n_vectors = 200
+    major_axes = np.array(jran.normal(axes_key, shape=(n_vectors, 3)))
+    major_axes[0] = (-3.0, 0.0, 0.0)
+    pos = np.array(jran.normal(pos_key, shape=(n_vectors, 3)))
+    vel = np.array(jran.normal(vel_key, shape=(n_vectors, 3)))
+
+    matrices = rotations3d.rotation_matrices_from_x_axis(major_axes)
+    pos_rot, vel_rot = rotations3d.rotate_from_x_axis(major_axes, pos, vel)
+    pos_rot_matrices = vectu.rotate_vector_collection(matrices, pos)
+    vel_rot_matrices = vectu.rotate_vector_collection(matrices, vel)
+    assert np.allclose(pos_rot, pos_rot_matrices, atol=1e-6)
+    assert np.allclose(vel_rot, vel_rot_matrices, atol=1e-6)
+
+    pos_rot2 = rotations3d.rotate_from_x_axis(major_axes, pos)
+    assert np.allclose(pos_rot, pos_rot2)
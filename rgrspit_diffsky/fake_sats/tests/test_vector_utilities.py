@@ -0,0 +1,127 @@
+""" """
+
+import tracemalloc
+
+import numpy as np
+
+from .. import vector_utilities as vectu
+
+
+def _random_vectors(n, dtype=np.float64, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.normal(size=(n, 3)).astype(dtype), rng.normal(size=(n, 3)).astype(dtype)
+
+
+def test_blocked_functions_agree_with_direct_calculation():
+    x, y = _random_vectors(1000)
+    norm = np.sqrt(np.sum(x**2, axis=1))
+    dot = np.sum(x * y, axis=1)
+    unit_x = x / norm[:, np.newaxis]
+    unit_y = y / np.sqrt(np.sum(y**2, axis=1))[:, np.newaxis]
+
+    assert np.allclose(vectu.elementwise_norm(x), norm)
+    assert np.allclose(vectu.elementwise_dot(x, y), dot)
+    for block_size in (7, 1000, vectu.BLOCK_SIZE):
+        assert np.allclose(vectu.normalized_vectors(x, block_size=block_size), unit_x)
+
+        angles = vectu.angles_between_list_of_vectors(x, y, block_size=block_size)
+        assert np.allclose(angles, np.arccos(np.sum(unit_x * unit_y, axis=1)))
+
+        vn = vectu.normalized_vectors(np.cross(x, y))
+        angles2 = vectu.angles_between_list_of_vectors(
+            unit_x, unit_y, vn=vn, block_size=block_size
+        )
+        assert np.allclose(angles2, angles)
+
+        proj = vectu.project_onto_plane(x, y, block_size=block_size)
+        assert np.allclose(proj, x - np.sum(x * unit_y, axis=1)[:, None] * unit_y)
+        assert np.allclose(vectu.elementwise_dot(proj, y), 0.0)
+
+
+def test_out_arguments_and_in_place_operation():
+    x, y = _random_vectors(500)
+    unit_x = vectu.normalized_vectors(x)
+    proj = vectu.project_onto_plane(x, y)
+
+    out = np.zeros(x.shape[0])
+    result = vectu.elementwise_norm(x, out=out)
+    assert result is out
+    assert np.allclose(out, np.sqrt(np.sum(x**2, axis=1)))
+    result = vectu.angles_between_list_of_vectors(x, y, out=out, block_size=64)
+    assert result is out
+    assert np.allclose(out, vectu.angles_between_list_of_vectors(x, y))
+
+    x2 = x.copy()
+    result = vectu.normalized_vectors(x2, out=x2, block_size=64)
+    assert result is x2
+    assert np.allclose(x2, unit_x)
+
+    x2 = x.copy()
+    result = vectu.project_onto_plane(x2, y, out=x2, block_size=64)
+    assert result is x2
+    assert np.allclose(x2, proj)
+
+
+def test_float32_inputs_return_float32():
+    x, y = _random_vectors(300, dtype=np.float32)
+    assert vectu.elementwise_norm(x).dtype == np.float32
+    assert vectu.elementwise_dot(x, y).dtype == np.float32
+    assert vectu.normalized_vectors(x).dtype == np.float32
+    assert vectu.project_onto_plane(x, y).dtype == np.float32
+
+    angles = vectu.angles_between_list_of_vectors(x, y)
+    assert angles.dtype == np.float32
+    angles64 = vectu.angles_between_list_of_vectors(x.astype(float), y.astype(float))
+    assert np.allclose(angles, angles64, atol=1e-3)
+
+    # Integer inputs are promoted to float64
+    assert vectu.normalized_vectors(np.ones((4, 3), dtype=int)).dtype == np.float64
+
+
+def test_integer_inputs():
+    x = np.array([[3, 4, 0], [1, 2, 2]])
+    y = np.array([[1, 0, 0], [0, 0, 1]])
+    norm = vectu.elementwise_norm(x)
+    assert norm.dtype == np.float64
+    assert np.allclose(norm, (5.0, 3.0))
+    assert np.allclose(vectu.elementwise_norm([3, 4, 0]), 5.0)
+
+    dot = vectu.elementwise_dot(x, y)
+    assert np.issubdtype(dot.dtype, np.integer)
+    assert np.all(dot == (3, 2))
+
+    xf, yf = x.astype(float), y.astype(float)
+    angles = vectu.angles_between_list_of_vectors(x, y)
+    assert np.allclose(angles, vectu.angles_between_list_of_vectors(xf, yf))
+    assert np.allclose(vectu.project_onto_plane(x, y), vectu.project_onto_plane(xf, yf))
+    assert np.allclose(vectu.normalized_vectors(x), xf / norm[:, np.newaxis])
+
+
+def test_single_vector_is_broadcast_to_all_points():
+    x, y = _random_vectors(50)
+    z_axis = np.array((0.0, 0.0, 1.0))
+    proj = vectu.project_onto_plane(x, z_axis, block_size=16)
+    assert np.allclose(proj[:, :2], x[:, :2])
+    assert np.allclose(proj[:, 2], 0.0)
+
+    angles = vectu.angles_between_list_of_vectors(x, z_axis, block_size=16)
+    assert np.allclose(np.cos(angles), x[:, 2] / vectu.elementwise_norm(x))
+
+
+def test_parallel_and_antiparallel_vectors():
+    x, __ = _random_vectors(20)
+    angles = vectu.angles_between_list_of_vectors(x, 3 * x)
+    assert np.all(np.isfinite(angles))
+    assert np.allclose(angles, 0.0, atol=1e-6)
+    angles = vectu.angles_between_list_of_vectors(x, -x)
+    assert np.allclose(angles, np.pi)
+
+
+def test_in_place_normalization_does_not_allocate_full_size_temporaries():
+    x, y = _random_vectors(200_000)
+    tracemalloc.start()
+    vectu.normalized_vectors(x, out=x)
+    vectu.project_onto_plane(y, x, out=y)
+    __, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert peak < x.nbytes / 4
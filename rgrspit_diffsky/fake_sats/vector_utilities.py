@@ -14,8 +14,12 @@ __all__ = [
     "rotate_vector_collection",
 ]
 
+# Number of points processed at a time by the blocked functions below.
+# The temporary arrays of a block of 3d vectors fit in the L2 cache.
+BLOCK_SIZE = 2**14
 
-def normalized_vectors(vectors):
+
+def normalized_vectors(vectors, out=None, block_size=BLOCK_SIZE):
     """
     Return a unit vector for each n-dimensional vector in the input list
     of n-dimensional points.
@@ -25,6 +29,13 @@ def normalized_vectors(vectors):
     x : ndarray
         Numpy array of shape (npts, ndim) storing a collection of n-dimensional points
 
+    out : ndarray, optional
+        Numpy array of shape (npts, ndim) in which to store the result.
+        Passing out=x normalizes x in place. Default is a new array.
+
+    block_size : int, optional
+        Number of points processed at a time. Default is BLOCK_SIZE.
+
     Returns
     -------
     normed_x : ndarray
@@ -33,13 +44,18 @@ def normalized_vectors(vectors):
     """
 
     vectors = np.atleast_2d(vectors)
-    npts = vectors.shape[0]
+    if out is None:
+        out = np.empty(vectors.shape, dtype=_float_dtype(vectors))
+    norm = np.empty(min(block_size, vectors.shape[0]), dtype=out.dtype)
 
     with np.errstate(divide="ignore", invalid="ignore"):
-        return vectors / elementwise_norm(vectors).reshape((npts, -1))
+        for s in _blocks(vectors.shape[0], block_size):
+            norm_s = elementwise_norm(vectors[s], out=norm[: s.stop - s.start])
+            np.divide(vectors[s], norm_s[:, np.newaxis], out=out[s])
+    return out
 
 
-def elementwise_norm(x):
+def elementwise_norm(x, out=None):
     """
     Calculate the normalization of each element in a list of n-dimensional points.
 
@@ -48,6 +64,10 @@ def elementwise_norm(x):
     x : ndarray
         Numpy array of shape (npts, ndim) storing a collection of n-dimensional points
 
+    out : ndarray, optional
+        Numpy array of shape (npts, ) in which to store the result.
+        Default is a new floating-point array, also for integer x.
+
     Returns
     -------
     result : ndarray
@@ -56,10 +76,13 @@ def elementwise_norm(x):
     """
 
     x = np.atleast_2d(x)
-    return np.sqrt(np.sum(x**2, axis=1))
+    if out is None:
+        out = np.empty(x.shape[0], dtype=_float_dtype(x))
+    out = elementwise_dot(x, x, out=out)
+    return np.sqrt(out, out=out)
 
 
-def elementwise_dot(x, y):
+def elementwise_dot(x, y, out=None):
     """
     Calculate the dot product between
     each pair of elements in two input lists of n-dimensional points.
@@ -72,20 +95,31 @@ def elementwise_dot(x, y):
     y : ndarray
         Numpy array of shape (npts, ndim) storing a collection of n-dimensional vectors
 
+    out : ndarray, optional
+        Numpy array of shape (npts, ) in which to store the result.
+        Default is a new array of the dtype of x*y, e.g., integer for integer inputs.
+
     Returns
     -------
     result : ndarray
         Numpy array of shape (npts, ) storing the dot product between each
         pair of corresponding vectors in x and y.
 
+    Notes
+    -----
+    The products x*y are summed by np.einsum without a temporary array
+    of shape (npts, ndim).
+
     """
 
     x = np.atleast_2d(x)
     y = np.atleast_2d(y)
-    return np.sum(x * y, axis=1)
+    return np.einsum("ij,ij->i", x, y, out=out)
 
 
-def angles_between_list_of_vectors(v0, v1, tol=1e-3, vn=None):
+def angles_between_list_of_vectors(
+    v0, v1, tol=1e-3, vn=None, out=None, block_size=BLOCK_SIZE
+):
     """Calculate the angle between a collection of n-dimensional vectors
 
     Parameters
@@ -107,6 +141,13 @@ def angles_between_list_of_vectors(v0, v1, tol=1e-3, vn=None):
     n1 : ndarray
         normal vector
 
+    out : ndarray, optional
+        Numpy array of shape (npts, ) in which to store the result.
+        Default is a new array.
+
+    block_size : int, optional
+        Number of points processed at a time. Default is BLOCK_SIZE.
+
     Returns
     -------
     angles : ndarray
@@ -117,20 +158,35 @@ def angles_between_list_of_vectors(v0, v1, tol=1e-3, vn=None):
 
     """
 
-    dot = elementwise_dot(normalized_vectors(v0), normalized_vectors(v1))
-
-    if vn is None:
-        #  Protect against tiny numerical excesses beyond the range [-1 ,1]
-        mask1 = (dot > 1) & (dot < 1 + tol)
-        dot = np.where(mask1, 1.0, dot)
-        mask2 = (dot < -1) & (dot > -1 - tol)
-        dot = np.where(mask2, -1.0, dot)
-        a = np.arccos(dot)
-    else:
-        cross = np.cross(v0, v1)
-        a = np.arctan2(elementwise_dot(cross, vn), dot)
-
-    return a
+    v0 = np.atleast_2d(v0)
+    v1 = np.atleast_2d(v1)
+    npts = max(v0.shape[0], v1.shape[0])
+    if out is None:
+        out = np.empty(npts, dtype=_float_dtype(v0, v1))
+    dot = np.empty(min(block_size, npts), dtype=out.dtype)
+    norm = np.empty_like(dot)
+    if vn is not None:
+        vn = np.atleast_2d(vn)
+
+    for s in _blocks(npts, block_size):
+        v0_s, v1_s = _rows(v0, s), _rows(v1, s)
+        n_s = s.stop - s.start
+        dot_s = elementwise_dot(v0_s, v1_s, out=dot[:n_s])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            dot_s /= elementwise_norm(v0_s, out=norm[:n_s])
+            dot_s /= elementwise_norm(v1_s, out=norm[:n_s])
+
+        if vn is None:
+            #  Protect against tiny numerical excesses beyond the range [-1 ,1]
+            dot_s[(dot_s > 1) & (dot_s < 1 + tol)] = 1.0
+            dot_s[(dot_s < -1) & (dot_s > -1 - tol)] = -1.0
+            np.arccos(dot_s, out=out[s])
+        else:
+            cross = np.cross(v0_s, v1_s)
+            y = elementwise_dot(cross, _rows(vn, s), out=norm[:n_s])
+            np.arctan2(y, dot_s, out=out[s])
+
+    return out
 
 
 def vectors_normal_to_planes(x, y):
@@ -160,7 +216,7 @@ def vectors_normal_to_planes(x, y):
     return normalized_vectors(np.cross(x, y))
 
 
-def project_onto_plane(x1, x2):
+def project_onto_plane(x1, x2, out=None, block_size=BLOCK_SIZE):
     """
     Given a collection of vectors, x1 and x2, project each vector
     in x1 onto the plane normal to the corresponding vector x2.
@@ -173,6 +229,13 @@ def project_onto_plane(x1, x2):
     x2 : ndarray
         Numpy array of shape (npts, 3) storing a collection of 3d points
 
+    out : ndarray, optional
+        Numpy array of shape (npts, 3) in which to store the result.
+        Passing out=x1 projects x1 in place. Default is a new array.
+
+    block_size : int, optional
+        Number of points processed at a time. Default is BLOCK_SIZE.
+
     Returns
     -------
     result : ndarray
@@ -180,10 +243,24 @@ def project_onto_plane(x1, x2):
 
     """
 
-    n = normalized_vectors(x2)
-    d = elementwise_dot(x1, n)
+    x1 = np.atleast_2d(x1)
+    x2 = np.atleast_2d(x2)
+    npts = max(x1.shape[0], x2.shape[0])
+    if out is None:
+        out = np.empty((npts, x1.shape[1]), dtype=_float_dtype(x1, x2))
+    n = np.empty((min(block_size, npts), x2.shape[1]), dtype=out.dtype)
+    d = np.empty(n.shape[0], dtype=out.dtype)
+
+    for s in _blocks(npts, block_size):
+        x1_s, x2_s = _rows(x1, s), _rows(x2, s)
+        n_s = n[: s.stop - s.start]
+        n_s[...] = x2_s
+        normalized_vectors(n_s, out=n_s, block_size=npts)
+        d_s = elementwise_dot(x1_s, n_s, out=d[: n_s.shape[0]])
+        n_s *= d_s[:, np.newaxis]
+        np.subtract(x1_s, n_s, out=out[s])
 
-    return x1 - d[:, np.newaxis] * n
+    return out
 
 
 def rotate_vector_collection(rotation_matrices, vectors, optimize=False):
@@ -241,3 +318,19 @@ def rotate_vector_collection(rotation_matrices, vectors, optimize=False):
             return np.einsum(ein_string, rotation_matrices, vectors, optimize=optimize)
         except TypeError:
             return np.einsum(ein_string, rotation_matrices, vectors)
+
+
+def _float_dtype(*arrays):
+    """Floating-point dtype of the result, preserving float32 inputs"""
+    return np.result_type(*[x.dtype for x in arrays], np.float16)
+
+
+def _blocks(npts, block_size):
+    """Iterate over slices of at most block_size consecutive points"""
+    for start in range(0, npts, block_size):
+        yield slice(start, min(start + block_size, npts))
+
+
+def _rows(x, s):
+    """Slice of the points in x, or x itself for a single point broadcast to all"""
+    return x if x.shape[0] == 1 else x[s]
@@ -0,0 +1,228 @@
+"""Host-major compressed sparse row (CSR) layout of galcat, and reductions over
+the galaxies of each host
+
+By default, mc_galpop_synthetic_subs returns the centrals first, followed by the
+satellites, which are sorted by host. In the host-major layout, each central is
+followed by its own satellites, so that the galaxies of host i are the rows
+host_offsets[i]:host_offsets[i+1] of galcat, and row host_offsets[i] is the central.
+Since the satellites are already sorted by host, the host-major order follows from
+the number of satellites of each host in linear time, without sorting galcat.
+In both layouts, upid is the row of the host central, or -1 for centrals.
+
+Per-host quantities such as the number of selected galaxies, or the halo occupation
+distribution, are then segment sums over host_offsets, in linear time.
+
+Example usage
+-------------
+>>> galcat = mc_galpop_synthetic_subs(*args, layout="host_major")  # doctest: +SKIP
+>>> msk = galcat["logsm_t_obs"] > 10  # doctest: +SKIP
+>>> n_gals_per_host = segment_sum(msk, galcat["host_offsets"])  # doctest: +SKIP
+>>> hod = measure_hod(logmhost, galcat["host_offsets"], msk, bins)  # doctest: +SKIP
+
+"""
+
+from collections import namedtuple
+
+import numpy as np
+from jax import tree_util
+
+from .galcat_io import GALCAT_HOST_KEYS, GALCAT_SHARED_KEYS
+
+GALCAT_LAYOUTS = ("cens_first", "host_major")
+
+HOD = namedtuple("HOD", ("n_hosts", "mean_n_cens", "mean_n_sats"))
+HOD.__doc__ = """Halo occupation distribution returned by measure_hod
+
+n_hosts : number of hosts in each bin of host mass
+mean_n_cens : mean number of selected centrals per host in each bin
+mean_n_sats : mean number of selected satellites per host in each bin
+"""
+
+
+def get_satellite_counts(upid):
+    """Number of satellites of each host
+
+    Parameters
+    ----------
+    upid : ndarray, shape (n_gals, )
+        Row of the host central of each satellite, and -1 for centrals,
+        in either layout of galcat
+
+    Returns
+    -------
+    sat_counts : ndarray, shape (n_hosts, )
+        Number of satellites of each central, in the order of the centrals in galcat
+
+    """
+    upid = np.asarray(upid)
+    msk_cens = upid == -1
+    counts = np.bincount(upid[~msk_cens], minlength=upid.size)
+    return counts[msk_cens]
+
+
+def get_host_offsets(upid):
+    """Rows of the galaxies of each host of a galcat in the host-major layout
+
+    Parameters
+    ----------
+    upid : ndarray, shape (n_gals, )
+        upid of a host-major galcat, e.g., as written to disk by galcat_io
+
+    Returns
+    -------
+    host_offsets : ndarray, shape (n_hosts+1, )
+        Galaxies of host i are the rows host_offsets[i]:host_offsets[i+1]
+
+    """
+    upid = np.asarray(upid)
+    return np.append(np.flatnonzero(upid == -1), upid.size)
+
+
+def get_host_major_indx(sat_counts):
+    """Rows of a centrals-first galcat in the order of the host-major layout
+
+    Parameters
+    ----------
+    sat_counts : ndarray, shape (n_hosts, )
+        Number of satellites of each host. Satellites are taken to be sorted by host,
+        as in the output of mc_galpop_synthetic_subs.
+
+    Returns
+    -------
+    indx : ndarray, shape (n_hosts + n_sats, )
+        Row i of the host-major galcat is row indx[i] of the centrals-first galcat
+
+    host_offsets : ndarray, shape (n_hosts+1, )
+        See get_host_offsets
+
+    """
+    sat_counts = np.asarray(sat_counts, dtype=np.int64)
+    n_hosts = sat_counts.size
+    n_sats = int(np.sum(sat_counts))
+    host_offsets = np.concatenate(([0], np.cumsum(1 + sat_counts)))
+
+    # Satellite j of host h moves down by the h+1 centrals of hosts 0, ..., h
+    indx = np.empty(n_hosts + n_sats, dtype=np.int64)
+    indx[host_offsets[:-1]] = np.arange(n_hosts)
+    sat_rows = np.arange(n_sats) + np.repeat(np.arange(1, n_hosts + 1), sat_counts)
+    indx[sat_rows] = np.arange(n_hosts, n_hosts + n_sats)
+    return indx, host_offsets
+
+
+def to_host_major(galcat):
+    """Reorder a centrals-first galcat into the host-major layout
+
+    Parameters
+    ----------
+    galcat : dict
+        Output of mc_galpop_synthetic_subs with the default layout, or of
+        mc_galpop_chunks.concatenate_galcats, with satellites sorted by host
+
+    Returns
+    -------
+    galcat : dict
+        Same keys, plus host_offsets, with the galaxies in the host-major layout.
+        upid is the row of the host central.
+
+    Raises
+    ------
+    ValueError
+        If galcat is already host-major, if the centrals do not come first,
+        or if the satellites are not sorted by host
+
+    """
+    if "host_offsets" in galcat:
+        raise ValueError("galcat is already in the host-major layout")
+    upid = np.asarray(galcat["upid"])
+    n_cens = int(np.sum(upid == -1))
+    sat_upid = upid[n_cens:]
+    if np.any(upid[:n_cens] != -1) or np.any(np.diff(sat_upid) < 0):
+        msg = "galcat must list centrals first, followed by satellites sorted by host"
+        raise ValueError(msg)
+    sat_counts = np.bincount(sat_upid, minlength=n_cens)
+    indx, host_offsets = get_host_major_indx(sat_counts)
+    return _take_host_major(galcat, indx, host_offsets)
+
+
+def segment_sum(values, host_offsets):
+    """Sum of values over the galaxies of each host of a host-major galcat
+
+    Parameters
+    ----------
+    values : ndarray, shape (n_gals, ...)
+        Boolean values are summed as integers, e.g., to count selected galaxies
+
+    host_offsets : ndarray, shape (n_hosts+1, )
+        See get_host_offsets
+
+    Returns
+    -------
+    sums : ndarray, shape (n_hosts, ...)
+
+    """
+    values = np.asarray(values)
+    host_offsets = np.asarray(host_offsets)
+    if values.shape[0] != host_offsets[-1]:
+        msg = "values has {0} rows but host_offsets has {1} galaxies"
+        raise ValueError(msg.format(values.shape[0], host_offsets[-1]))
+    if values.dtype == bool:
+        values = values.astype(np.int64)
+    if host_offsets.size == 1:
+        return np.zeros((0, *values.shape[1:]), dtype=values.dtype)
+    # Every host has at least its central, so that no segment is empty
+    return np.add.reduceat(values, host_offsets[:-1], axis=0)
+
+
+def measure_hod(logmhost, host_offsets, msk_gals, logmhost_bins):
+    """Mean number of selected centrals and satellites per host in bins of host mass
+
+    Parameters
+    ----------
+    logmhost : ndarray, shape (n_hosts, )
+        log10 of the mass of each host, in the order of the hosts of galcat
+
+    host_offsets : ndarray, shape (n_hosts+1, )
+        See get_host_offsets
+
+    msk_gals : ndarray, shape (n_gals, )
+        True for the selected galaxies of a host-major galcat,
+        e.g., galcat["logsm_t_obs"] > 10
+
+    logmhost_bins : ndarray, shape (n_bins+1, )
+        Edges of the bins of logmhost
+
+    Returns
+    -------
+    hod : HOD
+        Each field has shape (n_bins, ). Means are NaN in bins without hosts.
+
+    """
+    msk_gals = np.asarray(msk_gals, dtype=bool)
+    host_offsets = np.asarray(host_offsets)
+    n_cens = msk_gals[host_offsets[:-1]].astype(np.int64)
+    n_sats = segment_sum(msk_gals, host_offsets) - n_cens
+
+    n_bins = len(logmhost_bins) - 1
+    ibin = np.digitize(logmhost, logmhost_bins) - 1
+    msk_bin = (ibin >= 0) & (ibin < n_bins)
+    ibin = ibin[msk_bin]
+    n_hosts = np.bincount(ibin, minlength=n_bins)
+    sum_cens = np.bincount(ibin, weights=n_cens[msk_bin], minlength=n_bins)
+    sum_sats = np.bincount(ibin, weights=n_sats[msk_bin], minlength=n_bins)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return HOD(n_hosts, sum_cens / n_hosts, sum_sats / n_hosts)
+
+
+def _take_host_major(galcat, indx, host_offsets):
+    """Gather the rows indx of each per-galaxy entry of galcat, and convert upid
+    to the row of the host central in the host-major layout"""
+    galcat_out = dict()
+    for key, val in galcat.items():
+        if key in GALCAT_SHARED_KEYS:
+            galcat_out[key] = val
+        elif key not in GALCAT_HOST_KEYS:
+            galcat_out[key] = tree_util.tree_map(lambda x: np.asarray(x)[indx], val)
+    upid = galcat_out["upid"]
+    galcat_out["upid"] = np.where(upid == -1, -1, host_offsets[:-1][upid])
+    galcat_out["host_offsets"] = host_offsets
+    return galcat_out
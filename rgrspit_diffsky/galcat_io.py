@@ -0,0 +1,594 @@
+"""Read and write the galcat output of mc_galpop_synthetic_subs as columnar
+HDF5, Parquet, or npy files, one chunk of galaxies at a time"""
+
+import json
+import os
+import shutil
+from collections import namedtuple
+from time import time
+
+import numpy as np
+
+try:
+    import h5py
+
+    HAS_H5PY = True
+except ImportError:
+    HAS_H5PY = False
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# Entries of galcat that are shared by every galaxy rather than stored per galaxy
+GALCAT_SHARED_KEYS = ("t_table", "t0", "z_obs", "t_obs")
+
+# Entries of galcat that are stored per host, and that are not written since they
+# follow from upid, see galcat_groups.get_host_offsets
+GALCAT_HOST_KEYS = ("host_offsets",)
+
+FORMATS = ("hdf5", "parquet", "npy")
+DEFAULT_COMPRESSION = dict(hdf5="gzip", parquet="zstd", npy=None)
+
+# Suffix of the files written in each format. Files written with fmt="npy"
+# are directories with one npy file per column.
+SHARD_SUFFIXES = dict(hdf5=".h5", parquet=".parquet", npy="")
+
+NPY_ATTRS_BASENAME = "attrs.json"
+
+# Bytes reserved for the header of npy files whose length is only known once
+# every chunk has been written. Multiple of 64 so that the data is aligned.
+_NPY_HEADER_NBYTES = 256
+
+ChunkStats = namedtuple(
+    "ChunkStats", ("n_gals", "n_bytes", "file_size", "write_time", "throughput")
+)
+
+
+def flatten_galcat(galcat):
+    """Flatten the namedtuples of galcat into a dictionary of named columns
+
+    Parameters
+    ----------
+    galcat : dict
+        Output of mc_galpop_synthetic_subs
+
+    Returns
+    -------
+    columns : dict
+        Each namedtuple of galcat is replaced by one column per field,
+        e.g., galcat["mah_params"].logm0 becomes columns["mah_params/logm0"],
+        and galcat["sfh_params"].ms_params.lgmcrit becomes
+        columns["sfh_params/ms_params/lgmcrit"]
+
+    """
+    columns = dict()
+    for key, val in galcat.items():
+        if hasattr(val, "_fields"):
+            for colname, x in flatten_galcat(val._asdict()).items():
+                columns[key + "/" + colname] = x
+        else:
+            columns[key] = np.asarray(val)
+    return columns
+
+
+def select_columns(colnames, columns=None, exclude=None):
+    """Select column names, where a name also selects every column nested below it
+
+    Parameters
+    ----------
+    colnames : list of strings
+        Available columns, e.g., the keys of flatten_galcat(galcat)
+
+    columns : list of strings, optional
+        Columns to keep, e.g., ["pos", "logsm_t_obs", "mah_params"].
+        Default is to keep all columns.
+
+    exclude : list of strings, optional
+        Columns to drop, e.g., ["sfh_table", "log_mah_table"]
+
+    Returns
+    -------
+    selected : list of strings
+        Selected entries of colnames, in their original order
+
+    """
+
+    def _matches(colname, names):
+        return any(colname == x or colname.startswith(x + "/") for x in names)
+
+    selected = list(colnames)
+    if columns is not None:
+        for name in columns:
+            if not any(_matches(x, [name]) for x in colnames):
+                raise KeyError("Column {0} is not in galcat".format(name))
+        selected = [x for x in selected if _matches(x, columns)]
+    if exclude is not None:
+        selected = [x for x in selected if not _matches(x, exclude)]
+    return selected
+
+
+def write_galcats(
+    fname,
+    galcats,
+    fmt="hdf5",
+    columns=None,
+    exclude=None,
+    compression="default",
+    attrs=None,
+    verbose=False,
+):
+    """Stream a sequence of chunks of galaxies into a single columnar file
+
+    Parameters
+    ----------
+    fname : string
+
+    galcats : iterable of dicts
+        Each galcat is the output of mc_galpop_synthetic_subs for a disjoint set
+        of hosts, e.g., as yielded by mc_galpop_synthetic_subs_chunked.
+        Chunks are written as they are generated, and are not held in memory.
+
+    fmt : string, optional
+        Either "hdf5", "parquet", or "npy". Default is "hdf5".
+        With fmt="npy", fname is a directory holding one uncompressed npy file
+        per column, which can be memory-mapped, see mock_reader.
+
+    columns : list of strings, optional
+        Columns to write, see select_columns. Default is all columns.
+
+    exclude : list of strings, optional
+        Columns to skip, see select_columns
+
+    compression : string, optional
+        Compression filter, e.g., "gzip" or "lzf" for hdf5,
+        and "zstd", "snappy" or "gzip" for parquet. Use None for no compression.
+        Default is gzip for hdf5, zstd for parquet, and None for npy,
+        which does not support compression.
+
+    attrs : dict, optional
+        Metadata stored with the file. The total number of galaxies is also
+        stored as attrs["n_gals"].
+
+    verbose : bool, optional
+        If True, print the statistics of each chunk
+
+    Returns
+    -------
+    chunk_stats : list of ChunkStats
+        For each chunk: number of galaxies, size in bytes of the written columns
+        in memory, growth in bytes of the file, time to write the chunk in seconds,
+        and throughput in bytes per second
+
+    Notes
+    -----
+    Galaxies are stored chunk by chunk, with the centrals of each chunk
+    followed by its satellites. In the file, upid is the row of the host central,
+    so that it agrees with galcat["upid"] for a file with a single chunk.
+    Entries of galcat that are shared by all galaxies are written once.
+    Chunks in the host-major layout of galcat_groups keep their layout in the file,
+    and their host_offsets are not written.
+
+    The file is written to fname + ".tmp" and then renamed to fname,
+    so that fname only exists once it is complete.
+
+    """
+    if fmt not in FORMATS:
+        raise ValueError("fmt must be one of {0}".format(FORMATS))
+    if compression == "default":
+        compression = DEFAULT_COMPRESSION[fmt]
+    if fmt == "npy" and compression is not None:
+        raise ValueError("fmt=npy does not support compression")
+    attrs = dict() if attrs is None else dict(attrs)
+
+    fname_tmp = fname + ".tmp"
+    if fmt == "hdf5":
+        writer = _HDF5ChunkWriter(fname_tmp, compression)
+    elif fmt == "parquet":
+        writer = _ParquetChunkWriter(fname_tmp, compression)
+    else:
+        writer = _NpyChunkWriter(fname_tmp)
+
+    chunk_stats = []
+    n_rows = 0
+    try:
+        for ichunk, galcat in enumerate(galcats):
+            start = time()
+            galcat = {k: v for k, v in galcat.items() if k not in GALCAT_HOST_KEYS}
+            chunk = flatten_galcat(galcat)
+            if ichunk == 0:
+                colnames = select_columns(list(chunk), columns, exclude)
+                shared = [x for x in colnames if x in GALCAT_SHARED_KEYS]
+                per_gal = [x for x in colnames if x not in GALCAT_SHARED_KEYS]
+                writer.write_shared({x: chunk[x] for x in shared})
+            n_gals = np.asarray(galcat["upid"]).size
+            data = {x: chunk[x] for x in per_gal}
+            if "upid" in data:
+                data["upid"] = np.where(data["upid"] == -1, -1, data["upid"] + n_rows)
+            size_before = writer.file_size()
+            writer.append(data)
+            n_bytes = sum(x.nbytes for x in data.values())
+            write_time = time() - start
+            stats = ChunkStats(
+                n_gals,
+                n_bytes,
+                writer.file_size() - size_before,
+                write_time,
+                n_bytes / max(write_time, 1e-9),
+            )
+            chunk_stats.append(stats)
+            if verbose:
+                print(_format_chunk_stats(ichunk, stats))
+            n_rows += n_gals
+        attrs["n_gals"] = n_rows
+        writer.write_attrs(attrs)
+    finally:
+        writer.close()
+    if os.path.isdir(fname):
+        shutil.rmtree(fname)
+    os.replace(fname_tmp, fname)
+    return chunk_stats
+
+
+def write_galcat_hdf5(fname, galcat, attrs=None, columns=None, exclude=None):
+    """Write galcat to an HDF5 file, with one dataset per column
+
+    Parameters
+    ----------
+    fname : string
+
+    galcat : dict
+        Output of mc_galpop_synthetic_subs
+
+    attrs : dict, optional
+        Metadata stored as attributes of the root group
+
+    columns, exclude : list of strings, optional
+        Columns to write, see select_columns
+
+    Returns
+    -------
+    chunk_stats : ChunkStats
+
+    """
+    chunk_stats = write_galcats(
+        fname, [galcat], columns=columns, exclude=exclude, attrs=attrs
+    )
+    return chunk_stats[0]
+
+
+def load_galcat_hdf5(fname, columns=None):
+    """Load the columns of a galcat written by write_galcat_hdf5 or write_galcats
+
+    Parameters
+    ----------
+    fname : string
+
+    columns : list of strings, optional
+        Column names, e.g., ["pos", "logsm_t_obs", "mah_params/logm0"].
+        Default is to load all columns.
+
+    Returns
+    -------
+    galcat : dict
+        Flat dictionary of columns, see flatten_galcat
+
+    """
+    if not HAS_H5PY:
+        raise ImportError("h5py is required to read galcat from HDF5")
+
+    with h5py.File(fname, "r") as hdf:
+        if columns is None:
+            columns = get_colnames_hdf5(hdf)
+        galcat = dict()
+        for colname in columns:
+            galcat[colname] = hdf[colname][...]
+    return galcat
+
+
+def load_galcat_attrs_hdf5(fname):
+    """Load the attributes of a galcat written by write_galcat_hdf5"""
+    if not HAS_H5PY:
+        raise ImportError("h5py is required to read galcat from HDF5")
+
+    with h5py.File(fname, "r") as hdf:
+        attrs = dict(hdf.attrs)
+    return attrs
+
+
+def get_colnames_hdf5(hdf):
+    """List the paths of all datasets in an open HDF5 file or group"""
+    colnames = []
+
+    def _collect(name, obj):
+        if isinstance(obj, h5py.Dataset):
+            colnames.append(name)
+
+    hdf.visititems(_collect)
+    return colnames
+
+
+def load_galcat_parquet(fname, columns=None):
+    """Load the columns of a galcat written by write_galcats with fmt="parquet"
+
+    Parameters
+    ----------
+    fname : string
+
+    columns : list of strings, optional
+        Column names. Default is to load all columns.
+
+    Returns
+    -------
+    galcat : dict
+        Flat dictionary of columns, see flatten_galcat.
+        Shared entries such as t_table are read from the file metadata.
+
+    """
+    if not HAS_PYARROW:
+        raise ImportError("pyarrow is required to read galcat from Parquet")
+
+    metadata = pq.ParquetFile(fname).metadata.metadata
+    shared = json.loads(metadata[b"rgrspit_diffsky.shared"])
+    if columns is None:
+        per_gal = None
+        shared_names = list(shared)
+    else:
+        per_gal = [x for x in columns if x not in shared]
+        shared_names = [x for x in columns if x in shared]
+
+    table = pq.read_table(fname, columns=per_gal)
+    galcat = dict()
+    for colname in table.column_names:
+        galcat[colname] = _arrow_to_numpy(table.column(colname))
+    for colname in shared_names:
+        galcat[colname] = np.array(shared[colname])
+    return galcat
+
+
+def load_galcat_attrs_parquet(fname):
+    """Load the attributes of a galcat written by write_galcats with fmt="parquet" """
+    if not HAS_PYARROW:
+        raise ImportError("pyarrow is required to read galcat from Parquet")
+
+    metadata = pq.ParquetFile(fname).metadata.metadata
+    return json.loads(metadata[b"rgrspit_diffsky.attrs"])
+
+
+def load_galcat_npy(dirname, columns=None, mmap_mode="r"):
+    """Load the columns of a galcat written by write_galcats with fmt="npy"
+
+    Parameters
+    ----------
+    dirname : string
+
+    columns : list of strings, optional
+        Column names. Default is to load all columns.
+
+    mmap_mode : string, optional
+        Passed to np.load. Default is "r", in which case columns are read-only
+        memory-mapped arrays, and no data is read until it is accessed.
+        Use None to read the columns into memory.
+
+    Returns
+    -------
+    galcat : dict
+        Flat dictionary of columns, see flatten_galcat
+
+    """
+    if columns is None:
+        columns = get_colnames_npy(dirname)
+    galcat = dict()
+    for colname in columns:
+        fn = os.path.join(dirname, colname + ".npy")
+        galcat[colname] = np.load(fn, mmap_mode=mmap_mode)
+    return galcat
+
+
+def load_galcat_attrs_npy(dirname):
+    """Load the attributes of a galcat written by write_galcats with fmt="npy" """
+    with open(os.path.join(dirname, NPY_ATTRS_BASENAME), "r") as f:
+        attrs = json.load(f)
+    return attrs
+
+
+def get_colnames_npy(dirname):
+    """List the columns of a galcat written by write_galcats with fmt="npy" """
+    colnames = []
+    for root, dirs, fnames in os.walk(dirname):
+        dirs.sort()
+        for fn in sorted(fnames):
+            if fn.endswith(".npy"):
+                path = os.path.relpath(os.path.join(root, fn[:-4]), dirname)
+                colnames.append(path.replace(os.sep, "/"))
+    return colnames
+
+
+class _HDF5ChunkWriter:
+    """Append chunks of columns to resizable HDF5 datasets"""
+
+    def __init__(self, fname, compression):
+        if not HAS_H5PY:
+            raise ImportError("h5py is required to write galcat to HDF5")
+        self.fname = fname
+        self.compression = compression
+        self.hdf = h5py.File(fname, "w")
+
+    def write_attrs(self, attrs):
+        for key, val in attrs.items():
+            self.hdf.attrs[key] = val
+
+    def write_shared(self, data):
+        for colname, x in data.items():
+            self.hdf[colname] = x
+
+    def append(self, data):
+        for colname, x in data.items():
+            if colname not in self.hdf:
+                self.hdf.create_dataset(
+                    colname,
+                    data=x,
+                    maxshape=(None, *x.shape[1:]),
+                    chunks=True,
+                    compression=self.compression,
+                )
+            else:
+                dset = self.hdf[colname]
+                n = dset.shape[0]
+                dset.resize(n + x.shape[0], axis=0)
+                dset[n:] = x
+        self.hdf.flush()
+
+    def file_size(self):
+        return os.path.getsize(self.fname)
+
+    def close(self):
+        self.hdf.close()
+
+
+class _ParquetChunkWriter:
+    """Append chunks of columns as row groups of a Parquet file"""
+
+    def __init__(self, fname, compression):
+        if not HAS_PYARROW:
+            raise ImportError("pyarrow is required to write galcat to Parquet")
+        self.fname = fname
+        self.compression = "none" if compression is None else compression
+        self.shared = dict()
+        self.writer = None
+
+    def write_shared(self, data):
+        self.shared = {key: _to_json(val) for key, val in data.items()}
+
+    def write_attrs(self, attrs):
+        attrs = {key: _to_json(val) for key, val in attrs.items()}
+        if self.writer is None:
+            self._open(pa.schema([]))
+        self.writer.add_key_value_metadata({"rgrspit_diffsky.attrs": json.dumps(attrs)})
+
+    def _open(self, schema):
+        metadata = {"rgrspit_diffsky.shared": json.dumps(self.shared)}
+        self.writer = pq.ParquetWriter(
+            self.fname, schema.with_metadata(metadata), compression=self.compression
+        )
+
+    def append(self, data):
+        table = pa.table({key: _numpy_to_arrow(x) for key, x in data.items()})
+        if self.writer is None:
+            self._open(table.schema)
+        self.writer.write_table(table.cast(self.writer.schema))
+
+    def file_size(self):
+        return os.path.getsize(self.fname) if os.path.isfile(self.fname) else 0
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class _NpyChunkWriter:
+    """Append chunks of columns to npy files whose header is rewritten on close
+    with the final number of rows"""
+
+    def __init__(self, dirname):
+        if os.path.isdir(dirname):
+            shutil.rmtree(dirname)
+        os.makedirs(dirname)
+        self.dirname = dirname
+        self.files = dict()
+        self.shapes = dict()
+
+    def _fname(self, colname):
+        fn = os.path.join(self.dirname, *colname.split("/")) + ".npy"
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        return fn
+
+    def write_shared(self, data):
+        for colname, x in data.items():
+            np.save(self._fname(colname), x)
+
+    def write_attrs(self, attrs):
+        attrs = {key: _to_json(val) for key, val in attrs.items()}
+        with open(os.path.join(self.dirname, NPY_ATTRS_BASENAME), "w") as f:
+            json.dump(attrs, f, indent=2)
+
+    def append(self, data):
+        for colname, x in data.items():
+            x = np.ascontiguousarray(x)
+            if colname not in self.files:
+                self.files[colname] = open(self._fname(colname), "wb")
+                self.shapes[colname] = [0, *x.shape[1:]], x.dtype
+                self.files[colname].write(b"\0" * _NPY_HEADER_NBYTES)
+            self.files[colname].write(x.tobytes())
+            self.shapes[colname][0][0] += x.shape[0]
+
+    def file_size(self):
+        return sum(f.tell() for f in self.files.values())
+
+    def close(self):
+        for colname, f in self.files.items():
+            shape, dtype = self.shapes[colname]
+            f.seek(0)
+            f.write(_get_npy_header(tuple(shape), dtype))
+            f.close()
+        self.files = dict()
+
+
+def _get_npy_header(shape, dtype):
+    """Header of a version 1.0 npy file padded to _NPY_HEADER_NBYTES"""
+    header = np.lib.format.header_data_from_array_1_0(np.empty((0,), dtype=dtype))
+    header["shape"] = shape
+    header = repr(header).encode("latin1")
+    n_prefix = len(np.lib.format.MAGIC_PREFIX) + 4
+    n_pad = _NPY_HEADER_NBYTES - n_prefix - len(header) - 1
+    if n_pad < 0:
+        raise ValueError("npy header of shape {0} is too long".format(shape))
+    header = header + b" " * n_pad + b"\n"
+    prefix = np.lib.format.magic(1, 0) + np.uint16(len(header)).tobytes()
+    return prefix + header
+
+
+def _numpy_to_arrow(x):
+    """Convert a column to an arrow array, with one fixed-size list per row
+    for multi-dimensional columns such as pos or sfh_table"""
+    x = np.ascontiguousarray(x)
+    if x.ndim == 1:
+        return pa.array(x)
+    arr = pa.array(x.reshape(-1))
+    for n in x.shape[:0:-1]:
+        arr = pa.FixedSizeListArray.from_arrays(arr, n)
+    return arr
+
+
+def _arrow_to_numpy(col):
+    arr = col.combine_chunks() if isinstance(col, pa.ChunkedArray) else col
+    shape = [len(arr)]
+    while pa.types.is_fixed_size_list(arr.type):
+        shape.append(arr.type.list_size)
+        arr = arr.flatten()
+    return arr.to_numpy(zero_copy_only=False).reshape(shape)
+
+
+def _to_json(val):
+    val = np.asarray(val)
+    return val.item() if val.ndim == 0 else val.tolist()
+
+
+def _format_chunk_stats(ichunk, stats):
+    msg = (
+        "chunk {0}: {1} galaxies, {2:.1f} MB in memory, {3:.1f} MB on disk, "
+        "{4:.2f} sec, {5:.1f} MB/sec"
+    )
+    mb = 1024.0**2
+    return msg.format(
+        ichunk,
+        stats.n_gals,
+        stats.n_bytes / mb,
+        stats.file_size / mb,
+        stats.write_time,
+        stats.throughput / mb,
+    )
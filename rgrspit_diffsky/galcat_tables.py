@@ -0,0 +1,144 @@
+"""Evaluate the MAH and SFH tables of a galaxy catalog from its parameters
+
+When mc_galpop_synthetic_subs is called with store_tables=False, galcat stores
+only the diffmah and diffstar parameters of each galaxy. The functions below
+evaluate the tables for a requested subset of galaxies on a requested time grid,
+and reproduce the stored tables when evaluated on galcat["t_table"].
+
+Each function accepts either the galcat returned by mc_galpop_synthetic_subs,
+or a flattened galcat as returned by the loaders of galcat_io, in which case
+the parameters are read from columns such as "mah_params/logm0".
+
+"""
+
+import numpy as np
+from diffmah.diffmah_kernels import DiffmahParams, mah_halopop
+from diffstar import DiffstarParams, MSParams, QParams
+from diffstar.sfh_model_tpeak import calc_sfh_galpop
+from diffstar.utils import cumulative_mstar_formed_galpop
+
+TABLE_KEYS = ("log_mah_table", "sfh_table")
+
+
+def get_log_mah_table(galcat, indx=None, t_table=None):
+    """Evaluate log10 of the halo mass history of galaxies in galcat
+
+    Parameters
+    ----------
+    galcat : dict
+        Galaxy catalog storing mah_params and t0
+
+    indx : ndarray or slice, optional
+        Subset of galaxies. Default is all galaxies.
+
+    t_table : ndarray, shape (n_t, ), optional
+        Cosmic time in Gyr. Default is galcat["t_table"].
+
+    Returns
+    -------
+    log_mah_table : ndarray, shape (n_gals, n_t)
+        log10 of halo mass in units of Msun
+
+    """
+    t_table = _get_t_table(galcat, t_table)
+    mah_params = _get_mah_params(galcat, indx)
+    lgt0 = np.log10(galcat["t0"])
+    return np.asarray(mah_halopop(mah_params, t_table, lgt0)[1])
+
+
+def get_sfh_table(galcat, indx=None, t_table=None):
+    """Evaluate the star formation history of galaxies in galcat
+
+    Parameters
+    ----------
+    galcat : dict
+        Galaxy catalog storing mah_params and sfh_params
+
+    indx : ndarray or slice, optional
+        Subset of galaxies. Default is all galaxies.
+
+    t_table : ndarray, shape (n_t, ), optional
+        Cosmic time in Gyr. Default is galcat["t_table"].
+
+    Returns
+    -------
+    sfh_table : ndarray, shape (n_gals, n_t)
+        Star formation rate in units of Msun/yr
+
+    """
+    t_table = _get_t_table(galcat, t_table)
+    mah_params = _get_mah_params(galcat, indx)
+    sfh_params = _get_sfh_params(galcat, indx)
+    # lgt0 and fb are the diffstar defaults used by mc_diffstar_sfh_galpop
+    return np.asarray(calc_sfh_galpop(sfh_params, mah_params, t_table))
+
+
+def get_smh_table(galcat, indx=None, t_table=None):
+    """Evaluate the history of stellar mass formed by galaxies in galcat
+
+    The stellar mass is integrated over t_table, so that t_table should
+    densely sample cosmic time from early times up to the latest time of interest.
+
+    Parameters
+    ----------
+    galcat : dict
+        Galaxy catalog storing mah_params and sfh_params
+
+    indx : ndarray or slice, optional
+        Subset of galaxies. Default is all galaxies.
+
+    t_table : ndarray, shape (n_t, ), optional
+        Cosmic time in Gyr. Default is galcat["t_table"].
+
+    Returns
+    -------
+    smh_table : ndarray, shape (n_gals, n_t)
+        Stellar mass formed in units of Msun
+
+    """
+    t_table = _get_t_table(galcat, t_table)
+    sfh_table = get_sfh_table(galcat, indx=indx, t_table=t_table)
+    return np.asarray(cumulative_mstar_formed_galpop(t_table, sfh_table))
+
+
+def is_table_selected(columns=None, exclude=None):
+    """Check whether log_mah_table or sfh_table are selected by columns and exclude,
+    see galcat_io.select_columns"""
+    for colname in TABLE_KEYS:
+        is_selected = columns is None or colname in columns
+        is_excluded = exclude is not None and colname in exclude
+        if is_selected and not is_excluded:
+            return True
+    return False
+
+
+def _get_t_table(galcat, t_table):
+    if t_table is None:
+        t_table = galcat["t_table"]
+    return np.atleast_1d(np.asarray(t_table, dtype=float))
+
+
+def _get_mah_params(galcat, indx):
+    return _get_params(galcat, "mah_params", DiffmahParams, indx)
+
+
+def _get_sfh_params(galcat, indx):
+    ms_params = _get_params(galcat, "sfh_params/ms_params", MSParams, indx)
+    q_params = _get_params(galcat, "sfh_params/q_params", QParams, indx)
+    return DiffstarParams(ms_params, q_params)
+
+
+def _get_params(galcat, name, params_type, indx):
+    """Get a namedtuple of parameters of galcat, either stored as a namedtuple
+    at galcat[name], or as one flattened column per field"""
+    params = galcat
+    for key in name.split("/"):
+        if isinstance(params, dict):
+            params = params.get(key, None)
+        elif params is not None:
+            params = getattr(params, key)
+    if params is None:
+        params = [galcat["/".join((name, key))] for key in params_type._fields]
+    if indx is None:
+        indx = slice(None)
+    return params_type(*[np.asarray(x[indx]) for x in params])
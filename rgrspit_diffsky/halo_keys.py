@@ -0,0 +1,193 @@
+"""Counter-based random keys for halos and subhalos.
+
+Keys are derived by folding the halo id into a random key, so that the Monte Carlo
+draws of each galaxy only depend on the id of its halo, and not on the position
+of the halo in the input array or on how the catalog is partitioned.
+
+"""
+
+import numpy as np
+from jax import jit as jjit
+from jax import random as jran
+from jax import vmap
+
+_fold_in_pop = jjit(vmap(jran.fold_in, in_axes=(0, 0)))
+_fold_in_pop_singlekey = jjit(vmap(jran.fold_in, in_axes=(None, 0)))
+
+
+def get_halo_keys(ran_key, halo_ids):
+    """Get a random key for each halo by folding the halo id into ran_key
+
+    Parameters
+    ----------
+    ran_key : jax.random.key
+
+    halo_ids : ndarray of shape (n_halos, )
+        Non-negative integer ids, e.g., the AbacusSummit halo id.
+        Ids are treated as 64-bit integers.
+
+    Returns
+    -------
+    halo_keys : array of keys with shape (n_halos, )
+
+    """
+    return _halo_keys_kern(ran_key, *split_halo_ids(halo_ids))
+
+
+def split_halo_ids(halo_ids):
+    """Split 64-bit halo ids into the high and low 32-bit words folded into keys
+
+    Parameters
+    ----------
+    halo_ids : ndarray of shape (n_halos, )
+
+    Returns
+    -------
+    ids_hi, ids_lo : ndarrays of shape (n_halos, ) and dtype uint32
+
+    """
+    halo_ids = np.atleast_1d(halo_ids).astype(np.uint64)
+    ids_hi = (halo_ids >> np.uint64(32)).astype(np.uint32)
+    ids_lo = (halo_ids & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+    return ids_hi, ids_lo
+
+
+def get_rank_within_host(subs_host_halo_indx, n_hosts):
+    """Get the rank of each subhalo among the subhalos of its host
+
+    Parameters
+    ----------
+    subs_host_halo_indx : ndarray of shape (n_subs, )
+        Index of the host halo of each subhalo. Must be sorted.
+
+    n_hosts : int
+        Number of host halos
+
+    Returns
+    -------
+    subs_rank : ndarray of shape (n_subs, )
+        Equals 0 for the first subhalo of each host, 1 for the second, and so on
+
+    """
+    subs_host_halo_indx = np.asarray(subs_host_halo_indx)
+    counts = np.bincount(subs_host_halo_indx, minlength=n_hosts)
+    first_sub_indx = np.cumsum(counts) - counts
+    subs_rank = (
+        np.arange(subs_host_halo_indx.size) - first_sub_indx[subs_host_halo_indx]
+    )
+    return subs_rank
+
+
+def get_subhalo_keys(ran_key, halo_ids, subs_host_halo_indx):
+    """Get a random key for each subhalo from the id of its host and its rank
+
+    Parameters
+    ----------
+    ran_key : jax.random.key
+
+    halo_ids : ndarray of shape (n_hosts, )
+        Halo id of each host halo
+
+    subs_host_halo_indx : ndarray of shape (n_subs, )
+        Index of the host halo of each subhalo. Must be sorted.
+
+    Returns
+    -------
+    subs_keys : array of keys with shape (n_subs, )
+
+    """
+    subs_ids = get_subhalo_ids(halo_ids, subs_host_halo_indx)
+    return _subhalo_keys_kern(ran_key, *subs_ids)
+
+
+def get_subhalo_ids(halo_ids, subs_host_halo_indx):
+    """Get the words of the host id and the rank of each subhalo that are folded
+    into its key by get_subhalo_keys
+
+    Parameters
+    ----------
+    halo_ids : ndarray of shape (n_hosts, )
+
+    subs_host_halo_indx : ndarray of shape (n_subs, )
+        Index of the host halo of each subhalo. Must be sorted.
+
+    Returns
+    -------
+    ids_hi, ids_lo : ndarrays of shape (n_subs, )
+        Words of the id of the host of each subhalo, see split_halo_ids
+
+    subs_rank : ndarray of shape (n_subs, )
+        See get_rank_within_host
+
+    """
+    halo_ids = np.atleast_1d(halo_ids)
+    subs_host_halo_indx = np.asarray(subs_host_halo_indx)
+    subs_rank = get_rank_within_host(subs_host_halo_indx, halo_ids.size)
+    ids_hi, ids_lo = split_halo_ids(halo_ids[subs_host_halo_indx])
+    return ids_hi, ids_lo, subs_rank.astype(np.uint32)
+
+
+@jjit
+def _halo_keys_kern(ran_key, ids_hi, ids_lo):
+    halo_keys = _fold_in_pop_singlekey(ran_key, ids_hi)
+    return _fold_in_pop(halo_keys, ids_lo)
+
+
+@jjit
+def _subhalo_keys_kern(ran_key, ids_hi, ids_lo, subs_rank):
+    host_keys = _halo_keys_kern(ran_key, ids_hi, ids_lo)
+    return _fold_in_pop(host_keys, subs_rank)
+
+
+@jjit
+def _uniform_pop_kern(ran_keys):
+    return vmap(jran.uniform)(ran_keys)
+
+
+@jjit
+def _uniform3_pop_kern(ran_keys):
+    return vmap(lambda key: jran.uniform(key, shape=(3,)))(ran_keys)
+
+
+@jjit
+def _normal3_pop_kern(ran_keys):
+    return vmap(lambda key: jran.normal(key, shape=(3,)))(ran_keys)
+
+
+def mc_uniform_pop(ran_keys, ndim=None):
+    """Draw uniform randoms in (0, 1) separately for each key
+
+    Parameters
+    ----------
+    ran_keys : array of keys with shape (n, )
+
+    ndim : int, optional
+        Default is None, in which case one random is drawn per key.
+        Use ndim=3 to draw three randoms per key.
+
+    Returns
+    -------
+    uran : ndarray of shape (n, ) or (n, 3)
+
+    """
+    if ndim is None:
+        return _uniform_pop_kern(ran_keys)
+    elif ndim == 3:
+        return _uniform3_pop_kern(ran_keys)
+    else:
+        raise ValueError("ndim must be None or 3")
+
+
+def mc_normal3_pop(ran_keys):
+    """Draw three normal randoms separately for each key
+
+    Parameters
+    ----------
+    ran_keys : array of keys with shape (n, )
+
+    Returns
+    -------
+    nran : ndarray of shape (n, 3)
+
+    """
+    return _normal3_pop_kern(ran_keys)
@@ -1,32 +1,62 @@
 """Generate a Monte Carlo realization of the galaxy distribution
 for an input catalog of AbacusSummit host halos"""
 
+from collections import namedtuple
+from functools import partial
+
+import jax
 import numpy as np
-from diffmah.diffmah_kernels import DiffmahParams, _log_mah_kern, mah_halopop
+from diffmah.diffmah_kernels import DiffmahParams, _log_mah_noq_kern, mah_halopop
 from diffmah.diffmahpop_kernels.bimod_censat_params import DEFAULT_DIFFMAHPOP_PARAMS
 from diffmah.diffmahpop_kernels.mc_bimod_cens import mc_diffmah_params_singlecen
 from diffmah.diffmahpop_kernels.mc_bimod_sats import mc_diffmah_params_singlesat
 from diffmah.diffmahpop_kernels.param_utils import mc_select_diffmah_params
-from diffsky.mass_functions.mc_subs import generate_subhalopop
+from diffsky.mass_functions.ccshmf_model import DEFAULT_CCSHMF_PARAMS
+from diffsky.mass_functions.mc_subs import (
+    _compute_mean_subhalo_counts,
+    generate_subhalopop_vmap,
+)
 from diffstar.defaults import T_TABLE_MIN
 from diffstar.utils import cumulative_mstar_formed_galpop
 from diffstarpop import mc_diffstarpop_tpeak_sepms_satfrac as mcdsp
 from diffstarpop.defaults import DEFAULT_DIFFSTARPOP_PARAMS
 from diffstarpop.param_utils import mc_select_diffstar_params
 from dsps.cosmology.flat_wcdm import _age_at_z_kern, age_at_z0
+from jax import dtypes
 from jax import jit as jjit
 from jax import numpy as jnp
 from jax import random as jran
-from jax import vmap
+from jax import tree_util, vmap
 
-from .fake_sats import vector_utilities as vectu
-from .fake_sats.ellipsoidal_nfw_phase_space import mc_ellipsoidal_nfw
-from .fake_sats.ellipsoidal_velocities import calculate_virial_velocity
+from . import galcat_groups as gcg
+from . import halo_keys as hk
+from .fake_sats import phase_space_kernels as psk
+from .galcat_io import GALCAT_SHARED_KEYS
+from .precision import cast_floats, check_precision, get_precision_policy
+from .profiling import run_stage
 
 _POP = (None, 0, None, 0, None)
 mc_diffmah_params_cenpop = jjit(vmap(mc_diffmah_params_singlecen, in_axes=_POP))
 mc_diffmah_params_satpop = jjit(vmap(mc_diffmah_params_singlesat, in_axes=_POP))
 
+_G = (None, 0, 0, 0, 0, 0, 0, 0, None)
+mc_diffstar_sfh_galpop_per_gal_keys = jjit(
+    vmap(mcdsp.mc_diffstar_sfh_singlegal, in_axes=_G)
+)
+_poisson_pop = jjit(vmap(jran.poisson, in_axes=(0, 0)))
+
+N_T_TABLE = 50
+
+# Concentration of the NFW profile of satellites when none is passed for the hosts
+DEFAULT_CONC = 5.0
+
+# When padded=True, arrays are padded to a length of MIN_CAPACITY*2**k
+MIN_CAPACITY = 1_024
+
+# Each key is either a single key, or an array with one key per halo or subhalo
+_GALPOP_KEY_NAMES = ("cens", "sats", "subs_lgmu", "axes", "pos", "vel", "sfh")
+GalpopKeys = namedtuple("GalpopKeys", _GALPOP_KEY_NAMES)
+
 
 def mc_galpop_synthetic_subs(
     ran_key,
@@ -39,6 +69,15 @@ def mc_galpop_synthetic_subs(
     cosmo_params,
     Lbox,
     diffmahpop_params=DEFAULT_DIFFMAHPOP_PARAMS,
+    diffstarpop_params=DEFAULT_DIFFSTARPOP_PARAMS,
+    halo_ids=None,
+    padded=False,
+    store_tables=True,
+    concentration=None,
+    profiler=None,
+    cache=None,
+    precision=None,
+    layout="cens_first",
 ):
     """Generate a Monte Carlo realizaton of galaxies populating the input halos
 
@@ -70,159 +109,720 @@ def mc_galpop_synthetic_subs(
     Lbox : float
         Comoving size of the periodic box in Mpc
 
+    diffmahpop_params : namedtuple, optional
+        Parameters of the diffmahpop model of the MAHs of centrals and satellites.
+        Default is DEFAULT_DIFFMAHPOP_PARAMS.
+
+    diffstarpop_params : namedtuple, optional
+        Parameters of the diffstarpop model of star formation histories.
+        Default is DEFAULT_DIFFSTARPOP_PARAMS.
+
+    halo_ids : ndarray, shape (n_hosts, ), optional
+        Unique non-negative integer id of each host halo,
+        e.g., the id column of load_abacus_halo_catalog.
+        Default is None, in which case Monte Carlo draws are derived from
+        splitting ran_key according to the position of each galaxy in the arrays.
+        When halo_ids is passed, the key of each halo is instead derived by
+        folding its id into ran_key, and the key of each subhalo by folding in
+        its rank among the subhalos of its host. Every galaxy is then independent
+        of the ordering of the hosts and of how the catalog is partitioned,
+        so that chunked or parallel runs are identical to a serial run.
+
+    padded : bool, optional
+        If True, host and subhalo arrays are padded to a length taken from
+        a fixed set of capacity buckets (see get_capacity_bucket) before entering
+        the jitted kernels, so that the same compiled executables serve
+        every catalog whose size falls in the same bucket.
+        Padded entries are flagged by a validity mask and dropped from galcat.
+        Default is False, in which case the kernels are compiled for the exact
+        number of hosts and subhalos, and each new size triggers a new compilation.
+        Without halo_ids, the Monte Carlo realization depends on the padded length.
+
+    store_tables : bool, optional
+        If True (the default), galcat stores log_mah_table and sfh_table
+        tabulated on t_table. If False, the tables are only used to compute
+        logsm_t_obs and logssfr_t_obs and are not returned, which reduces the
+        memory of galcat from about 130 to about 30 values per galaxy.
+        The tables can then be evaluated for any subset of galaxies and
+        any time grid with the functions of galcat_tables.
+
+    concentration : ndarray, shape (n_hosts, ), optional
+        NFW concentration of each host halo, e.g., the concentration column
+        of load_abacus_halo_catalog, used to draw the radial positions
+        of its satellites. Values are clipped to the range [1, 1000] of the table
+        returned by fake_sats.phase_space_kernels.get_qnfw_table.
+        Default is None, in which case every host has concentration DEFAULT_CONC.
+
+    profiler : profiling.StageProfiler, optional
+        If passed, each stage of the calculation is evaluated by a separate
+        jitted kernel, and its wall time, compile time, and peak memory are
+        recorded by profiler. Stages are subhalo_counts, halo_keys (only with
+        halo_ids), subhalos, diffmah, mah, sfh, mah_table (only with
+        store_tables=True), phase_space, and valid_galaxies.
+        Default is None, in which case the stages are fused in a single kernel.
+
+    cache : stage_cache.StageCache, optional
+        If passed, each stage is evaluated by a separate jitted kernel as with
+        profiler, and the outputs of the subhalos, diffmah, mah, sfh, mah_table,
+        and phase_space stages are looked up in cache by the contents of their
+        inputs before being evaluated, and stored in cache otherwise.
+        Rerunning with a new diffstarpop_params then only evaluates the sfh stage.
+        Default is None, in which case nothing is cached.
+
+    precision : string, optional
+        One of precision.PRECISIONS: "float64", "mixed", or "float32", which set
+        the floating-point dtype of the calculations and of galcat,
+        see the precision module for their accuracy.
+        "float32" requires a process in which precision.set_precision("float32")
+        was called before compiling any kernel.
+        Default is None, in which case the precision is "float64",
+        or "float32" in such a process.
+
+    layout : string, optional
+        One of galcat_groups.GALCAT_LAYOUTS. Default is "cens_first",
+        in which case galcat lists the centrals, followed by the satellites
+        sorted by host, and upid is the index of the host.
+        With "host_major", each central is followed by its satellites,
+        upid is the row of the host central, and galcat["host_offsets"] stores
+        the rows of the galaxies of each host, see galcat_groups.
+
     Returns
     -------
     galcat : dict
         Dictionary storing MAHs, pos/vel, and SFH info about cens and sats
 
     """
+    if layout not in gcg.GALCAT_LAYOUTS:
+        msg = "layout = {0} must be one of {1}"
+        raise ValueError(msg.format(layout, gcg.GALCAT_LAYOUTS))
+    policy = get_precision_policy(check_precision(precision))
+    dtype = policy.compute_dtype
+    logmhost = np.asarray(logmhost, dtype=dtype)
+    halo_radius = np.asarray(halo_radius, dtype=dtype)
+    halo_pos = np.asarray(halo_pos, dtype=dtype)
+    halo_vel = np.asarray(halo_vel, dtype=dtype)
+    if concentration is None:
+        concentration = np.zeros(logmhost.size) + DEFAULT_CONC
+    concentration = np.asarray(concentration, dtype=dtype)
+    lgmp_min = _as_kern_scalar(lgmp_min, dtype)
+    z_obs_kern = _as_kern_scalar(z_obs, dtype)
+
     n_cens = logmhost.size
-    mah_key, rhalo_key, axes_key, sfh_key = jran.split(ran_key, 4)
-    _res = _mc_diffmah_params_halopop_synthetic_subs(
-        mah_key,
-        logmhost,
-        z_obs,
+    n_cens_pad = get_capacity_bucket(n_cens) if padded else n_cens
+    msk_cens = np.arange(n_cens_pad) < n_cens
+    logmhost_pad = _pad_array(logmhost, n_cens_pad)
+    if halo_ids is not None:
+        halo_ids = _pad_array(np.asarray(halo_ids), n_cens_pad)
+
+    counts_key, galpop_keys = _get_galpop_keys(ran_key, halo_ids is not None)
+    if halo_ids is not None:
+        counts_key = hk.get_halo_keys(counts_key, halo_ids)
+    subs_counts = run_stage(
+        profiler,
+        "subhalo_counts",
+        _mc_subhalo_counts_kern,
+        counts_key,
+        logmhost_pad,
+        lgmp_min,
+        msk_cens,
+    )
+    subs_host_halo_indx = np.repeat(np.arange(n_cens_pad), np.asarray(subs_counts))
+    n_sats = subs_host_halo_indx.size
+    n_sats_pad = get_capacity_bucket(n_sats) if padded else n_sats
+    msk_sats = np.arange(n_sats_pad) < n_sats
+    subs_host_halo_indx_pad = _pad_array(subs_host_halo_indx, n_sats_pad)
+
+    if halo_ids is not None:
+        galpop_keys = run_stage(
+            profiler,
+            "halo_keys",
+            _get_galpop_halo_keys,
+            galpop_keys,
+            halo_ids,
+            subs_host_halo_indx_pad,
+        )
+
+    kern_args = (
+        galpop_keys,
+        logmhost_pad,
+        subs_host_halo_indx_pad,
+        _pad_array(halo_radius, n_cens_pad),
+        _pad_array(concentration, n_cens_pad),
+        _pad_array(halo_pos, n_cens_pad),
+        _pad_array(halo_vel, n_cens_pad),
         lgmp_min,
+        z_obs_kern,
         cosmo_params,
-        diffmahpop_params=diffmahpop_params,
+        float(Lbox),
+        diffmahpop_params,
+        psk.get_qnfw_table(),
+        diffstarpop_params,
+    )
+    kern_args = cast_floats(kern_args, dtype)
+    if profiler is None and cache is None:
+        galcat_pad = _mc_galpop_kern(*kern_args, store_tables=store_tables)
+    else:
+        galcat_pad = _mc_galpop_kern_staged(
+            *kern_args,
+            profiler=profiler,
+            cache=cache,
+            store_tables=store_tables,
+        )
+    sat_counts = np.asarray(subs_counts)[:n_cens] if layout == "host_major" else None
+    galcat = run_stage(
+        profiler,
+        "valid_galaxies",
+        _get_valid_galaxies,
+        galcat_pad,
+        msk_cens,
+        msk_sats,
+        sat_counts,
     )
-    mah_params_cens, mah_params_sats, subs_host_halo_indx, subs_logmh_at_z_obs = _res
+    galcat = cast_floats(galcat, policy.output_dtype)
+    galcat["z_obs"] = z_obs
 
-    subs_rhost = halo_radius[subs_host_halo_indx]
-    subs_logmhost = logmhost[subs_host_halo_indx]
-    n_sats = subs_host_halo_indx.size
-    ZZ = jnp.zeros(n_sats)
-    conc = ZZ + 5.0
-    subs_sigma = calculate_virial_velocity(10**subs_logmhost, subs_rhost)
-    major_axes = jran.uniform(axes_key, minval=0, maxval=1, shape=(n_sats, 3))
-    major_axes = vectu.normalized_vectors(major_axes)
-    b_to_a = jnp.ones(n_sats)
-    c_to_a = jnp.ones(n_sats)
+    return galcat
 
-    subs_host_centric_pos, subs_host_centric_vel = mc_ellipsoidal_nfw(
-        rhalo_key, subs_rhost, conc, subs_sigma, major_axes, b_to_a, c_to_a
-    )
-    subs_host_pos = halo_pos[subs_host_halo_indx]
-    subs_host_vel = halo_vel[subs_host_halo_indx]
 
-    subs_pos = jnp.mod(subs_host_pos + subs_host_centric_pos, Lbox)
-    subs_vel = subs_host_vel + subs_host_centric_vel
+def _as_kern_scalar(x, dtype):
+    """Cast a scalar argument of the kernels to a 0-d array of dtype, so that
+    Python floats, which JAX types weakly, and NumPy scalars share compiled kernels"""
+    return jnp.asarray(x, dtype=dtype)
 
-    pos = np.concatenate((halo_pos, subs_pos))
-    vel = np.concatenate((halo_vel, subs_vel))
 
-    # For every sub, get diffmah params of its host halo
-    subs_host_diffmah = DiffmahParams(
-        *[x[subs_host_halo_indx] for x in mah_params_cens]
-    )
+def get_capacity_bucket(n, min_capacity=MIN_CAPACITY):
+    """Get the padded array length used by the jitted kernels for n halos
 
-    t_obs = _age_at_z_kern(z_obs, *cosmo_params)
-    t0 = age_at_z0(*cosmo_params)
-    lgt0 = np.log10(t0)
+    Parameters
+    ----------
+    n : int
+        Number of halos
 
-    mah_params = DiffmahParams(
-        *[np.concatenate((x, y)) for x, y in zip(mah_params_cens, mah_params_sats)]
-    )
-    logmp0 = np.array(_log_mah_kern(mah_params, t0, lgt0))
-    lgmp_t_obs = np.array(_log_mah_kern(mah_params, t_obs, lgt0))
+    min_capacity : int, optional
+        Smallest capacity. Default is set by MIN_CAPACITY.
+
+    Returns
+    -------
+    capacity : int
+        Smallest value of min_capacity * 2**k that is >= n
+
+    """
+    n_doublings = max(int(np.ceil(np.log2(max(n, 1) / min_capacity))), 0)
+    return min_capacity * 2**n_doublings
+
+
+@partial(jjit, static_argnames=("store_tables",))
+def _mc_galpop_kern(
+    galpop_keys,
+    logmhost,
+    subs_host_halo_indx,
+    halo_radius,
+    halo_conc,
+    halo_pos,
+    halo_vel,
+    lgmp_min,
+    z_obs,
+    cosmo_params,
+    Lbox,
+    diffmahpop_params,
+    qnfw_table,
+    diffstarpop_params,
+    store_tables=True,
+):
+    """Subhalo masses, diffmah and diffstar quantities of centrals and satellites,
+    and the phase-space coordinates of satellites
 
-    host_mah_params = DiffmahParams(
-        *[np.concatenate((x, y)) for x, y in zip(mah_params_cens, subs_host_diffmah)]
+    Shapes of the input arrays set the number of centrals and satellites,
+    so that padded arrays of fixed length reuse the compiled kernel.
+    Radial positions of satellites are interpolated from qnfw_table,
+    so that the cost of the kernel does not depend on halo_conc.
+
+    """
+    args = (
+        galpop_keys,
+        logmhost,
+        subs_host_halo_indx,
+        halo_radius,
+        halo_conc,
+        halo_pos,
+        halo_vel,
+        lgmp_min,
+        z_obs,
+        cosmo_params,
+        Lbox,
+        diffmahpop_params,
+        qnfw_table,
+        diffstarpop_params,
     )
-    lgmhost_at_t_inf = _log_mah_kern(host_mah_params, mah_params.t_peak, lgt0)
+    return _galpop_stages(_call_stage, *args, store_tables=store_tables)
+
+
+def _mc_galpop_kern_staged(*args, profiler=None, cache=None, store_tables=True):
+    """Same as _mc_galpop_kern, with each stage evaluated by a separate jitted kernel,
+    recorded by profiler and looked up in cache when they are passed"""
+
+    def _run_stage(stage, *stage_args):
+        func = _GALPOP_STAGE_KERNS[stage]
+        if profiler is not None:
+            func = partial(profiler.run, stage, func)
+        if cache is not None:
+            return cache.run(stage, func, *stage_args)
+        return func(*stage_args)
+
+    return _galpop_stages(_run_stage, *args, store_tables=store_tables)
+
+
+def _call_stage(stage, *args):
+    return _GALPOP_STAGES[stage](*args)
 
-    subs_lgmh_at_t_inf = _log_mah_kern(mah_params_sats, mah_params_sats.t_peak, lgt0)
-    subs_lgmhost_at_t_inf = _log_mah_kern(
-        subs_host_diffmah, mah_params_sats.t_peak, lgt0
+
+def _galpop_stages(
+    run_stage,
+    galpop_keys,
+    logmhost,
+    subs_host_halo_indx,
+    halo_radius,
+    halo_conc,
+    halo_pos,
+    halo_vel,
+    lgmp_min,
+    z_obs,
+    cosmo_params,
+    Lbox,
+    diffmahpop_params,
+    qnfw_table,
+    diffstarpop_params,
+    store_tables=True,
+):
+    """Body of _mc_galpop_kern, in which run_stage(stage, *args) evaluates
+    each stage of _GALPOP_STAGES"""
+    subs_logmhost, subs_logmh_at_z_obs = run_stage(
+        "subhalos", galpop_keys.subs_lgmu, logmhost, subs_host_halo_indx, lgmp_min
+    )
+    mah_params_cens, mah_params_sats = run_stage(
+        "diffmah",
+        galpop_keys.cens,
+        galpop_keys.sats,
+        logmhost,
+        subs_logmh_at_z_obs,
+        z_obs,
+        cosmo_params,
+        diffmahpop_params,
     )
-    subs_lgmu_t_inf = subs_lgmh_at_t_inf - subs_lgmhost_at_t_inf
-    hosts_lgmu_t_inf = np.zeros(n_cens)
-    lgmu_t_inf = np.concatenate((hosts_lgmu_t_inf, subs_lgmu_t_inf))
 
-    upid = np.concatenate((np.zeros(n_cens).astype(int) - 1, subs_host_halo_indx))
+    t_obs = _age_at_z_kern(z_obs, *cosmo_params)
+    t0 = age_at_z0(*cosmo_params)
+    lgt0 = jnp.log10(t0)
 
-    t_table = jnp.linspace(T_TABLE_MIN, t_obs, 50)
-    log_mah_table = mah_halopop(mah_params, t_table, lgt0)[1]
-    args = (
-        DEFAULT_DIFFSTARPOP_PARAMS,
+    _mah_res = run_stage(
+        "mah", mah_params_cens, mah_params_sats, subs_host_halo_indx, t0, t_obs, lgt0
+    )
+    mah_params, host_mah_params, upid = _mah_res[:3]
+    logmp0, lgmp_t_obs, lgmhost_at_t_inf, lgmu_t_inf = _mah_res[3:]
+
+    t_table = jnp.linspace(T_TABLE_MIN, t_obs, N_T_TABLE)
+    _sfh_res = run_stage(
+        "sfh",
+        galpop_keys.sfh,
         mah_params,
         logmp0,
         upid,
         lgmu_t_inf,
         lgmhost_at_t_inf,
-        t_obs - mah_params.t_peak,
-        sfh_key,
+        t_obs,
         t_table,
+        diffstarpop_params,
     )
-    _sfh_res = mcdsp.mc_diffstar_sfh_galpop(*args)
-    sfh_ms, sfh_q, frac_q, mc_is_q = _sfh_res[2:]
-    sfh_table = jnp.where(mc_is_q.reshape((-1, 1)), sfh_q, sfh_ms)
-    smh_table = cumulative_mstar_formed_galpop(t_table, sfh_table)
-    diffstar_params_ms, diffstar_params_q = _sfh_res[0:2]
-    sfh_params = mc_select_diffstar_params(
-        diffstar_params_q, diffstar_params_ms, mc_is_q
-    )
-
-    lgsfr_at_t_obs = np.log10(sfh_table[:, -1])
-    logsm_t_obs = np.log10(smh_table[:, -1])
-    logssfr_t_obs = lgsfr_at_t_obs - logsm_t_obs
+    sfh_params, sfh_table, logsm_t_obs, logssfr_t_obs = _sfh_res
 
     galcat = dict()
     galcat["mah_params"] = mah_params
     galcat["sfh_params"] = sfh_params
     galcat["host_mah_params"] = host_mah_params
-    galcat["upid"] = upid
-    galcat["pos"] = pos
-    galcat["vel"] = vel
     galcat["logmp0"] = logmp0
     galcat["logmp_t_obs"] = lgmp_t_obs
     galcat["logmu_t_inf"] = lgmu_t_inf
     galcat["logsm_t_obs"] = logsm_t_obs
     galcat["logssfr_t_obs"] = logssfr_t_obs
     galcat["t_table"] = t_table
-    galcat["log_mah_table"] = log_mah_table
-    galcat["sfh_table"] = sfh_table
+    if store_tables:
+        galcat["log_mah_table"] = run_stage("mah_table", mah_params, t_table, lgt0)
+        galcat["sfh_table"] = sfh_table
 
     galcat["t0"] = t0
-    galcat["z_obs"] = z_obs
     galcat["t_obs"] = t_obs
 
+    pos, vel = run_stage(
+        "phase_space",
+        galpop_keys,
+        subs_logmhost,
+        subs_host_halo_indx,
+        halo_radius,
+        halo_conc,
+        halo_pos,
+        halo_vel,
+        Lbox,
+        qnfw_table,
+    )
+    galcat["upid"] = upid
+    galcat["pos"] = pos
+    galcat["vel"] = vel
+
     return galcat
 
 
-def _mc_diffmah_params_halopop_synthetic_subs(
-    ran_key,
-    logmhost_at_z_obs,
+def _subhalo_stage(subs_lgmu_key, logmhost, subs_host_halo_indx, lgmp_min):
+    """Host mass and mass at z_obs of each subhalo"""
+    subs_logmhost = logmhost[subs_host_halo_indx]
+    subs_lgmu = _mc_subhalo_lgmu(subs_lgmu_key, subs_logmhost, lgmp_min)
+    return subs_logmhost, subs_lgmu + subs_logmhost
+
+
+def _diffmah_stage(
+    cens_key,
+    sats_key,
+    logmhost,
+    subs_logmh_at_z_obs,
     z_obs,
-    lgmp_min,
     cosmo_params,
-    diffmahpop_params=DEFAULT_DIFFMAHPOP_PARAMS,
+    diffmahpop_params,
 ):
+    """Monte Carlo diffmah parameters of centrals and satellites"""
     mah_params_cens = _mc_diffmah_params_cens(
-        ran_key,
-        logmhost_at_z_obs,
+        cens_key,
+        logmhost,
         z_obs,
         cosmo_params,
         diffmahpop_params=diffmahpop_params,
     )
-    subs_logmh_at_z_obs, subs_host_halo_indx = _mc_subhalo_mass(
-        ran_key, logmhost_at_z_obs, lgmp_min
-    )
     mah_params_sats = _mc_diffmah_params_sats(
-        ran_key,
+        sats_key,
         subs_logmh_at_z_obs,
         z_obs,
         cosmo_params,
         diffmahpop_params=diffmahpop_params,
     )
-    return mah_params_cens, mah_params_sats, subs_host_halo_indx, subs_logmh_at_z_obs
+    return mah_params_cens, mah_params_sats
+
+
+def _mah_table_stage(mah_params, t_table, lgt0):
+    return mah_halopop(mah_params, t_table, lgt0)[1]
+
+
+def _sfh_stage(
+    sfh_key,
+    mah_params,
+    logmp0,
+    upid,
+    lgmu_t_inf,
+    lgmhost_at_t_inf,
+    t_obs,
+    t_table,
+    diffstarpop_params=DEFAULT_DIFFSTARPOP_PARAMS,
+):
+    """Monte Carlo diffstar parameters and star formation history of every galaxy
+
+    Returns
+    -------
+    sfh_params : namedtuple of diffstar parameters
+
+    sfh_table : ndarray of shape (n_gals, n_t)
+
+    logsm_t_obs, logssfr_t_obs : ndarrays of shape (n_gals, )
+
+    """
+    args = (
+        diffstarpop_params,
+        mah_params,
+        logmp0,
+        upid,
+        lgmu_t_inf,
+        lgmhost_at_t_inf,
+        t_obs - mah_params.t_peak,
+        sfh_key,
+        t_table,
+    )
+    if sfh_key.shape == ():
+        _sfh_res = mcdsp.mc_diffstar_sfh_galpop(*args)
+    else:
+        _sfh_res = mc_diffstar_sfh_galpop_per_gal_keys(*args)
+    sfh_ms, sfh_q, frac_q, mc_is_q = _sfh_res[2:]
+    sfh_table = jnp.where(mc_is_q.reshape((-1, 1)), sfh_q, sfh_ms)
+    diffstar_params_ms, diffstar_params_q = _sfh_res[0:2]
+    sfh_params = mc_select_diffstar_params(
+        diffstar_params_q, diffstar_params_ms, mc_is_q
+    )
+
+    lgsfr_at_t_obs = jnp.log10(sfh_table[:, -1])
+    logsm_t_obs = _get_logsm_t_obs(t_table, sfh_table)
+    logssfr_t_obs = lgsfr_at_t_obs - logsm_t_obs
+    return sfh_params, sfh_table, logsm_t_obs, logssfr_t_obs
+
+
+def _get_logsm_t_obs(t_table, sfh_table):
+    """log10 of the stellar mass formed by the last time of t_table,
+    integrated in double precision whatever the dtype of sfh_table"""
+    with jax.enable_x64(True):
+        smh_table = cumulative_mstar_formed_galpop(
+            t_table.astype(jnp.float64), sfh_table.astype(jnp.float64)
+        )
+        logsm_t_obs = jnp.log10(smh_table[:, -1])
+    return logsm_t_obs.astype(sfh_table.dtype)
+
+
+def _phase_space_stage(
+    galpop_keys,
+    subs_logmhost,
+    subs_host_halo_indx,
+    halo_radius,
+    halo_conc,
+    halo_pos,
+    halo_vel,
+    Lbox,
+    qnfw_table,
+):
+    """Positions and velocities of centrals followed by satellites"""
+    n_sats = subs_host_halo_indx.size
+    subs_rhost = halo_radius[subs_host_halo_indx]
+    subs_sigma = psk.calculate_virial_velocity(10**subs_logmhost, subs_rhost)
+    conc = halo_conc[subs_host_halo_indx]
+    # Satellites populate spherical halos, so that no rotation is computed
+    b_to_a = jnp.ones(n_sats)
+    c_to_a = jnp.ones(n_sats)
+    major_axes = _mc_uniform3(galpop_keys.axes, n_sats)
+    if galpop_keys.pos.shape == ():
+        # Same draws from pos_key and vel_key as fake_sats.mc_ellipsoidal_nfw,
+        # so that the realization without halo_ids is unchanged
+        pos_randoms = vel_randoms = None
+    else:
+        # ran_key is unused by the sampler when randoms are passed
+        pos_randoms = hk.mc_uniform_pop(galpop_keys.pos, ndim=3)
+        vel_randoms = hk.mc_normal3_pop(galpop_keys.vel)
+
+    subs_host_centric_pos = psk.mc_ellipsoidal_positions(
+        galpop_keys.pos,
+        subs_rhost,
+        conc,
+        major_axes,
+        b_to_a,
+        c_to_a,
+        randoms=pos_randoms,
+        spherical=True,
+        qnfw_table=qnfw_table,
+    )
+    subs_host_centric_vel = psk.mc_ellipsoidal_velocities(
+        galpop_keys.vel,
+        subs_sigma,
+        major_axes,
+        b_to_a,
+        c_to_a,
+        randoms=vel_randoms,
+        spherical=True,
+    )
+    subs_pos = jnp.mod(halo_pos[subs_host_halo_indx] + subs_host_centric_pos, Lbox)
+    subs_vel = halo_vel[subs_host_halo_indx] + subs_host_centric_vel
+    pos = jnp.concatenate((halo_pos, subs_pos))
+    vel = jnp.concatenate((halo_vel, subs_vel))
+    return pos, vel
+
+
+def _mah_stage(mah_params_cens, mah_params_sats, subs_host_halo_indx, t0, t_obs, lgt0):
+    """Diffmah parameters of every galaxy and of its host halo, and their MAHs
+    at the epochs needed by the diffstarpop model
+
+    Parameters
+    ----------
+    mah_params_cens : namedtuple of arrays with shape (n_cens, )
+
+    mah_params_sats : namedtuple of arrays with shape (n_sats, )
+
+    subs_host_halo_indx : ndarray of shape (n_sats, )
+        Index of the host of each satellite in mah_params_cens
+
+    t0, t_obs : floats
+        Age of the Universe in Gyr today and at the redshift of the catalog
+
+    lgt0 : float
+        log10 of t0
+
+    Returns
+    -------
+    mah_params : namedtuple of arrays with shape (n_gals, )
+        Centrals followed by satellites
+
+    host_mah_params : namedtuple of arrays with shape (n_gals, )
+        Parameters of the host halo of each galaxy, equal to mah_params for centrals
+
+    upid : ndarray of shape (n_gals, )
+        -1 for centrals, and the index of the host for satellites
+
+    logmp0, logmp_t_obs : ndarrays of shape (n_gals, )
+        log10 of halo mass in Msun at t0 and t_obs
+
+    lgmhost_at_t_inf : ndarray of shape (n_gals, )
+        log10 of the mass of the host halo at the time t_peak of each galaxy
+
+    lgmu_t_inf : ndarray of shape (n_gals, )
+        log10 of the ratio of halo mass to host halo mass at t_peak,
+        which is zero for centrals
+
+    Notes
+    -----
+    The host parameters are gathered from mah_params, without concatenating
+    a separate copy of the parameters of the hosts of satellites.
+    The MAH clipped at t_peak is the unclipped MAH evaluated at min(t, t_peak),
+    so that each of the four values needed per galaxy (the galaxy at t0, t_obs
+    and t_peak, and its host at the t_peak of the galaxy) is one call to
+    _log_mah_noq_kern on arrays of shape (n_gals, ), rather than one of five calls
+    to _log_mah_kern that each evaluate the MAH twice. Within the jitted kernel,
+    XLA fuses the four elementwise calls.
+
+    """
+    n_cens = mah_params_cens.logm0.shape[0]
+    mah_params = DiffmahParams(
+        *[jnp.concatenate((x, y)) for x, y in zip(mah_params_cens, mah_params_sats)]
+    )
+    upid = jnp.concatenate((jnp.zeros(n_cens).astype(int) - 1, subs_host_halo_indx))
+    host_indx = jnp.where(upid == -1, jnp.arange(upid.size), upid)
+    host_mah_params = DiffmahParams(*[x[host_indx] for x in mah_params])
+
+    t_peak = mah_params.t_peak
+    logmp0 = _log_mah_noq_kern(mah_params, jnp.minimum(t0, t_peak), lgt0)
+    logmp_t_obs = _log_mah_noq_kern(mah_params, jnp.minimum(t_obs, t_peak), lgt0)
+    logmp_t_peak = _log_mah_noq_kern(mah_params, t_peak, lgt0)
+    t_inf = jnp.minimum(t_peak, host_mah_params.t_peak)
+    lgmhost_at_t_inf = _log_mah_noq_kern(host_mah_params, t_inf, lgt0)
+    lgmu_t_inf = jnp.where(upid == -1, 0.0, logmp_t_peak - lgmhost_at_t_inf)
+
+    return (
+        mah_params,
+        host_mah_params,
+        upid,
+        logmp0,
+        logmp_t_obs,
+        lgmhost_at_t_inf,
+        lgmu_t_inf,
+    )
+
 
+# Stages of _mc_galpop_kern, in order of evaluation
+_GALPOP_STAGES = dict(
+    subhalos=_subhalo_stage,
+    diffmah=_diffmah_stage,
+    mah=_mah_stage,
+    sfh=_sfh_stage,
+    mah_table=_mah_table_stage,
+    phase_space=_phase_space_stage,
+)
+_GALPOP_STAGE_KERNS = {key: jjit(func) for key, func in _GALPOP_STAGES.items()}
 
-def _mc_subhalo_mass(ran_key, logmhost, lgmp_min):
-    subhalo_info = generate_subhalopop(ran_key, logmhost, lgmp_min)
-    subs_lgmu, subs_lgmhost, subs_host_halo_indx = subhalo_info
-    subs_logmh_at_z = subs_lgmu + subs_lgmhost
-    return subs_logmh_at_z, subs_host_halo_indx
+
+def _get_valid_galaxies(galcat_pad, msk_cens, msk_sats, sat_counts=None):
+    """Drop the entries of galcat that correspond to padded halos, and with
+    sat_counts, gather the valid galaxies directly in the host-major layout"""
+    msk_gals = np.concatenate((msk_cens, msk_sats))
+    if sat_counts is not None:
+        indx, host_offsets = gcg.get_host_major_indx(sat_counts)
+        indx = np.flatnonzero(msk_gals)[indx]
+        return gcg._take_host_major(galcat_pad, indx, host_offsets)
+
+    if np.all(msk_gals):
+        return galcat_pad
+
+    galcat = dict()
+    for key, val in galcat_pad.items():
+        if key in GALCAT_SHARED_KEYS:
+            galcat[key] = val
+        else:
+            galcat[key] = tree_util.tree_map(lambda x: np.asarray(x)[msk_gals], val)
+    return galcat
+
+
+def _pad_array(x, capacity):
+    """Pad x along its first axis to the input capacity by repeating x[-1]"""
+    if jnp.issubdtype(x.dtype, dtypes.prng_key):
+        return jran.wrap_key_data(_pad_array(jran.key_data(x), capacity))
+    n_pad = capacity - x.shape[0]
+    if n_pad == 0:
+        return x
+    elif x.shape[0] == 0:
+        return np.zeros((capacity, *x.shape[1:]), dtype=x.dtype)
+    else:
+        pad = np.repeat(np.asarray(x[-1:]), n_pad, axis=0)
+        return np.concatenate((np.asarray(x), pad))
+
+
+def _get_mah_stage_keys(mah_key, with_halo_ids):
+    """Keys for the centrals, subhalo population, and satellites"""
+    if not with_halo_ids:
+        cens_key = subs_key = sats_key = mah_key
+    else:
+        cens_key, subs_key, sats_key = jran.split(mah_key, 3)
+    return cens_key, subs_key, sats_key
+
+
+def _get_galpop_keys(ran_key, with_halo_ids):
+    """Key of the number of subhalos of each host, and GalpopKeys of the stages
+    of _mc_galpop_kern"""
+    mah_key, rhalo_key, axes_key, sfh_key = jran.split(ran_key, 4)
+    cens_key, subs_key, sats_key = _get_mah_stage_keys(mah_key, with_halo_ids)
+    uran_key, counts_key = jran.split(subs_key, 2)
+    pos_key, vel_key = jran.split(rhalo_key, 2)
+    galpop_keys = GalpopKeys(
+        cens_key, sats_key, uran_key, axes_key, pos_key, vel_key, sfh_key
+    )
+    return counts_key, galpop_keys
+
+
+def _get_galpop_halo_keys(galpop_keys, halo_ids, subs_host_halo_indx):
+    """Replace each key of galpop_keys with one key per halo or subhalo"""
+    halo_words = hk.split_halo_ids(halo_ids)
+    subs_ids = hk.get_subhalo_ids(halo_ids, subs_host_halo_indx)
+    return _get_galpop_halo_keys_kern(galpop_keys, halo_words, subs_ids)
+
+
+@jjit
+def _get_galpop_halo_keys_kern(galpop_keys, halo_words, subs_ids):
+    cens_key = hk._halo_keys_kern(galpop_keys.cens, *halo_words)
+    sfh_keys = jnp.concatenate(
+        (
+            hk._halo_keys_kern(galpop_keys.sfh, *halo_words),
+            hk._subhalo_keys_kern(galpop_keys.sfh, *subs_ids),
+        )
+    )
+    subs_keys = [hk._subhalo_keys_kern(key, *subs_ids) for key in galpop_keys[1:6]]
+    return GalpopKeys(cens_key, *subs_keys, sfh_keys)
+
+
+@jjit
+def _mc_subhalo_counts_kern(ran_key, logmhost, lgmp_min, msk_hosts):
+    mean_counts = _compute_mean_subhalo_counts(logmhost, lgmp_min)
+    mean_counts = jnp.where(msk_hosts, mean_counts, 0.0)
+    if ran_key.shape == ():
+        subs_counts = jran.poisson(ran_key, mean_counts)
+    else:
+        subs_counts = _poisson_pop(ran_key, mean_counts)
+    return subs_counts
+
+
+def _mc_subhalo_lgmu(ran_key, subs_logmhost, lgmp_min):
+    n_subs = subs_logmhost.shape[0]
+    if ran_key.shape == ():
+        urandoms = jran.uniform(ran_key, shape=(n_subs,))
+    else:
+        urandoms = hk.mc_uniform_pop(ran_key)
+    ccshmf_params = cast_floats(DEFAULT_CCSHMF_PARAMS, subs_logmhost.dtype)
+    subs_lgmu = generate_subhalopop_vmap(
+        urandoms, subs_logmhost, lgmp_min, ccshmf_params
+    )
+    return subs_lgmu
+
+
+def _mc_uniform3(ran_key, n):
+    if ran_key.shape == ():
+        return jran.uniform(ran_key, minval=0, maxval=1, shape=(n, 3))
+    else:
+        return hk.mc_uniform_pop(ran_key, ndim=3)
 
 
 def _mc_diffmah_params_cens(
@@ -233,8 +833,7 @@ def _mc_diffmah_params_cens(
     diffmahpop_params=DEFAULT_DIFFMAHPOP_PARAMS,
 ):
     n_halos = lgmh_at_z_obs.size
-    params_key, mah_type_key = jran.split(ran_key, 2)
-    ran_keys = jran.split(params_key, n_halos)
+    ran_keys, uran_early = _get_pop_keys_and_uran(ran_key, n_halos)
     t0 = age_at_z0(*cosmo_params)
     lgt0 = jnp.log10(t0)
     t_obs = _age_at_z_kern(z_obs, *cosmo_params)
@@ -244,7 +843,6 @@ def _mc_diffmah_params_cens(
     )
     mah_params_early, mah_params_late, frac_early_cens = _res
 
-    uran_early = jran.uniform(mah_type_key, minval=0, maxval=1, shape=(n_halos,))
     mc_is_early = uran_early < frac_early_cens
     mah_params = mc_select_diffmah_params(
         mah_params_early, mah_params_late, mc_is_early
@@ -260,8 +858,7 @@ def _mc_diffmah_params_sats(
     diffmahpop_params=DEFAULT_DIFFMAHPOP_PARAMS,
 ):
     n_halos = lgmh_at_z_obs.size
-    params_key, mah_type_key = jran.split(ran_key, 2)
-    ran_keys = jran.split(params_key, n_halos)
+    ran_keys, uran_early = _get_pop_keys_and_uran(ran_key, n_halos)
     t0 = age_at_z0(*cosmo_params)
     lgt0 = jnp.log10(t0)
     t_obs = _age_at_z_kern(z_obs, *cosmo_params)
@@ -270,9 +867,39 @@ def _mc_diffmah_params_sats(
     )
     mah_params_early, mah_params_late, frac_early_cens = _res
 
-    uran_early = jran.uniform(mah_type_key, minval=0, maxval=1, shape=(n_halos,))
     mc_is_early = uran_early < frac_early_cens
     mah_params = mc_select_diffmah_params(
         mah_params_early, mah_params_late, mc_is_early
     )
     return mah_params
+
+
+def _get_pop_keys_and_uran(ran_key, n_halos):
+    """Get per-halo keys for the diffmah params and a uniform random per halo
+    to select early- vs late-forming MAHs
+
+    Parameters
+    ----------
+    ran_key : jax.random.key, or array of keys with shape (n_halos, )
+        When passed a single key, it is split into n_halos keys.
+        When passed an array of keys, each halo uses its own key.
+
+    n_halos : int
+
+    Returns
+    -------
+    ran_keys : array of keys with shape (n_halos, )
+
+    uran : ndarray of shape (n_halos, )
+
+    """
+    if ran_key.shape == ():
+        params_key, mah_type_key = jran.split(ran_key, 2)
+        ran_keys = jran.split(params_key, n_halos)
+        uran = jran.uniform(mah_type_key, minval=0, maxval=1, shape=(n_halos,))
+    else:
+        assert ran_key.shape == (n_halos,), "Must pass one key per halo"
+        keys = vmap(jran.split)(ran_key)
+        ran_keys = keys[:, 0]
+        uran = hk.mc_uniform_pop(keys[:, 1])
+    return ran_keys, uran
@@ -0,0 +1,318 @@
+"""Generate a Monte Carlo realization of the galaxy distribution in chunks of hosts,
+so that peak memory is set by a user-defined budget rather than the size of the box"""
+
+import numpy as np
+from diffmah.diffmahpop_kernels.bimod_censat_params import DEFAULT_DIFFMAHPOP_PARAMS
+from diffstarpop.defaults import DEFAULT_DIFFSTARPOP_PARAMS
+from jax import random as jran
+from jax import tree_util
+
+from . import mc_galpop
+from .galcat_io import GALCAT_SHARED_KEYS
+from .planner import DEFAULT_MEM_BUDGET, get_planned_chunk_edges
+
+
+def get_chunk_edges(
+    logmhost,
+    lgmp_min,
+    mem_budget=DEFAULT_MEM_BUDGET,
+    store_tables=True,
+    precision=None,
+    halo_ids=True,
+):
+    """Partition a host halo catalog into contiguous chunks that fit a memory budget
+
+    Parameters
+    ----------
+    logmhost : ndarray, shape (n_hosts, )
+        log10 of halo mass in units of Msun
+
+    lgmp_min : float
+        log10 of halo mass cutoff in Msun
+
+    mem_budget : int, optional
+        Target peak memory in bytes of each call to mc_galpop_synthetic_subs
+
+    store_tables : bool, optional
+        Whether galcat stores log_mah_table and sfh_table. Default is True.
+
+    precision : string, optional
+        One of precision.PRECISIONS, whose compute dtype sets the memory per value.
+        Default is None, in which case precision.get_precision() is used.
+
+    halo_ids : bool, optional
+        Whether halo_ids is passed to mc_galpop_synthetic_subs. Default is True.
+
+    Returns
+    -------
+    chunk_edges : ndarray, shape (n_chunks+1, )
+        Hosts in chunk i are logmhost[chunk_edges[i]:chunk_edges[i+1]]
+
+    Notes
+    -----
+    Chunks are those of planner.get_planned_chunk_edges, whose peak memory
+    follows from the measured cost of each stage for the padded number of centrals
+    and of satellites, one plus the mean of the conditional subhalo mass function
+    per host, plus DEFAULT_N_SIGMA Poisson standard deviations.
+
+    """
+    return get_planned_chunk_edges(
+        logmhost,
+        lgmp_min,
+        mem_budget=mem_budget,
+        store_tables=store_tables,
+        halo_ids=halo_ids,
+        precision=precision,
+    )
+
+
+def mc_galpop_synthetic_subs_chunked(
+    ran_key,
+    logmhost,
+    halo_radius,
+    halo_pos,
+    halo_vel,
+    z_obs,
+    lgmp_min,
+    cosmo_params,
+    Lbox,
+    mem_budget=DEFAULT_MEM_BUDGET,
+    diffmahpop_params=DEFAULT_DIFFMAHPOP_PARAMS,
+    diffstarpop_params=DEFAULT_DIFFSTARPOP_PARAMS,
+    halo_ids=None,
+    padded=True,
+    store_tables=True,
+    concentration=None,
+    profiler=None,
+    chunk_edges=None,
+    cache=None,
+    precision=None,
+    layout="cens_first",
+):
+    """Generate a Monte Carlo realizaton of galaxies populating the input halos,
+    one chunk of hosts at a time
+
+    Parameters
+    ----------
+    ran_key : jax.random.key
+
+    logmhost : ndarray, shape (n_hosts, )
+        log10 of halo mass in units of Msun
+
+    halo_radius : ndarray, shape (n_hosts, )
+        Halo radius in units of Mpc
+
+    halo_pos : ndarray, shape (n_hosts, 3)
+        Comoving halo position in units of Mpc
+
+    halo_vel : ndarray, shape (n_hosts, 3)
+        Halo velocity in units of km/s
+
+    z_obs : float
+        Redshift of the halo catalog
+
+    lgmp_min : float
+        log10 of halo mass cutoff in Msun
+
+    cosmo_params : namedtuple
+        Field names: ('Om0', 'w0', 'wa', 'h')
+
+    Lbox : float
+        Comoving size of the periodic box in Mpc
+
+    mem_budget : int, optional
+        Target peak memory in bytes of the galaxies generated for each chunk
+
+    diffmahpop_params, diffstarpop_params : namedtuple, optional
+        Passed to mc_galpop_synthetic_subs
+
+    halo_ids : ndarray, shape (n_hosts, ), optional
+        Unique integer id of each host halo. See mc_galpop_synthetic_subs.
+
+    padded : bool, optional
+        Passed to mc_galpop_synthetic_subs. Default is True, so that chunks of
+        similar size reuse the same compiled kernels.
+
+    store_tables : bool, optional
+        Passed to mc_galpop_synthetic_subs. Default is True. When False,
+        chunks are larger for the same mem_budget.
+
+    concentration : ndarray, shape (n_hosts, ), optional
+        NFW concentration of each host halo. See mc_galpop_synthetic_subs.
+
+    profiler : profiling.StageProfiler, optional
+        Passed to mc_galpop_synthetic_subs for each chunk,
+        with the index of the chunk stored in the chunk tag of each record.
+
+    chunk_edges : ndarray, shape (n_chunks+1, ), optional
+        Hosts in chunk i are logmhost[chunk_edges[i]:chunk_edges[i+1]].
+        Default is set by get_chunk_edges with mem_budget, store_tables,
+        precision, and whether halo_ids is passed.
+
+    cache : stage_cache.StageCache, optional
+        Passed to mc_galpop_synthetic_subs for each chunk. Rerunning with the same
+        chunks and a new diffstarpop_params then only evaluates the sfh stage,
+        provided max_bytes fits the stages of all chunks or cache_dir is passed.
+
+    precision : string, optional
+        Passed to get_chunk_edges and to mc_galpop_synthetic_subs.
+        Single precision halves the memory per galaxy, so that chunks are
+        twice as large for the same mem_budget.
+
+    layout : string, optional
+        Passed to mc_galpop_synthetic_subs. Default is "cens_first".
+
+    Yields
+    ------
+    galcat : dict
+        Output of mc_galpop_synthetic_subs for the next chunk of hosts.
+        Each satellite is in the same chunk as its host,
+        and upid indexes the centrals of the chunk, or their rows
+        with layout="host_major".
+
+    Notes
+    -----
+    When halo_ids is passed, every chunk uses ran_key, and the Monte Carlo draws
+    of each galaxy are keyed on the id of its halo. Concatenating the chunks then
+    gives the same galaxies as a single call to mc_galpop_synthetic_subs,
+    regardless of mem_budget.
+
+    Otherwise, the random key of chunk i is jran.fold_in(ran_key, i),
+    so the realization is reproducible for fixed ran_key and mem_budget.
+
+    Use concatenate_galcats to assemble the chunks into a single galcat.
+
+    """
+    if chunk_edges is None:
+        chunk_edges = get_chunk_edges(
+            logmhost,
+            lgmp_min,
+            mem_budget=mem_budget,
+            store_tables=store_tables,
+            precision=precision,
+            halo_ids=halo_ids is not None,
+        )
+    for ichunk, (indx_lo, indx_hi) in enumerate(zip(chunk_edges[:-1], chunk_edges[1:])):
+        if concentration is None:
+            chunk_conc = None
+        else:
+            chunk_conc = concentration[indx_lo:indx_hi]
+        if profiler is None:
+            chunk_profiler = None
+        else:
+            chunk_profiler = profiler.tagged(chunk=ichunk)
+        if halo_ids is None:
+            chunk_key = jran.fold_in(ran_key, ichunk)
+            chunk_halo_ids = None
+        else:
+            chunk_key = ran_key
+            chunk_halo_ids = halo_ids[indx_lo:indx_hi]
+        galcat = mc_galpop.mc_galpop_synthetic_subs(
+            chunk_key,
+            logmhost[indx_lo:indx_hi],
+            halo_radius[indx_lo:indx_hi],
+            halo_pos[indx_lo:indx_hi],
+            halo_vel[indx_lo:indx_hi],
+            z_obs,
+            lgmp_min,
+            cosmo_params,
+            Lbox,
+            diffmahpop_params=diffmahpop_params,
+            diffstarpop_params=diffstarpop_params,
+            halo_ids=chunk_halo_ids,
+            padded=padded,
+            store_tables=store_tables,
+            concentration=chunk_conc,
+            profiler=chunk_profiler,
+            cache=cache,
+            precision=precision,
+            layout=layout,
+        )
+        yield galcat
+
+
+def concatenate_galcats(galcats):
+    """Concatenate a sequence of galcats into a single galcat
+
+    Parameters
+    ----------
+    galcats : sequence of dicts
+        Each galcat is the output of mc_galpop_synthetic_subs for a
+        disjoint set of hosts, e.g., as yielded by mc_galpop_synthetic_subs_chunked
+
+    Returns
+    -------
+    galcat : dict
+        Same layout as the output of mc_galpop_synthetic_subs:
+        centrals of all chunks come first, followed by satellites of all chunks,
+        and upid indexes the concatenated centrals.
+        Chunks in the host-major layout, which store host_offsets, are instead
+        concatenated chunk after chunk, so that galcat is also host-major.
+
+    Raises
+    ------
+    ValueError
+        If galcats is empty, or if only some of the chunks are in the host-major layout
+
+    """
+    galcats = list(galcats)
+    if len(galcats) == 0:
+        raise ValueError("galcats must contain at least one galcat")
+    is_host_major = ["host_offsets" in galcat for galcat in galcats]
+    if any(is_host_major):
+        if not all(is_host_major):
+            msg = "Cannot concatenate host-major galcats with centrals-first galcats"
+            raise ValueError(msg)
+        return _concatenate_host_major_galcats(galcats)
+
+    n_cens_per_chunk = [int(np.sum(galcat["upid"] == -1)) for galcat in galcats]
+    host_indx_offsets = np.cumsum([0] + n_cens_per_chunk[:-1])
+
+    galcat = dict()
+    for key in GALCAT_SHARED_KEYS:
+        galcat[key] = galcats[0][key]
+
+    per_gal_keys = [key for key in galcats[0].keys() if key not in GALCAT_SHARED_KEYS]
+    for key in per_gal_keys:
+        cens = [
+            tree_util.tree_map(lambda x: np.asarray(x)[:n_cens], chunk[key])
+            for chunk, n_cens in zip(galcats, n_cens_per_chunk)
+        ]
+        sats = [
+            tree_util.tree_map(lambda x: np.asarray(x)[n_cens:], chunk[key])
+            for chunk, n_cens in zip(galcats, n_cens_per_chunk)
+        ]
+        if key == "upid":
+            sats = [x + offset for x, offset in zip(sats, host_indx_offsets)]
+        galcat[key] = tree_util.tree_map(lambda *x: np.concatenate(x), *cens, *sats)
+
+    return galcat
+
+
+def _concatenate_host_major_galcats(galcats):
+    """Concatenate galcats in the host-major layout, shifting upid and host_offsets
+    by the number of galaxies of the previous chunks"""
+    n_gals_per_chunk = [np.asarray(galcat["upid"]).size for galcat in galcats]
+    row_offsets = np.cumsum([0] + n_gals_per_chunk)
+
+    galcat = dict()
+    for key in GALCAT_SHARED_KEYS:
+        galcat[key] = galcats[0][key]
+
+    per_gal_keys = [key for key in galcats[0].keys() if key not in GALCAT_SHARED_KEYS]
+    per_gal_keys.remove("host_offsets")
+    for key in per_gal_keys:
+        chunks = [tree_util.tree_map(np.asarray, chunk[key]) for chunk in galcats]
+        if key == "upid":
+            chunks = [
+                np.where(x == -1, -1, x + offset)
+                for x, offset in zip(chunks, row_offsets)
+            ]
+        galcat[key] = tree_util.tree_map(lambda *x: np.concatenate(x), *chunks)
+
+    host_offsets = [
+        np.asarray(chunk["host_offsets"])[:-1] + offset
+        for chunk, offset in zip(galcats, row_offsets)
+    ]
+    galcat["host_offsets"] = np.concatenate((*host_offsets, row_offsets[-1:]))
+    return galcat
@@ -0,0 +1,430 @@
+"""Generate many Monte Carlo realizations of the galaxy distribution of the same
+host halos, with each batch of realizations drawn by kernels vmapped over keys
+
+Example usage
+-------------
+>>> ran_keys = jran.split(jran.key(0), 100)  # doctest: +SKIP
+>>> args = (logmhost, halo_radius, halo_pos, halo_vel, z_obs, lgmp_min, cosmo, Lbox)  # doctest: +SKIP
+>>> for galcat in iter_galpop_realizations(ran_keys, *args, halo_ids=halo_ids):  # doctest: +SKIP
+...     n_gals.append(np.sum(galcat["logsm_t_obs"] > 10))
+
+"""
+
+import os
+from functools import partial
+
+import numpy as np
+from diffmah.diffmahpop_kernels.bimod_censat_params import DEFAULT_DIFFMAHPOP_PARAMS
+from diffstarpop.defaults import DEFAULT_DIFFSTARPOP_PARAMS
+from jax import jit as jjit
+from jax import numpy as jnp
+from jax import tree_util, vmap
+
+from . import galcat_io, galcat_tables
+from . import halo_keys as hk
+from . import mc_galpop, planner
+from .fake_sats import phase_space_kernels as psk
+from .galcat_io import GALCAT_SHARED_KEYS, SHARD_SUFFIXES
+from .mc_galpop_chunks import DEFAULT_MEM_BUDGET
+from .precision import cast_floats, check_precision, get_precision_policy
+
+
+def mc_galpop_realizations(
+    ran_keys,
+    logmhost,
+    halo_radius,
+    halo_pos,
+    halo_vel,
+    z_obs,
+    lgmp_min,
+    cosmo_params,
+    Lbox,
+    diffmahpop_params=DEFAULT_DIFFMAHPOP_PARAMS,
+    diffstarpop_params=DEFAULT_DIFFSTARPOP_PARAMS,
+    halo_ids=None,
+    store_tables=True,
+    concentration=None,
+    n_sats_pad=None,
+    precision=None,
+):
+    """Generate a batch of Monte Carlo realizations of galaxies populating
+    the same halos, with one realization per key
+
+    Parameters
+    ----------
+    ran_keys : array of keys with shape (n_realizations, )
+        e.g., jran.split(ran_key, n_realizations)
+
+    logmhost, halo_radius, halo_pos, halo_vel, z_obs, lgmp_min, cosmo_params, Lbox
+        Same as mc_galpop.mc_galpop_synthetic_subs
+
+    diffmahpop_params, diffstarpop_params, halo_ids, store_tables, concentration,
+    precision
+        Optional. Same as mc_galpop.mc_galpop_synthetic_subs
+
+    n_sats_pad : int, optional
+        Length to which the satellites of every realization are padded,
+        which must be at least their largest number.
+        Default is the largest number of satellites of the realizations.
+        Batches with the same n_sats_pad share the same compiled kernel,
+        see get_n_sats_max.
+
+    Returns
+    -------
+    galcats : dict
+        Same keys as the galcat of mc_galpop_synthetic_subs, plus msk_gals.
+        Each per-galaxy array has shape (n_realizations, n_hosts + n_sats_pad, ...).
+        The centrals of every realization come first, followed by its satellites,
+        and msk_gals is False for the entries beyond the satellites
+        of each realization. Entries of GALCAT_SHARED_KEYS are the same
+        for all realizations, and have no realization axis.
+        Use get_realization to extract the galcat of a single realization.
+
+    Notes
+    -----
+    Hosts are transferred to the device once, and all realizations are evaluated
+    by two compiled calls: one for the number of subhalos of each host,
+    and one for the galaxies. Unlike mc_galpop_synthetic_subs with padded=True,
+    hosts are not padded, and satellites are only padded to the largest number
+    of the realizations, so that little work is spent on padded entries.
+    Memory scales with n_realizations, see iter_galpop_realizations
+    for realizations drawn in batches that fit a memory budget.
+
+    When halo_ids is passed, realization i is the same as
+    mc_galpop_synthetic_subs(ran_keys[i], ..., halo_ids=halo_ids).
+    Otherwise, draws are split from each key according to the position of
+    each galaxy in the padded arrays, so that realization i depends on n_sats_pad.
+
+    """
+    policy = get_precision_policy(check_precision(precision))
+    dtype = policy.compute_dtype
+    logmhost = np.asarray(logmhost, dtype=dtype)
+    if concentration is None:
+        concentration = np.zeros(logmhost.size) + mc_galpop.DEFAULT_CONC
+    n_cens = logmhost.size
+    halo_words = None if halo_ids is None else hk.split_halo_ids(halo_ids)
+
+    counts_keys, galpop_keys = _get_galpop_keys_batch(ran_keys, halo_ids)
+    subs_counts = np.asarray(
+        _mc_subhalo_counts_batch_kern(counts_keys, halo_words, logmhost, lgmp_min)
+    )
+    n_sats = np.sum(subs_counts, axis=1)
+    if n_sats_pad is None:
+        n_sats_pad = int(np.max(n_sats))
+    elif n_sats_pad < np.max(n_sats):
+        msg = "n_sats_pad = {0} is smaller than the {1} satellites of a realization"
+        raise ValueError(msg.format(n_sats_pad, np.max(n_sats)))
+    subs_host_halo_indx = np.stack(
+        [
+            mc_galpop._pad_array(np.repeat(np.arange(n_cens), x), n_sats_pad)
+            for x in subs_counts
+        ]
+    )
+
+    subs_ids = None
+    if halo_ids is not None:
+        subs_ids = [hk.get_subhalo_ids(halo_ids, x) for x in subs_host_halo_indx]
+        subs_ids = tuple(np.stack(x) for x in zip(*subs_ids))
+
+    args = (
+        np.asarray(halo_radius),
+        np.asarray(concentration),
+        np.asarray(halo_pos),
+        np.asarray(halo_vel),
+        lgmp_min,
+        z_obs,
+        cosmo_params,
+        float(Lbox),
+        diffmahpop_params,
+        psk.get_qnfw_table(),
+        diffstarpop_params,
+    )
+    galcats = _mc_galpop_batch_kern(
+        galpop_keys,
+        halo_words,
+        subs_ids,
+        logmhost,
+        subs_host_halo_indx,
+        *cast_floats(args, dtype),
+        store_tables=store_tables,
+    )
+    galcats = cast_floats(galcats, policy.output_dtype)
+    galcats = {
+        key: np.asarray(val[0]) if key in GALCAT_SHARED_KEYS else val
+        for key, val in galcats.items()
+    }
+    galcats["z_obs"] = z_obs
+    msk_sats = np.arange(n_sats_pad) < n_sats[:, None]
+    msk_cens = np.ones((n_sats.size, n_cens), dtype=bool)
+    galcats["msk_gals"] = np.concatenate((msk_cens, msk_sats), axis=1)
+    return galcats
+
+
+def get_n_sats_max(ran_keys, logmhost, lgmp_min, halo_ids=None, batch_size=1_000):
+    """Largest number of satellites of the realizations of mc_galpop_realizations
+    drawn with ran_keys, which only requires the number of subhalos of each host
+
+    Parameters
+    ----------
+    ran_keys : array of keys with shape (n_realizations, )
+
+    logmhost : ndarray, shape (n_hosts, )
+
+    lgmp_min : float
+
+    halo_ids : ndarray, shape (n_hosts, ), optional
+
+    batch_size : int, optional
+        Number of realizations whose subhalos are counted at once
+
+    Returns
+    -------
+    n_sats_max : int
+
+    """
+    logmhost = np.asarray(logmhost)
+    halo_words = None if halo_ids is None else hk.split_halo_ids(halo_ids)
+    n_sats_max = 0
+    for indx_lo in range(0, ran_keys.shape[0], batch_size):
+        counts_keys = _get_galpop_keys_batch(
+            ran_keys[indx_lo : indx_lo + batch_size], halo_ids
+        )[0]
+        subs_counts = _mc_subhalo_counts_batch_kern(
+            counts_keys, halo_words, logmhost, lgmp_min
+        )
+        n_sats_max = max(n_sats_max, int(np.max(np.sum(subs_counts, axis=1))))
+    return n_sats_max
+
+
+def get_realization(galcats, i):
+    """Get the galcat of realization i of the output of mc_galpop_realizations"""
+    msk_gals = galcats["msk_gals"][i]
+    galcat = dict()
+    for key, val in galcats.items():
+        if key in GALCAT_SHARED_KEYS:
+            galcat[key] = val
+        elif key != "msk_gals":
+            galcat[key] = tree_util.tree_map(lambda x: np.asarray(x[i])[msk_gals], val)
+    return galcat
+
+
+def get_batch_size(
+    n_hosts,
+    n_sats_pad,
+    mem_budget=DEFAULT_MEM_BUDGET,
+    store_tables=True,
+    precision=None,
+):
+    """Number of realizations of mc_galpop_realizations whose predicted peak memory
+    fits mem_budget, according to planner.estimate_peak_memory"""
+    peak_mem = planner.estimate_peak_memory(
+        n_hosts, n_sats_pad, store_tables, padded=False, precision=precision
+    )
+    return max(int(mem_budget // peak_mem), 1)
+
+
+def iter_galpop_realizations(
+    ran_keys,
+    logmhost,
+    halo_radius,
+    halo_pos,
+    halo_vel,
+    z_obs,
+    lgmp_min,
+    cosmo_params,
+    Lbox,
+    batch_size=None,
+    mem_budget=DEFAULT_MEM_BUDGET,
+    **kwargs,
+):
+    """Generate Monte Carlo realizations of galaxies populating the same halos,
+    one batch of realizations at a time
+
+    Parameters
+    ----------
+    ran_keys : array of keys with shape (n_realizations, )
+
+    logmhost, halo_radius, halo_pos, halo_vel, z_obs, lgmp_min, cosmo_params, Lbox
+        Same as mc_galpop.mc_galpop_synthetic_subs
+
+    batch_size : int, optional
+        Largest number of realizations drawn by each call to mc_galpop_realizations.
+        Default is set by get_batch_size with mem_budget.
+
+    mem_budget : int, optional
+        Target peak memory in bytes of each batch. Default is DEFAULT_MEM_BUDGET.
+
+    **kwargs : optional
+        Passed to mc_galpop_realizations
+
+    Yields
+    ------
+    galcat : dict
+        Galcat of the next realization, in the order of ran_keys,
+        with the same keys as the output of mc_galpop_synthetic_subs
+
+    Notes
+    -----
+    Unless n_sats_pad is passed, the subhalos of all realizations are counted first
+    with get_n_sats_max, so that every batch is padded to the same number of
+    satellites. Realizations are split into batches of equal size, up to one,
+    so that the galaxies of all batches are drawn by at most two compiled kernels.
+
+    """
+    if kwargs.get("n_sats_pad") is None:
+        kwargs["n_sats_pad"] = get_n_sats_max(
+            ran_keys, logmhost, lgmp_min, kwargs.get("halo_ids")
+        )
+    if batch_size is None:
+        batch_size = get_batch_size(
+            np.size(logmhost),
+            kwargs["n_sats_pad"],
+            mem_budget,
+            kwargs.get("store_tables", True),
+            kwargs.get("precision"),
+        )
+    n_batches = -(-ran_keys.shape[0] // batch_size)
+    args = (logmhost, halo_radius, halo_pos, halo_vel, z_obs, lgmp_min)
+    args = (*args, cosmo_params, Lbox)
+    for indx in np.array_split(np.arange(ran_keys.shape[0]), n_batches):
+        galcats = mc_galpop_realizations(ran_keys[indx], *args, **kwargs)
+        for i in range(indx.size):
+            yield get_realization(galcats, i)
+        del galcats
+
+
+def write_galpop_realizations(
+    output_dir,
+    ran_keys,
+    logmhost,
+    halo_radius,
+    halo_pos,
+    halo_vel,
+    z_obs,
+    lgmp_min,
+    cosmo_params,
+    Lbox,
+    fmt="hdf5",
+    columns=None,
+    exclude=None,
+    attrs=None,
+    batch_size=None,
+    mem_budget=DEFAULT_MEM_BUDGET,
+    **kwargs,
+):
+    """Stream Monte Carlo realizations of galaxies populating the same halos to disk,
+    one file per realization
+
+    Parameters
+    ----------
+    output_dir : string
+        Realization i is written to output_dir/galcat_realization_XXXX,
+        with the suffix of fmt, see get_realization_fname
+
+    ran_keys, logmhost, halo_radius, halo_pos, halo_vel, z_obs, lgmp_min,
+    cosmo_params, Lbox, batch_size, mem_budget, **kwargs
+        Same as iter_galpop_realizations
+
+    fmt, columns, exclude : optional
+        Passed to galcat_io.write_galcats. Tables of MAH and SFH are only
+        generated when written, see galcat_tables.is_table_selected.
+
+    attrs : dict, optional
+        Metadata stored in every file, together with the index of the realization
+
+    Returns
+    -------
+    fnames : list of strings
+        Path of the file of each realization
+
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    kwargs["store_tables"] = galcat_tables.is_table_selected(columns, exclude)
+    galcats = iter_galpop_realizations(
+        ran_keys,
+        logmhost,
+        halo_radius,
+        halo_pos,
+        halo_vel,
+        z_obs,
+        lgmp_min,
+        cosmo_params,
+        Lbox,
+        batch_size=batch_size,
+        mem_budget=mem_budget,
+        **kwargs,
+    )
+    fnames = []
+    for i, galcat in enumerate(galcats):
+        fname = get_realization_fname(output_dir, i, fmt)
+        file_attrs = dict() if attrs is None else dict(attrs)
+        file_attrs["realization"] = i
+        galcat_io.write_galcats(
+            fname,
+            [galcat],
+            fmt=fmt,
+            columns=columns,
+            exclude=exclude,
+            attrs=file_attrs,
+        )
+        fnames.append(fname)
+    return fnames
+
+
+def get_realization_fname(output_dir, i, fmt="hdf5"):
+    """Path of the file of realization i written by write_galpop_realizations"""
+    basename = "galcat_realization_{0:04d}{1}".format(i, SHARD_SUFFIXES[fmt])
+    return os.path.join(output_dir, basename)
+
+
+def _get_galpop_keys_batch(ran_keys, halo_ids):
+    """mc_galpop._get_galpop_keys for each key of ran_keys"""
+    return _get_galpop_keys_batch_kern(ran_keys, halo_ids is not None)
+
+
+@partial(jjit, static_argnums=(1,))
+def _get_galpop_keys_batch_kern(ran_keys, with_halo_ids):
+    return vmap(partial(mc_galpop._get_galpop_keys, with_halo_ids=with_halo_ids))(
+        ran_keys
+    )
+
+
+@jjit
+def _mc_subhalo_counts_batch_kern(counts_keys, halo_words, logmhost, lgmp_min):
+    """Number of subhalos of each host for each realization"""
+    msk_hosts = jnp.ones(logmhost.shape, dtype=bool)
+
+    def _counts(counts_key):
+        if halo_words is not None:
+            counts_key = hk._halo_keys_kern(counts_key, *halo_words)
+        return mc_galpop._mc_subhalo_counts_kern(
+            counts_key, logmhost, lgmp_min, msk_hosts
+        )
+
+    return vmap(_counts)(counts_keys)
+
+
+@partial(jjit, static_argnames=("store_tables",))
+def _mc_galpop_batch_kern(
+    galpop_keys,
+    halo_words,
+    subs_ids,
+    logmhost,
+    subs_host_halo_indx,
+    *args,
+    store_tables=True,
+):
+    """mc_galpop._mc_galpop_kern vmapped over the keys and subhalos of each
+    realization, with the keys of each halo derived from halo_words and subs_ids
+    when passed"""
+
+    def _kern(galpop_keys, subs_ids, subs_host_halo_indx):
+        if halo_words is not None:
+            galpop_keys = mc_galpop._get_galpop_halo_keys_kern(
+                galpop_keys, halo_words, subs_ids
+            )
+        return mc_galpop._mc_galpop_kern(
+            galpop_keys, logmhost, subs_host_halo_indx, *args, store_tables=store_tables
+        )
+
+    return vmap(_kern)(galpop_keys, subs_ids, subs_host_halo_indx)
@@ -0,0 +1,299 @@
+"""Generate a Monte Carlo realization of the galaxy distribution with a pool of
+worker processes, each populating a contiguous shard of host halos"""
+
+import multiprocessing
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from diffmah.diffmahpop_kernels.bimod_censat_params import DEFAULT_DIFFMAHPOP_PARAMS
+from diffsky.mass_functions.mc_subs import _compute_mean_subhalo_counts
+from diffstarpop.defaults import DEFAULT_DIFFSTARPOP_PARAMS
+from jax import random as jran
+from jax import tree_util
+
+from . import mc_galpop
+from .mc_galpop_chunks import concatenate_galcats
+from .precision import get_precision
+from .worker_setup import init_worker
+
+# Arguments of mc_galpop_synthetic_subs for one shard, with the random key as raw data
+ShardArgs = namedtuple(
+    "ShardArgs",
+    (
+        "key_data",
+        "logmhost",
+        "halo_radius",
+        "halo_pos",
+        "halo_vel",
+        "z_obs",
+        "lgmp_min",
+        "cosmo_params",
+        "Lbox",
+        "diffmahpop_params",
+        "diffstarpop_params",
+        "halo_ids",
+        "padded",
+        "store_tables",
+        "concentration",
+        "precision",
+    ),
+)
+
+
+def get_shard_edges(logmhost, lgmp_min, n_shards):
+    """Partition a host halo catalog into contiguous shards of similar workload
+
+    Parameters
+    ----------
+    logmhost : ndarray, shape (n_hosts, )
+        log10 of halo mass in units of Msun
+
+    lgmp_min : float
+        log10 of halo mass cutoff in Msun
+
+    n_shards : int
+        Number of shards. Reduced to n_hosts if there are fewer hosts.
+
+    Returns
+    -------
+    shard_edges : ndarray, shape (n_shards+1, )
+        Hosts in shard i are logmhost[shard_edges[i]:shard_edges[i+1]]
+
+    Notes
+    -----
+    The workload of a host is taken to be its expected number of galaxies,
+    one central plus the mean of the conditional subhalo mass function.
+
+    """
+    logmhost = np.atleast_1d(logmhost)
+    n_hosts = logmhost.size
+    n_shards = max(min(int(n_shards), n_hosts), 1)
+
+    mean_n_sats = np.array(_compute_mean_subhalo_counts(logmhost, lgmp_min))
+    cumsum_n_gals = np.cumsum(1.0 + mean_n_sats)
+    targets = cumsum_n_gals[-1] * np.arange(1, n_shards) / n_shards
+    inner_edges = np.searchsorted(cumsum_n_gals, targets, side="right")
+
+    # Every shard keeps at least one host
+    inner_edges = np.maximum(inner_edges, np.arange(1, n_shards))
+    inner_edges = np.minimum(inner_edges, n_hosts - n_shards + np.arange(1, n_shards))
+    inner_edges = np.maximum.accumulate(inner_edges)
+
+    shard_edges = np.concatenate(([0], inner_edges, [n_hosts])).astype(int)
+    return shard_edges
+
+
+def mc_galpop_synthetic_subs_sharded(
+    ran_key,
+    logmhost,
+    halo_radius,
+    halo_pos,
+    halo_vel,
+    z_obs,
+    lgmp_min,
+    cosmo_params,
+    Lbox,
+    diffmahpop_params=DEFAULT_DIFFMAHPOP_PARAMS,
+    diffstarpop_params=DEFAULT_DIFFSTARPOP_PARAMS,
+    halo_ids=None,
+    padded=True,
+    store_tables=True,
+    concentration=None,
+    n_workers=None,
+    n_shards=None,
+    cache_dir=None,
+    executor=None,
+    precision=None,
+):
+    """Generate a Monte Carlo realizaton of galaxies populating the input halos,
+    with the hosts split into shards that are processed in parallel
+
+    Parameters
+    ----------
+    ran_key : jax.random.key
+
+    logmhost : ndarray, shape (n_hosts, )
+        log10 of halo mass in units of Msun
+
+    halo_radius : ndarray, shape (n_hosts, )
+        Halo radius in units of Mpc
+
+    halo_pos : ndarray, shape (n_hosts, 3)
+        Comoving halo position in units of Mpc
+
+    halo_vel : ndarray, shape (n_hosts, 3)
+        Halo velocity in units of km/s
+
+    z_obs : float
+        Redshift of the halo catalog
+
+    lgmp_min : float
+        log10 of halo mass cutoff in Msun
+
+    cosmo_params : namedtuple
+        Field names: ('Om0', 'w0', 'wa', 'h')
+
+    Lbox : float
+        Comoving size of the periodic box in Mpc
+
+    diffmahpop_params, diffstarpop_params : namedtuple, optional
+        Passed to mc_galpop_synthetic_subs
+
+    halo_ids : ndarray, shape (n_hosts, ), optional
+        Unique integer id of each host halo. See mc_galpop_synthetic_subs.
+
+    padded : bool, optional
+        Passed to mc_galpop_synthetic_subs. Default is True.
+
+    store_tables : bool, optional
+        Passed to mc_galpop_synthetic_subs. Default is True.
+
+    concentration : ndarray, shape (n_hosts, ), optional
+        NFW concentration of each host halo. See mc_galpop_synthetic_subs.
+
+    n_workers : int, optional
+        Number of worker processes. Default is os.cpu_count().
+        Use n_workers=1 to process the shards serially in the calling process.
+
+    n_shards : int, optional
+        Number of shards of hosts. Default is n_workers.
+
+    cache_dir : string, optional
+        Directory of the persistent compilation cache used by the workers,
+        see compilation_cache.enable_compilation_cache. Default is None,
+        in which case each worker compiles the kernels from scratch.
+
+    executor : concurrent.futures.Executor, optional
+        Pool of workers, e.g., as returned by get_executor. Reusing the same pool
+        across calls avoids paying the startup and compilation time of the workers
+        more than once. Default is None, in which case a pool of n_workers processes
+        is created for this call, or no pool is used if n_workers=1.
+
+    precision : string, optional
+        Passed to mc_galpop_synthetic_subs for each shard, and to get_executor
+        when the pool is created for this call. "float32" requires a pool created
+        with the same precision, or a calling process set to "float32"
+        if n_workers=1. Default is None, in which case
+        precision.get_precision() of the calling process is used.
+
+    Returns
+    -------
+    galcat : dict
+        Same layout as the output of mc_galpop_synthetic_subs:
+        centrals come first, followed by satellites,
+        and the satellites of each host are contiguous.
+
+    Notes
+    -----
+    When halo_ids is passed, the galaxies are the same as those of a single call
+    to mc_galpop_synthetic_subs, regardless of n_workers and n_shards.
+    Otherwise, the random key of shard i is jran.fold_in(ran_key, i).
+
+    Workers are started with the spawn method, since JAX is not fork-safe,
+    and each worker runs XLA on a single thread, see get_executor.
+
+    """
+    n_workers = os.cpu_count() if n_workers is None else int(n_workers)
+    n_shards = n_workers if n_shards is None else int(n_shards)
+    if precision is None:
+        precision = get_precision()
+
+    logmhost = np.asarray(logmhost)
+    shard_edges = get_shard_edges(logmhost, lgmp_min, n_shards)
+
+    shard_args = []
+    for ishard, (indx_lo, indx_hi) in enumerate(zip(shard_edges[:-1], shard_edges[1:])):
+        if halo_ids is None:
+            shard_key = jran.fold_in(ran_key, ishard)
+            shard_halo_ids = None
+        else:
+            shard_key = ran_key
+            shard_halo_ids = np.asarray(halo_ids[indx_lo:indx_hi])
+        if concentration is None:
+            shard_conc = None
+        else:
+            shard_conc = np.asarray(concentration[indx_lo:indx_hi])
+        shard_args.append(
+            ShardArgs(
+                key_data=np.asarray(jran.key_data(shard_key)),
+                logmhost=logmhost[indx_lo:indx_hi],
+                halo_radius=np.asarray(halo_radius[indx_lo:indx_hi]),
+                halo_pos=np.asarray(halo_pos[indx_lo:indx_hi]),
+                halo_vel=np.asarray(halo_vel[indx_lo:indx_hi]),
+                z_obs=z_obs,
+                lgmp_min=lgmp_min,
+                cosmo_params=cosmo_params,
+                Lbox=Lbox,
+                diffmahpop_params=diffmahpop_params,
+                diffstarpop_params=diffstarpop_params,
+                halo_ids=shard_halo_ids,
+                padded=padded,
+                store_tables=store_tables,
+                concentration=shard_conc,
+                precision=precision,
+            )
+        )
+
+    if executor is not None:
+        galcats = list(executor.map(_mc_galpop_shard, shard_args))
+    elif n_workers == 1:
+        galcats = [_mc_galpop_shard(args) for args in shard_args]
+    else:
+        n_workers = min(n_workers, len(shard_args))
+        with get_executor(
+            n_workers, cache_dir=cache_dir, precision=precision
+        ) as executor:
+            galcats = list(executor.map(_mc_galpop_shard, shard_args))
+
+    return concatenate_galcats(galcats)
+
+
+def get_executor(n_workers=None, cache_dir=None, precision=None):
+    """Get a pool of worker processes for mc_galpop_synthetic_subs_sharded
+
+    Parameters
+    ----------
+    n_workers : int, optional
+        Number of worker processes. Default is os.cpu_count().
+
+    cache_dir : string, optional
+        Directory of the persistent compilation cache used by the workers
+
+    precision : string, optional
+        Precision of the workers, see precision.set_precision.
+        Default is None, in which case workers use the default precision.
+
+    Returns
+    -------
+    executor : concurrent.futures.ProcessPoolExecutor
+
+    Notes
+    -----
+    Workers are spawned, and each worker runs worker_setup.init_worker,
+    which sets XLA_FLAGS to run XLA on a single thread before JAX is imported
+    in the worker. The environment of the calling process is left unchanged.
+    Spawned workers first import the main module of the calling process, and
+    importing diffmah, diffstarpop or dsps creates the JAX backend, so that
+    the main module should import them within functions or under
+    if __name__ == "__main__", as in scripts/bench_sharded_scaling.py.
+    Otherwise, init_worker warns that XLA_FLAGS has no effect.
+
+    """
+    executor = ProcessPoolExecutor(
+        max_workers=n_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+        initargs=(cache_dir, precision),
+    )
+    return executor
+
+
+def _mc_galpop_shard(args):
+    """Run mc_galpop_synthetic_subs on the ShardArgs of a shard,
+    and return galcat as numpy arrays"""
+    kwargs = args._asdict()
+    ran_key = jran.wrap_key_data(kwargs.pop("key_data"))
+    galcat = mc_galpop.mc_galpop_synthetic_subs(ran_key, **kwargs)
+    return tree_util.tree_map(np.asarray, galcat)
@@ -0,0 +1,175 @@
+"""Memory-mapped reader of galaxy mocks that are stored as many npy shards
+
+Shards are written by galcat_io.write_galcats with fmt="npy", e.g., by
+rgrspit-mock --format npy. Opening a mock only reads the small metadata file
+of each shard, and columns are memory-mapped when they are first accessed,
+so that only the requested rows of the requested columns are ever read from disk.
+
+"""
+
+import json
+import os
+
+import numpy as np
+
+from . import galcat_io
+
+MANIFEST_BASENAME = "manifest.json"
+
+
+def open_mock(shards):
+    """Open a collection of npy shards as a single virtual catalog of galaxies
+
+    Parameters
+    ----------
+    shards : string or list of strings
+        Either the output directory of rgrspit-mock, in which case the shards
+        are those listed in its manifest, or a list of shard directories.
+        Shards of the manifest are looked up in the output directory,
+        so that a mock can be moved after it is written.
+
+    Returns
+    -------
+    mock : MockCatalog
+
+    """
+    if isinstance(shards, str):
+        output_dir = shards
+        with open(os.path.join(output_dir, MANIFEST_BASENAME), "r") as f:
+            manifest = json.load(f)
+        shards = [
+            os.path.join(output_dir, os.path.basename(x["shard_fname"]))
+            for x in manifest["shards"]
+        ]
+    return MockCatalog(shards)
+
+
+class MockCatalog:
+    """Virtual catalog of galaxies spanning many npy shards
+
+    Rows are ordered shard by shard. Columns are returned as read-only
+    memory-mapped arrays whenever the requested rows lie in a single shard,
+    in which case no data is copied. Rows spanning several shards are
+    gathered into a new array holding only the requested rows.
+
+    In the virtual catalog, upid is the row of the host central in the catalog.
+
+    Parameters
+    ----------
+    shard_dirs : list of strings
+        Directories written by galcat_io.write_galcats with fmt="npy"
+
+    """
+
+    def __init__(self, shard_dirs):
+        self.shard_dirs = list(shard_dirs)
+        if len(self.shard_dirs) == 0:
+            raise ValueError("MockCatalog requires at least one shard")
+        n_gals = [galcat_io.load_galcat_attrs_npy(x)["n_gals"] for x in self.shard_dirs]
+        self.n_gals_per_shard = np.array(n_gals, dtype=int)
+        self.row_offsets = np.concatenate(([0], np.cumsum(self.n_gals_per_shard)))
+        self.colnames = galcat_io.get_colnames_npy(self.shard_dirs[0])
+        self._memmaps = dict()
+
+    def __len__(self):
+        return int(self.row_offsets[-1])
+
+    def __getitem__(self, colname):
+        return self.get(colname)
+
+    def get(self, colname, rows=None):
+        """Get a column of the catalog
+
+        Parameters
+        ----------
+        colname : string
+            e.g., "pos", "logsm_t_obs", or "mah_params/logm0"
+
+        rows : slice or tuple (start, stop), optional
+            Contiguous range of rows. Default is all rows.
+
+        Returns
+        -------
+        x : ndarray
+            Memory-mapped view if the rows lie in a single shard,
+            otherwise a new array. Shared entries such as t_table
+            are returned for the whole catalog.
+
+        """
+        if colname in galcat_io.GALCAT_SHARED_KEYS:
+            return self._memmap(0, colname)
+
+        views = [x[colname] for __, x in self.iter_shards([colname], rows=rows)]
+        if len(views) == 1:
+            return views[0]
+        elif len(views) == 0:
+            x = self._memmap(0, colname)
+            return x[:0]
+        else:
+            return np.concatenate(views)
+
+    def load(self, columns=None, rows=None):
+        """Get several columns of the catalog as a dictionary, see get"""
+        columns = self.colnames if columns is None else columns
+        return {colname: self.get(colname, rows=rows) for colname in columns}
+
+    def iter_shards(self, columns=None, rows=None):
+        """Iterate over the shards that overlap a range of rows
+
+        Parameters
+        ----------
+        columns : list of strings, optional
+            Default is all per-galaxy columns
+
+        rows : slice or tuple (start, stop), optional
+            Contiguous range of rows. Default is all rows.
+
+        Yields
+        ------
+        row_offset : int
+            Row of the catalog of the first row yielded for the shard
+
+        galcat : dict
+            Memory-mapped views of the requested rows of the shard.
+            upid is converted to rows of the catalog, which is the only case
+            in which data is copied for a shard other than the first.
+
+        """
+        if columns is None:
+            columns = self.colnames
+        columns = [x for x in columns if x not in galcat_io.GALCAT_SHARED_KEYS]
+        start, stop = self._get_row_range(rows)
+
+        for ishard in range(len(self.shard_dirs)):
+            shard_lo, shard_hi = self.row_offsets[ishard : ishard + 2]
+            lo, hi = max(start, shard_lo), min(stop, shard_hi)
+            if lo >= hi:
+                continue
+            galcat = dict()
+            for colname in columns:
+                x = self._memmap(ishard, colname)[lo - shard_lo : hi - shard_lo]
+                if colname == "upid" and shard_lo > 0:
+                    x = np.where(x == -1, -1, x + shard_lo)
+                galcat[colname] = x
+            yield int(lo), galcat
+
+    def _get_row_range(self, rows):
+        n_rows = len(self)
+        if rows is None:
+            return 0, n_rows
+        if isinstance(rows, slice):
+            start, stop, step = rows.indices(n_rows)
+            if step != 1:
+                raise ValueError("rows must be a contiguous range")
+            return start, stop
+        start, stop = rows
+        return max(int(start), 0), min(int(stop), n_rows)
+
+    def _memmap(self, ishard, colname):
+        key = (ishard, colname)
+        if key not in self._memmaps:
+            if colname not in self.colnames:
+                raise KeyError("Column {0} is not in the mock".format(colname))
+            fn = os.path.join(self.shard_dirs[ishard], *colname.split("/")) + ".npy"
+            self._memmaps[key] = np.load(fn, mmap_mode="r")
+        return self._memmaps[key]
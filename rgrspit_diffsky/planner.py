@@ -0,0 +1,660 @@
+"""Predict the number of galaxies, the memory, and the runtime of the galaxy pipeline
+before running it, and choose chunks of hosts that fit a memory budget
+
+The number of satellites of each host is the integral of the conditional subhalo
+mass function above lgmp_min, so the size of the galaxy population follows from
+logmhost and lgmp_min without drawing any subhalos. Memory and runtime follow from
+the per-galaxy costs of each stage of mc_galpop_synthetic_subs, which are linear in
+the padded number of galaxies, and are calibrated with calibrate_stage_costs.
+
+Example usage
+-------------
+>>> plan = plan_galpop(logmhost, lgmp_min, mem_budget=16 * 1024**3, n_workers=4)  # doctest: +SKIP
+>>> plan.chunk_edges, plan.chunk_peak_mem, plan.runtime  # doctest: +SKIP
+
+"""
+
+import json
+from collections import namedtuple
+from functools import lru_cache
+
+import jax
+import numpy as np
+from diffsky.mass_functions.mc_subs import _compute_mean_subhalo_counts
+from dsps.cosmology.defaults import DEFAULT_COSMOLOGY
+from jax import random as jran
+from scipy.optimize import nnls
+
+from . import galcat_io, galcat_tables, mc_galpop
+from .fake_sats import phase_space_kernels as psk
+from .galcat_io import GALCAT_SHARED_KEYS
+from .precision import get_precision, get_precision_policy
+from .profiling import StageProfiler, get_rss
+
+# Cost of each stage of mc_galpop_synthetic_subs as a linear function of the
+# padded numbers of centrals and of satellites, which are drawn by different models
+# of diffmahpop and diffstarpop and so have different costs. Memory is the size of the
+# arguments, outputs, and temporary buffers of the compiled stage reported by XLA.
+StageCost = namedtuple(
+    "StageCost",
+    (
+        "bytes_per_cen",
+        "bytes_per_sat",
+        "bytes_const",
+        "secs_per_cen",
+        "secs_per_sat",
+        "secs_const",
+    ),
+)
+
+# Calibrated with calibrate_stage_costs on one core of an x86-64 CPU, jax 0.10.2
+DEFAULT_STAGE_COSTS = dict(
+    subhalo_counts=StageCost(179.0, 0.0, 1_400.0, 1.3e-6, 1.0e-7, 7.5e-4),
+    halo_keys=StageCost(0.0, 0.0, 0.0, 0.0, 6.5e-7, 8.3e-4),
+    subhalos=StageCost(8.0, 1_672.0, 160.0, 9.2e-7, 3.1e-6, 0.0),
+    diffmah=StageCost(0.0, 16_400.0, 2.99e6, 9.7e-6, 4.0e-5, 0.0),
+    mah=StageCost(160.0, 168.0, 144.0, 3.0e-7, 1.4e-7, 1.3e-5),
+    sfh=StageCost(2_896.0, 2_896.0, 2_936.0, 2.8e-4, 3.3e-4, 0.0),
+    mah_table=StageCost(456.0, 456.0, 808.0, 1.1e-7, 2.2e-7, 3.1e-4),
+    phase_space=StageCost(82.0, 206.0, 1.04e6, 6.8e-8, 5.5e-7, 4.4e-4),
+    valid_galaxies=StageCost(0.0, 0.0, 0.0, 3.1e-7, 2.9e-7, 0.0),
+)
+
+# Size and minimum host mass of the catalogs of calibrate_stage_costs
+CALIBRATION_CATALOGS = ((1_000, 11.0), (4_000, 11.0), (500, 12.0), (1_000, 12.0))
+
+DEFAULT_MEM_BUDGET = 4 * 1024**3  # bytes
+
+# Resident memory of a process that has imported and compiled the pipeline
+DEFAULT_PROCESS_BYTES = 1024**3
+
+# Size of the host_halo_id column added by run_mock
+HOST_HALO_ID_BYTES = 8
+
+# Upper bound on the Poisson fluctuation of the number of satellites
+DEFAULT_N_SIGMA = 3.0
+
+GalaxyCounts = namedtuple("GalaxyCounts", ("n_cens", "n_sats", "n_sats_std"))
+
+GalpopPlan = namedtuple(
+    "GalpopPlan",
+    (
+        "n_hosts",
+        "n_sats",
+        "n_sats_std",
+        "stage_mem",
+        "peak_mem",
+        "galcat_bytes",
+        "output_bytes",
+        "chunk_edges",
+        "chunk_peak_mem",
+        "runtime",
+    ),
+)
+GalpopPlan.__doc__ = """Prediction of plan_galpop
+
+n_hosts, n_sats, n_sats_std : number of hosts, and mean and standard deviation
+    of the number of satellites
+stage_mem : dict of the memory in bytes of each stage for all hosts at once
+peak_mem : peak memory in bytes of mc_galpop_synthetic_subs for all hosts at once
+galcat_bytes : memory in bytes of galcat for all hosts
+output_bytes : uncompressed size in bytes of the selected columns for all hosts
+chunk_edges : chunks of hosts that fit the memory budget of each worker
+chunk_peak_mem : largest peak memory in bytes of a chunk
+runtime : wall time in seconds with the chunks distributed over the workers
+"""
+
+
+def estimate_galaxy_counts(logmhost, lgmp_min):
+    """Expected number of centrals and satellites of a host halo catalog
+
+    Parameters
+    ----------
+    logmhost : ndarray, shape (n_hosts, )
+        log10 of halo mass in units of Msun
+
+    lgmp_min : float
+        log10 of halo mass cutoff in Msun
+
+    Returns
+    -------
+    counts : GalaxyCounts
+        n_cens is the number of hosts, and n_sats and n_sats_std are the mean and
+        standard deviation of the number of satellites, which is Poisson-distributed
+
+    """
+    mean_n_sats = _get_mean_n_sats(logmhost, lgmp_min)
+    n_sats = float(np.sum(mean_n_sats))
+    return GalaxyCounts(int(mean_n_sats.size), n_sats, float(np.sqrt(n_sats)))
+
+
+def estimate_stage_memory(
+    n_cens,
+    n_sats,
+    store_tables=True,
+    halo_ids=True,
+    padded=True,
+    stage_costs=DEFAULT_STAGE_COSTS,
+    precision=None,
+):
+    """Memory in bytes of each stage of mc_galpop_synthetic_subs
+
+    Parameters
+    ----------
+    n_cens, n_sats : int
+        Number of centrals and satellites
+
+    store_tables : bool, optional
+        Whether galcat stores log_mah_table and sfh_table. Default is True.
+
+    halo_ids : bool, optional
+        Whether halo_ids is passed to mc_galpop_synthetic_subs. Default is True.
+
+    padded : bool, optional
+        Whether arrays are padded to capacity buckets. Default is True.
+
+    stage_costs : dict, optional
+        StageCost of each stage. Default is DEFAULT_STAGE_COSTS.
+
+    precision : string, optional
+        One of precision.PRECISIONS. Stage costs are calibrated in double
+        precision, and are scaled by the itemsize of the compute dtype.
+        Default is None, in which case precision.get_precision() is used.
+
+    Returns
+    -------
+    stage_mem : dict
+        Bytes of each stage that is evaluated
+
+    """
+    n_cens, n_sats = _get_n_padded(n_cens, n_sats, padded)
+    scale = _get_policy(precision).compute_dtype.itemsize / 8
+    return {
+        stage: scale
+        * (
+            stage_costs[stage].bytes_per_cen * n_cens
+            + stage_costs[stage].bytes_per_sat * n_sats
+            + stage_costs[stage].bytes_const
+        )
+        for stage in _get_stages(store_tables, halo_ids, stage_costs)
+    }
+
+
+def estimate_stage_runtime(
+    n_cens,
+    n_sats,
+    store_tables=True,
+    halo_ids=True,
+    padded=True,
+    stage_costs=DEFAULT_STAGE_COSTS,
+):
+    """Wall time in seconds of each stage of mc_galpop_synthetic_subs,
+    excluding compilation
+
+    Parameters are the same as estimate_stage_memory
+
+    Returns
+    -------
+    stage_runtime : dict
+        Seconds of each stage that is evaluated
+
+    """
+    n_cens, n_sats = _get_n_padded(n_cens, n_sats, padded)
+    return {
+        stage: (
+            stage_costs[stage].secs_per_cen * n_cens
+            + stage_costs[stage].secs_per_sat * n_sats
+            + stage_costs[stage].secs_const
+        )
+        for stage in _get_stages(store_tables, halo_ids, stage_costs)
+    }
+
+
+def estimate_peak_memory(
+    n_cens,
+    n_sats,
+    store_tables=True,
+    halo_ids=True,
+    padded=True,
+    stage_costs=DEFAULT_STAGE_COSTS,
+    precision=None,
+):
+    """Peak memory in bytes of mc_galpop_synthetic_subs
+
+    The peak is the memory of the most expensive stage plus the memory of galcat,
+    which bounds the memory of the outputs of the stages that are alive at once.
+    With padding, galcat is held both with and without the padded galaxies.
+    Parameters are the same as estimate_stage_memory.
+
+    """
+    stage_mem = estimate_stage_memory(
+        n_cens, n_sats, store_tables, halo_ids, padded, stage_costs, precision
+    )
+    n_gals = n_cens + n_sats
+    if padded:
+        n_gals = n_gals + sum(_get_n_padded(n_cens, n_sats, padded))
+    galcat_bytes_per_gal = sum(
+        get_galcat_column_bytes(store_tables, precision).values()
+    )
+    return max(stage_mem.values()) + n_gals * galcat_bytes_per_gal
+
+
+def get_galcat_column_bytes(store_tables=True, precision=None):
+    """Bytes per galaxy of each column of galcat
+
+    Parameters
+    ----------
+    store_tables : bool, optional
+        Whether galcat stores log_mah_table and sfh_table. Default is True.
+
+    precision : string, optional
+        One of precision.PRECISIONS, whose output dtype sets the itemsize of
+        floating-point columns. Default is None, in which case
+        precision.get_precision() is used.
+
+    Returns
+    -------
+    column_bytes : dict
+        Keys are the names of the columns of galcat_io.flatten_galcat
+
+    """
+    itemsize = _get_policy(precision).output_dtype.itemsize
+    return dict(_get_galcat_column_bytes(bool(store_tables), itemsize))
+
+
+def get_output_bytes_per_galaxy(
+    store_tables=True, columns=None, exclude=None, precision=None
+):
+    """Bytes per galaxy of the columns written by run_mock
+
+    Columns are those of galcat plus host_halo_id, selected with columns and exclude
+    as in galcat_io.select_columns
+
+    """
+    column_bytes = get_galcat_column_bytes(store_tables, precision)
+    column_bytes["host_halo_id"] = HOST_HALO_ID_BYTES
+    selected = galcat_io.select_columns(list(column_bytes), columns, exclude)
+    return sum(column_bytes[colname] for colname in selected)
+
+
+def get_planned_chunk_edges(
+    logmhost,
+    lgmp_min,
+    mem_budget=DEFAULT_MEM_BUDGET,
+    store_tables=True,
+    halo_ids=True,
+    n_sigma=DEFAULT_N_SIGMA,
+    stage_costs=DEFAULT_STAGE_COSTS,
+    precision=None,
+):
+    """Partition a host halo catalog into the fewest contiguous chunks whose
+    predicted peak memory fits a budget
+
+    Parameters
+    ----------
+    logmhost : ndarray, shape (n_hosts, )
+
+    lgmp_min : float
+
+    mem_budget : int, optional
+        Peak memory in bytes of each call to mc_galpop_synthetic_subs
+
+    store_tables, halo_ids, stage_costs, precision : optional
+        See estimate_stage_memory
+
+    n_sigma : float, optional
+        The number of satellites of each chunk is taken to exceed its mean by
+        n_sigma standard deviations. Default is DEFAULT_N_SIGMA.
+
+    Returns
+    -------
+    chunk_edges : ndarray, shape (n_chunks+1, )
+        Hosts in chunk i are logmhost[chunk_edges[i]:chunk_edges[i+1]],
+        which can be passed to mc_galpop_chunks.mc_galpop_synthetic_subs_chunked
+
+    Notes
+    -----
+    Chunks are padded to capacity buckets by mc_galpop_synthetic_subs_chunked,
+    so that the peak memory of a chunk increases in steps with its number of hosts.
+    Each chunk is extended by bisection to the last host for which the predicted
+    peak memory of the padded chunk fits mem_budget. A chunk has at least one host,
+    even if that host alone exceeds mem_budget.
+
+    """
+    mean_n_sats = _get_mean_n_sats(logmhost, lgmp_min)
+    cumsum_n_sats = np.concatenate(([0.0], np.cumsum(mean_n_sats)))
+    n_hosts = mean_n_sats.size
+
+    def _fits(indx_lo, indx_hi):
+        n_sats = cumsum_n_sats[indx_hi] - cumsum_n_sats[indx_lo]
+        n_sats = int(np.ceil(n_sats + n_sigma * np.sqrt(n_sats)))
+        peak_mem = estimate_peak_memory(
+            indx_hi - indx_lo,
+            n_sats,
+            store_tables,
+            halo_ids,
+            True,
+            stage_costs,
+            precision,
+        )
+        return peak_mem <= mem_budget
+
+    chunk_edges = [0]
+    while chunk_edges[-1] < n_hosts:
+        indx_lo = chunk_edges[-1]
+        lo, hi = indx_lo + 1, n_hosts
+        if _fits(indx_lo, hi):
+            lo = hi
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if _fits(indx_lo, mid):
+                lo = mid
+            else:
+                hi = mid - 1
+        chunk_edges.append(lo)
+    return np.array(chunk_edges)
+
+
+def plan_galpop(
+    logmhost,
+    lgmp_min,
+    mem_budget=DEFAULT_MEM_BUDGET,
+    n_workers=1,
+    columns=None,
+    exclude=None,
+    halo_ids=True,
+    n_sigma=DEFAULT_N_SIGMA,
+    stage_costs=DEFAULT_STAGE_COSTS,
+    process_bytes=DEFAULT_PROCESS_BYTES,
+    precision=None,
+):
+    """Predict the galaxies, memory, and runtime of populating a host halo catalog,
+    and choose chunks of hosts that fit a memory budget
+
+    Parameters
+    ----------
+    logmhost : ndarray, shape (n_hosts, )
+        log10 of halo mass in units of Msun
+
+    lgmp_min : float
+        log10 of halo mass cutoff in Msun
+
+    mem_budget : int, optional
+        Total memory in bytes available to the workers. Default is DEFAULT_MEM_BUDGET.
+
+    n_workers : int, optional
+        Number of worker processes, each using mem_budget/n_workers bytes,
+        of which process_bytes are taken by the process itself. Default is 1.
+
+    columns, exclude : list of strings, optional
+        Columns written to disk, see galcat_io.select_columns.
+        Tables of MAH and SFH are only computed when selected, as in run_mock.
+
+    halo_ids : bool, optional
+        Whether halo_ids is passed to mc_galpop_synthetic_subs. Default is True.
+
+    n_sigma : float, optional
+        See get_planned_chunk_edges
+
+    stage_costs : dict, optional
+        StageCost of each stage, e.g., from calibrate_stage_costs
+
+    process_bytes : int, optional
+        Resident memory of each worker process outside of the pipeline
+
+    precision : string, optional
+        Precision of the workers, see estimate_stage_memory
+
+    Returns
+    -------
+    plan : GalpopPlan
+
+    """
+    logmhost = np.atleast_1d(logmhost)
+    chunk_budget = mem_budget / n_workers - process_bytes
+    if chunk_budget <= 0:
+        msg = "mem_budget/n_workers = {0:.2f} GB leaves no memory for galaxies"
+        raise ValueError(msg.format(mem_budget / n_workers / 1024**3))
+
+    store_tables = galcat_tables.is_table_selected(columns, exclude)
+    counts = estimate_galaxy_counts(logmhost, lgmp_min)
+    n_sats = int(np.ceil(counts.n_sats))
+    args = (store_tables, halo_ids, True, stage_costs, precision)
+    stage_mem = estimate_stage_memory(counts.n_cens, n_sats, *args)
+    peak_mem = estimate_peak_memory(counts.n_cens, n_sats, *args)
+    n_gals = counts.n_cens + n_sats
+    column_bytes = get_galcat_column_bytes(store_tables, precision)
+    galcat_bytes = n_gals * sum(column_bytes.values())
+    output_bytes = n_gals * get_output_bytes_per_galaxy(
+        store_tables, columns, exclude, precision
+    )
+
+    chunk_edges = get_planned_chunk_edges(
+        logmhost,
+        lgmp_min,
+        chunk_budget,
+        store_tables,
+        halo_ids,
+        n_sigma,
+        stage_costs,
+        precision,
+    )
+    mean_n_sats = _get_mean_n_sats(logmhost, lgmp_min)
+    chunk_peak_mems, chunk_runtimes = [], []
+    for indx_lo, indx_hi in zip(chunk_edges[:-1], chunk_edges[1:]):
+        chunk_n_sats = int(np.ceil(np.sum(mean_n_sats[indx_lo:indx_hi])))
+        chunk_args = (indx_hi - indx_lo, chunk_n_sats, store_tables, halo_ids, True)
+        chunk_peak_mems.append(
+            estimate_peak_memory(*chunk_args, stage_costs, precision)
+        )
+        stage_runtime = estimate_stage_runtime(*chunk_args, stage_costs)
+        chunk_runtimes.append(sum(stage_runtime.values()))
+    runtime = max(sum(chunk_runtimes) / n_workers, max(chunk_runtimes))
+
+    return GalpopPlan(
+        counts.n_cens,
+        counts.n_sats,
+        counts.n_sats_std,
+        stage_mem,
+        peak_mem,
+        galcat_bytes,
+        output_bytes,
+        chunk_edges,
+        max(chunk_peak_mems),
+        runtime,
+    )
+
+
+def calibrate_stage_costs(
+    calibration_catalogs=CALIBRATION_CATALOGS, lgmp_min=11.0, z_obs=0.5, seed=0
+):
+    """Measure the memory and runtime of each stage of mc_galpop_synthetic_subs
+
+    Parameters
+    ----------
+    calibration_catalogs : sequence of (n_halos, host_lgmp_min), optional
+        Size and minimum host mass of the synthetic host catalogs of the
+        calibration, drawn with data_loaders.load_fake_abacus.mc_fake_abacus_halos.
+        The padded numbers of centrals and of satellites of the catalogs should
+        not be proportional to one another. Default is CALIBRATION_CATALOGS.
+
+    lgmp_min, z_obs : float, optional
+
+    seed : int, optional
+
+    Returns
+    -------
+    stage_costs : dict
+        StageCost of each stage, fit by non-negative least squares to the memory
+        reported by XLA for the compiled stage, and to the wall time of a second
+        evaluation, which excludes compilation
+
+    """
+    from .data_loaders.load_abacus import get_mc_galpop_inputs
+    from .data_loaders.load_fake_abacus import mc_fake_abacus_halos
+
+    n_pads, stage_mems, stage_times = [], [], []
+    for n_halos, host_lgmp_min in calibration_catalogs:
+        halos = mc_fake_abacus_halos(
+            n_halos, seed=seed, lgmp_min=host_lgmp_min, redshift=z_obs
+        )
+        inputs = get_mc_galpop_inputs(halos)
+        args = (
+            jran.key(seed),
+            inputs["logmhost"],
+            inputs["halo_radius"],
+            inputs["halo_pos"],
+            inputs["halo_vel"],
+            z_obs,
+            lgmp_min,
+            inputs["cosmo_params"],
+            inputs["Lbox"],
+        )
+        kwargs = dict(
+            halo_ids=inputs["halo_ids"],
+            concentration=inputs["concentration"],
+            padded=True,
+        )
+        profiler = _XlaMemoryProfiler()
+        galcat = mc_galpop.mc_galpop_synthetic_subs(*args, profiler=profiler, **kwargs)
+        profiler = _XlaMemoryProfiler()
+        mc_galpop.mc_galpop_synthetic_subs(*args, profiler=profiler, **kwargs)
+
+        n_cens = inputs["logmhost"].size
+        n_sats = galcat["upid"].size - n_cens
+        n_pads.append(_get_n_padded(n_cens, n_sats, True))
+        stage_mems.append(profiler.stage_mem)
+        stage_times.append({k: v.wall_time for k, v in profiler.summary().items()})
+
+    stage_costs = dict()
+    for stage in stage_times[0]:
+        mems = [x.get(stage, 0) for x in stage_mems]
+        times = [x[stage] for x in stage_times]
+        stage_costs[stage] = StageCost(
+            *_fit_linear_cost(n_pads, mems), *_fit_linear_cost(n_pads, times)
+        )
+    return stage_costs
+
+
+def get_process_bytes():
+    """Resident memory in bytes of the current process, e.g., after calibration,
+    or DEFAULT_PROCESS_BYTES where unavailable"""
+    rss = get_rss()
+    return DEFAULT_PROCESS_BYTES if rss is None else rss
+
+
+def save_stage_costs(fname, stage_costs):
+    """Write stage costs in JSON format"""
+    with open(fname, "w") as f:
+        json.dump({key: val._asdict() for key, val in stage_costs.items()}, f, indent=1)
+
+
+def load_stage_costs(fname):
+    """Load stage costs written by save_stage_costs"""
+    with open(fname, "r") as f:
+        return {key: StageCost(**val) for key, val in json.load(f).items()}
+
+
+class _XlaMemoryProfiler(StageProfiler):
+    """StageProfiler that also records the memory of each jitted stage reported
+    by XLA, as the size of its arguments, outputs, and temporary buffers"""
+
+    def __init__(self):
+        super().__init__()
+        self.stage_mem = dict()
+
+    def run(self, stage, func, *args, **kwargs):
+        if hasattr(func, "lower"):
+            mem = func.lower(*args, **kwargs).compile().memory_analysis()
+            self.stage_mem[stage] = (
+                mem.argument_size_in_bytes
+                + mem.output_size_in_bytes
+                + mem.temp_size_in_bytes
+            )
+        return super().run(stage, func, *args, **kwargs)
+
+
+def _fit_linear_cost(n_pads, y):
+    """Non-negative coefficients of y = c_cens*n_cens + c_sats*n_sats + c_const"""
+    n_pads, y = np.asarray(n_pads, dtype=float), np.asarray(y, dtype=float)
+    design = np.concatenate((n_pads, np.ones((y.size, 1))), axis=1)
+    scale = np.max(design, axis=0)
+    coeffs = nnls(design / scale, y)[0] / scale
+    return tuple(float(x) for x in coeffs)
+
+
+def _get_mean_n_sats(logmhost, lgmp_min):
+    logmhost = np.atleast_1d(logmhost)
+    return np.asarray(_compute_mean_subhalo_counts(logmhost, lgmp_min), dtype=float)
+
+
+def _get_n_padded(n_cens, n_sats, padded):
+    if not padded:
+        return n_cens, n_sats
+    n_cens_pad = mc_galpop.get_capacity_bucket(n_cens)
+    n_sats_pad = mc_galpop.get_capacity_bucket(n_sats)
+    return n_cens_pad, n_sats_pad
+
+
+def _get_stages(store_tables, halo_ids, stage_costs):
+    stages = list(stage_costs)
+    if not halo_ids:
+        stages.remove("halo_keys")
+    if not store_tables:
+        stages.remove("mah_table")
+    return stages
+
+
+def _get_policy(precision):
+    if precision is None:
+        precision = get_precision()
+    return get_precision_policy(precision)
+
+
+@lru_cache()
+def _get_galcat_column_bytes(store_tables, float_itemsize=8):
+    """Bytes per galaxy of each column, from the shapes of the outputs of the
+    galpop kernel evaluated with jax.eval_shape for two centrals and two satellites,
+    with float_itemsize bytes per floating-point value"""
+    n_cens, n_sats = 2, 2
+    logmhost = np.zeros(n_cens) + 12.0
+    galpop_keys = mc_galpop.GalpopKeys(*jran.split(jran.key(0), 7))
+    args = (
+        galpop_keys,
+        logmhost,
+        np.zeros(n_sats, dtype=int),
+        np.ones(n_cens),
+        np.ones(n_cens),
+        np.zeros((n_cens, 3)),
+        np.zeros((n_cens, 3)),
+        11.0,
+        0.5,
+        DEFAULT_COSMOLOGY,
+        1_000.0,
+        mc_galpop.DEFAULT_DIFFMAHPOP_PARAMS,
+        psk.get_qnfw_table(),
+        mc_galpop.DEFAULT_DIFFSTARPOP_PARAMS,
+    )
+    galcat = jax.eval_shape(
+        lambda *x: mc_galpop._mc_galpop_kern(*x, store_tables=store_tables), *args
+    )
+    galcat = {k: v for k, v in galcat.items() if k not in GALCAT_SHARED_KEYS}
+    column_bytes = dict()
+    for key, val in _flatten_shapes(galcat).items():
+        itemsize = val.dtype.itemsize
+        if np.issubdtype(val.dtype, np.floating):
+            itemsize = float_itemsize
+        column_bytes[key] = itemsize * int(np.prod(val.shape[1:]))
+    return tuple(column_bytes.items())
+
+
+def _flatten_shapes(galcat):
+    """Same as galcat_io.flatten_galcat for the output of jax.eval_shape"""
+    columns = dict()
+    for key, val in galcat.items():
+        if hasattr(val, "_fields"):
+            for colname, x in _flatten_shapes(val._asdict()).items():
+                columns[key + "/" + colname] = x
+        else:
+            columns[key] = val
+    return columns
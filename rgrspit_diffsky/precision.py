@@ -0,0 +1,165 @@
+"""Precision policies of the galaxy pipeline
+
+The precision of mc_galpop_synthetic_subs sets the floating-point dtype of
+its calculations and of the arrays of galcat:
+
+- "float64": computed and stored in double precision (the default)
+- "mixed": computed in double precision, and stored in single precision
+- "float32": computed and stored in single precision
+
+Whatever the precision, the table of the inverse NFW CDF, which requires
+the Lambert W function, and the cumulative integral of the star formation
+history that gives logsm_t_obs are always computed in double precision.
+
+Since JAX sets the precision of a process with the jax_enable_x64 flag, and since
+the models of the pipeline enable it on import, "float32" requires the process
+to call set_precision("float32") after importing the pipeline and before
+compiling any kernel, e.g., at the start of a script or in the initializer
+of a worker process. The other precisions are available in any process with
+jax_enable_x64. Switching precision back and forth within a process
+is not supported, since JAX reuses constants traced at the previous precision.
+
+Example usage
+-------------
+>>> set_precision("float32")  # doctest: +SKIP
+>>> galcat = mc_galpop_synthetic_subs(*args, precision="float32")  # doctest: +SKIP
+
+Notes
+-----
+With "mixed", galcat is the same realization as with "float64", rounded to
+single precision: positions differ by at most 6e-8*Lbox, and logsm_t_obs by
+less than 1e-6 dex. galcat takes half the memory, but the peak memory of the
+calculation is that of "float64".
+
+With "float32", uniform and normal draws differ from those of double precision
+for the same keys, so that galcat is a different realization with the same
+statistics, while the numbers of subhalos of each host are the same.
+For the same diffmah and diffstar parameters, logsm_t_obs differs from its
+double-precision value by less than 1e-4 dex, and positions are stored to
+within 6e-8*Lbox. The memory of the calculation is about half that of "float64",
+e.g., 1.0 GB rather than 2.1 GB for 130,000 galaxies, on top of the memory
+of the process itself.
+
+"""
+
+from collections import namedtuple
+
+import jax
+import numpy as np
+from jax import numpy as jnp
+from jax import tree_util
+
+PRECISIONS = ("float64", "mixed", "float32")
+DEFAULT_PRECISION = "float64"
+
+PrecisionPolicy = namedtuple("PrecisionPolicy", ("compute_dtype", "output_dtype"))
+
+PRECISION_POLICIES = dict(
+    float64=PrecisionPolicy(np.dtype(np.float64), np.dtype(np.float64)),
+    mixed=PrecisionPolicy(np.dtype(np.float64), np.dtype(np.float32)),
+    float32=PrecisionPolicy(np.dtype(np.float32), np.dtype(np.float32)),
+)
+
+
+def get_precision_policy(precision=DEFAULT_PRECISION):
+    """Dtypes of the calculations and of the outputs of a precision
+
+    Parameters
+    ----------
+    precision : string, optional
+        One of PRECISIONS. Default is DEFAULT_PRECISION.
+
+    Returns
+    -------
+    policy : PrecisionPolicy
+        Fields are compute_dtype and output_dtype
+
+    """
+    if precision not in PRECISION_POLICIES:
+        msg = "precision = {0} must be one of {1}"
+        raise ValueError(msg.format(precision, PRECISIONS))
+    return PRECISION_POLICIES[precision]
+
+
+def set_precision(precision=DEFAULT_PRECISION):
+    """Set the precision of the JAX kernels of the process
+
+    Parameters
+    ----------
+    precision : string, optional
+        One of PRECISIONS. Default is DEFAULT_PRECISION.
+        "float32" disables jax_enable_x64, and the other precisions enable it.
+
+    Notes
+    -----
+    Call set_precision after importing the pipeline, since its models
+    enable jax_enable_x64 on import, and before compiling any kernel.
+
+    """
+    policy = get_precision_policy(precision)
+    jax.config.update("jax_enable_x64", policy.compute_dtype == np.float64)
+
+
+def get_precision():
+    """Default precision of the process, "float64" unless set_precision("float32")
+    disabled jax_enable_x64"""
+    return "float64" if jax.config.jax_enable_x64 else "float32"
+
+
+def check_precision(precision=None):
+    """Check that precision is available in the process
+
+    Parameters
+    ----------
+    precision : string, optional
+        One of PRECISIONS. Default is None, in which case get_precision() is used.
+
+    Returns
+    -------
+    precision : string
+
+    Raises
+    ------
+    ValueError
+        If precision is not one of PRECISIONS, or if the precision of its
+        calculations differs from the precision of the process
+
+    """
+    if precision is None:
+        return get_precision()
+    policy = get_precision_policy(precision)
+    if (policy.compute_dtype == np.float64) != jax.config.jax_enable_x64:
+        msg = (
+            "precision = {0} is not available in a process with "
+            "jax_enable_x64 = {1}. Call precision.set_precision({0!r}) "
+            "before compiling any kernel."
+        )
+        raise ValueError(msg.format(precision, jax.config.jax_enable_x64))
+    return precision
+
+
+def cast_floats(tree, dtype):
+    """Cast the floating-point arrays of a pytree to dtype
+
+    Parameters
+    ----------
+    tree : pytree
+        e.g., galcat or a namedtuple of parameters. Leaves that are not
+        floating-point arrays, such as integers, random keys, and Python scalars,
+        are returned unchanged.
+
+    dtype : dtype
+
+    Returns
+    -------
+    tree : pytree
+
+    """
+
+    def _cast(x):
+        if isinstance(x, (np.ndarray, np.floating, jax.Array)):
+            if jnp.issubdtype(x.dtype, jnp.floating) and x.dtype != dtype:
+                return x.astype(dtype)
+        return x
+
+    return tree_util.tree_map(_cast, tree)
@@ -0,0 +1,316 @@
+"""Opt-in timing and memory instrumentation of the stages of the galaxy pipeline
+
+Passing a StageProfiler as the profiler argument of mc_galpop_synthetic_subs
+evaluates each stage of the pipeline as a separately jitted kernel, and records
+its wall time, compile time, and peak resident memory. Records are kept by the
+profiler and passed to an optional sink, e.g., JsonLinesSink or LoggingSink.
+Without a profiler, the stages are fused into a single kernel as usual.
+
+Example usage
+-------------
+>>> profiler = StageProfiler(sink=JsonLinesSink("profile.jsonl"))  # doctest: +SKIP
+>>> galcat = mc_galpop_synthetic_subs(*args, profiler=profiler)  # doctest: +SKIP
+>>> profiler.summary()["sfh"].wall_time  # doctest: +SKIP
+
+"""
+
+import json
+import logging
+import os
+import resource
+import sys
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+import jax
+from jax import monitoring
+
+_BACKEND_COMPILE_EVENT = "/jax/core/compile/backend_compile_duration"
+_CACHE_HIT_EVENT = "/jax/compilation_cache/cache_hits"
+_CACHE_MISS_EVENT = "/jax/compilation_cache/cache_misses"
+_COMPILE_TIME_SAVED_EVENT = "/jax/compilation_cache/compile_time_saved_sec"
+
+_PROC_STATUS = "/proc/self/status"
+_PROC_CLEAR_REFS = "/proc/self/clear_refs"
+
+CompileStats = namedtuple(
+    "CompileStats",
+    (
+        "wall_time",
+        "compile_time",
+        "n_compiles",
+        "n_cache_hits",
+        "n_cache_misses",
+        "compile_time_saved",
+    ),
+)
+
+StageStats = namedtuple(
+    "StageStats",
+    (
+        "stage",
+        "wall_time",
+        "compile_time",
+        "execute_time",
+        "n_compiles",
+        "peak_rss",
+        "tags",
+    ),
+)
+
+
+@contextmanager
+def track_compilation():
+    """Context manager that counts compilations and persistent cache hits
+
+    Yields
+    ------
+    stats : dict
+        Keys are the fields of CompileStats. Values are updated as compilations
+        occur inside the context, and wall_time is set on exit.
+        compile_time is the total time spent in the compiler backend,
+        including the time to read executables from the persistent cache.
+
+    """
+    stats = {key: 0 for key in CompileStats._fields}
+    stats["wall_time"] = 0.0
+    stats["compile_time"] = 0.0
+    stats["compile_time_saved"] = 0.0
+
+    def _event_listener(event, **kwargs):
+        if event == _CACHE_HIT_EVENT:
+            stats["n_cache_hits"] += 1
+        elif event == _CACHE_MISS_EVENT:
+            stats["n_cache_misses"] += 1
+
+    def _duration_listener(event, duration, **kwargs):
+        if event == _BACKEND_COMPILE_EVENT:
+            stats["n_compiles"] += 1
+            stats["compile_time"] += duration
+        elif event == _COMPILE_TIME_SAVED_EVENT:
+            stats["compile_time_saved"] += duration
+
+    monitoring.register_event_listener(_event_listener)
+    monitoring.register_event_duration_secs_listener(_duration_listener)
+    start = time.time()
+    try:
+        yield stats
+    finally:
+        stats["wall_time"] = time.time() - start
+        monitoring.unregister_event_listener(_event_listener)
+        monitoring.unregister_event_duration_listener(_duration_listener)
+
+
+class StageProfiler:
+    """Record the wall time, compile time, and peak memory of pipeline stages
+
+    Parameters
+    ----------
+    sink : callable, optional
+        Called with the StageStats of each stage as soon as it completes,
+        e.g., JsonLinesSink or LoggingSink. Default is None.
+
+    tags : dict, optional
+        Stored in the tags field of every record, e.g., the slab or chunk
+        being processed. Values should be serializable to JSON.
+
+    Attributes
+    ----------
+    records : list of StageStats
+        Records of every stage run by the profiler, in order of completion.
+        Profilers returned by the tagged method share the same list.
+
+    Notes
+    -----
+    Each stage is timed from its call until its outputs are ready,
+    using jax.block_until_ready, so that asynchronous dispatch is accounted for.
+    compile_time is the time spent in the XLA backend compiler during the stage,
+    and execute_time is the remainder of wall_time, which includes tracing.
+
+    peak_rss is the peak resident memory of the process in bytes during the stage.
+    On Linux, the peak is reset at the start of each stage. Elsewhere, it is the
+    peak since the start of the process, which bounds the peak of the stage.
+
+    """
+
+    def __init__(self, sink=None, tags=None):
+        self.sink = sink
+        self.tags = dict() if tags is None else dict(tags)
+        self.records = []
+
+    def tagged(self, **tags):
+        """Profiler sharing the sink and the records of self, with additional tags"""
+        profiler = StageProfiler(sink=self.sink, tags={**self.tags, **tags})
+        profiler.records = self.records
+        return profiler
+
+    def run(self, stage, func, *args, **kwargs):
+        """Evaluate func(*args, **kwargs) and record the stats of the evaluation
+
+        Parameters
+        ----------
+        stage : string
+            Name of the stage
+
+        func : callable
+
+        Returns
+        -------
+        res : object
+            Output of func, after all its arrays are ready
+
+        """
+        _reset_peak_rss()
+        with track_compilation() as compile_stats:
+            start = time.perf_counter()
+            res = jax.block_until_ready(func(*args, **kwargs))
+            wall_time = time.perf_counter() - start
+        compile_time = compile_stats["compile_time"]
+        stats = StageStats(
+            stage,
+            wall_time,
+            compile_time,
+            max(wall_time - compile_time, 0.0),
+            compile_stats["n_compiles"],
+            get_peak_rss(),
+            self.tags,
+        )
+        self.records.append(stats)
+        if self.sink is not None:
+            self.sink(stats)
+        return res
+
+    def summary(self):
+        """Aggregate the records of each stage
+
+        Returns
+        -------
+        summary : dict
+            Keys are stage names in order of first appearance, and values are
+            StageStats with the total times and number of compilations of the stage,
+            the maximum peak_rss, and tags storing the number of calls as n_calls
+
+        """
+        summary = dict()
+        for stats in self.records:
+            if stats.stage in summary:
+                prev = summary[stats.stage]
+                stats = StageStats(
+                    stats.stage,
+                    prev.wall_time + stats.wall_time,
+                    prev.compile_time + stats.compile_time,
+                    prev.execute_time + stats.execute_time,
+                    prev.n_compiles + stats.n_compiles,
+                    max(prev.peak_rss, stats.peak_rss),
+                    dict(n_calls=prev.tags["n_calls"] + 1),
+                )
+            else:
+                stats = stats._replace(tags=dict(n_calls=1))
+            summary[stats.stage] = stats
+        return summary
+
+
+def run_stage(profiler, stage, func, *args, **kwargs):
+    """Evaluate func(*args, **kwargs), recorded by profiler unless it is None"""
+    if profiler is None:
+        return func(*args, **kwargs)
+    return profiler.run(stage, func, *args, **kwargs)
+
+
+class JsonLinesSink:
+    """Append each StageStats to a file as one JSON object per line
+
+    Parameters
+    ----------
+    fname : string
+        The file is opened in append mode for each record, so that
+        several processes can write to the same file.
+
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+
+    def __call__(self, stats):
+        line = json.dumps(dict(stats._asdict(), time=time.time(), pid=os.getpid()))
+        with open(self.fname, "a") as f:
+            f.write(line + "\n")
+
+
+class LoggingSink:
+    """Log each StageStats with the logging module
+
+    Parameters
+    ----------
+    logger : logging.Logger, optional
+        Default is the logger of this module
+
+    level : int, optional
+        Default is logging.INFO
+
+    """
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logging.getLogger(__name__) if logger is None else logger
+        self.level = level
+
+    def __call__(self, stats):
+        msg = "%s: wall_time=%.3fs compile_time=%.3fs peak_rss=%.1fMB %s"
+        self.logger.log(
+            self.level,
+            msg,
+            stats.stage,
+            stats.wall_time,
+            stats.compile_time,
+            stats.peak_rss / 1024**2,
+            stats.tags,
+        )
+
+
+def load_profile(fname):
+    """Load the records written by JsonLinesSink
+
+    Returns
+    -------
+    records : list of dicts
+
+    """
+    with open(fname, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def get_peak_rss():
+    """Peak resident memory of the process in bytes"""
+    try:
+        with open(_PROC_STATUS, "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def get_rss():
+    """Current resident memory of the process in bytes, or None if unavailable"""
+    try:
+        with open(_PROC_STATUS, "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    """Reset the peak resident memory of the process where supported"""
+    try:
+        with open(_PROC_CLEAR_REFS, "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
@@ -0,0 +1,508 @@
+"""Generate a galaxy mock for an AbacusSummit halo catalog, one output shard per slab
+
+Example usage
+-------------
+rgrspit-mock /path/to/AbacusSummit_base_c000_ph000/halos/z1.100 outdir --n_workers 16
+
+Each CompaSO slab file halo_info_XXX.asdf is populated by a worker process
+and written to outdir/galcat_XXX.h5. The file outdir/manifest.json lists
+the shards that are complete. Rerunning the same command skips the slabs
+whose shard is already complete, so an interrupted run can be restarted.
+
+"""
+
+import argparse
+import json
+import os
+from concurrent.futures import as_completed
+from time import time
+
+import numpy as np
+from jax import random as jran
+
+from . import galcat_io, galcat_tables, planner
+from .compilation_cache import enable_compilation_cache
+from .data_loaders import load_abacus
+from .data_loaders.prefetch import iter_mc_galpop_inputs
+from .galcat_io import SHARD_SUFFIXES
+from .mc_galpop_chunks import DEFAULT_MEM_BUDGET, mc_galpop_synthetic_subs_chunked
+from .mc_galpop_sharded import get_executor
+from .precision import (
+    DEFAULT_PRECISION,
+    PRECISIONS,
+    check_precision,
+    get_precision,
+    set_precision,
+)
+from .profiling import JsonLinesSink, StageProfiler
+
+MANIFEST_BASENAME = "manifest.json"
+PROFILE_BASENAME = "profile.jsonl"
+DEFAULT_LGMP_MIN = 11.0
+
+# Settings of a run that must be the same when the run is restarted
+_RUN_CONFIG_KEYS = ("halocat_dir", "seed", "lgmp_min", "precision")
+
+
+def get_shard_fname(output_dir, slab_fname, fmt="hdf5"):
+    """Path of the output shard of a CompaSO slab file, e.g., halo_info_003.asdf is
+    populated into output_dir/galcat_003.h5"""
+    slab_id = os.path.basename(slab_fname).replace(".asdf", "").split("_")[-1]
+    basename = "galcat_{0}{1}".format(slab_id, SHARD_SUFFIXES[fmt])
+    return os.path.join(output_dir, basename)
+
+
+def run_slab(
+    slab_fname,
+    shard_fname,
+    seed,
+    lgmp_min=DEFAULT_LGMP_MIN,
+    mem_budget=DEFAULT_MEM_BUDGET,
+    load_halos=load_abacus.load_abacus_halo_catalog,
+    profiler=None,
+    precision=None,
+    **write_kwargs,
+):
+    """Populate a single slab with galaxies and write the output shard
+
+    Parameters
+    ----------
+    slab_fname : string
+        Path to a CompaSO halo_info_XXX.asdf file
+
+    shard_fname : string
+        Path to the output HDF5 file
+
+    seed : int
+        Seed of the random key. Monte Carlo draws are keyed on the Abacus halo id,
+        so that galaxies do not depend on how halos are split into slabs.
+
+    lgmp_min : float, optional
+        log10 of subhalo mass cutoff in Msun
+
+    mem_budget : int, optional
+        Target peak memory in bytes of each chunk of hosts,
+        see planner.get_planned_chunk_edges
+
+    load_halos : callable, optional
+        Function that returns the halo catalog of slab_fname with the columns
+        of load_abacus.load_abacus_halo_catalog
+
+    profiler : profiling.StageProfiler, optional
+        Records the stages of the pipeline, see populate_slab
+
+    precision : string, optional
+        Passed to mc_galpop_synthetic_subs, see populate_slab
+
+    **write_kwargs : optional
+        Passed to galcat_io.write_galcats, e.g., fmt, columns, exclude, compression
+
+    Returns
+    -------
+    shard_info : dict
+        Summary of the shard that is stored in the manifest
+
+    """
+    start = time()
+    halos = load_halos(slab_fname)
+    inputs = load_abacus.get_mc_galpop_inputs(halos)
+    shard_info = populate_slab(
+        inputs,
+        slab_fname,
+        shard_fname,
+        seed,
+        lgmp_min=lgmp_min,
+        mem_budget=mem_budget,
+        profiler=profiler,
+        precision=precision,
+        **write_kwargs,
+    )
+    shard_info["runtime"] = time() - start
+    return shard_info
+
+
+def populate_slab(
+    inputs,
+    slab_fname,
+    shard_fname,
+    seed,
+    lgmp_min=DEFAULT_LGMP_MIN,
+    mem_budget=DEFAULT_MEM_BUDGET,
+    profiler=None,
+    precision=None,
+    **write_kwargs,
+):
+    """Populate the halos of a slab with galaxies and write the output shard
+
+    Parameters
+    ----------
+    inputs : dict
+        Halos of the slab, as returned by load_abacus.get_mc_galpop_inputs
+
+    slab_fname : string
+        Path to the CompaSO halo_info_XXX.asdf file of the halos
+
+    shard_fname : string
+        Path to the output HDF5 file
+
+    seed : int
+
+    lgmp_min : float, optional
+
+    mem_budget : int, optional
+
+    profiler : profiling.StageProfiler, optional
+        If passed, records the stages of mc_galpop_synthetic_subs for each chunk,
+        with the basename of slab_fname stored in the slab tag of each record
+
+    precision : string, optional
+        Passed to mc_galpop_synthetic_subs, and stored in the attributes
+        of the shard. Default is None, in which case
+        precision.get_precision() of the process is used.
+
+    **write_kwargs : optional
+        Passed to galcat_io.write_galcats
+
+    Returns
+    -------
+    shard_info : dict
+        Summary of the shard that is stored in the manifest
+
+    Notes
+    -----
+    Each chunk of hosts is written to the shard as soon as it is generated,
+    so that memory is set by mem_budget rather than by the size of the slab.
+    Chunks are chosen by planner.get_planned_chunk_edges so that the predicted
+    peak memory of each chunk fits mem_budget.
+    Tables of MAH and SFH are only generated when written to the shard.
+
+    """
+    start = time()
+    precision = check_precision(precision)
+    store_tables = galcat_tables.is_table_selected(
+        write_kwargs.get("columns"), write_kwargs.get("exclude")
+    )
+    chunk_edges = planner.get_planned_chunk_edges(
+        inputs["logmhost"],
+        lgmp_min,
+        mem_budget,
+        store_tables=store_tables,
+        precision=precision,
+    )
+    if profiler is not None:
+        profiler = profiler.tagged(slab=os.path.basename(slab_fname))
+    galcats = mc_galpop_synthetic_subs_chunked(
+        jran.key(seed),
+        inputs["logmhost"],
+        inputs["halo_radius"],
+        inputs["halo_pos"],
+        inputs["halo_vel"],
+        inputs["z_obs"],
+        lgmp_min,
+        inputs["cosmo_params"],
+        inputs["Lbox"],
+        mem_budget=mem_budget,
+        halo_ids=inputs["halo_ids"],
+        store_tables=store_tables,
+        concentration=inputs["concentration"],
+        profiler=profiler,
+        chunk_edges=chunk_edges,
+        precision=precision,
+    )
+    galcats = _add_host_halo_id(galcats, inputs["halo_ids"])
+
+    n_halos = inputs["logmhost"].size
+    attrs = dict(slab_fname=slab_fname, seed=seed, lgmp_min=lgmp_min)
+    attrs["n_halos"] = n_halos
+    attrs["precision"] = precision
+    chunk_stats = galcat_io.write_galcats(
+        shard_fname, galcats, attrs=attrs, **write_kwargs
+    )
+    n_gals = sum(x.n_gals for x in chunk_stats)
+
+    shard_info = dict(
+        slab_fname=slab_fname,
+        shard_fname=shard_fname,
+        n_halos=int(n_halos),
+        n_gals=int(n_gals),
+        file_size=int(sum(x.file_size for x in chunk_stats)),
+        write_time=float(sum(x.write_time for x in chunk_stats)),
+        runtime=time() - start,
+    )
+    return shard_info
+
+
+def _add_host_halo_id(galcats, halo_ids):
+    """Add the Abacus id of the host halo of each galaxy to each chunk"""
+    indx_lo = 0
+    for galcat in galcats:
+        upid = np.asarray(galcat["upid"])
+        n_cens = int(np.sum(upid == -1))
+        chunk_halo_ids = halo_ids[indx_lo : indx_lo + n_cens]
+        galcat["host_halo_id"] = np.concatenate(
+            (chunk_halo_ids, chunk_halo_ids[upid[n_cens:]])
+        )
+        indx_lo += n_cens
+        yield galcat
+
+
+def run_mock(
+    halocat_dir,
+    output_dir,
+    n_workers=1,
+    seed=0,
+    lgmp_min=DEFAULT_LGMP_MIN,
+    mem_budget=DEFAULT_MEM_BUDGET,
+    cache_dir=None,
+    overwrite=False,
+    load_halos=load_abacus.load_abacus_halo_catalog,
+    slab_fnames=None,
+    prefetch_depth=1,
+    fmt="hdf5",
+    columns=None,
+    exclude=None,
+    profile=False,
+    precision=None,
+):
+    """Populate every slab of a halo catalog with galaxies, one output shard per slab
+
+    Parameters
+    ----------
+    halocat_dir : string
+        Redshift directory of an AbacusSummit simulation, e.g., .../halos/z1.100
+
+    output_dir : string
+        Directory of the output shards and of the manifest
+
+    n_workers : int, optional
+        Number of worker processes. Default is 1, in which case slabs are
+        processed serially in the calling process, with the next slabs loaded
+        on a background thread while the current slab is populated.
+
+    seed : int, optional
+
+    lgmp_min : float, optional
+        log10 of subhalo mass cutoff in Msun
+
+    mem_budget : int, optional
+        Target peak memory in bytes of each chunk of hosts in each worker
+
+    cache_dir : string, optional
+        Directory of the persistent compilation cache shared by the workers
+
+    overwrite : bool, optional
+        If True, regenerate every shard. Default is False, in which case
+        slabs with a complete shard in output_dir are skipped.
+
+    load_halos : callable, optional
+        Function that loads the halo catalog of a slab file, see run_slab
+
+    slab_fnames : list of strings, optional
+        Slab files to process. Default is all slabs of halocat_dir.
+
+    prefetch_depth : int, optional
+        Number of slabs loaded ahead of the slab being populated when n_workers=1,
+        see data_loaders.prefetch.prefetch. Default is 1.
+
+    fmt : string, optional
+        Format of the shards, either "hdf5", "parquet", or "npy". Default is "hdf5".
+        Use "npy" for shards that can be opened with mock_reader.open_mock.
+
+    columns, exclude : list of strings, optional
+        Columns of galcat to write, see galcat_io.select_columns.
+        Default is to write all columns.
+
+    profile : bool, optional
+        If True, the wall time, compile time, and peak memory of each stage of
+        the pipeline are appended to output_dir/profile.jsonl by every worker,
+        see profiling.StageProfiler. Default is False.
+
+    precision : string, optional
+        One of precision.PRECISIONS, see mc_galpop.mc_galpop_synthetic_subs.
+        The precision of the workers, or of the calling process when n_workers=1,
+        is set with precision.set_precision. A run can only be restarted
+        with the same precision. Default is None, in which case
+        precision.get_precision() of the calling process is used.
+
+    Returns
+    -------
+    manifest : dict
+        Contents of output_dir/manifest.json
+
+    """
+    if slab_fnames is None:
+        slab_fnames = load_abacus.get_slab_fnames(halocat_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    if precision is None:
+        precision = get_precision()
+    run_config = dict(halocat_dir=halocat_dir, seed=seed, lgmp_min=lgmp_min)
+    run_config["precision"] = precision
+    manifest = _get_manifest(output_dir, run_config, overwrite)
+    completed = {x["slab_fname"]: x for x in manifest["shards"]}
+
+    todo = []
+    for slab_fname in slab_fnames:
+        shard_fname = get_shard_fname(output_dir, slab_fname, fmt=fmt)
+        if not overwrite and os.path.exists(shard_fname):
+            if slab_fname not in completed:
+                completed[slab_fname] = _get_shard_info(shard_fname, fmt)
+        else:
+            completed.pop(slab_fname, None)
+            todo.append((slab_fname, shard_fname))
+
+    def _update_manifest(shard_info):
+        if shard_info is not None:
+            completed[shard_info["slab_fname"]] = shard_info
+        manifest["shards"] = [completed[x] for x in slab_fnames if x in completed]
+        manifest["complete"] = len(manifest["shards"]) == len(slab_fnames)
+        _write_manifest(output_dir, manifest)
+
+    _update_manifest(None)
+
+    write_kwargs = dict(fmt=fmt, columns=columns, exclude=exclude)
+    if profile:
+        profile_fname = os.path.join(output_dir, PROFILE_BASENAME)
+        profiler = StageProfiler(sink=JsonLinesSink(profile_fname))
+    else:
+        profiler = None
+    if n_workers == 1:
+        set_precision(precision)
+        if cache_dir is not None:
+            enable_compilation_cache(cache_dir)
+        shard_fnames = dict(todo)
+        slabs = iter_mc_galpop_inputs(
+            list(shard_fnames), load_halos=load_halos, depth=prefetch_depth
+        )
+        for slab_fname, inputs in slabs:
+            shard_fname = shard_fnames[slab_fname]
+            shard_info = populate_slab(
+                inputs,
+                slab_fname,
+                shard_fname,
+                seed,
+                lgmp_min,
+                mem_budget,
+                profiler=profiler,
+                precision=precision,
+                **write_kwargs,
+            )
+            _update_manifest(shard_info)
+    elif len(todo) > 0:
+        slab_args = (seed, lgmp_min, mem_budget, load_halos, profiler, precision)
+        with get_executor(
+            min(n_workers, len(todo)), cache_dir=cache_dir, precision=precision
+        ) as executor:
+            futures = [
+                executor.submit(
+                    run_slab, slab_fname, shard_fname, *slab_args, **write_kwargs
+                )
+                for slab_fname, shard_fname in todo
+            ]
+            for future in as_completed(futures):
+                _update_manifest(future.result())
+
+    return manifest
+
+
+def load_manifest(output_dir):
+    """Load the manifest of a run of run_mock"""
+    with open(os.path.join(output_dir, MANIFEST_BASENAME), "r") as f:
+        manifest = json.load(f)
+    return manifest
+
+
+def _get_manifest(output_dir, run_config, overwrite):
+    fname = os.path.join(output_dir, MANIFEST_BASENAME)
+    if overwrite or not os.path.isfile(fname):
+        return dict(**run_config, complete=False, shards=[])
+
+    manifest = load_manifest(output_dir)
+    # Manifests written before the precision option was added are double precision
+    manifest.setdefault("precision", DEFAULT_PRECISION)
+    for key in _RUN_CONFIG_KEYS:
+        if manifest[key] != run_config[key]:
+            msg = (
+                "Cannot restart run in {0}: {1}={2} differs from {1}={3} of "
+                "the existing manifest. Use overwrite=True to start a new run."
+            )
+            raise ValueError(
+                msg.format(output_dir, key, run_config[key], manifest[key])
+            )
+    return manifest
+
+
+def _get_shard_info(shard_fname, fmt):
+    if fmt == "hdf5":
+        attrs = galcat_io.load_galcat_attrs_hdf5(shard_fname)
+    elif fmt == "parquet":
+        attrs = galcat_io.load_galcat_attrs_parquet(shard_fname)
+    else:
+        attrs = galcat_io.load_galcat_attrs_npy(shard_fname)
+    shard_info = dict(
+        slab_fname=str(attrs["slab_fname"]),
+        shard_fname=shard_fname,
+        n_halos=int(attrs["n_halos"]),
+        n_gals=int(attrs["n_gals"]),
+        runtime=None,
+    )
+    return shard_info
+
+
+def _write_manifest(output_dir, manifest):
+    fname = os.path.join(output_dir, MANIFEST_BASENAME)
+    with open(fname + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(fname + ".tmp", fname)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="rgrspit-mock",
+        description="Populate the slabs of an AbacusSummit halo catalog with galaxies",
+    )
+    parser.add_argument("halocat_dir", help="Redshift directory, e.g., .../z1.100")
+    parser.add_argument("output_dir", help="Directory of the output shards")
+    parser.add_argument("--n_workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--lgmp_min", type=float, default=DEFAULT_LGMP_MIN)
+    parser.add_argument(
+        "--mem_budget", type=float, default=DEFAULT_MEM_BUDGET / 1024**3, help="GB"
+    )
+    parser.add_argument("--cache_dir", default=None, help="JAX compilation cache")
+    parser.add_argument(
+        "--prefetch_depth", type=int, default=1, help="Slabs loaded ahead"
+    )
+    parser.add_argument("--format", choices=galcat_io.FORMATS, default="hdf5")
+    parser.add_argument(
+        "--columns", nargs="+", default=None, help="Columns to write, e.g., pos"
+    )
+    parser.add_argument(
+        "--exclude", nargs="+", default=None, help="Columns to skip, e.g., sfh_table"
+    )
+    parser.add_argument("--overwrite", action="store_true")
+    parser.add_argument("--precision", choices=PRECISIONS, default=DEFAULT_PRECISION)
+    parser.add_argument(
+        "--profile", action="store_true", help="Write stage timings to profile.jsonl"
+    )
+    args = parser.parse_args(argv)
+
+    manifest = run_mock(
+        args.halocat_dir,
+        args.output_dir,
+        n_workers=args.n_workers,
+        seed=args.seed,
+        lgmp_min=args.lgmp_min,
+        mem_budget=int(args.mem_budget * 1024**3),
+        cache_dir=args.cache_dir,
+        overwrite=args.overwrite,
+        prefetch_depth=args.prefetch_depth,
+        fmt=args.format,
+        columns=args.columns,
+        exclude=args.exclude,
+        profile=args.profile,
+        precision=args.precision,
+    )
+    n_gals = sum(x["n_gals"] for x in manifest["shards"])
+    msg = "Wrote {0} galaxies in {1} shards to {2}"
+    print(msg.format(n_gals, len(manifest["shards"]), args.output_dir))
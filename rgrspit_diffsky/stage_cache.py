@@ -0,0 +1,218 @@
+"""Content-addressed cache of the outputs of the stages of the galaxy pipeline
+
+Passing a StageCache as the cache argument of mc_galpop_synthetic_subs
+evaluates each stage of the pipeline as a separately jitted kernel, as with
+a profiler, and stores the outputs of each stage under a key computed from the
+contents of its inputs: random keys, halo properties, and model parameters.
+When a stage is rerun with the same inputs, its outputs are read from the cache
+instead of being evaluated. Since the outputs of a stage are the inputs of the
+next ones, a rerun that changes only diffstarpop_params evaluates the sfh stage
+alone, and a rerun that changes only diffmahpop_params skips the subhalos and
+phase_space stages.
+
+Outputs are kept in memory up to max_bytes, evicting the least recently used
+entries first. If cache_dir is passed, evicted entries are written to disk and
+reloaded on their next use.
+
+Example usage
+-------------
+>>> cache = StageCache(max_bytes=4 * 1024**3, cache_dir="stage_cache")  # doctest: +SKIP
+>>> galcat = mc_galpop_synthetic_subs(*args, cache=cache)  # doctest: +SKIP
+>>> galcat2 = mc_galpop_synthetic_subs(  # doctest: +SKIP
+...     *args, diffstarpop_params=new_params, cache=cache
+... )
+>>> cache.summary()["sfh"].misses  # doctest: +SKIP
+2
+
+"""
+
+import hashlib
+import os
+import pickle
+from collections import OrderedDict, namedtuple
+
+import jax
+import numpy as np
+from jax import dtypes
+from jax import numpy as jnp
+from jax import random as jran
+from jax import tree_util
+
+from . import __version__
+
+DEFAULT_CACHE_BYTES = 2 * 1024**3
+
+CacheStats = namedtuple("CacheStats", ("hits", "disk_hits", "misses"))
+
+
+def get_cache_key(stage, *args):
+    """Key of the outputs of stage evaluated on args
+
+    Parameters
+    ----------
+    stage : string
+        Name of the stage
+
+    args : pytrees
+        Inputs of the stage. Leaves can be arrays, typed random keys, or scalars.
+
+    Returns
+    -------
+    key : string
+        Hexadecimal digest of the stage name, the package version, the structure
+        of args, and the dtype, shape, and contents of each of its leaves
+
+    """
+    leaves, treedef = tree_util.tree_flatten(args)
+    digest = hashlib.sha256()
+    digest.update("{0}:{1}:{2}".format(__version__, stage, treedef).encode())
+    for leaf in leaves:
+        if hasattr(leaf, "dtype") and dtypes.issubdtype(leaf.dtype, dtypes.prng_key):
+            leaf = jran.key_data(leaf)
+        leaf = np.ascontiguousarray(leaf)
+        digest.update("{0}{1}".format(leaf.dtype.str, leaf.shape).encode())
+        digest.update(leaf.tobytes())
+    return digest.hexdigest()
+
+
+def get_nbytes(res):
+    """Total number of bytes of the arrays of the pytree res"""
+    return sum(np.asarray(leaf).nbytes for leaf in tree_util.tree_leaves(res))
+
+
+class StageCache:
+    """In-memory LRU cache of stage outputs with optional spill to disk
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        Maximum total size in bytes of the outputs kept in memory.
+        Default is DEFAULT_CACHE_BYTES.
+        Outputs larger than max_bytes are never kept in memory.
+
+    cache_dir : string, optional
+        Directory storing the outputs evicted from memory, one pickle file per key.
+        Files are never deleted by the cache, so that the directory can be
+        shared between runs. Default is None, in which case evicted outputs
+        are discarded.
+
+    Attributes
+    ----------
+    nbytes : int
+        Total size in bytes of the outputs kept in memory
+
+    stats : dict
+        Keys are stage names in order of first appearance, and values are
+        CacheStats with the number of memory hits, disk hits, and misses
+
+    Notes
+    -----
+    Keys are computed by get_cache_key from the contents of the inputs,
+    which requires them to be concrete, so the cache cannot be used inside jit.
+    Outputs are stored as returned by the stage, without copies,
+    and are shared by all the galaxy catalogs built from them.
+
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.nbytes = 0
+        self.stats = dict()
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries or os.path.isfile(self._get_fname(key))
+
+    def run(self, stage, func, *args):
+        """Outputs of func(*args), read from the cache if stage was already
+        evaluated on the same inputs, and stored in the cache otherwise
+
+        Parameters
+        ----------
+        stage : string
+            Name of the stage
+
+        func : callable
+
+        Returns
+        -------
+        res : object
+            Output of func
+
+        """
+        key = get_cache_key(stage, *args)
+        stats = self.stats.get(stage, CacheStats(0, 0, 0))
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.stats[stage] = stats._replace(hits=stats.hits + 1)
+            return self._entries[key][0]
+
+        res = self._load(key)
+        if res is None:
+            self.stats[stage] = stats._replace(misses=stats.misses + 1)
+            res = jax.block_until_ready(func(*args))
+        else:
+            self.stats[stage] = stats._replace(disk_hits=stats.disk_hits + 1)
+        self.put(key, res)
+        return res
+
+    def put(self, key, res):
+        """Store res in memory under key, evicting the least recently used entries
+        until the cache fits in max_bytes"""
+        if key in self._entries:
+            self.nbytes -= self._entries.pop(key)[1]
+        nbytes = get_nbytes(res)
+        self._entries[key] = (res, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes and self._entries:
+            self._evict()
+
+    def clear(self):
+        """Remove all the entries kept in memory, without writing them to disk"""
+        self._entries.clear()
+        self.nbytes = 0
+
+    def summary(self):
+        """Number of hits and misses of each stage
+
+        Returns
+        -------
+        summary : dict
+            Same as the stats attribute
+
+        """
+        return dict(self.stats)
+
+    def _evict(self):
+        key, (res, nbytes) = self._entries.popitem(last=False)
+        self.nbytes -= nbytes
+        if self.cache_dir is not None:
+            self._dump(key, res)
+
+    def _get_fname(self, key):
+        if self.cache_dir is None:
+            return ""
+        return os.path.join(self.cache_dir, key + ".pkl")
+
+    def _dump(self, key, res):
+        fname = self._get_fname(key)
+        if os.path.isfile(fname):
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        res = tree_util.tree_map(np.asarray, res)
+        tmp_fname = "{0}.{1}.tmp".format(fname, os.getpid())
+        with open(tmp_fname, "wb") as fobj:
+            pickle.dump(res, fobj, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_fname, fname)
+
+    def _load(self, key):
+        fname = self._get_fname(key)
+        if not os.path.isfile(fname):
+            return None
+        with open(fname, "rb") as fobj:
+            res = pickle.load(fobj)
+        return tree_util.tree_map(jnp.asarray, res)
@@ -0,0 +1,64 @@
+""" """
+
+import numpy as np
+
+from .. import benchmarks as bench
+
+
+def test_every_benchmark_runs_with_quick_params():
+    for benchmark, params in bench.iter_benchmark_params(quick=True):
+        result = bench.run_benchmark(benchmark, params, n_repeat=1)
+        assert result.key == bench.get_benchmark_key(benchmark.name, params)
+        assert result.n_items > 0
+        assert result.time > 0
+        assert np.isclose(result.throughput, result.n_items / result.time)
+        assert result.peak_mem is None or result.peak_mem >= 0
+
+
+def test_baseline_roundtrip_and_comparison(tmp_path):
+    benchmark = bench.select_benchmarks(["sfr_to_Halpha"])[0]
+    params = benchmark.quick_params[0]
+    result = bench.run_benchmark(benchmark, params, n_repeat=2)
+    assert result.n_items == params["n"]
+
+    fname = str(tmp_path / "baseline.json")
+    bench.save_baseline([result], fname)
+    baseline = bench.load_baseline(fname)
+    assert baseline[result.key] == result
+
+    comparison = bench.compare_to_baseline([result], baseline)[0]
+    assert np.isclose(comparison.time_ratio, 1.0)
+    assert not comparison.time_regression
+    assert not comparison.mem_regression
+
+    slow = result._replace(time=2 * result.time, peak_mem=10 * bench.MEM_SLACK)
+    baseline = {result.key: result._replace(peak_mem=bench.MEM_SLACK)}
+    comparison = bench.compare_to_baseline([slow], baseline)[0]
+    assert comparison.time_regression
+    assert comparison.mem_regression
+    assert np.isclose(comparison.mem_ratio, 10.0)
+
+    assert bench.compare_to_baseline([result._replace(key="other")], baseline) == []
+
+
+def test_main_exits_with_regression_status(tmp_path):
+    fname = str(tmp_path / "baseline.json")
+    argv = ["--quick", "--filter", "logsfr_poly2_mod", "--n_repeat", "1"]
+    assert bench.main(argv + ["--save", fname]) == 0
+    baseline = bench.load_baseline(fname)
+    assert len(baseline) == 1
+    assert bench.main(argv + ["--baseline", fname, "--time_tol", "100"]) == 0
+
+    result = list(baseline.values())[0]
+    bench.save_baseline([result._replace(time=result.time / 1e3)], fname)
+    assert bench.main(argv + ["--baseline", fname]) == 1
+
+
+def test_select_benchmarks():
+    names = [b.name for b in bench.select_benchmarks(["rotation", "qnfw"])]
+    assert names == [
+        "_qnfw",
+        "rotation_matrices_from_vectors",
+        "phase_space_kernels.rotation_matrices_from_vectors",
+    ]
+    assert len(bench.select_benchmarks()) == len(bench.BENCHMARKS)
@@ -0,0 +1,74 @@
+""" """
+
+import numpy as np
+import pytest
+from dsps.cosmology.defaults import DEFAULT_COSMOLOGY
+from jax import jit as jjit
+from jax import numpy as jnp
+from jax import random as jran
+
+from .. import compilation_cache as cc
+from .. import mc_galpop
+
+
+def test_track_compilation_counts_compiles():
+    @jjit
+    def _kern(x):
+        return jnp.sin(x) + 1.0
+
+    with cc.track_compilation() as stats:
+        _kern(np.zeros(7))
+        _kern(np.zeros(7))
+    assert stats["n_compiles"] == 1
+    assert stats["compile_time"] > 0
+    assert stats["wall_time"] >= stats["compile_time"]
+
+    with cc.track_compilation() as stats:
+        _kern(np.zeros(7))
+    assert stats["n_compiles"] == 0
+
+
+def test_warmup_rejects_capacity_outside_buckets():
+    with pytest.raises(ValueError):
+        cc.warmup([1_000], DEFAULT_COSMOLOGY)
+
+
+def test_warmup_precompiles_padded_kernel():
+    capacity = mc_galpop.MIN_CAPACITY
+    report = cc.warmup([capacity], DEFAULT_COSMOLOGY)
+    stats = report[(capacity, capacity)]
+    assert stats.wall_time > 0
+
+    lgmp_min = 11.5
+    n_halos = 50
+    logmhost = np.linspace(lgmp_min, 13, n_halos)
+    args = (np.ones(n_halos), np.zeros((n_halos, 3)), np.zeros((n_halos, 3)))
+    with cc.track_compilation() as stats:
+        galcat = mc_galpop.mc_galpop_synthetic_subs(
+            jran.key(0),
+            logmhost,
+            *args,
+            0.5,
+            lgmp_min,
+            DEFAULT_COSMOLOGY,
+            2_000.0,
+            padded=True,
+        )
+    assert galcat["upid"].size < capacity
+    assert stats["n_compiles"] == 0
+
+    # NumPy scalars reuse the kernels compiled for Python floats
+    for z_obs, lgmp_min in ((np.float64(0.5), np.float64(11.5)), (0.3, np.float32(11))):
+        with cc.track_compilation() as stats:
+            galcat = mc_galpop.mc_galpop_synthetic_subs(
+                jran.key(0),
+                logmhost,
+                *args,
+                z_obs,
+                lgmp_min,
+                DEFAULT_COSMOLOGY,
+                2_000.0,
+                padded=True,
+            )
+        assert galcat["z_obs"] == z_obs
+        assert stats["n_compiles"] == 0
@@ -0,0 +1,179 @@
+""" """
+
+from collections import namedtuple
+
+import numpy as np
+import pytest
+from dsps.cosmology.defaults import DEFAULT_COSMOLOGY
+from jax import random as jran
+from jax import tree_util
+
+from .. import galcat_groups as gcg
+from .. import galcat_io
+from ..mc_galpop import mc_galpop_synthetic_subs
+
+LBOX = 500.0
+
+
+def _get_galpop_args(n_halos=50, lgmp_min=11.5):
+    pos_key, vel_key = jran.split(jran.key(1), 2)
+    logmhost = np.linspace(lgmp_min, 14, n_halos)
+    halo_radius = np.ones_like(logmhost)
+    halo_pos = np.array(jran.uniform(pos_key, shape=(n_halos, 3))) * LBOX
+    halo_vel = np.array(jran.normal(vel_key, shape=(n_halos, 3))) * 200.0
+    args = (logmhost, halo_radius, halo_pos, halo_vel, 0.5, lgmp_min)
+    return (*args, DEFAULT_COSMOLOGY, LBOX)
+
+
+def _get_cens_first_upid(sat_counts):
+    n_cens = len(sat_counts)
+    sat_upid = np.repeat(np.arange(n_cens), sat_counts)
+    return np.concatenate((np.zeros(n_cens, dtype=int) - 1, sat_upid))
+
+
+def _get_cens_first_galcat(sat_counts):
+    """Centrals-first galcat with per-galaxy columns equal to the row numbers"""
+    upid = _get_cens_first_upid(sat_counts)
+    rows = np.arange(upid.size)
+    Params = namedtuple("Params", ("x", "y"))
+    galcat = dict(
+        upid=upid,
+        logmp_t_obs=rows.astype(float),
+        pos=np.repeat(rows, 3).reshape((-1, 3)),
+        mah_params=Params(rows.astype(float), -rows.astype(float)),
+        t_table=np.linspace(0.1, 13.8, 5),
+        t0=13.8,
+        t_obs=8.6,
+        z_obs=0.5,
+    )
+    return galcat
+
+
+def test_get_host_major_indx_agrees_with_sorting_by_host():
+    sat_counts = np.array([0, 3, 1, 0, 0, 5, 2])
+    upid = _get_cens_first_upid(sat_counts)
+    indx, host_offsets = gcg.get_host_major_indx(sat_counts)
+
+    host = np.where(upid == -1, np.arange(upid.size), upid)
+    indx_sorted = np.lexsort((upid != -1, host))
+    assert np.all(indx == indx_sorted)
+    assert np.all(np.diff(host_offsets) == 1 + sat_counts)
+    assert np.all(upid[indx][host_offsets[:-1]] == -1)
+
+    indx, host_offsets = gcg.get_host_major_indx(np.zeros(0, dtype=int))
+    assert indx.size == 0
+    assert np.all(host_offsets == [0])
+
+
+def test_to_host_major():
+    sat_counts = np.array([0, 3, 1, 0, 0, 5, 2])
+    galcat = _get_cens_first_galcat(sat_counts)
+    galcat2 = gcg.to_host_major(galcat)
+    upid, upid2 = galcat["upid"], galcat2["upid"]
+    host_offsets = galcat2["host_offsets"]
+    assert np.all(gcg.get_satellite_counts(upid) == sat_counts)
+    assert np.all(gcg.get_satellite_counts(upid2) == sat_counts)
+    assert np.all(host_offsets == gcg.get_host_offsets(upid2))
+    assert np.all(np.diff(host_offsets) == 1 + sat_counts)
+
+    # Each central is followed by its satellites, whose upid is the row of the central
+    host_rows = np.repeat(host_offsets[:-1], 1 + sat_counts)
+    assert np.all(np.where(upid2 == -1, np.arange(upid2.size), upid2) == host_rows)
+    for key in ("t_table", "t0", "t_obs", "z_obs"):
+        assert np.all(galcat2[key] == galcat[key])
+
+    # Per-galaxy columns, including namedtuples, are gathered from rows indx
+    indx, __ = gcg.get_host_major_indx(sat_counts)
+    assert np.all(galcat2["logmp_t_obs"] == indx)
+    assert np.all(galcat2["pos"] == indx[:, None])
+    assert np.all(galcat2["mah_params"].x == indx)
+    assert np.all(galcat2["mah_params"].y == -indx)
+    n_cens = sat_counts.size
+    cens = np.zeros(upid.size, dtype=bool)
+    cens[host_offsets[:-1]] = True
+    assert np.all(galcat2["logmp_t_obs"][cens] == np.arange(n_cens))
+    assert np.all(galcat2["logmp_t_obs"][~cens] == np.arange(n_cens, upid.size))
+
+    with pytest.raises(ValueError):
+        gcg.to_host_major(galcat2)
+    galcat["upid"] = upid[::-1]
+    with pytest.raises(ValueError):
+        gcg.to_host_major(galcat)
+    galcat["upid"] = np.concatenate((upid[:n_cens], upid[n_cens:][::-1]))
+    with pytest.raises(ValueError):
+        gcg.to_host_major(galcat)
+
+
+def test_host_major_layout_of_mc_galpop():
+    args = _get_galpop_args()
+    galcat = mc_galpop_synthetic_subs(jran.key(0), *args, padded=True)
+    galcat2 = mc_galpop_synthetic_subs(
+        jran.key(0), *args, padded=True, layout="host_major"
+    )
+    galcat3 = gcg.to_host_major(galcat)
+    assert set(galcat2) == set(galcat3)
+    for key in galcat2:
+        for x, y in zip(
+            tree_util.tree_leaves(galcat2[key]), tree_util.tree_leaves(galcat3[key])
+        ):
+            assert np.all(np.asarray(x) == np.asarray(y)), key
+
+    with pytest.raises(ValueError):
+        mc_galpop_synthetic_subs(jran.key(0), *args, layout="sorted")
+
+
+def test_segment_sum():
+    sat_counts = np.array([2, 0, 4, 1])
+    upid = _get_cens_first_upid(sat_counts)
+    indx, host_offsets = gcg.get_host_major_indx(sat_counts)
+    values = np.arange(upid.size * 2, dtype=float).reshape((-1, 2))[indx]
+    host_rows = np.repeat(np.arange(sat_counts.size), 1 + sat_counts)
+    sums = gcg.segment_sum(values, host_offsets)
+    for i in range(sat_counts.size):
+        assert np.allclose(sums[i], values[host_rows == i].sum(axis=0))
+
+    msk = values[:, 0] > 3
+    n_sel = gcg.segment_sum(msk, host_offsets)
+    assert np.all(n_sel == np.bincount(host_rows[msk], minlength=sat_counts.size))
+
+    with pytest.raises(ValueError):
+        gcg.segment_sum(values[1:], host_offsets)
+    assert gcg.segment_sum(np.zeros(0), np.zeros(1, dtype=int)).shape == (0,)
+
+
+def test_measure_hod():
+    sat_counts = np.array([0, 3, 1, 0, 2, 5, 2, 1])
+    logmhost = np.array([11.6, 12.8, 12.1, 11.9, 13.2, 13.9, 12.5, 15.7])
+    indx, host_offsets = gcg.get_host_major_indx(sat_counts)
+    n_gals = host_offsets[-1]
+
+    # Select the centrals of even hosts and every other satellite
+    host_rows = np.repeat(np.arange(sat_counts.size), 1 + sat_counts)
+    cens = np.zeros(n_gals, dtype=bool)
+    cens[host_offsets[:-1]] = True
+    msk = np.where(cens, host_rows % 2 == 0, np.arange(n_gals) % 2 == 0)
+    bins = np.array((11.5, 12.5, 13.5, 14.5, 15.5))
+    hod = gcg.measure_hod(logmhost, host_offsets, msk, bins)
+    assert np.all(hod.n_hosts == [3, 3, 1, 0])
+    assert np.all(np.isnan(hod.mean_n_cens[-1]))
+    assert np.all(np.isnan(hod.mean_n_sats[-1]))
+
+    # Brute-force count of the selected galaxies of each host
+    for i in range(bins.size - 2):
+        hosts = np.flatnonzero((logmhost >= bins[i]) & (logmhost < bins[i + 1]))
+        n_cens = np.sum(msk & cens & np.isin(host_rows, hosts))
+        n_sats = np.sum(msk & ~cens & np.isin(host_rows, hosts))
+        assert np.isclose(hod.mean_n_cens[i], n_cens / hosts.size)
+        assert np.isclose(hod.mean_n_sats[i], n_sats / hosts.size)
+
+
+def test_write_host_major_galcat(tmp_path):
+    sat_counts = np.array([2, 0, 4, 1])
+    galcat = gcg.to_host_major(_get_cens_first_galcat(sat_counts))
+    fname = str(tmp_path / "galcat.h5")
+    galcat_io.write_galcats(fname, [galcat], compression=None)
+    galcat2 = galcat_io.load_galcat_hdf5(fname)
+    assert "host_offsets" not in galcat2
+    assert np.all(galcat2["upid"] == galcat["upid"])
+    assert np.all(galcat2["mah_params/x"] == galcat["mah_params"].x)
+    assert np.all(gcg.get_host_offsets(galcat2["upid"]) == galcat["host_offsets"])
@@ -0,0 +1,128 @@
+""" """
+
+import numpy as np
+import pytest
+from diffmah.diffmah_kernels import DEFAULT_MAH_PARAMS
+from diffstar.defaults import DEFAULT_DIFFSTAR_PARAMS
+
+from .. import galcat_io
+
+
+def _get_fake_galcat(n_gals=20, n_t=7, n_cens=None):
+    n_cens = n_gals if n_cens is None else n_cens
+    zz = np.zeros(n_gals)
+    galcat = dict()
+    galcat["mah_params"] = DEFAULT_MAH_PARAMS._make(
+        [zz + x for x in DEFAULT_MAH_PARAMS]
+    )
+    ms_params = DEFAULT_DIFFSTAR_PARAMS.ms_params._make(
+        [zz + x for x in DEFAULT_DIFFSTAR_PARAMS.ms_params]
+    )
+    q_params = DEFAULT_DIFFSTAR_PARAMS.q_params._make(
+        [zz + x for x in DEFAULT_DIFFSTAR_PARAMS.q_params]
+    )
+    galcat["sfh_params"] = DEFAULT_DIFFSTAR_PARAMS._make((ms_params, q_params))
+    galcat["logsm_t_obs"] = np.linspace(8, 11, n_gals)
+    galcat["sfh_table"] = np.ones((n_gals, n_t))
+    galcat["pos"] = np.ones((n_gals, 3))
+    galcat["upid"] = np.concatenate(
+        (np.zeros(n_cens).astype(int) - 1, np.arange(n_gals - n_cens) % n_cens)
+    )
+    galcat["t_table"] = np.linspace(0.1, 13.8, n_t)
+    galcat["z_obs"] = 0.5
+    return galcat
+
+
+def test_flatten_galcat():
+    galcat = _get_fake_galcat()
+    columns = galcat_io.flatten_galcat(galcat)
+    for key in DEFAULT_MAH_PARAMS._fields:
+        assert "mah_params/" + key in columns
+    for key in DEFAULT_DIFFSTAR_PARAMS.ms_params._fields:
+        assert "sfh_params/ms_params/" + key in columns
+    for key in DEFAULT_DIFFSTAR_PARAMS.q_params._fields:
+        assert "sfh_params/q_params/" + key in columns
+    assert np.allclose(columns["logsm_t_obs"], galcat["logsm_t_obs"])
+
+
+def test_write_and_load_galcat_hdf5(tmp_path):
+    galcat = _get_fake_galcat()
+    fname = str(tmp_path / "galcat.h5")
+    galcat_io.write_galcat_hdf5(fname, galcat, attrs=dict(n_gals=20))
+    assert not (tmp_path / "galcat.h5.tmp").exists()
+
+    columns = galcat_io.flatten_galcat(galcat)
+    galcat2 = galcat_io.load_galcat_hdf5(fname)
+    assert set(galcat2.keys()) == set(columns.keys())
+    for key, val in columns.items():
+        assert np.allclose(val, galcat2[key]), key
+
+    galcat3 = galcat_io.load_galcat_hdf5(fname, columns=["pos", "mah_params/logm0"])
+    assert set(galcat3.keys()) == set(("pos", "mah_params/logm0"))
+
+    attrs = galcat_io.load_galcat_attrs_hdf5(fname)
+    assert attrs["n_gals"] == 20
+
+
+def test_select_columns():
+    colnames = list(galcat_io.flatten_galcat(_get_fake_galcat()))
+    selected = galcat_io.select_columns(colnames, columns=["pos", "mah_params"])
+    assert selected == ["mah_params/" + x for x in DEFAULT_MAH_PARAMS._fields] + ["pos"]
+
+    selected = galcat_io.select_columns(colnames, exclude=["sfh_table", "sfh_params"])
+    assert "sfh_table" not in selected
+    assert not any(x.startswith("sfh_params") for x in selected)
+    assert "logsm_t_obs" in selected
+
+    with pytest.raises(KeyError):
+        galcat_io.select_columns(colnames, columns=["not_a_column"])
+
+
+@pytest.mark.parametrize(
+    "fmt",
+    [
+        "hdf5",
+        pytest.param(
+            "parquet",
+            marks=pytest.mark.skipif(
+                not galcat_io.HAS_PYARROW, reason="requires pyarrow"
+            ),
+        ),
+    ],
+)
+def test_write_galcats_streams_chunks(tmp_path, fmt):
+    n_cens = (5, 8, 3)
+    galcats = [_get_fake_galcat(n_gals=3 * n, n_cens=n) for n in n_cens]
+    for i, galcat in enumerate(galcats):
+        galcat["logsm_t_obs"] = galcat["logsm_t_obs"] + i
+    fname = str(tmp_path / "galcat")
+    chunk_stats = galcat_io.write_galcats(
+        fname, iter(galcats), fmt=fmt, exclude=["sfh_table"], attrs=dict(seed=3)
+    )
+    assert [x.n_gals for x in chunk_stats] == [3 * n for n in n_cens]
+    assert all(x.file_size >= 0 for x in chunk_stats)
+    assert sum(x.file_size for x in chunk_stats) > 0
+    assert all(x.throughput > 0 for x in chunk_stats)
+
+    if fmt == "hdf5":
+        galcat = galcat_io.load_galcat_hdf5(fname)
+        attrs = galcat_io.load_galcat_attrs_hdf5(fname)
+    else:
+        galcat = galcat_io.load_galcat_parquet(fname)
+        attrs = galcat_io.load_galcat_attrs_parquet(fname)
+    assert attrs["seed"] == 3
+    assert attrs["n_gals"] == 3 * sum(n_cens)
+    assert "sfh_table" not in galcat
+    assert np.allclose(galcat["t_table"], galcats[0]["t_table"])
+    assert galcat["pos"].shape == (3 * sum(n_cens), 3)
+    assert np.allclose(
+        galcat["logsm_t_obs"], np.concatenate([x["logsm_t_obs"] for x in galcats])
+    )
+    assert galcat["sfh_params/ms_params/lgmcrit"].shape == (3 * sum(n_cens),)
+
+    # upid is the row of the host central in the file
+    upid = galcat["upid"]
+    is_sat = upid != -1
+    assert np.all(upid[upid[is_sat]] == -1)
+    assert np.all(upid[5:15] < 5)
+    assert np.all((upid[15 + 8 : 15 + 24] >= 15) & (upid[15 + 8 : 15 + 24] < 15 + 8))
@@ -0,0 +1,135 @@
+""" """
+
+import numpy as np
+from diffmah.diffmah_kernels import DEFAULT_MAH_PARAMS, mah_halopop
+from diffstar.defaults import DEFAULT_DIFFSTAR_PARAMS
+from diffstar.sfh_model_tpeak import calc_sfh_galpop
+from dsps.cosmology.defaults import DEFAULT_COSMOLOGY
+from jax import random as jran
+from jax import tree_util
+
+from .. import galcat_io, galcat_tables, mc_galpop
+
+T0 = 13.8
+
+
+def _get_params(default_params, n_gals, rng, **ranges):
+    """Broadcast default_params to n_gals galaxies, drawing the fields in ranges"""
+    params = dict()
+    for key, val in default_params._asdict().items():
+        if key in ranges:
+            params[key] = rng.uniform(*ranges[key], n_gals)
+        else:
+            params[key] = np.zeros(n_gals) + val
+    return default_params._make(params.values())
+
+
+def _get_galcat(n_gals=20):
+    """Galcat storing only the parameters of the galaxies, as with store_tables=False"""
+    rng = np.random.default_rng(0)
+    mah_params = _get_params(
+        DEFAULT_MAH_PARAMS, n_gals, rng, logm0=(11.0, 14.0), t_peak=(5.0, T0)
+    )
+    ms_params = _get_params(
+        DEFAULT_DIFFSTAR_PARAMS.ms_params, n_gals, rng, lgmcrit=(11.0, 13.0)
+    )
+    q_params = _get_params(
+        DEFAULT_DIFFSTAR_PARAMS.q_params, n_gals, rng, lg_qt=(0.5, 1.1)
+    )
+    sfh_params = DEFAULT_DIFFSTAR_PARAMS._make((ms_params, q_params))
+    galcat = dict(
+        mah_params=mah_params,
+        sfh_params=sfh_params,
+        t_table=np.linspace(0.1, T0, 50),
+        t0=T0,
+    )
+    return galcat
+
+
+def _mc_galcats(n_halos=50):
+    rng = np.random.default_rng(0)
+    Lbox = 100.0
+    logmhost = rng.uniform(11.0, 14.0, n_halos)
+    halo_radius = np.zeros(n_halos) + 0.3
+    halo_pos = rng.uniform(0, Lbox, (n_halos, 3))
+    halo_vel = np.zeros((n_halos, 3))
+    args = (
+        jran.key(0),
+        logmhost,
+        halo_radius,
+        halo_pos,
+        halo_vel,
+        0.5,
+        11.0,
+        DEFAULT_COSMOLOGY,
+        Lbox,
+    )
+    galcat = mc_galpop.mc_galpop_synthetic_subs(*args)
+    galcat_lazy = mc_galpop.mc_galpop_synthetic_subs(*args, store_tables=False)
+    return galcat, galcat_lazy
+
+
+def test_tables_agree_with_diffmah_and_diffstar():
+    galcat = _get_galcat()
+    t_table = galcat["t_table"]
+    log_mah_table = galcat_tables.get_log_mah_table(galcat)
+    log_mah_table2 = mah_halopop(galcat["mah_params"], t_table, np.log10(T0))[1]
+    assert log_mah_table.shape == (20, t_table.size)
+    assert np.allclose(log_mah_table, log_mah_table2, rtol=1e-10)
+
+    sfh_table = galcat_tables.get_sfh_table(galcat)
+    sfh_table2 = calc_sfh_galpop(galcat["sfh_params"], galcat["mah_params"], t_table)
+    assert np.allclose(sfh_table, sfh_table2, rtol=1e-10)
+
+    # Stellar mass formed is the integral of the SFH
+    smh_table = galcat_tables.get_smh_table(galcat)
+    assert np.all(np.diff(smh_table, axis=1) >= 0)
+    dsmh = np.diff(smh_table, axis=1) / np.diff(t_table) / 1e9
+    sfh_mid = (sfh_table[:, 1:] + sfh_table[:, :-1]) / 2
+    assert np.allclose(dsmh, sfh_mid, rtol=1e-4)
+
+    # Flattened galcats as returned by the loaders of galcat_io
+    flat_galcat = galcat_io.flatten_galcat(galcat)
+    assert "sfh_params/ms_params/lgmcrit" in flat_galcat
+    log_mah_table2 = galcat_tables.get_log_mah_table(flat_galcat)
+    assert np.allclose(log_mah_table2, log_mah_table, rtol=1e-10)
+    sfh_table2 = galcat_tables.get_sfh_table(flat_galcat)
+    assert np.allclose(sfh_table2, sfh_table, rtol=1e-10)
+
+
+def test_lazy_tables_for_subset_of_galaxies_and_times():
+    galcat = _get_galcat()
+    log_mah_table = galcat_tables.get_log_mah_table(galcat)
+    sfh_table = galcat_tables.get_sfh_table(galcat)
+    indx = np.arange(2, 20, 3)
+    t_table = galcat["t_table"][::7]
+
+    sfh_table2 = galcat_tables.get_sfh_table(galcat, indx=indx, t_table=t_table)
+    assert sfh_table2.shape == (indx.size, t_table.size)
+    assert np.allclose(sfh_table2, sfh_table[indx, ::7], rtol=1e-8)
+
+    log_mah_table2 = galcat_tables.get_log_mah_table(
+        galcat, indx=slice(0, 10), t_table=t_table
+    )
+    assert np.allclose(log_mah_table2, log_mah_table[:10, ::7], rtol=1e-8)
+
+    flat_galcat = galcat_io.flatten_galcat(galcat)
+    sfh_table3 = galcat_tables.get_sfh_table(flat_galcat, indx=indx, t_table=t_table)
+    assert np.allclose(sfh_table3, sfh_table2, rtol=1e-10)
+
+
+def test_lazy_tables_of_mc_galpop_agree_with_stored_tables():
+    galcat, galcat_lazy = _mc_galcats()
+    assert set(galcat) - set(galcat_lazy) == set(galcat_tables.TABLE_KEYS)
+    for key in galcat_lazy:
+        for x, y in zip(
+            tree_util.tree_leaves(galcat[key]), tree_util.tree_leaves(galcat_lazy[key])
+        ):
+            assert np.allclose(x, y, rtol=1e-10)
+
+    log_mah_table = galcat_tables.get_log_mah_table(galcat_lazy)
+    assert np.allclose(log_mah_table, galcat["log_mah_table"], rtol=1e-8)
+    sfh_table = galcat_tables.get_sfh_table(galcat_lazy)
+    assert np.allclose(sfh_table, galcat["sfh_table"], rtol=1e-8)
+    smh_table = galcat_tables.get_smh_table(galcat_lazy)
+    assert np.allclose(np.log10(smh_table[:, -1]), galcat["logsm_t_obs"], atol=1e-8)
@@ -0,0 +1,49 @@
+""" """
+
+import numpy as np
+from jax import random as jran
+
+from .. import halo_keys as hk
+
+
+def test_get_halo_keys_is_independent_of_ordering():
+    ran_key = jran.key(0)
+    halo_ids = np.array([5, 2**40 + 5, 2**33, 17, 0]).astype(np.uint64)
+    halo_keys = jran.key_data(hk.get_halo_keys(ran_key, halo_ids))
+    assert len(np.unique(halo_keys, axis=0)) == halo_ids.size
+
+    indx = np.array((3, 1))
+    halo_keys2 = jran.key_data(hk.get_halo_keys(ran_key, halo_ids[indx]))
+    assert np.all(halo_keys2 == halo_keys[indx])
+
+
+def test_get_rank_within_host():
+    subs_host_halo_indx = np.array((0, 0, 0, 2, 3, 3))
+    subs_rank = hk.get_rank_within_host(subs_host_halo_indx, 5)
+    assert np.all(subs_rank == (0, 1, 2, 0, 0, 1))
+
+
+def test_get_subhalo_keys_only_depend_on_host_id_and_rank():
+    ran_key = jran.key(0)
+    halo_ids = np.array((11, 7, 3))
+    subs_host_halo_indx = np.array((0, 0, 1, 2, 2, 2))
+    subs_keys = jran.key_data(
+        hk.get_subhalo_keys(ran_key, halo_ids, subs_host_halo_indx)
+    )
+    assert len(np.unique(subs_keys, axis=0)) == subs_host_halo_indx.size
+
+    subs_keys2 = jran.key_data(
+        hk.get_subhalo_keys(ran_key, halo_ids[1:], subs_host_halo_indx[2:] - 1)
+    )
+    assert np.all(subs_keys2 == subs_keys[2:])
+
+
+def test_mc_uniform_pop():
+    ran_keys = jran.split(jran.key(0), 100)
+    uran = hk.mc_uniform_pop(ran_keys)
+    assert uran.shape == (100,)
+    uran3 = hk.mc_uniform_pop(ran_keys, ndim=3)
+    assert uran3.shape == (100, 3)
+    assert np.all((uran3 >= 0) & (uran3 < 1))
+    nran3 = hk.mc_normal3_pop(ran_keys)
+    assert nran3.shape == (100, 3)
@@ -1,21 +1,49 @@
 """ """
 
+import os
+
 import numpy as np
+from diffmah.diffmah_kernels import _log_mah_kern
+from diffmah.diffmahpop_kernels.bimod_censat_params import DEFAULT_DIFFMAHPOP_PARAMS
 from dsps.cosmology.defaults import DEFAULT_COSMOLOGY
+from dsps.cosmology.flat_wcdm import _age_at_z_kern, age_at_z0
 from jax import random as jran
+from jax import tree_util
 
+from .. import halo_keys as hk
 from .. import mc_galpop
 
+_THIS_DRNAME = os.path.dirname(os.path.abspath(__file__))
+TESTING_DATA_DRN = os.path.join(_THIS_DRNAME, "testing_data")
+
+
+def _mc_subhalos(ran_key, logmhost, lgmp_min, halo_ids=None):
+    """Subhalos of each host drawn by the stages of mc_galpop_synthetic_subs"""
+    counts_key, galpop_keys = mc_galpop._get_galpop_keys(ran_key, halo_ids is not None)
+    if halo_ids is not None:
+        counts_key = hk.get_halo_keys(counts_key, halo_ids)
+    msk_hosts = np.ones(logmhost.size).astype(bool)
+    subs_counts = mc_galpop._mc_subhalo_counts_kern(
+        counts_key, logmhost, lgmp_min, msk_hosts
+    )
+    subs_host_halo_indx = np.repeat(np.arange(logmhost.size), np.asarray(subs_counts))
+    if halo_ids is not None:
+        galpop_keys = mc_galpop._get_galpop_halo_keys(
+            galpop_keys, halo_ids, subs_host_halo_indx
+        )
+    subs_logmhost, subs_logmh = mc_galpop._subhalo_stage(
+        galpop_keys.subs_lgmu, logmhost, subs_host_halo_indx, lgmp_min
+    )
+    return galpop_keys, subs_logmh, subs_host_halo_indx
+
 
-def test_mc_subhalo_mass():
-    """Enforce that mc_subhalo_mass generates subs with 10**lgmp_min<=Msub<=Mhost"""
+def test_subhalo_stage():
+    """Enforce that the subhalo stages generate subs with 10**lgmp_min<=Msub<=Mhost"""
     ran_key = jran.key(0)
     lgmp_min = 11.0
     n_halos = 500
     logmh_host = np.linspace(lgmp_min, 15, n_halos)
-    subhalo_logmh, subs_host_halo_indx = mc_galpop._mc_subhalo_mass(
-        ran_key, logmh_host, lgmp_min
-    )
+    __, subhalo_logmh, subs_host_halo_indx = _mc_subhalos(ran_key, logmh_host, lgmp_min)
     assert np.all(np.isfinite(subhalo_logmh))
     assert np.all(subhalo_logmh >= lgmp_min)
     assert np.all(subs_host_halo_indx >= 0)
@@ -25,6 +53,27 @@ def test_mc_subhalo_mass():
     assert np.all(subhalo_logmhost >= subhalo_logmh)
 
 
+def test_subhalo_stage_with_halo_ids_is_independent_of_partition():
+    ran_key = jran.key(0)
+    lgmp_min = 11.0
+    n_halos = 500
+    logmh_host = np.linspace(lgmp_min, 15, n_halos)
+    halo_ids = np.arange(n_halos) * 3 + 2**35
+    __, subhalo_logmh, subs_host_halo_indx = _mc_subhalos(
+        ran_key, logmh_host, lgmp_min, halo_ids=halo_ids
+    )
+    assert np.all(subhalo_logmh >= lgmp_min)
+    assert np.all(logmh_host[subs_host_halo_indx] >= subhalo_logmh)
+
+    indx_lo = 300
+    __, subhalo_logmh2, subs_host_halo_indx2 = _mc_subhalos(
+        ran_key, logmh_host[indx_lo:], lgmp_min, halo_ids=halo_ids[indx_lo:]
+    )
+    msk = subs_host_halo_indx >= indx_lo
+    assert np.all(subs_host_halo_indx2 + indx_lo == subs_host_halo_indx[msk])
+    assert np.allclose(subhalo_logmh2, subhalo_logmh[msk])
+
+
 def test_mc_diffmah_params_cens():
     ran_key = jran.key(0)
     lgmp_min = 11.0
@@ -49,16 +98,42 @@ def test_mc_diffmah_params_sats():
     assert np.all(np.isfinite(mah_params))
 
 
-def test_mc_diffmah_params_halopop_synthetic_subs():
+def test_mc_diffmah_params_cens_accepts_per_halo_keys():
+    ran_key = jran.key(0)
+    n_halos = 50
+    logmh_host = np.linspace(11, 15, n_halos)
+    z_obs = 0.5
+    ran_keys = jran.split(ran_key, n_halos)
+    mah_params = mc_galpop._mc_diffmah_params_cens(
+        ran_keys, logmh_host, z_obs, DEFAULT_COSMOLOGY
+    )
+    assert np.all(np.isfinite(mah_params))
+
+    mah_params2 = mc_galpop._mc_diffmah_params_cens(
+        ran_keys[::-1], logmh_host[::-1], z_obs, DEFAULT_COSMOLOGY
+    )
+    for x, x2 in zip(mah_params, mah_params2):
+        assert np.allclose(x, x2[::-1])
+
+
+def test_diffmah_stage():
     ran_key = jran.key(0)
     lgmp_min = 11.0
     n_halos = 500
     logmhost_at_z_obs = np.linspace(lgmp_min, 15, n_halos)
     z_obs = 0.5
-    _res = mc_galpop._mc_diffmah_params_halopop_synthetic_subs(
-        ran_key, logmhost_at_z_obs, z_obs, lgmp_min, DEFAULT_COSMOLOGY
+    galpop_keys, subs_mhalo_at_z_obs, subs_host_halo_indx = _mc_subhalos(
+        ran_key, logmhost_at_z_obs, lgmp_min
+    )
+    mah_params_cens, mah_params_sats = mc_galpop._diffmah_stage(
+        galpop_keys.cens,
+        galpop_keys.sats,
+        logmhost_at_z_obs,
+        subs_mhalo_at_z_obs,
+        z_obs,
+        DEFAULT_COSMOLOGY,
+        DEFAULT_DIFFMAHPOP_PARAMS,
     )
-    mah_params_cens, mah_params_sats, subs_host_halo_indx, subs_mhalo_at_z_obs = _res
     assert np.all(np.isfinite(mah_params_cens))
     assert np.all(np.isfinite(mah_params_sats))
     assert np.all(np.isfinite(subs_host_halo_indx))
@@ -97,3 +172,195 @@ def test_mc_galpop_synthetic_subs():
 
     assert np.all(galcat["pos"] >= 0)
     assert np.all(galcat["pos"] <= Lbox)
+
+
+def test_mc_galpop_synthetic_subs_default_realization_is_unchanged():
+    """Without halo_ids, galcat is the realization of the original pipeline.
+    Reference values were computed before the pipeline was jitted."""
+    fn = os.path.join(TESTING_DATA_DRN, "mc_galpop_default_realization.npy")
+    ref = np.load(fn)
+
+    lgmp_min = 11.5
+    n_halos = 20
+    logmhost = np.linspace(lgmp_min, 14, n_halos)
+    halo_radius = np.linspace(0.1, 1.0, n_halos)
+    halo_pos = np.zeros((n_halos, 3)) + 50.0
+    halo_vel = np.zeros((n_halos, 3))
+    args = (logmhost, halo_radius, halo_pos, halo_vel, 0.5, lgmp_min)
+    galcat = mc_galpop.mc_galpop_synthetic_subs(
+        jran.key(0), *args, DEFAULT_COSMOLOGY, 100.0
+    )
+    assert np.all(galcat["upid"] == ref[:, 0])
+    assert np.allclose(galcat["logmp0"], ref[:, 1], rtol=0, atol=1e-10)
+    assert np.allclose(galcat["logsm_t_obs"], ref[:, 2], rtol=0, atol=1e-10)
+
+    # Satellites in spherical halos are no longer rotated into their major axis,
+    # which leaves the host-centric distance and speed of each satellite unchanged
+    r = np.linalg.norm(galcat["pos"] - 50.0, axis=1)
+    speed = np.linalg.norm(galcat["vel"], axis=1)
+    assert np.allclose(r, ref[:, 3], rtol=1e-3)
+    assert np.allclose(speed, ref[:, 4], rtol=1e-10)
+
+
+def test_get_capacity_bucket():
+    min_capacity = mc_galpop.MIN_CAPACITY
+    assert mc_galpop.get_capacity_bucket(0) == min_capacity
+    assert mc_galpop.get_capacity_bucket(1) == min_capacity
+    assert mc_galpop.get_capacity_bucket(min_capacity) == min_capacity
+    assert mc_galpop.get_capacity_bucket(min_capacity + 1) == 2 * min_capacity
+    for n in (5, 2_000, 100_000):
+        capacity = mc_galpop.get_capacity_bucket(n)
+        assert capacity >= n
+        assert capacity < 2 * n or capacity == min_capacity
+
+
+def test_mc_galpop_synthetic_subs_padded_agrees_with_unpadded():
+    ran_key = jran.key(0)
+    lgmp_min = 11.5
+    n_halos = 100
+    logmhost = np.linspace(lgmp_min, 14, n_halos)
+    halo_radius = np.ones_like(logmhost)
+    halo_ids = np.arange(n_halos) * 7 + 2**40
+    z_obs = 0.5
+    mc_key, pos_key, vel_key = jran.split(ran_key, 3)
+    halo_pos = np.array(jran.uniform(pos_key, shape=(n_halos, 3)))
+    halo_vel = np.array(jran.uniform(vel_key, shape=(n_halos, 3)))
+    Lbox = 2_000.0
+
+    def _mc_galpop(n):
+        return mc_galpop.mc_galpop_synthetic_subs(
+            mc_key,
+            logmhost[:n],
+            halo_radius[:n],
+            halo_pos[:n],
+            halo_vel[:n],
+            z_obs,
+            lgmp_min,
+            DEFAULT_COSMOLOGY,
+            Lbox,
+            halo_ids=halo_ids[:n],
+            padded=True,
+        )
+
+    galcat = mc_galpop.mc_galpop_synthetic_subs(
+        mc_key,
+        logmhost,
+        halo_radius,
+        halo_pos,
+        halo_vel,
+        z_obs,
+        lgmp_min,
+        DEFAULT_COSMOLOGY,
+        Lbox,
+        halo_ids=halo_ids,
+    )
+    galcat2 = _mc_galpop(n_halos)
+    assert galcat2["upid"].size == galcat["upid"].size
+    for key, val in galcat.items():
+        val2 = galcat2[key]
+        for x, x2 in zip(tree_util.tree_leaves(val), tree_util.tree_leaves(val2)):
+            assert np.allclose(x, x2, rtol=1e-10), key
+
+    # A catalog of different size in the same capacity bucket reuses the kernel
+    n_compiled = mc_galpop._mc_galpop_kern._cache_size()
+    galcat3 = _mc_galpop(n_halos - 10)
+    assert mc_galpop._mc_galpop_kern._cache_size() == n_compiled
+    assert np.all(galcat3["upid"] >= -1)
+    assert np.all(galcat3["upid"] < n_halos - 10)
+
+
+def test_mc_galpop_synthetic_subs_uses_host_concentration():
+    ran_key = jran.key(0)
+    lgmp_min = 11.5
+    n_halos = 50
+    logmhost = np.linspace(13, 14, n_halos)
+    halo_radius = np.ones_like(logmhost)
+    halo_ids = np.arange(n_halos)
+    z_obs = 0.5
+    Lbox = 2_000.0
+    halo_pos = np.zeros((n_halos, 3)) + Lbox / 2
+    halo_vel = np.zeros((n_halos, 3))
+    args = (
+        ran_key,
+        logmhost,
+        halo_radius,
+        halo_pos,
+        halo_vel,
+        z_obs,
+        lgmp_min,
+        DEFAULT_COSMOLOGY,
+        Lbox,
+    )
+
+    def _sat_radii(galcat):
+        msk_sats = galcat["upid"] >= 0
+        return np.linalg.norm(galcat["pos"][msk_sats] - Lbox / 2, axis=1)
+
+    galcat = mc_galpop.mc_galpop_synthetic_subs(*args, halo_ids=halo_ids)
+    r_default = _sat_radii(galcat)
+    assert r_default.size > 0
+    assert np.all(r_default <= 1.0 + 1e-4)
+
+    conc = np.zeros(n_halos) + mc_galpop.DEFAULT_CONC
+    galcat = mc_galpop.mc_galpop_synthetic_subs(
+        *args, halo_ids=halo_ids, concentration=conc
+    )
+    assert np.allclose(_sat_radii(galcat), r_default, atol=1e-4)
+
+    # For the same randoms, more concentrated halos have smaller radii
+    r_lo = _sat_radii(
+        mc_galpop.mc_galpop_synthetic_subs(
+            *args, halo_ids=halo_ids, concentration=conc / 2
+        )
+    )
+    r_hi = _sat_radii(
+        mc_galpop.mc_galpop_synthetic_subs(
+            *args, halo_ids=halo_ids, concentration=conc * 4
+        )
+    )
+    assert np.all(r_hi <= r_lo + 1e-4)
+    assert np.median(r_hi) < np.median(r_default) < np.median(r_lo)
+
+
+def test_mah_stage_agrees_with_log_mah_kern():
+    ran_key = jran.key(0)
+    lgmp_min = 11.0
+    n_halos = 200
+    logmhost = np.linspace(lgmp_min, 14, n_halos)
+    z_obs = 0.5
+    galpop_keys, subs_logmh, subs_host_halo_indx = _mc_subhalos(
+        ran_key, logmhost, lgmp_min
+    )
+    mah_params_cens, mah_params_sats = mc_galpop._diffmah_stage(
+        galpop_keys.cens,
+        galpop_keys.sats,
+        logmhost,
+        subs_logmh,
+        z_obs,
+        DEFAULT_COSMOLOGY,
+        DEFAULT_DIFFMAHPOP_PARAMS,
+    )
+    t0 = age_at_z0(*DEFAULT_COSMOLOGY)
+    t_obs = _age_at_z_kern(z_obs, *DEFAULT_COSMOLOGY)
+    lgt0 = np.log10(t0)
+
+    _res = mc_galpop._mah_stage(
+        mah_params_cens, mah_params_sats, subs_host_halo_indx, t0, t_obs, lgt0
+    )
+    mah_params, host_mah_params, upid = _res[:3]
+    logmp0, logmp_t_obs, lgmhost_at_t_inf, lgmu_t_inf = _res[3:]
+
+    n_cens = n_halos
+    assert np.all(upid[:n_cens] == -1)
+    assert np.all(upid[n_cens:] == subs_host_halo_indx)
+    for x, y in zip(host_mah_params, mah_params):
+        assert np.all(x[:n_cens] == y[:n_cens])
+        assert np.all(x[n_cens:] == y[subs_host_halo_indx])
+
+    assert np.allclose(logmp0, _log_mah_kern(mah_params, t0, lgt0))
+    assert np.allclose(logmp_t_obs, _log_mah_kern(mah_params, t_obs, lgt0))
+    t_peak = mah_params.t_peak
+    assert np.allclose(lgmhost_at_t_inf, _log_mah_kern(host_mah_params, t_peak, lgt0))
+    lgmh_at_t_inf = _log_mah_kern(mah_params, t_peak, lgt0)
+    assert np.allclose(lgmu_t_inf[n_cens:], (lgmh_at_t_inf - lgmhost_at_t_inf)[n_cens:])
+    assert np.all(lgmu_t_inf[:n_cens] == 0)
@@ -0,0 +1,171 @@
+""" """
+
+import numpy as np
+import pytest
+from dsps.cosmology.defaults import DEFAULT_COSMOLOGY
+from jax import random as jran
+from jax import tree_util
+
+from .. import mc_galpop
+from .. import mc_galpop_chunks as mcgc
+from .. import planner
+
+
+def test_get_chunk_edges_partitions_hosts():
+    lgmp_min = 11.0
+    n_halos = 5_000
+    logmhost = np.linspace(lgmp_min, 15, n_halos)
+    mem_budget = 100 * 1024**2
+    chunk_edges = mcgc.get_chunk_edges(logmhost, lgmp_min, mem_budget=mem_budget)
+
+    assert chunk_edges[0] == 0
+    assert chunk_edges[-1] == n_halos
+    assert np.all(np.diff(chunk_edges) > 0)
+    assert chunk_edges.size > 2
+
+    # Chunks are sized by the measured costs of the stages of the planner
+    planned_edges = planner.get_planned_chunk_edges(
+        logmhost, lgmp_min, mem_budget=mem_budget
+    )
+    assert np.all(chunk_edges == planned_edges)
+    counts = [
+        planner.estimate_galaxy_counts(logmhost[lo:hi], lgmp_min)
+        for lo, hi in zip(chunk_edges[:-1], chunk_edges[1:])
+    ]
+    peak_mem = [planner.estimate_peak_memory(x.n_cens, x.n_sats) for x in counts]
+    assert np.all(np.array(peak_mem) <= mem_budget)
+
+    # The memory per galaxy is set by the satellites of the diffmah stage
+    n_sats = sum(x.n_sats for x in counts)
+    assert mem_budget * (chunk_edges.size - 1) > n_sats * 16_000
+
+
+def test_get_chunk_edges_large_budget_is_single_chunk():
+    lgmp_min = 11.0
+    logmhost = np.linspace(lgmp_min, 15, 200)
+    chunk_edges = mcgc.get_chunk_edges(logmhost, lgmp_min)
+    assert np.all(chunk_edges == (0, 200))
+
+
+def test_mc_galpop_synthetic_subs_chunked():
+    ran_key = jran.key(0)
+    lgmp_min = 11.5
+    n_halos = 100
+    logmhost = np.linspace(lgmp_min, 14, n_halos)
+    halo_radius = np.ones_like(logmhost)
+    z_obs = 0.5
+    mc_key, pos_key, vel_key = jran.split(ran_key, 3)
+    halo_pos = np.array(jran.uniform(pos_key, shape=(n_halos, 3)))
+    halo_vel = np.array(jran.uniform(vel_key, shape=(n_halos, 3)))
+    Lbox = 2_000.0
+
+    chunk_edges = np.array((0, 60, n_halos))
+
+    galcats = list(
+        mcgc.mc_galpop_synthetic_subs_chunked(
+            mc_key,
+            logmhost,
+            halo_radius,
+            halo_pos,
+            halo_vel,
+            z_obs,
+            lgmp_min,
+            DEFAULT_COSMOLOGY,
+            Lbox,
+            chunk_edges=chunk_edges,
+        )
+    )
+    assert len(galcats) == chunk_edges.size - 1
+
+    galcat = mcgc.concatenate_galcats(galcats)
+    n_gals = sum(x["upid"].size for x in galcats)
+    assert galcat["upid"].size == n_gals
+    assert galcat["sfh_table"].shape == (n_gals, galcats[0]["t_table"].size)
+    assert np.all(np.isfinite(galcat["logsm_t_obs"]))
+
+    # Centrals come first and satellites point to their own host
+    is_cen = galcat["upid"] == -1
+    assert np.all(is_cen[:n_halos])
+    assert ~np.any(is_cen[n_halos:])
+    assert np.allclose(galcat["pos"][:n_halos], halo_pos)
+    sats_upid = galcat["upid"][n_halos:]
+    assert np.all(sats_upid < n_halos)
+    assert np.all(np.diff(sats_upid) >= 0)
+    assert np.allclose(
+        galcat["host_mah_params"].logm0[n_halos:],
+        galcat["mah_params"].logm0[sats_upid],
+    )
+
+
+def test_mc_galpop_synthetic_subs_chunked_with_halo_ids_agrees_with_single_call():
+    ran_key = jran.key(0)
+    lgmp_min = 11.5
+    n_halos = 100
+    logmhost = np.linspace(lgmp_min, 14, n_halos)
+    halo_radius = np.ones_like(logmhost)
+    halo_ids = np.arange(n_halos) * 7 + 2**40
+    z_obs = 0.5
+    mc_key, pos_key, vel_key = jran.split(ran_key, 3)
+    halo_pos = np.array(jran.uniform(pos_key, shape=(n_halos, 3)))
+    halo_vel = np.array(jran.uniform(vel_key, shape=(n_halos, 3)))
+    Lbox = 2_000.0
+    args = (
+        mc_key,
+        logmhost,
+        halo_radius,
+        halo_pos,
+        halo_vel,
+        z_obs,
+        lgmp_min,
+        DEFAULT_COSMOLOGY,
+        Lbox,
+    )
+
+    galcat = mc_galpop.mc_galpop_synthetic_subs(*args, halo_ids=halo_ids)
+
+    galcats = mcgc.mc_galpop_synthetic_subs_chunked(
+        *args, chunk_edges=np.array((0, 60, n_halos)), halo_ids=halo_ids
+    )
+    galcat2 = mcgc.concatenate_galcats(galcats)
+
+    assert np.all(galcat["upid"] == galcat2["upid"])
+    for key, val in galcat.items():
+        val2 = galcat2[key]
+        for x, x2 in zip(tree_util.tree_leaves(val), tree_util.tree_leaves(val2)):
+            assert np.allclose(x, x2, rtol=1e-10), key
+
+
+def test_concatenate_host_major_galcats_agrees_with_single_call():
+    ran_key = jran.key(0)
+    lgmp_min = 11.5
+    n_halos = 60
+    logmhost = np.linspace(lgmp_min, 14, n_halos)
+    halo_radius = np.ones_like(logmhost)
+    halo_ids = np.arange(n_halos) * 7 + 2**40
+    pos_key, vel_key = jran.split(ran_key, 2)
+    halo_pos = np.array(jran.uniform(pos_key, shape=(n_halos, 3)))
+    halo_vel = np.array(jran.uniform(vel_key, shape=(n_halos, 3)))
+    args = (ran_key, logmhost, halo_radius, halo_pos, halo_vel, 0.5, lgmp_min)
+    args = (*args, DEFAULT_COSMOLOGY, 2_000.0)
+    kwargs = dict(halo_ids=halo_ids, store_tables=False, layout="host_major")
+
+    galcat = mc_galpop.mc_galpop_synthetic_subs(*args, padded=True, **kwargs)
+    galcats = list(
+        mcgc.mc_galpop_synthetic_subs_chunked(
+            *args, chunk_edges=np.array((0, 30, n_halos)), **kwargs
+        )
+    )
+    galcat2 = mcgc.concatenate_galcats(galcats)
+
+    assert galcat2["host_offsets"].size == n_halos + 1
+    assert set(galcat) == set(galcat2)
+    for key, val in galcat.items():
+        val2 = galcat2[key]
+        for x, x2 in zip(tree_util.tree_leaves(val), tree_util.tree_leaves(val2)):
+            assert np.allclose(x, x2, rtol=1e-10), key
+
+    galcat3 = mc_galpop.mc_galpop_synthetic_subs(*args, halo_ids=halo_ids)
+    with pytest.raises(ValueError):
+        mcgc.concatenate_galcats([galcats[0], galcat3])
+    with pytest.raises(ValueError):
+        mcgc.concatenate_galcats([])
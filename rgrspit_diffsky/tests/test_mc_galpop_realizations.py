@@ -0,0 +1,156 @@
+""" """
+
+from collections import namedtuple
+
+import numpy as np
+import pytest
+from dsps.cosmology.defaults import DEFAULT_COSMOLOGY
+from jax import random as jran
+
+from .. import galcat_io
+from .. import halo_keys as hk
+from .. import mc_galpop
+from .. import mc_galpop_realizations as mgr
+
+
+def _get_halos(n_halos=50, lgmp_min=11.5, seed=0):
+    rng = np.random.default_rng(seed)
+    logmhost = np.sort(rng.uniform(lgmp_min, 14, n_halos))
+    halo_radius = np.ones(n_halos)
+    halo_pos = rng.uniform(0, 100, size=(n_halos, 3))
+    halo_vel = rng.normal(size=(n_halos, 3))
+    halo_ids = rng.choice(10**12, n_halos, replace=False)
+    args = (logmhost, halo_radius, halo_pos, halo_vel, 0.5, lgmp_min)
+    return (*args, DEFAULT_COSMOLOGY, 100.0), halo_ids
+
+
+def _get_realization_inputs():
+    """Keys and padding shared by the tests, so that they share compiled kernels"""
+    args, halo_ids = _get_halos()
+    ran_keys = jran.split(jran.key(0), 4)
+    n_sats_pad = mgr.get_n_sats_max(ran_keys, args[0], args[5], halo_ids) + 10
+    return ran_keys, args, halo_ids, n_sats_pad
+
+
+def _get_subhalo_counts(ran_key, logmhost, lgmp_min, halo_ids=None):
+    """Number of subhalos of each host drawn by mc_galpop_synthetic_subs"""
+    counts_key = mc_galpop._get_galpop_keys(ran_key, halo_ids is not None)[0]
+    if halo_ids is not None:
+        counts_key = hk.get_halo_keys(counts_key, halo_ids)
+    msk_hosts = np.ones(logmhost.size, dtype=bool)
+    return mc_galpop._mc_subhalo_counts_kern(counts_key, logmhost, lgmp_min, msk_hosts)
+
+
+def test_get_n_sats_max():
+    args, halo_ids = _get_halos()
+    logmhost, lgmp_min = args[0], args[5]
+    ran_keys = jran.split(jran.key(0), 4)
+    for ids in (halo_ids, None):
+        n_sats = [
+            np.sum(_get_subhalo_counts(x, logmhost, lgmp_min, ids)) for x in ran_keys
+        ]
+        n_sats_max = mgr.get_n_sats_max(ran_keys, logmhost, lgmp_min, ids)
+        assert n_sats_max == np.max(n_sats)
+        assert mgr.get_n_sats_max(ran_keys, logmhost, lgmp_min, ids, 2) == n_sats_max
+
+    # Too small a padding is detected before drawing the galaxies
+    with pytest.raises(ValueError):
+        mgr.mc_galpop_realizations(ran_keys, *args, n_sats_pad=n_sats_max - 1)
+
+
+def test_get_realization():
+    Params = namedtuple("Params", ("x", "y"))
+    msk_gals = np.array([[1, 1, 1, 0, 0], [1, 1, 1, 1, 0]], dtype=bool)
+    logsm = np.arange(10.0).reshape((2, 5))
+    galcats = dict(
+        logsm_t_obs=logsm,
+        pos=np.repeat(logsm, 3).reshape((2, 5, 3)),
+        mah_params=Params(logsm, -logsm),
+        t_table=np.linspace(0.1, 13.8, 5),
+        t0=13.8,
+        t_obs=8.6,
+        z_obs=0.5,
+        msk_gals=msk_gals,
+    )
+    for i in range(2):
+        galcat = mgr.get_realization(galcats, i)
+        assert "msk_gals" not in galcat
+        assert np.all(galcat["logsm_t_obs"] == logsm[i][msk_gals[i]])
+        assert galcat["pos"].shape == (np.sum(msk_gals[i]), 3)
+        assert np.all(galcat["pos"] == galcat["logsm_t_obs"][:, None])
+        assert np.all(galcat["mah_params"].y == -galcat["logsm_t_obs"])
+        for key in galcat_io.GALCAT_SHARED_KEYS:
+            assert np.all(galcat[key] == galcats[key])
+
+
+def test_get_batch_size():
+    n_hosts, n_sats = 10_000, 20_000
+    batch_size = mgr.get_batch_size(n_hosts, n_sats, mem_budget=4 * 1024**3)
+    assert batch_size > 1
+    assert mgr.get_batch_size(n_hosts, 2 * n_sats, 4 * 1024**3) < batch_size
+    assert mgr.get_batch_size(n_hosts, n_sats, 4 * 1024**3, False) > batch_size
+    assert mgr.get_batch_size(n_hosts, n_sats, mem_budget=1) == 1
+
+
+def test_galpop_realizations_agree_with_single_realizations(tmp_path):
+    ran_keys, args, halo_ids, n_sats_pad = _get_realization_inputs()
+    galcats = mgr.mc_galpop_realizations(
+        ran_keys[:2], *args, halo_ids=halo_ids, n_sats_pad=n_sats_pad
+    )
+
+    n_cens = args[0].size
+    n_gals = n_cens + n_sats_pad
+    assert galcats["msk_gals"].shape == (2, n_gals)
+    assert np.all(galcats["msk_gals"][:, :n_cens])
+    assert not np.any(galcats["msk_gals"][:, -10:])
+    assert galcats["logsm_t_obs"].shape == (2, n_gals)
+    assert galcats["pos"].shape == (2, n_gals, 3)
+    assert galcats["t_table"].shape == (mc_galpop.N_T_TABLE,)
+
+    for i, ran_key in enumerate(ran_keys[:2]):
+        galcat = mc_galpop.mc_galpop_synthetic_subs(
+            ran_key, *args, halo_ids=halo_ids, padded=True
+        )
+        galcat_i = mgr.get_realization(galcats, i)
+        assert galcat_i["upid"].size == np.sum(galcats["msk_gals"][i])
+        columns = galcat_io.flatten_galcat(galcat)
+        columns_i = galcat_io.flatten_galcat(galcat_i)
+        assert set(columns) == set(columns_i)
+        for key, val in columns.items():
+            assert np.allclose(val, columns_i[key], rtol=1e-4), key
+
+    # Batches of two realizations share the kernel compiled above
+    realizations = mgr.iter_galpop_realizations(
+        ran_keys, *args, batch_size=2, halo_ids=halo_ids, n_sats_pad=n_sats_pad
+    )
+    for i, galcat in enumerate(realizations):
+        if i < 2:
+            galcat_i = mgr.get_realization(galcats, i)
+            assert np.all(galcat["logsm_t_obs"] == galcat_i["logsm_t_obs"])
+            assert np.all(galcat["pos"] == galcat_i["pos"])
+    assert i == 3
+    assert not np.allclose(
+        galcat["logsm_t_obs"][:n_cens], galcat_i["logsm_t_obs"][:n_cens]
+    )
+
+    output_dir = str(tmp_path / "realizations")
+    fnames = mgr.write_galpop_realizations(
+        output_dir,
+        ran_keys[:2],
+        *args,
+        batch_size=2,
+        fmt="npy",
+        columns=["logsm_t_obs", "upid"],
+        halo_ids=halo_ids,
+        n_sats_pad=n_sats_pad,
+    )
+    assert fnames == [
+        mgr.get_realization_fname(output_dir, i, fmt="npy") for i in range(2)
+    ]
+    for i, fname in enumerate(fnames):
+        galcat_i = mgr.get_realization(galcats, i)
+        columns = galcat_io.load_galcat_npy(fname)
+        assert set(columns) == {"logsm_t_obs", "upid"}
+        assert np.all(columns["logsm_t_obs"] == galcat_i["logsm_t_obs"])
+        assert np.all(columns["upid"] == galcat_i["upid"])
+        assert galcat_io.load_galcat_attrs_npy(fname)["realization"] == i
@@ -0,0 +1,129 @@
+""" """
+
+import os
+import subprocess
+import sys
+
+import numpy as np
+from diffstarpop.defaults import DEFAULT_DIFFSTARPOP_PARAMS
+from dsps.cosmology.defaults import DEFAULT_COSMOLOGY
+from jax import random as jran
+from jax import tree_util
+
+from .. import mc_galpop
+from .. import mc_galpop_sharded as mcgs
+from .. import worker_setup
+
+
+def test_get_shard_edges_partitions_hosts():
+    lgmp_min = 11.0
+    n_halos = 5_000
+    logmhost = np.linspace(lgmp_min, 15, n_halos)
+    for n_shards in (1, 2, 7, 64):
+        shard_edges = mcgs.get_shard_edges(logmhost, lgmp_min, n_shards)
+        assert shard_edges.size == n_shards + 1
+        assert shard_edges[0] == 0
+        assert shard_edges[-1] == n_halos
+        assert np.all(np.diff(shard_edges) > 0)
+
+    # Massive hosts have more satellites and so their shards have fewer hosts
+    shard_edges = mcgs.get_shard_edges(logmhost, lgmp_min, 4)
+    n_hosts_per_shard = np.diff(shard_edges)
+    assert n_hosts_per_shard[0] > n_hosts_per_shard[-1]
+
+
+def test_get_shard_edges_more_shards_than_hosts():
+    lgmp_min = 11.0
+    logmhost = np.array((15.0, 15.0, 15.0, 11.0, 11.0))
+    shard_edges = mcgs.get_shard_edges(logmhost, lgmp_min, 10)
+    assert np.all(shard_edges == np.arange(6))
+
+    shard_edges = mcgs.get_shard_edges(logmhost, lgmp_min, 4)
+    assert shard_edges.size == 5
+    assert np.all(np.diff(shard_edges) > 0)
+
+
+def _get_worker_xla_flags(_):
+    return os.environ.get("XLA_FLAGS", "")
+
+
+def test_workers_run_single_threaded_xla():
+    xla_flags = os.environ.get("XLA_FLAGS")
+    with mcgs.get_executor(1) as executor:
+        worker_xla_flags = executor.submit(_get_worker_xla_flags, None).result()
+    assert worker_setup.WORKER_XLA_FLAGS in worker_xla_flags.split()
+    assert os.environ.get("XLA_FLAGS") == xla_flags
+
+
+def test_worker_setup_sets_xla_flags_before_jax_is_imported():
+    """Spawned workers import the console script and worker_setup before
+    init_worker runs, and JAX must not be loaded by then for XLA_FLAGS to take effect"""
+    code = "; ".join(
+        (
+            "import sys",
+            "import rgrspit_diffsky.cli",
+            "import rgrspit_diffsky.worker_setup",
+            "assert 'jax' not in sys.modules",
+        )
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def _get_galpop_args(n_halos=100):
+    ran_key = jran.key(0)
+    lgmp_min = 11.5
+    logmhost = np.linspace(lgmp_min, 14, n_halos)
+    halo_radius = np.ones_like(logmhost)
+    halo_ids = np.arange(n_halos) * 7 + 2**40
+    z_obs = 0.5
+    mc_key, pos_key, vel_key = jran.split(ran_key, 3)
+    halo_pos = np.array(jran.uniform(pos_key, shape=(n_halos, 3)))
+    halo_vel = np.array(jran.uniform(vel_key, shape=(n_halos, 3)))
+    Lbox = 2_000.0
+    args = (
+        mc_key,
+        logmhost,
+        halo_radius,
+        halo_pos,
+        halo_vel,
+        z_obs,
+        lgmp_min,
+        DEFAULT_COSMOLOGY,
+        Lbox,
+    )
+    return args, halo_ids
+
+
+def test_mc_galpop_synthetic_subs_sharded_with_halo_ids_agrees_with_single_call():
+    args, halo_ids = _get_galpop_args()
+    galcat = mc_galpop.mc_galpop_synthetic_subs(*args, halo_ids=halo_ids, padded=True)
+    galcat2 = mcgs.mc_galpop_synthetic_subs_sharded(
+        *args, halo_ids=halo_ids, n_workers=1, n_shards=3
+    )
+
+    assert np.all(galcat["upid"] == galcat2["upid"])
+    for key, val in galcat.items():
+        val2 = galcat2[key]
+        for x, x2 in zip(tree_util.tree_leaves(val), tree_util.tree_leaves(val2)):
+            assert np.allclose(x, x2, rtol=1e-10), key
+
+
+def test_mc_galpop_synthetic_subs_sharded_passes_diffstarpop_params():
+    args, halo_ids = _get_galpop_args(n_halos=20)
+    cens_params = DEFAULT_DIFFSTARPOP_PARAMS.sfh_pdf_cens_params
+    cens_params = cens_params._replace(
+        frac_quench_cen_x0=cens_params.frac_quench_cen_x0 + 0.5
+    )
+    diffstarpop_params = DEFAULT_DIFFSTARPOP_PARAMS._replace(
+        sfh_pdf_cens_params=cens_params
+    )
+    kwargs = dict(halo_ids=halo_ids, padded=True, diffstarpop_params=diffstarpop_params)
+    galcat = mc_galpop.mc_galpop_synthetic_subs(*args, **kwargs)
+    galcat2 = mcgs.mc_galpop_synthetic_subs_sharded(
+        *args, n_workers=1, n_shards=2, **kwargs
+    )
+    galcat3 = mcgs.mc_galpop_synthetic_subs_sharded(
+        *args, halo_ids=halo_ids, n_workers=1, n_shards=2
+    )
+    assert np.allclose(galcat["logsm_t_obs"], galcat2["logsm_t_obs"], rtol=1e-10)
+    assert not np.allclose(galcat2["logsm_t_obs"], galcat3["logsm_t_obs"])
@@ -0,0 +1,98 @@
+""" """
+
+import json
+import os
+from time import time
+
+import numpy as np
+import pytest
+
+from .. import galcat_io
+from .. import mock_reader as mr
+
+
+def _write_fake_shards(dirname, n_cens=(5, 8, 3)):
+    shard_dirs = []
+    row = 0
+    for ishard, n in enumerate(n_cens):
+        n_gals = 3 * n
+        galcat = dict()
+        galcat["upid"] = np.concatenate(
+            (np.zeros(n).astype(int) - 1, np.arange(n_gals - n) % n)
+        )
+        galcat["logsm_t_obs"] = np.arange(row, row + n_gals).astype(float)
+        galcat["pos"] = np.zeros((n_gals, 3)) + ishard
+        galcat["t_table"] = np.linspace(0.1, 13.8, 5)
+        shard_dir = os.path.join(dirname, "galcat_{0:03d}".format(ishard))
+        galcat_io.write_galcats(shard_dir, [galcat], fmt="npy")
+        shard_dirs.append(shard_dir)
+        row += n_gals
+    return shard_dirs
+
+
+def test_mock_catalog_columns_and_rows(tmp_path):
+    shard_dirs = _write_fake_shards(str(tmp_path))
+    mock = mr.MockCatalog(shard_dirs)
+    n_gals = 3 * (5 + 8 + 3)
+    assert len(mock) == n_gals
+    assert set(mock.colnames) == set(("upid", "logsm_t_obs", "pos", "t_table"))
+
+    logsm = mock["logsm_t_obs"]
+    assert np.allclose(logsm, np.arange(n_gals))
+    assert mock.get("pos").shape == (n_gals, 3)
+    assert mock.get("t_table").shape == (5,)
+
+    # Rows within a single shard are memory-mapped views with no copy
+    x = mock.get("logsm_t_obs", rows=(16, 30))
+    assert isinstance(x, np.memmap)
+    assert not x.flags.writeable
+    assert np.allclose(x, np.arange(16, 30))
+
+    # Rows spanning several shards
+    x = mock.get("logsm_t_obs", rows=slice(10, 45))
+    assert np.allclose(x, np.arange(10, 45))
+    assert mock.get("logsm_t_obs", rows=(3, 3)).size == 0
+
+    # upid is the row of the host central in the virtual catalog
+    upid = mock["upid"]
+    is_sat = upid != -1
+    assert np.all(upid[upid[is_sat]] == -1)
+    assert np.all(mock.get("pos")[is_sat, 0] == mock.get("pos")[upid[is_sat], 0])
+
+    galcat = mock.load(["pos", "upid"], rows=(20, 40))
+    assert galcat["pos"].shape == (20, 3)
+    assert np.all(galcat["upid"] == upid[20:40])
+
+    with pytest.raises(KeyError):
+        mock.get("not_a_column")
+    with pytest.raises(ValueError):
+        mock.get("pos", rows=slice(0, 10, 2))
+
+    # Shards passed as an iterator, e.g., from glob.iglob
+    mock2 = mr.MockCatalog(iter(shard_dirs))
+    assert mock2.shard_dirs == shard_dirs
+    assert np.all(mock2.n_gals_per_shard == mock.n_gals_per_shard)
+    assert len(mock2) == n_gals
+
+
+def test_iter_shards(tmp_path):
+    shard_dirs = _write_fake_shards(str(tmp_path))
+    mock = mr.MockCatalog(shard_dirs)
+    chunks = list(mock.iter_shards(["logsm_t_obs"], rows=(10, 45)))
+    assert [x[0] for x in chunks] == [10, 15, 39]
+    for row_offset, galcat in chunks:
+        x = galcat["logsm_t_obs"]
+        assert isinstance(x, np.memmap)
+        assert np.allclose(x, row_offset + np.arange(x.size))
+
+
+def test_open_mock_from_manifest(tmp_path):
+    shard_dirs = _write_fake_shards(str(tmp_path))
+    manifest = dict(shards=[dict(shard_fname=x) for x in shard_dirs])
+    with open(os.path.join(str(tmp_path), mr.MANIFEST_BASENAME), "w") as f:
+        json.dump(manifest, f)
+
+    start = time()
+    mock = mr.open_mock(str(tmp_path))
+    assert time() - start < 1.0
+    assert len(mock) == 48
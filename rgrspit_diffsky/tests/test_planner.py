@@ -0,0 +1,157 @@
+""" """
+
+import numpy as np
+import pytest
+from diffsky.mass_functions.mc_subs import _compute_mean_subhalo_counts
+from dsps.cosmology.defaults import DEFAULT_COSMOLOGY
+from jax import random as jran
+
+from .. import galcat_io, mc_galpop
+from .. import planner as pl
+from ..galcat_io import GALCAT_SHARED_KEYS
+
+
+def test_estimate_galaxy_counts():
+    lgmp_min = 11.0
+    logmhost = np.linspace(lgmp_min, 15, 500)
+    counts = pl.estimate_galaxy_counts(logmhost, lgmp_min)
+    assert counts.n_cens == logmhost.size
+    n_sats = np.sum(_compute_mean_subhalo_counts(logmhost, lgmp_min))
+    assert np.isclose(counts.n_sats, n_sats)
+    assert np.isclose(counts.n_sats_std, np.sqrt(n_sats))
+
+
+def test_get_galcat_column_bytes_agrees_with_galcat():
+    lgmp_min = 11.5
+    n_halos = 20
+    logmhost = np.linspace(lgmp_min, 14, n_halos)
+    halo_radius = np.ones(n_halos)
+    halo_pos = np.zeros((n_halos, 3))
+    halo_vel = np.zeros((n_halos, 3))
+    for store_tables in (True, False):
+        galcat = mc_galpop.mc_galpop_synthetic_subs(
+            jran.key(0),
+            logmhost,
+            halo_radius,
+            halo_pos,
+            halo_vel,
+            0.5,
+            lgmp_min,
+            DEFAULT_COSMOLOGY,
+            1_000.0,
+            store_tables=store_tables,
+        )
+        galcat = {k: v for k, v in galcat.items() if k not in GALCAT_SHARED_KEYS}
+        columns = galcat_io.flatten_galcat(galcat)
+        column_bytes = pl.get_galcat_column_bytes(store_tables)
+        assert set(column_bytes) == set(columns)
+        for key, val in columns.items():
+            val = np.asarray(val)
+            assert column_bytes[key] == val.nbytes // val.shape[0]
+
+
+def test_estimate_memory_and_runtime_increase_with_galaxies():
+    n_cens, n_sats = 10_000, 20_000
+    stage_mem = pl.estimate_stage_memory(n_cens, n_sats)
+    assert set(stage_mem) == set(pl.DEFAULT_STAGE_COSTS)
+    assert "mah_table" not in pl.estimate_stage_memory(n_cens, n_sats, False)
+    assert "halo_keys" not in pl.estimate_stage_runtime(n_cens, n_sats, halo_ids=False)
+
+    peak_mem = pl.estimate_peak_memory(n_cens, n_sats)
+    assert peak_mem > max(stage_mem.values())
+    assert pl.estimate_peak_memory(n_cens, n_sats, store_tables=False) < peak_mem
+    assert pl.estimate_peak_memory(n_cens, 2 * n_sats) > peak_mem
+    assert pl.estimate_peak_memory(n_cens, n_sats, padded=False) < peak_mem
+
+    runtime = sum(pl.estimate_stage_runtime(n_cens, n_sats).values())
+    assert runtime > 0
+    assert sum(pl.estimate_stage_runtime(n_cens, 2 * n_sats).values()) > runtime
+
+
+def test_single_precision_halves_the_predicted_memory():
+    n_cens, n_sats = 10_000, 20_000
+    peak_mem = pl.estimate_peak_memory(n_cens, n_sats)
+    peak_mem32 = pl.estimate_peak_memory(n_cens, n_sats, precision="float32")
+    assert 0.45 * peak_mem < peak_mem32 < 0.55 * peak_mem
+    peak_mem_mixed = pl.estimate_peak_memory(n_cens, n_sats, precision="mixed")
+    assert peak_mem32 < peak_mem_mixed < peak_mem
+
+    column_bytes = pl.get_galcat_column_bytes(precision="mixed")
+    assert column_bytes["logsm_t_obs"] == 4
+    assert column_bytes["upid"] == pl.get_galcat_column_bytes()["upid"]
+
+    logmhost = np.linspace(11.0, 15, 2_000)
+    chunk_edges = pl.get_planned_chunk_edges(logmhost, 11.0, 512 * 1024**2)
+    chunk_edges32 = pl.get_planned_chunk_edges(
+        logmhost, 11.0, 512 * 1024**2, precision="float32"
+    )
+    assert chunk_edges32.size < chunk_edges.size
+
+
+def test_get_planned_chunk_edges_fit_the_budget():
+    lgmp_min = 11.0
+    logmhost = np.linspace(lgmp_min, 14.5, 20_000)
+    mean_n_sats = _compute_mean_subhalo_counts(logmhost, lgmp_min)
+    mem_budget = 200 * 1024**2
+    chunk_edges = pl.get_planned_chunk_edges(logmhost, lgmp_min, mem_budget)
+
+    assert chunk_edges[0] == 0
+    assert chunk_edges[-1] == logmhost.size
+    assert np.all(np.diff(chunk_edges) > 0)
+    assert chunk_edges.size > 2
+    for indx_lo, indx_hi in zip(chunk_edges[:-1], chunk_edges[1:]):
+        n_sats = np.sum(mean_n_sats[indx_lo:indx_hi])
+        peak_mem = pl.estimate_peak_memory(indx_hi - indx_lo, int(n_sats))
+        assert peak_mem <= mem_budget
+
+    chunk_edges2 = pl.get_planned_chunk_edges(logmhost, lgmp_min, mem_budget / 2)
+    assert chunk_edges2.size > chunk_edges.size
+
+    chunk_edges3 = pl.get_planned_chunk_edges(logmhost, lgmp_min, 1024**4)
+    assert np.all(chunk_edges3 == (0, logmhost.size))
+
+
+def test_plan_galpop():
+    lgmp_min = 11.0
+    logmhost = np.linspace(lgmp_min, 14.5, 20_000)
+    mem_budget = 4 * 1024**3
+    plan = pl.plan_galpop(logmhost, lgmp_min, mem_budget, n_workers=2)
+    assert plan.n_hosts == logmhost.size
+    assert plan.chunk_peak_mem <= mem_budget / 2 - pl.DEFAULT_PROCESS_BYTES
+    assert plan.chunk_edges[-1] == logmhost.size
+    assert plan.peak_mem == pl.estimate_peak_memory(
+        plan.n_hosts, int(np.ceil(plan.n_sats))
+    )
+    assert plan.output_bytes > plan.galcat_bytes
+    assert plan.runtime > 0
+
+    plan2 = pl.plan_galpop(
+        logmhost, lgmp_min, mem_budget, exclude=["log_mah_table", "sfh_table"]
+    )
+    assert "mah_table" not in plan2.stage_mem
+    assert plan2.galcat_bytes < plan.galcat_bytes
+    assert plan2.output_bytes < plan.output_bytes
+    assert plan2.chunk_edges.size <= plan.chunk_edges.size
+
+
+def test_plan_galpop_raises_without_memory_for_galaxies():
+    logmhost = np.linspace(11, 14, 100)
+    with pytest.raises(ValueError):
+        pl.plan_galpop(logmhost, 11.0, pl.DEFAULT_PROCESS_BYTES, n_workers=2)
+
+
+def test_stage_costs_roundtrip(tmp_path):
+    fname = str(tmp_path / "stage_costs.json")
+    pl.save_stage_costs(fname, pl.DEFAULT_STAGE_COSTS)
+    assert pl.load_stage_costs(fname) == pl.DEFAULT_STAGE_COSTS
+
+
+def test_calibrate_stage_costs():
+    calibration_catalogs = ((200, 11.0), (500, 11.0), (200, 12.0))
+    stage_costs = pl.calibrate_stage_costs(calibration_catalogs, lgmp_min=11.5)
+    assert set(stage_costs) == set(pl.DEFAULT_STAGE_COSTS)
+    for cost in stage_costs.values():
+        assert np.all(np.array(cost) >= 0)
+    diffmah_cost = stage_costs["diffmah"]
+    assert diffmah_cost.bytes_per_cen + diffmah_cost.bytes_per_sat > 0
+    assert pl.estimate_peak_memory(1_000, 1_000, stage_costs=stage_costs) > 0
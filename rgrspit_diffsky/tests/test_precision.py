@@ -0,0 +1,111 @@
+""" """
+
+from collections import namedtuple
+
+import numpy as np
+import pytest
+from dsps.cosmology.defaults import DEFAULT_COSMOLOGY
+from jax import numpy as jnp
+from jax import random as jran
+from jax import tree_util
+
+from .. import mc_galpop
+from .. import mc_galpop_sharded as mcgs
+from .. import precision as prec
+
+LBOX = 500.0
+
+
+def _get_galpop_args(n_halos=50, lgmp_min=11.5):
+    pos_key, vel_key = jran.split(jran.key(1), 2)
+    logmhost = np.linspace(lgmp_min, 14, n_halos)
+    halo_radius = np.ones_like(logmhost)
+    halo_pos = np.array(jran.uniform(pos_key, shape=(n_halos, 3))) * LBOX
+    halo_vel = np.array(jran.normal(vel_key, shape=(n_halos, 3))) * 200.0
+    args = (logmhost, halo_radius, halo_pos, halo_vel, 0.5, lgmp_min)
+    return (*args, DEFAULT_COSMOLOGY, LBOX)
+
+
+def _get_float_dtypes(galcat):
+    leaves = tree_util.tree_leaves({k: v for k, v in galcat.items() if k != "z_obs"})
+    return {x.dtype for x in leaves if jnp.issubdtype(x.dtype, jnp.floating)}
+
+
+def test_get_precision_policy():
+    assert set(prec.PRECISIONS) == set(prec.PRECISION_POLICIES)
+    assert prec.DEFAULT_PRECISION in prec.PRECISIONS
+    policy = prec.get_precision_policy("mixed")
+    assert policy.compute_dtype == np.float64
+    assert policy.output_dtype == np.float32
+    with pytest.raises(ValueError):
+        prec.get_precision_policy("float16")
+
+
+def test_check_precision():
+    # Importing the pipeline enables jax_enable_x64
+    assert prec.get_precision() == "float64"
+    assert prec.check_precision() == "float64"
+    assert prec.check_precision("mixed") == "mixed"
+    with pytest.raises(ValueError):
+        prec.check_precision("float32")
+    with pytest.raises(ValueError):
+        prec.check_precision("float16")
+
+
+def test_cast_floats():
+    Params = namedtuple("Params", ("a", "b"))
+    tree = dict(
+        x=np.zeros(3),
+        y=jnp.ones(2),
+        params=Params(np.float64(1.0), 2.0),
+        ids=np.arange(3),
+        key=jran.key(0),
+    )
+    tree32 = prec.cast_floats(tree, np.float32)
+    assert tree32["x"].dtype == np.float32
+    assert tree32["y"].dtype == np.float32
+    assert tree32["params"].a.dtype == np.float32
+    assert tree32["params"].b == 2.0
+    assert tree32["ids"].dtype == tree["ids"].dtype
+    assert tree32["key"] is tree["key"]
+    assert prec.cast_floats(tree32, np.float32)["x"] is tree32["x"]
+
+
+def test_precisions_of_mc_galpop():
+    args = _get_galpop_args()
+    halo_ids = np.arange(args[0].size)
+    galcat = mc_galpop.mc_galpop_synthetic_subs(jran.key(0), *args, halo_ids=halo_ids)
+
+    # Mixed precision shares the float64 kernels and returns single precision
+    galcat_mixed = mc_galpop.mc_galpop_synthetic_subs(
+        jran.key(0), *args, halo_ids=halo_ids, precision="mixed"
+    )
+    assert _get_float_dtypes(galcat) == {np.dtype(np.float64)}
+    assert _get_float_dtypes(galcat_mixed) == {np.dtype(np.float32)}
+    assert np.all(galcat["upid"] == galcat_mixed["upid"])
+    assert np.allclose(galcat_mixed["pos"], galcat["pos"], rtol=0, atol=1e-7 * LBOX)
+    assert np.allclose(galcat_mixed["logsm_t_obs"], galcat["logsm_t_obs"], atol=1e-6)
+
+    # float32 requires a process whose precision is set before compiling kernels
+    with pytest.raises(ValueError):
+        mc_galpop.mc_galpop_synthetic_subs(jran.key(0), *args, precision="float32")
+    with mcgs.get_executor(1, precision="float32") as executor:
+        galcat2 = mcgs.mc_galpop_synthetic_subs_sharded(
+            jran.key(0),
+            *args,
+            halo_ids=halo_ids,
+            n_shards=1,
+            executor=executor,
+            precision="float32",
+        )
+    assert _get_float_dtypes(galcat2) == {np.dtype(np.float32)}
+    for key in ("pos", "vel", "logsm_t_obs", "logmp_t_obs"):
+        assert np.all(np.isfinite(galcat2[key])), key
+    assert np.all(galcat2["pos"] >= 0)
+    assert np.all(galcat2["pos"] < LBOX)
+
+    # Draws in single precision are a different realization with the same statistics
+    n_gals, n_gals2 = galcat["upid"].size, galcat2["upid"].size
+    assert abs(n_gals - n_gals2) < 0.05 * n_gals
+    logsm, logsm2 = galcat["logsm_t_obs"], galcat2["logsm_t_obs"]
+    assert np.isclose(np.median(logsm), np.median(logsm2), atol=0.1)
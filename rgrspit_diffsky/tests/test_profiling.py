@@ -0,0 +1,125 @@
+""" """
+
+import logging
+
+import numpy as np
+from dsps.cosmology.defaults import DEFAULT_COSMOLOGY
+from jax import jit as jjit
+from jax import numpy as jnp
+from jax import random as jran
+from jax import tree_util
+
+from .. import mc_galpop
+from .. import profiling as prof
+from .. import run_mock as rm
+from .test_run_mock import _load_fake_slab
+
+
+def test_stage_profiler_records_compile_and_execute_time(tmp_path):
+    fname = str(tmp_path / "profile.jsonl")
+    profiler = prof.StageProfiler(sink=prof.JsonLinesSink(fname), tags=dict(run=0))
+
+    @jjit
+    def _kern(x):
+        return jnp.cumsum(jnp.sin(x) ** 2)
+
+    x = np.linspace(0, 1, 1_000)
+    res = profiler.run("stage1", _kern, x)
+    assert np.allclose(res, np.cumsum(np.sin(x) ** 2), rtol=1e-4)
+    profiler.run("stage1", _kern, x)
+    profiler.tagged(chunk=3).run("stage2", np.sum, x)
+
+    stats1, stats2, stats3 = profiler.records
+    assert stats1.n_compiles >= 1
+    assert stats1.compile_time > 0
+    assert stats2.n_compiles == 0
+    assert stats2.compile_time == 0
+    for stats in profiler.records:
+        assert stats.wall_time >= stats.execute_time >= 0
+        assert stats.peak_rss > 0
+    assert stats3.tags == dict(run=0, chunk=3)
+
+    summary = profiler.summary()
+    assert list(summary) == ["stage1", "stage2"]
+    assert summary["stage1"].tags == dict(n_calls=2)
+    assert np.isclose(summary["stage1"].wall_time, stats1.wall_time + stats2.wall_time)
+
+    records = prof.load_profile(fname)
+    assert [x["stage"] for x in records] == ["stage1", "stage1", "stage2"]
+    assert records[2]["tags"] == dict(run=0, chunk=3)
+    assert records[0]["wall_time"] == stats1.wall_time
+
+
+def test_run_stage_without_profiler_calls_func():
+    assert prof.run_stage(None, "stage", np.add, 1, 2) == 3
+
+
+def test_logging_sink(caplog):
+    profiler = prof.StageProfiler(sink=prof.LoggingSink())
+    with caplog.at_level(logging.INFO, logger=prof.__name__):
+        profiler.run("my_stage", np.sum, np.ones(3))
+    assert "my_stage" in caplog.text
+
+
+def test_profiled_galpop_agrees_with_fused_kernel():
+    ran_key = jran.key(0)
+    lgmp_min = 11.5
+    n_halos = 100
+    logmhost = np.linspace(lgmp_min, 14, n_halos)
+    halo_radius = np.ones_like(logmhost)
+    Lbox = 500.0
+    halo_pos = np.zeros((n_halos, 3)) + Lbox / 2
+    halo_vel = np.zeros((n_halos, 3))
+    args = (
+        ran_key,
+        logmhost,
+        halo_radius,
+        halo_pos,
+        halo_vel,
+        0.5,
+        lgmp_min,
+        DEFAULT_COSMOLOGY,
+        Lbox,
+    )
+    kwargs = dict(halo_ids=np.arange(n_halos), padded=True)
+    galcat = mc_galpop.mc_galpop_synthetic_subs(*args, **kwargs)
+
+    profiler = prof.StageProfiler()
+    galcat2 = mc_galpop.mc_galpop_synthetic_subs(*args, profiler=profiler, **kwargs)
+    assert set(galcat) == set(galcat2)
+    for key, val in galcat.items():
+        leaves2 = tree_util.tree_leaves(galcat2[key])
+        for x, x2 in zip(tree_util.tree_leaves(val), leaves2):
+            assert np.allclose(x, x2, rtol=1e-4, atol=1e-4), key
+
+    stages = [x.stage for x in profiler.records]
+    assert stages == [
+        "subhalo_counts",
+        "halo_keys",
+        "subhalos",
+        "diffmah",
+        "mah",
+        "sfh",
+        "mah_table",
+        "phase_space",
+        "valid_galaxies",
+    ]
+
+
+def test_run_mock_writes_profile(tmp_path):
+    output_dir = str(tmp_path / "mock")
+    slab_fnames = ["halo_info_{0:03d}.asdf".format(i) for i in range(2)]
+    rm.run_mock(
+        "halocat_dir",
+        output_dir,
+        lgmp_min=11.5,
+        load_halos=_load_fake_slab,
+        slab_fnames=slab_fnames,
+        exclude=["sfh_table", "log_mah_table"],
+        profile=True,
+    )
+    records = prof.load_profile(str(tmp_path / "mock" / rm.PROFILE_BASENAME))
+    slabs = {x["tags"]["slab"] for x in records}
+    assert slabs == {"halo_info_000.asdf", "halo_info_001.asdf"}
+    assert "mah_table" not in {x["stage"] for x in records}
+    assert all(x["tags"]["chunk"] == 0 for x in records)
@@ -0,0 +1,91 @@
+""" """
+
+import os
+
+import numpy as np
+import pytest
+
+from .. import galcat_io, mock_reader
+from .. import run_mock as rm
+
+LBOX, H = 500.0, 0.7
+
+
+def _load_fake_slab(slab_fname):
+    """Abacus-like halo catalog of a slab, with ids that are unique across slabs"""
+    islab = int(os.path.basename(slab_fname).split("_")[-1].split(".")[0])
+    n_halos = 30
+    rng = np.random.default_rng(islab)
+    halos = dict(lbox=LBOX, redshift=1.1, Om0=0.3, w0=-1.0, wa=0.0, h=H)
+    halos["id"] = (np.arange(n_halos) + islab * 1_000).astype(np.uint64)
+    halos["npart"] = np.logspace(2, 4, n_halos)
+    halos["mass"] = halos["npart"] * 2e9
+    halos["pos"] = rng.uniform(-LBOX / 2, LBOX / 2, size=(n_halos, 3))
+    halos["vel"] = rng.normal(scale=200.0, size=(n_halos, 3))
+    halos["radius"] = np.ones(n_halos) * 0.2
+    halos["concentration"] = np.zeros(n_halos) + 5.0
+    return halos
+
+
+def test_get_shard_fname():
+    shard_fname = rm.get_shard_fname("outdir", "/a/b/halo_info/halo_info_012.asdf")
+    assert shard_fname == os.path.join("outdir", "galcat_012.h5")
+
+
+def test_run_mock_is_restartable(tmp_path):
+    output_dir = str(tmp_path / "mock")
+    slab_fnames = ["halo_info_{0:03d}.asdf".format(i) for i in range(3)]
+    kwargs = dict(lgmp_min=11.5, load_halos=_load_fake_slab, slab_fnames=slab_fnames)
+
+    manifest = rm.run_mock("halocat_dir", output_dir, **kwargs)
+    assert manifest["complete"]
+    assert len(manifest["shards"]) == len(slab_fnames)
+    assert manifest == rm.load_manifest(output_dir)
+    assert manifest["precision"] == "float64"
+
+    shard_fnames = [x["shard_fname"] for x in manifest["shards"]]
+    galcat = galcat_io.load_galcat_hdf5(shard_fnames[1])
+    assert galcat["upid"].size == manifest["shards"][1]["n_gals"]
+    assert np.all(galcat["pos"] >= 0)
+    assert np.all(galcat["pos"] < LBOX / H)
+    is_cen = galcat["upid"] == -1
+    assert np.all(galcat["host_halo_id"][is_cen] == np.arange(30) + 1_000)
+
+    # Restarting skips complete shards and regenerates missing ones
+    mtimes = [os.path.getmtime(x) for x in shard_fnames]
+    os.remove(shard_fnames[2])
+    manifest2 = rm.run_mock("halocat_dir", output_dir, **kwargs)
+    assert manifest2["complete"]
+    assert [os.path.getmtime(x) for x in shard_fnames[:2]] == mtimes[:2]
+    galcat2 = galcat_io.load_galcat_hdf5(shard_fnames[2])
+    assert galcat2["upid"].size == manifest["shards"][2]["n_gals"]
+
+    # Restarting with different settings requires overwrite=True
+    with pytest.raises(ValueError):
+        rm.run_mock("halocat_dir", output_dir, seed=1, **kwargs)
+    manifest3 = rm.run_mock("halocat_dir", output_dir, seed=1, overwrite=True, **kwargs)
+    assert manifest3["seed"] == 1
+    assert manifest3["complete"]
+
+
+def test_run_mock_npy_shards_open_as_single_mock(tmp_path):
+    output_dir = str(tmp_path / "mock")
+    slab_fnames = ["halo_info_{0:03d}.asdf".format(i) for i in range(2)]
+    manifest = rm.run_mock(
+        "halocat_dir",
+        output_dir,
+        lgmp_min=11.5,
+        load_halos=_load_fake_slab,
+        slab_fnames=slab_fnames,
+        fmt="npy",
+        exclude=["sfh_table", "log_mah_table"],
+    )
+    mock = mock_reader.open_mock(output_dir)
+    assert len(mock) == sum(x["n_gals"] for x in manifest["shards"])
+    assert "sfh_table" not in mock.colnames
+    assert "mah_params/logm0" in mock.colnames
+
+    upid = mock["upid"]
+    host_halo_id = mock["host_halo_id"]
+    is_sat = upid != -1
+    assert np.all(host_halo_id[is_sat] == host_halo_id[upid[is_sat]])
@@ -0,0 +1,129 @@
+""" """
+
+import numpy as np
+from diffstarpop.defaults import DEFAULT_DIFFSTARPOP_PARAMS
+from dsps.cosmology.defaults import DEFAULT_COSMOLOGY
+from jax import numpy as jnp
+from jax import random as jran
+from jax import tree_util
+
+from .. import mc_galpop
+from .. import stage_cache as sc
+
+CACHED_STAGES = ("subhalos", "diffmah", "mah", "sfh", "mah_table", "phase_space")
+
+
+def _get_galpop_args(n_halos=100, lgmp_min=11.5):
+    logmhost = np.linspace(lgmp_min, 14, n_halos)
+    halo_radius = np.ones_like(logmhost)
+    Lbox = 500.0
+    halo_pos = np.zeros((n_halos, 3)) + Lbox / 2
+    halo_vel = np.zeros((n_halos, 3))
+    args = (logmhost, halo_radius, halo_pos, halo_vel, 0.5, lgmp_min)
+    return (*args, DEFAULT_COSMOLOGY, Lbox)
+
+
+def _get_new_diffstarpop_params():
+    cens_params = DEFAULT_DIFFSTARPOP_PARAMS.sfh_pdf_cens_params
+    cens_params = cens_params._replace(
+        frac_quench_cen_x0=cens_params.frac_quench_cen_x0 + 0.5
+    )
+    return DEFAULT_DIFFSTARPOP_PARAMS._replace(sfh_pdf_cens_params=cens_params)
+
+
+def _assert_galcats_agree(galcat, galcat2):
+    assert set(galcat) == set(galcat2)
+    for key, val in galcat.items():
+        leaves2 = tree_util.tree_leaves(galcat2[key])
+        for x, x2 in zip(tree_util.tree_leaves(val), leaves2):
+            assert np.allclose(x, x2, rtol=1e-4, atol=1e-4), key
+
+
+def test_sfh_only_rerun_evaluates_only_the_sfh_stage():
+    ran_key = jran.key(0)
+    args = _get_galpop_args()
+    kwargs = dict(padded=True)
+    cache = sc.StageCache()
+    galcat = mc_galpop.mc_galpop_synthetic_subs(ran_key, *args, cache=cache, **kwargs)
+    assert set(cache.summary()) == set(CACHED_STAGES)
+    for stats in cache.summary().values():
+        assert stats == sc.CacheStats(0, 0, 1)
+    _assert_galcats_agree(
+        mc_galpop.mc_galpop_synthetic_subs(ran_key, *args, **kwargs), galcat
+    )
+
+    diffstarpop_params = _get_new_diffstarpop_params()
+    galcat2 = mc_galpop.mc_galpop_synthetic_subs(
+        ran_key, *args, diffstarpop_params=diffstarpop_params, cache=cache, **kwargs
+    )
+    summary = cache.summary()
+    assert summary["sfh"] == sc.CacheStats(0, 0, 2)
+    for stage in CACHED_STAGES:
+        if stage != "sfh":
+            assert summary[stage] == sc.CacheStats(1, 0, 1), stage
+    assert not np.allclose(galcat["logsm_t_obs"], galcat2["logsm_t_obs"])
+    assert np.all(galcat["pos"] == galcat2["pos"])
+
+    galcat3 = mc_galpop.mc_galpop_synthetic_subs(
+        ran_key, *args, diffstarpop_params=diffstarpop_params, **kwargs
+    )
+    _assert_galcats_agree(galcat3, galcat2)
+
+    mc_galpop.mc_galpop_synthetic_subs(jran.key(1), *args, cache=cache, **kwargs)
+    assert cache.summary()["subhalos"].misses == 2
+
+
+def test_get_cache_key():
+    x = jnp.linspace(0, 1, 10)
+    key = sc.get_cache_key("stage", jran.key(0), x, DEFAULT_DIFFSTARPOP_PARAMS)
+    assert key == sc.get_cache_key(
+        "stage", jran.key(0), np.array(x), DEFAULT_DIFFSTARPOP_PARAMS
+    )
+    params = _get_new_diffstarpop_params()
+    assert key != sc.get_cache_key("stage", jran.key(1), x, DEFAULT_DIFFSTARPOP_PARAMS)
+    assert key != sc.get_cache_key("stage", jran.key(0), x, params)
+    assert key != sc.get_cache_key("stage2", jran.key(0), x, DEFAULT_DIFFSTARPOP_PARAMS)
+    assert key != sc.get_cache_key(
+        "stage", jran.key(0), x.astype("f2"), DEFAULT_DIFFSTARPOP_PARAMS
+    )
+    assert sc.get_cache_key("stage", x) != sc.get_cache_key("stage", x.reshape(2, 5))
+
+
+def test_stage_cache_evicts_least_recently_used_entries():
+    cache = sc.StageCache(max_bytes=2 * 8 * 100)
+
+    def _func(x):
+        return jnp.zeros(100, dtype="f8") + x
+
+    for x in (0.0, 1.0, 0.0, 2.0):
+        cache.run("stage", _func, x)
+    assert len(cache) == 2
+    assert cache.nbytes == 2 * _func(0.0).nbytes
+    assert cache.summary()["stage"] == sc.CacheStats(1, 0, 3)
+    assert sc.get_cache_key("stage", 0.0) in cache
+    assert sc.get_cache_key("stage", 1.0) not in cache
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.nbytes == 0
+
+
+def test_stage_cache_spills_to_disk(tmp_path):
+    cache_dir = str(tmp_path / "stage_cache")
+    cache = sc.StageCache(max_bytes=0, cache_dir=cache_dir)
+
+    def _func(x):
+        return dict(a=jnp.zeros(10) + x, b=(jnp.arange(3), jnp.ones((2, 2))))
+
+    res = cache.run("stage", _func, 1.0)
+    assert len(cache) == 0
+    assert sc.get_cache_key("stage", 1.0) in cache
+
+    cache2 = sc.StageCache(cache_dir=cache_dir)
+    res2 = cache2.run("stage", _func, 1.0)
+    assert cache2.summary()["stage"] == sc.CacheStats(0, 1, 0)
+    assert len(cache2) == 1
+    assert tree_util.tree_structure(res) == tree_util.tree_structure(res2)
+    for x, x2 in zip(tree_util.tree_leaves(res), tree_util.tree_leaves(res2)):
+        assert isinstance(x2, jnp.ndarray)
+        assert np.all(x == x2)
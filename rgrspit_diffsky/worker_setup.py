@@ -0,0 +1,58 @@
+"""Initializer of the worker processes of mc_galpop_sharded.get_executor
+
+XLA reads XLA_FLAGS when JAX creates its backend, and importing the pipeline
+already creates it. This module therefore imports neither JAX nor the pipeline
+at module level, so that init_worker sets XLA_FLAGS in a spawned worker
+before JAX is loaded there, without touching the environment of the calling process.
+
+"""
+
+import os
+import sys
+import warnings
+
+# Each worker runs XLA on a single thread so that n_workers processes use n_workers cores
+WORKER_XLA_FLAGS = "--xla_cpu_multi_thread_eigen=false"
+
+
+def init_worker(cache_dir=None, precision=None):
+    """Set up a worker process before it runs any task
+
+    Parameters
+    ----------
+    cache_dir : string, optional
+        Directory of the persistent compilation cache,
+        see compilation_cache.enable_compilation_cache
+
+    precision : string, optional
+        Precision of the worker, see precision.set_precision
+
+    Notes
+    -----
+    Spawned workers import the main module of the calling process before
+    running init_worker. A main module that imports the pipeline at module level
+    creates the JAX backend first, in which case WORKER_XLA_FLAGS has no effect
+    and a warning is issued. See cli for the console scripts.
+
+    """
+    if _jax_backends_are_initialized():
+        msg = "JAX was initialized before init_worker, so XLA_FLAGS has no effect"
+        warnings.warn(msg)
+    xla_flags = os.environ.get("XLA_FLAGS", "")
+    os.environ["XLA_FLAGS"] = " ".join((xla_flags, WORKER_XLA_FLAGS)).strip()
+
+    from .compilation_cache import enable_compilation_cache
+    from .precision import set_precision
+
+    if precision is not None:
+        set_precision(precision)
+    if cache_dir is not None:
+        enable_compilation_cache(cache_dir)
+
+
+def _jax_backends_are_initialized():
+    if "jax" not in sys.modules:
+        return False
+    from jax._src import xla_bridge
+
+    return xla_bridge.backends_are_initialized()
@@ -0,0 +1,168 @@
+"""Compare the runtime and memory of the MAH stage of mc_galpop before and after
+fusing the evaluations of the diffmah kernel
+
+Example usage
+-------------
+python scripts/bench_mah_stage.py --n_cens 10000 100000 1000000
+
+For each number of host halos, the diffmah parameters of centrals and satellites
+are drawn once from simple distributions, and both versions of the MAH stage are compiled with jit.
+The reference version is the MAH stage of mc_galpop._mc_galpop_kern prior to
+the fused mc_galpop._mah_stage: five calls to _log_mah_kern, and concatenated
+copies of the host parameters of satellites.
+Memory is the size of the temporary buffers of the compiled executable,
+as reported by XLA, which excludes the outputs that are the same for both versions.
+Runtimes exclude compilation.
+
+"""
+
+import argparse
+from time import time
+
+import jax
+import numpy as np
+from diffmah.diffmah_kernels import DiffmahParams, _log_mah_kern
+from dsps.cosmology.defaults import DEFAULT_COSMOLOGY
+from dsps.cosmology.flat_wcdm import _age_at_z_kern, age_at_z0
+from jax import jit as jjit
+from jax import numpy as jnp
+from jax import random as jran
+
+from rgrspit_diffsky import mc_galpop
+
+Z_OBS = 0.5
+LGMP_MIN = 11.0
+
+
+@jjit
+def _mah_stage_reference(
+    mah_params_cens, mah_params_sats, subs_host_halo_indx, t0, t_obs, lgt0
+):
+    n_cens = mah_params_cens.logm0.shape[0]
+    subs_host_diffmah = DiffmahParams(
+        *[x[subs_host_halo_indx] for x in mah_params_cens]
+    )
+    mah_params = DiffmahParams(
+        *[jnp.concatenate((x, y)) for x, y in zip(mah_params_cens, mah_params_sats)]
+    )
+    logmp0 = _log_mah_kern(mah_params, t0, lgt0)
+    lgmp_t_obs = _log_mah_kern(mah_params, t_obs, lgt0)
+
+    host_mah_params = DiffmahParams(
+        *[jnp.concatenate((x, y)) for x, y in zip(mah_params_cens, subs_host_diffmah)]
+    )
+    lgmhost_at_t_inf = _log_mah_kern(host_mah_params, mah_params.t_peak, lgt0)
+
+    subs_lgmh_at_t_inf = _log_mah_kern(mah_params_sats, mah_params_sats.t_peak, lgt0)
+    subs_lgmhost_at_t_inf = _log_mah_kern(
+        subs_host_diffmah, mah_params_sats.t_peak, lgt0
+    )
+    subs_lgmu_t_inf = subs_lgmh_at_t_inf - subs_lgmhost_at_t_inf
+    hosts_lgmu_t_inf = jnp.zeros(n_cens)
+    lgmu_t_inf = jnp.concatenate((hosts_lgmu_t_inf, subs_lgmu_t_inf))
+
+    upid = jnp.concatenate((jnp.zeros(n_cens).astype(int) - 1, subs_host_halo_indx))
+    return (
+        mah_params,
+        host_mah_params,
+        upid,
+        logmp0,
+        lgmp_t_obs,
+        lgmhost_at_t_inf,
+        lgmu_t_inf,
+    )
+
+
+_mah_stage_fused = jjit(mc_galpop._mah_stage)
+
+
+def _get_mah_stage_args(n_cens, seed):
+    """Diffmah parameters drawn from uniform distributions about typical values,
+    with the number of satellites of each host drawn from the subhalo mass function"""
+    rng = np.random.default_rng(seed)
+    logmhost = np.sort(LGMP_MIN + rng.exponential(scale=0.6, size=n_cens))
+    logmhost = np.minimum(logmhost, 15.5)
+    counts_key, galpop_keys = mc_galpop._get_galpop_keys(jran.key(seed), False)
+    msk_hosts = np.ones(n_cens).astype(bool)
+    subs_counts = mc_galpop._mc_subhalo_counts_kern(
+        counts_key, logmhost, LGMP_MIN, msk_hosts
+    )
+    subs_host_halo_indx = np.repeat(np.arange(n_cens), np.asarray(subs_counts))
+    __, subs_logmh = mc_galpop._subhalo_stage(
+        galpop_keys.subs_lgmu, logmhost, subs_host_halo_indx, LGMP_MIN
+    )
+    t0 = age_at_z0(*DEFAULT_COSMOLOGY)
+    t_obs = _age_at_z_kern(Z_OBS, *DEFAULT_COSMOLOGY)
+
+    def _mc_mah_params(logm0, t_peak):
+        n = logm0.size
+        logtc = rng.uniform(-0.5, 0.5, n)
+        early_index = rng.uniform(1.0, 4.0, n)
+        late_index = rng.uniform(0.1, 1.0, n)
+        return DiffmahParams(logm0, logtc, early_index, late_index, t_peak)
+
+    mah_params_cens = _mc_mah_params(logmhost, np.zeros(n_cens) + t0)
+    n_sats = subs_logmh.size
+    t_peak_sats = rng.uniform(1.0, t0, n_sats)
+    mah_params_sats = _mc_mah_params(np.asarray(subs_logmh), t_peak_sats)
+    args = (
+        mah_params_cens,
+        mah_params_sats,
+        np.asarray(subs_host_halo_indx),
+        t0,
+        t_obs,
+        np.log10(t0),
+    )
+    return args
+
+
+def _run(func, args, n_repeat):
+    compiled = func.lower(*args).compile()
+    mem = compiled.memory_analysis()
+    n_bytes = mem.temp_size_in_bytes
+    jax.block_until_ready(compiled(*args))
+    runtimes = []
+    for __ in range(n_repeat):
+        start = time()
+        res = jax.block_until_ready(compiled(*args))
+        runtimes.append(time() - start)
+    return np.median(runtimes), n_bytes, res
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_cens", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--n_repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print("JAX backend: {0}".format(jax.default_backend()))
+    msg = "{0:>9}  {1:>9}  {2:>9}  {3:>9}  {4:>7}  {5:>10}  {6:>10}  {7:>9}"
+    print(
+        msg.format(
+            "n_cens", "n_gals", "ref [s]", "fused [s]", "speedup",
+            "ref [MB]", "fused [MB]", "max |dx|",
+        )
+    )  # fmt: skip
+    msg = "{0:9d}  {1:9d}  {2:9.4f}  {3:9.4f}  {4:7.2f}  {5:10.1f}  {6:10.1f}  {7:9.2e}"
+    for n_cens in args.n_cens:
+        stage_args = _get_mah_stage_args(n_cens, args.seed)
+        t_ref, mem_ref, res_ref = _run(_mah_stage_reference, stage_args, args.n_repeat)
+        t_new, mem_new, res_new = _run(_mah_stage_fused, stage_args, args.n_repeat)
+        dx = max(
+            float(np.max(np.abs(np.asarray(x) - np.asarray(y))))
+            for x, y in zip(jax.tree.leaves(res_ref), jax.tree.leaves(res_new))
+        )
+        n_gals = res_new[2].size
+        print(
+            msg.format(
+                n_cens,
+                n_gals,
+                t_ref,
+                t_new,
+                t_ref / t_new,
+                mem_ref / 1024**2,
+                mem_new / 1024**2,
+                dx,
+            )
+        )
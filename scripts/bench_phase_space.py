@@ -0,0 +1,78 @@
+"""Compare the runtime of the NumPy and JAX ellipsoidal NFW phase-space samplers
+
+Example usage
+-------------
+python scripts/bench_phase_space.py --n_sats 100000 1000000 10000000 100000000
+
+For each number of satellites, both samplers are called with the same randoms.
+The JAX sampler is called once untimed so that the timed run excludes compilation,
+and the timed run includes the transfer of the outputs to host memory.
+Large values of n_sats need about 200 bytes per satellite for the JAX sampler,
+and about 400 bytes per satellite for the NumPy sampler.
+
+"""
+
+import argparse
+from time import time
+
+import jax
+import numpy as np
+from jax import random as jran
+
+from rgrspit_diffsky.fake_sats import phase_space_kernels as psk
+from rgrspit_diffsky.fake_sats.ellipsoidal_nfw_phase_space import mc_ellipsoidal_nfw
+
+
+def _get_sats(n_sats, seed):
+    rng = np.random.default_rng(seed)
+    rhalo = rng.uniform(0.1, 1.0, n_sats)
+    conc = rng.uniform(2.0, 20.0, n_sats)
+    sigma = rng.uniform(100.0, 1000.0, n_sats)
+    major_axes = rng.normal(size=(n_sats, 3))
+    b_to_a = rng.uniform(0.5, 1.0, n_sats)
+    c_to_a = b_to_a * rng.uniform(0.5, 1.0, n_sats)
+    pos_randoms = rng.uniform(size=(n_sats, 3))
+    vel_randoms = rng.normal(size=(n_sats, 3))
+    return (rhalo, conc, sigma, major_axes, b_to_a, c_to_a, pos_randoms, vel_randoms)
+
+
+def _run_numpy(sats):
+    *args, pos_randoms, vel_randoms = sats
+    start = time()
+    pos, vel = mc_ellipsoidal_nfw(
+        jran.key(0), *args, pos_randoms=pos_randoms, vel_randoms=vel_randoms
+    )
+    return time() - start, pos, vel
+
+
+def _run_jax(sats):
+    *args, pos_randoms, vel_randoms = sats
+    start = time()
+    pos, vel = psk.mc_ellipsoidal_nfw(
+        jran.key(0), *args, pos_randoms=pos_randoms, vel_randoms=vel_randoms
+    )
+    pos, vel = np.asarray(pos), np.asarray(vel)
+    return time() - start, pos, vel
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_sats", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip_numpy", action="store_true")
+    args = parser.parse_args()
+
+    print("JAX backend: {0}".format(jax.default_backend()))
+    print("   n_sats  numpy [s]  jax [s]  speedup  max |dpos|  max |dvel|/sigma")
+    for n_sats in args.n_sats:
+        sats = jax.device_get(_get_sats(n_sats, args.seed))
+        _run_jax(sats)
+        t_jax, pos_jax, vel_jax = _run_jax(sats)
+        if args.skip_numpy:
+            t_np, dpos, dvel = np.nan, np.nan, np.nan
+        else:
+            t_np, pos_np, vel_np = _run_numpy(sats)
+            dpos = np.max(np.abs(pos_np - pos_jax))
+            dvel = np.max(np.abs(vel_np - vel_jax) / sats[2].reshape((-1, 1)))
+        msg = "{0:9d}  {1:9.3f}  {2:7.3f}  {3:7.2f}  {4:10.2e}  {5:16.2e}"
+        print(msg.format(n_sats, t_np, t_jax, t_np / t_jax, dpos, dvel))
@@ -0,0 +1,88 @@
+"""Compare the runtime per realization of a Python loop over mc_galpop_synthetic_subs
+with the batched realizations of mc_galpop_realizations
+
+Example usage
+-------------
+python scripts/bench_realizations.py --n_halos 200 2000 --n_realizations 16
+
+For each number of host halos, the same n_realizations keys are drawn
+by a loop over mc_galpop_synthetic_subs with padded=True, so that the loop
+compiles its kernels once, and by a single batch of iter_galpop_realizations.
+Both use halo_ids, so that the realizations of both methods are the same.
+Runtimes exclude compilation.
+
+"""
+
+import argparse
+from time import time
+
+import jax
+import numpy as np
+from dsps.cosmology.defaults import DEFAULT_COSMOLOGY
+from jax import random as jran
+
+from rgrspit_diffsky import mc_galpop
+from rgrspit_diffsky import mc_galpop_realizations as mgr
+from rgrspit_diffsky.benchmarks import LBOX, _get_halos
+
+Z_OBS = 0.5
+LGMP_MIN = 11.0
+
+
+def _loop(ran_keys, args, halo_ids):
+    return [
+        mc_galpop.mc_galpop_synthetic_subs(key, *args, halo_ids=halo_ids, padded=True)
+        for key in ran_keys
+    ]
+
+
+def _batch(ran_keys, args, halo_ids):
+    n_real = ran_keys.shape[0]
+    return list(
+        mgr.iter_galpop_realizations(
+            ran_keys, *args, batch_size=n_real, halo_ids=halo_ids
+        )
+    )
+
+
+def _run(func, ran_keys, args, halo_ids, n_repeat):
+    func(ran_keys, args, halo_ids)
+    runtimes = []
+    for __ in range(n_repeat):
+        start = time()
+        res = func(ran_keys, args, halo_ids)
+        runtimes.append(time() - start)
+    return np.median(runtimes) / ran_keys.shape[0], res
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_halos", type=int, nargs="+", default=[200, 2_000])
+    parser.add_argument("--n_realizations", type=int, default=16)
+    parser.add_argument("--n_repeat", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print("JAX backend: {0}".format(jax.default_backend()))
+    msg = "{0:>9}  {1:>9}  {2:>10}  {3:>10}  {4:>7}  {5:>9}"
+    print(
+        msg.format("n_halos", "n_gals", "loop [s]", "batch [s]", "speedup", "max |dx|")
+    )
+    msg = "{0:9d}  {1:9d}  {2:10.4f}  {3:10.4f}  {4:7.2f}  {5:9.2e}"
+    ran_keys = jran.split(jran.key(args.seed), args.n_realizations)
+    for n_halos in args.n_halos:
+        logmhost, halo_radius, halo_pos, halo_vel, halo_ids = _get_halos(
+            n_halos, args.seed
+        )
+        galpop_args = (logmhost, halo_radius, halo_pos, halo_vel, Z_OBS, LGMP_MIN)
+        galpop_args = (*galpop_args, DEFAULT_COSMOLOGY, LBOX)
+        t_loop, res_loop = _run(_loop, ran_keys, galpop_args, halo_ids, args.n_repeat)
+        t_batch, res_batch = _run(
+            _batch, ran_keys, galpop_args, halo_ids, args.n_repeat
+        )
+        dx = max(
+            float(np.max(np.abs(x["logsm_t_obs"] - y["logsm_t_obs"])))
+            for x, y in zip(res_loop, res_batch)
+        )
+        n_gals = int(np.mean([x["upid"].size for x in res_batch]))
+        print(msg.format(n_halos, n_gals, t_loop, t_batch, t_loop / t_batch, dx))
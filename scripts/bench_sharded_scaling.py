@@ -0,0 +1,107 @@
+"""Measure the throughput of mc_galpop_synthetic_subs_sharded vs number of workers
+
+Example usage
+-------------
+python scripts/bench_sharded_scaling.py --n_halos 200000 --workers 1 2 4 8 16 32 64
+
+For each number of workers, a pool is started and used for an untimed run
+with the same shards, so that the timed run measures throughput
+rather than the startup and compilation time of the workers.
+
+The pipeline is imported within functions, since spawned workers import this script
+before their initializer sets XLA_FLAGS, and importing the pipeline creates
+the JAX backend, see mc_galpop_sharded.get_executor.
+
+"""
+
+import argparse
+import os
+import tempfile
+from time import time
+
+LGMP_MIN = 11.0
+Z_OBS = 0.5
+LBOX = 1_000.0
+
+
+def _get_halos(n_halos, seed):
+    """Host halos of a synthetic Abacus-like catalog drawn from the halo mass function"""
+    from dsps.cosmology.defaults import DEFAULT_COSMOLOGY
+
+    from rgrspit_diffsky.data_loaders.load_abacus import get_mc_galpop_inputs
+    from rgrspit_diffsky.data_loaders.load_fake_abacus import mc_fake_abacus_halos
+
+    halos = mc_fake_abacus_halos(
+        n_halos,
+        seed=seed,
+        lgmp_min=LGMP_MIN,
+        redshift=Z_OBS,
+        lbox=LBOX * DEFAULT_COSMOLOGY.h,
+    )
+    inputs = get_mc_galpop_inputs(halos)
+    keys = ("logmhost", "halo_radius", "halo_pos", "halo_vel", "halo_ids")
+    return tuple(inputs[key] for key in keys)
+
+
+def _run(halos, n_shards, executor):
+    from dsps.cosmology.defaults import DEFAULT_COSMOLOGY
+    from jax import random as jran
+
+    from rgrspit_diffsky.mc_galpop_sharded import mc_galpop_synthetic_subs_sharded
+
+    logmhost, halo_radius, halo_pos, halo_vel, halo_ids = halos
+    start = time()
+    galcat = mc_galpop_synthetic_subs_sharded(
+        jran.key(0),
+        logmhost,
+        halo_radius,
+        halo_pos,
+        halo_vel,
+        Z_OBS,
+        LGMP_MIN,
+        DEFAULT_COSMOLOGY,
+        LBOX,
+        halo_ids=halo_ids,
+        n_shards=n_shards,
+        executor=executor,
+    )
+    return time() - start, galcat["upid"].size
+
+
+if __name__ == "__main__":
+    from rgrspit_diffsky.mc_galpop_sharded import get_executor
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_halos", type=int, default=20_000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument(
+        "--shards_per_worker", type=int, default=4, help="Shards per worker"
+    )
+    parser.add_argument("--cache_dir", default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    cache_dir = args.cache_dir
+    if cache_dir is None:
+        cache_dir = tempfile.mkdtemp(prefix="rgrspit_diffsky_jax_cache_")
+
+    halos = _get_halos(args.n_halos, args.seed)
+    print("n_halos = {0}, os.cpu_count() = {1}".format(args.n_halos, os.cpu_count()))
+
+    print("n_workers  n_gals  time [s]  gals/s  speedup  efficiency")
+    t_ref = None
+    for n_workers in args.workers:
+        n_shards = n_workers * args.shards_per_worker
+        with get_executor(n_workers, cache_dir=cache_dir) as executor:
+            _run(halos, n_shards, executor)
+            runtime, n_gals = _run(halos, n_shards, executor)
+        throughput = n_gals / runtime
+        if t_ref is None:
+            t_ref = runtime * args.workers[0]
+        speedup = t_ref / runtime
+        msg = "{0:9d}  {1:6d}  {2:8.2f}  {3:6.0f}  {4:7.2f}  {5:10.2f}"
+        print(
+            msg.format(
+                n_workers, n_gals, runtime, throughput, speedup, speedup / n_workers
+            )
+        )